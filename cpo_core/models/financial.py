@@ -124,23 +124,23 @@ class FinancialProjection(models.Model):
     
     def calculate_yearly_financials(self, charging_stations):
         """Calcola i dati finanziari annuali per i 10 anni di proiezione"""
+        from projects.services.amortization import annual_loan_schedule
+        
         yearly_data = []
         
         # Calcola i parametri di base
         total_connectors = sum(station.num_connectors for station in charging_stations)
         avg_power = sum(station.power_kw for station in charging_stations) / len(charging_stations) if charging_stations else 0
         
-        # Parametri del prestito
+        # Piano di ammortamento del prestito (rate mensili aggregate per anno)
         loan_amount = self.loan_amount or self.total_investment
-        monthly_rate = (self.loan_interest_rate / 100) / 12
-        loan_term_months = self.loan_term * 12
-        grace_period_months = self.grace_period * 12
-        
-        # Calcola la rata mensile del prestito (escludendo periodo di preammortamento)
-        if monthly_rate > 0:
-            monthly_payment = loan_amount * monthly_rate * (1 + monthly_rate) ** loan_term_months / ((1 + monthly_rate) ** loan_term_months - 1)
-        else:
-            monthly_payment = loan_amount / loan_term_months
+        loan_schedule = annual_loan_schedule(
+            loan_amount,
+            float(self.loan_interest_rate) / 100,
+            self.loan_term,
+            pre_amortization_years=self.grace_period,
+        )
+        loan_payments = loan_schedule['payment']
         
         # Genera dati per 10 anni
         for year in range(1, 11):
@@ -166,13 +166,8 @@ class FinancialProjection(models.Model):
             # Calcola i costi dell'elettricità (85% dei ricavi lordi come stima)
             annual_electricity_cost = total_connectors * avg_daily_sessions * avg_kwh_per_session * self.electricity_price_kwh * 365
             
-            # Calcola i pagamenti del prestito per l'anno
-            if year <= self.grace_period:
-                # Solo interessi durante il preammortamento
-                annual_loan_payment = loan_amount * (self.loan_interest_rate / 100)
-            else:
-                # Rata completa dopo il preammortamento
-                annual_loan_payment = monthly_payment * 12
+            # Pagamenti del prestito per l'anno (solo interessi durante il preammortamento)
+            annual_loan_payment = loan_payments[year] if year < len(loan_payments) else 0
             
             # Simula guasti casuali (aggiunge costi di manutenzione straordinaria)
             # Probabilità di guasto aumenta con l'età delle stazioni
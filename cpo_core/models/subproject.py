@@ -106,6 +106,8 @@ class SubProject(models.Model):
     longitude_proposed = models.DecimalField(_("Longitudine Proposta"), max_digits=9, decimal_places=6, null=True, blank=True)
     latitude_approved = models.DecimalField(_("Latitudine Approvata"), max_digits=9, decimal_places=6, null=True, blank=True)
     longitude_approved = models.DecimalField(_("Longitudine Approvata"), max_digits=9, decimal_places=6, null=True, blank=True)
+    # Cella geohash della posizione approvata (o proposta), aggiornata al salvataggio
+    geohash = models.CharField(_("Geohash"), max_length=12, blank=True, default="", db_index=True, editable=False)
     
     # Giorni di indisponibilità
     WEEKDAY_CHOICES = [
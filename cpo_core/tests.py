@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from decimal import Decimal
 from cpo_core.models.charging_station import ChargingStation
 from projects.models import Project
@@ -6,6 +6,7 @@ from cpo_core.models.subproject import SubProject
 from infrastructure.models import Municipality
 from cpo_core.models.organization import Organization
 
+@override_settings(MAP_TILE_CACHE='default')
 class ChargingStationCalculationTest(TestCase):
     """Test per i calcoli di utilizzo e guadagno della stazione di ricarica"""
     
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class MappingConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'cpo_planner.mapping'
+    label = 'mapping'
+
+    def ready(self):
+        """Importa i segnali quando l'app è pronta"""
+        import cpo_planner.mapping.signals
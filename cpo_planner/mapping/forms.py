@@ -1,5 +1,6 @@
 # mapping/forms.py
 from django import forms
+from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from projects.models import Project, SubProject, ChargingStation
 from .models import MapSettings, CustomMarker, SavedMap
@@ -300,4 +301,76 @@ class SavedMapFilterForm(forms.Form):
         # Imposta il queryset per gli utenti con mappe salvate
         from django.contrib.auth import get_user_model
         User = get_user_model()
-        self.fields['user'].queryset = User.objects.filter(saved_maps__isnull=False).distinct()
\ No newline at end of file
+        self.fields['user'].queryset = User.objects.filter(saved_maps__isnull=False).distinct()
+class SiteSelectionForm(forms.Form):
+    """Form per la scelta dei siti di nuovi sottoprogetti"""
+    k = forms.IntegerField(
+        label=_('Numero di Siti'),
+        initial=10,
+        min_value=1,
+        max_value=200,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'min': '1', 'max': '200'})
+    )
+    
+    radius_km = forms.FloatField(
+        label=_('Raggio di Servizio (km)'),
+        required=False,
+        min_value=0.5,
+        max_value=100,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.5', 'min': '0.5'})
+    )
+    
+    source = forms.ChoiceField(
+        label=_('Candidati'),
+        choices=[
+            ('subprojects', _('Coordinate proposte dei sotto-progetti')),
+            ('markers', _('Marker personalizzati')),
+            ('grid', _('Griglia regolare')),
+        ],
+        initial='subprojects',
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    
+    grid_spacing_km = forms.FloatField(
+        label=_('Passo della Griglia (km)'),
+        required=False,
+        min_value=0.5,
+        max_value=100,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.5', 'min': '0.5'})
+    )
+    
+    region = forms.ChoiceField(
+        label=_('Regione'),
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        from infrastructure.models import Municipality
+        
+        # Solo le regioni con comuni georeferenziati
+        regions = Municipality.objects.filter(latitude__isnull=False).exclude(region='').order_by(
+            'region').values_list('region', flat=True).distinct()
+        self.fields['region'].choices = [('', _('Tutte'))] + [(region, region) for region in regions]
+        self.fields['radius_km'].widget.attrs['placeholder'] = getattr(settings, 'COVERAGE_RADIUS_KM', 10)
+
+class SiteSelectionSaveForm(forms.Form):
+    """Form per salvare i siti scelti come mappa"""
+    name = forms.CharField(
+        label=_('Nome'),
+        max_length=100,
+        widget=forms.TextInput(attrs={'class': 'form-control'})
+    )
+    
+    description = forms.CharField(
+        label=_('Descrizione'),
+        required=False,
+        widget=forms.Textarea(attrs={'class': 'form-control', 'rows': 2})
+    )
+    
+    is_public = forms.BooleanField(
+        label=_('Pubblica'),
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
@@ -0,0 +1,128 @@
+"""
+Codifica geohash delle coordinate.
+
+Il geohash divide la superficie terrestre in celle annidate: ogni carattere
+in più riduce la cella di un fattore 32 e due punti vicini condividono un
+prefisso, quindi una colonna indicizzata con il geohash permette di filtrare
+per zona con un semplice startswith. Con GEOHASH_PRECISION caratteri la cella
+misura circa 38 x 19 metri.
+"""
+
+# Alfabeto base32 del geohash (senza a, i, l, o)
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Caratteri salvati nelle colonne geohash dei modelli
+GEOHASH_PRECISION = 8
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """
+    Geohash di un punto.
+
+    Args:
+        latitude: Latitudine in gradi (None se assente)
+        longitude: Longitudine in gradi (None se assente)
+        precision: Numero di caratteri
+
+    Returns:
+        str: Geohash, stringa vuota se mancano le coordinate
+    """
+    if latitude is None or longitude is None:
+        return ''
+    latitude, longitude = float(latitude), float(longitude)
+    south, north, west, east = -90.0, 90.0, -180.0, 180.0
+    chars = []
+    value = bits = 0
+    even = True  # I bit pari dividono la longitudine
+    while len(chars) < precision:
+        if even:
+            middle = (west + east) / 2
+            bit = longitude >= middle
+            west, east = (middle, east) if bit else (west, middle)
+        else:
+            middle = (south + north) / 2
+            bit = latitude >= middle
+            south, north = (middle, north) if bit else (south, middle)
+        value = (value << 1) | bit
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            value = bits = 0
+    return ''.join(chars)
+
+
+def bounds(geohash):
+    """
+    Riquadro della cella di un geohash.
+
+    Args:
+        geohash: Geohash (di qualsiasi lunghezza)
+
+    Returns:
+        tuple: (ovest, sud, est, nord) in gradi
+    """
+    south, north, west, east = -90.0, 90.0, -180.0, 180.0
+    even = True
+    for char in geohash:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                middle = (west + east) / 2
+                west, east = (middle, east) if bit else (west, middle)
+            else:
+                middle = (south + north) / 2
+                south, north = (middle, north) if bit else (south, middle)
+            even = not even
+    return west, south, east, north
+
+
+
+def cell_size(precision):
+    """
+    Dimensioni delle celle di una precisione.
+
+    Args:
+        precision: Numero di caratteri
+
+    Returns:
+        tuple: (larghezza, altezza) in gradi
+    """
+    bits = 5 * precision
+    return 360.0 / 2 ** ((bits + 1) // 2), 180.0 / 2 ** (bits // 2)
+
+
+def covering(west, south, east, north, max_cells=32):
+    """
+    Prefissi geohash le cui celle coprono un riquadro.
+
+    Viene scelta la precisione più alta (fino a GEOHASH_PRECISION) per cui
+    bastano al più max_cells celle, così un filtro startswith sui prefissi
+    legge solo le righe vicine al riquadro.
+
+    Args:
+        west, south, east, north: Riquadro in gradi
+        max_cells: Numero massimo di prefissi
+
+    Returns:
+        list: Prefissi ordinati; vuota se il riquadro è troppo grande per
+            un filtro utile (più di max_cells celle di due caratteri)
+    """
+    # Il margine assorbe gli arrotondamenti sui bordi delle celle
+    west, east = max(west - 1e-9, -180.0), min(east + 1e-9, 180.0)
+    south, north = max(south - 1e-9, -90.0), min(north + 1e-9, 90.0)
+    if west > east or south > north:
+        return []
+
+    for precision in range(GEOHASH_PRECISION, 1, -1):
+        width, height = cell_size(precision)
+        # Indici delle celle ai bordi (l'ultima cella comprende il bordo est/nord)
+        columns = range(int((west + 180) // width), min(int((east + 180) // width), int(360 / width) - 1) + 1)
+        rows = range(int((south + 90) // height), min(int((north + 90) // height), int(180 / height) - 1) + 1)
+        if len(columns) * len(rows) <= max_cells:
+            return sorted(
+                encode(-90 + (row + 0.5) * height, -180 + (column + 0.5) * width, precision)
+                for row in rows for column in columns
+            )
+    return []
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cpo_planner.mapping.models import MunicipalityCoverage
+from cpo_planner.mapping.services import CoverageAnalysisService
+
+
+class Command(BaseCommand):
+    help = (
+        'Ricalcola la copertura di ricarica di tutti i comuni (distanza dalla stazione più vicina '
+        'e kW per potenziale utente EV nel raggio)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--radius', type=float,
+                            help='Raggio in km (default: impostazione COVERAGE_RADIUS_KM)')
+
+    def handle(self, *args, **options):
+        started = time.time()
+        stats = CoverageAnalysisService.compute(radius_km=options['radius'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Copertura calcolata in {time.time() - started:.2f}s: "
+            f"{stats['municipalities']} comuni, {stats['stations']} stazioni"
+        ))
+        for coverage_class, label in MunicipalityCoverage.COVERAGE_CLASS_CHOICES:
+            count = MunicipalityCoverage.objects.filter(coverage_class=coverage_class).count()
+            self.stdout.write(f'  {label}: {count}')
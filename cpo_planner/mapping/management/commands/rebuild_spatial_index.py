@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Coalesce
+
+from cpo_core.models import SubProject as Site
+from cpo_planner.mapping.geohash import encode
+from cpo_planner.mapping.models import CustomMarker
+from cpo_planner.mapping.services import SpatialIndexService
+from projects.models import ChargingStation
+
+
+class Command(BaseCommand):
+    help = (
+        'Ricalcola le colonne geohash di stazioni, siti e marker e ricostruisce gli indici spaziali '
+        '(necessario dopo importazioni o aggiornamenti in blocco, che non passano dal salvataggio)'
+    )
+
+    def handle(self, *args, **options):
+        started = time.time()
+        querysets = (
+            (ChargingStation, ChargingStation.objects.values_list('id', 'latitude', 'longitude', 'geohash')),
+            (CustomMarker, CustomMarker.objects.values_list('id', 'latitude', 'longitude', 'geohash')),
+            (Site, Site.objects.annotate(
+                lat=Coalesce('latitude_approved', 'latitude_proposed'),
+                lng=Coalesce('longitude_approved', 'longitude_proposed'),
+            ).values_list('id', 'lat', 'lng', 'geohash')),
+        )
+        for model, queryset in querysets:
+            rows = (
+                (pk, encode(latitude, longitude), geohash)
+                for pk, latitude, longitude, geohash in queryset.order_by().iterator()
+            )
+            changed = [model(pk=pk, geohash=computed) for pk, computed, geohash in rows if computed != geohash]
+            model.objects.bulk_update(changed, ['geohash'], batch_size=1000)
+            self.stdout.write(f'  {model._meta.verbose_name_plural}: {len(changed)} geohash aggiornati')
+
+        for layer in SpatialIndexService.LAYERS:
+            SpatialIndexService.invalidate(layer)
+            self.stdout.write(f'  indice {layer}: {len(SpatialIndexService.get_index(layer))} punti')
+        self.stdout.write(self.style.SUCCESS(f'Indici spaziali ricostruiti in {time.time() - started:.2f}s'))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cpo_planner.mapping.services import MapTileService
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera in anticipo i tile GeoJSON della mappa che contengono stazioni o marker '
+        '(con --flush scarta prima quelli esistenti, es. dopo aggiornamenti in blocco)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-zoom', type=int, default=12,
+                            help='Ultimo livello di zoom da generare (default: 12)')
+        parser.add_argument('--layer', choices=MapTileService.LAYERS, action='append',
+                            help='Layer da generare (default: tutti)')
+        parser.add_argument('--flush', action='store_true',
+                            help='Scarta i tile esistenti prima di generarli')
+
+    def handle(self, *args, **options):
+        max_zoom = min(options['max_zoom'], MapTileService.MAX_ZOOM)
+        for layer in options['layer'] or MapTileService.LAYERS:
+            if options['flush']:
+                MapTileService.invalidate_layer(layer)
+            started = time.time()
+            rendered = MapTileService.prerender(
+                layer, max_zoom,
+                progress=lambda zoom, count: self.stdout.write(f'  {layer} z{zoom}: {count} tile'))
+            self.stdout.write(self.style.SUCCESS(
+                f'{rendered} tile {layer} generati fino allo zoom {max_zoom} in {time.time() - started:.2f}s'
+            ))
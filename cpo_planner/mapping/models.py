@@ -159,6 +159,8 @@ class CustomMarker(models.Model):
         _('Longitudine'),
         validators=[MinValueValidator(-180), MaxValueValidator(180)]
     )
+    # Cella geohash della posizione, aggiornata al salvataggio
+    geohash = models.CharField(_('Geohash'), max_length=12, blank=True, default='', db_index=True, editable=False)
     
     # Stile del marker
     color = models.CharField(
@@ -303,3 +305,51 @@ class SavedMap(models.Model):
     
     def __str__(self):
         return self.name
+
+
+class MunicipalityCoverage(models.Model):
+    """Copertura di ricarica di un comune (aggregato calcolato da CoverageAnalysisService)"""
+    COVERAGE_CLASS_CHOICES = [
+        ('none', _('Nessuna stazione nel raggio')),
+        ('critical', _('Critica')),
+        ('low', _('Bassa')),
+        ('medium', _('Media')),
+        ('adequate', _('Adeguata')),
+    ]
+    
+    municipality = models.OneToOneField(
+        Municipality,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='coverage',
+        verbose_name=_('Comune')
+    )
+    radius_km = models.FloatField(_('Raggio (km)'))
+    nearest_station = models.ForeignKey(
+        'projects.ChargingStation',
+        on_delete=models.SET_NULL,
+        related_name='+',
+        verbose_name=_('Stazione più vicina'),
+        null=True,
+        blank=True
+    )
+    nearest_station_km = models.FloatField(_('Distanza stazione più vicina (km)'), null=True, blank=True)
+    stations_within = models.PositiveIntegerField(_('Stazioni nel raggio'), default=0)
+    power_within_kw = models.FloatField(_('Potenza nel raggio (kW)'), default=0)
+    potential_ev_users = models.PositiveIntegerField(_('Potenziali utenti EV'), default=0)
+    kw_per_ev_user = models.FloatField(_('kW per utente EV'), null=True, blank=True)
+    coverage_class = models.CharField(
+        _('Classe di copertura'),
+        max_length=10,
+        choices=COVERAGE_CLASS_CHOICES,
+        default='none',
+        db_index=True
+    )
+    updated_at = models.DateTimeField(_('Ultimo Aggiornamento'), auto_now=True)
+    
+    class Meta:
+        verbose_name = _('Copertura Comune')
+        verbose_name_plural = _('Coperture Comuni')
+    
+    def __str__(self):
+        return f"{self.municipality} - {self.get_coverage_class_display()}"
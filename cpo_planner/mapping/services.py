@@ -0,0 +1,1504 @@
+# mapping/services.py
+import hashlib
+import json
+import math
+import operator
+import threading
+import time
+import uuid
+from functools import reduce
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Avg, Count, F, FloatField, Q, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Floor
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from infrastructure.services import InMemoryData
+from projects.models import ChargingStation
+from . import geohash
+from .models import MapSettings
+
+
+class StationMapService:
+    """
+    Dati GeoJSON delle stazioni per la porzione di mappa visibile.
+
+    Le stazioni vengono lette solo dentro il riquadro (bbox) richiesto, con
+    un prefiltro sulla colonna geohash indicizzata (vedi near); fino a
+    CLUSTER_MAX_ZOOM vengono raggruppate nel database in celle di una griglia
+    regolare, così il browser riceve poche centinaia di feature anche per la
+    mappa nazionale.
+    """
+
+    # Oltre questo livello di zoom le stazioni sono sempre restituite singolarmente
+    CLUSTER_MAX_ZOOM = 14
+
+    # Lato di una cella della griglia, in pixel dello schermo
+    CLUSTER_CELL_PIXELS = 60
+
+    # Moltiplicatore della colonna nella chiave di cella (più del doppio delle righe possibili)
+    CELL_KEY_FACTOR = 1000000
+
+    # Campi letti per ogni stazione (un'unica query con i join su sotto-progetto e progetto)
+    POINT_FIELDS = (
+        'id', 'name', 'identifier', 'address', 'status', 'total_power', 'charging_points',
+        'installation_date', 'latitude', 'longitude',
+        'sub_project_id', 'sub_project__name', 'sub_project__project_id', 'sub_project__project__name',
+    )
+
+    @staticmethod
+    def parse_bbox(value):
+        """
+        Legge un riquadro nel formato 'ovest,sud,est,nord'.
+
+        Args:
+            value: Stringa del parametro bbox
+
+        Returns:
+            tuple: (ovest, sud, est, nord) in gradi, oppure None se assente o non valido
+        """
+        try:
+            west, south, east, north = (float(part) for part in value.split(','))
+        except (AttributeError, ValueError):
+            return None
+        if not (-90 <= south <= north <= 90) or west > east:
+            return None
+        return max(west, -180.0), south, min(east, 180.0), north
+
+    @staticmethod
+    def cell_size(zoom):
+        """
+        Lato (in gradi) delle celle di raggruppamento per un livello di zoom.
+
+        Args:
+            zoom: Livello di zoom della mappa (tile da 256 pixel)
+
+        Returns:
+            float: Gradi di longitudine (e latitudine) per cella
+        """
+        return 360.0 / (2 ** zoom) * StationMapService.CLUSTER_CELL_PIXELS / 256
+
+    @staticmethod
+    def cluster_settings():
+        """
+        Impostazioni di raggruppamento della mappa predefinita.
+
+        Returns:
+            tuple: (show_clusters, min_cluster_size)
+        """
+        values = MapSettings.objects.filter(is_default=True).values_list('show_clusters', 'min_cluster_size').first()
+        return values or (True, 3)
+
+    @staticmethod
+    def filter_stations(queryset, params):
+        """
+        Applica i filtri della mappa a un queryset di stazioni.
+
+        Args:
+            queryset: QuerySet di ChargingStation
+            params: QueryDict della richiesta
+
+        Returns:
+            QuerySet: Stazioni filtrate
+        """
+        status = params.getlist('status[]')
+        if status:
+            queryset = queryset.filter(status__in=status)
+
+        numeric_filters = (
+            ('min_power', 'total_power__gte', float),
+            ('max_power', 'total_power__lte', float),
+            ('project', 'sub_project__project_id', int),
+            ('subproject', 'sub_project_id', int),
+            ('min_connectors', 'charging_points__gte', int),
+        )
+        for param, lookup, cast in numeric_filters:
+            value = params.get(param)
+            if value:
+                try:
+                    queryset = queryset.filter(**{lookup: cast(value)})
+                except (ValueError, TypeError):
+                    pass
+        return queryset
+
+    @staticmethod
+    def geojson(params):
+        """
+        Costruisce la FeatureCollection per i parametri della richiesta.
+
+        Args:
+            params: QueryDict con bbox, zoom, clusters e i filtri della mappa
+
+        Returns:
+            dict: FeatureCollection GeoJSON con i membri aggiuntivi 'clustered' e 'zoom'
+        """
+        queryset = StationMapService.filter_stations(
+            ChargingStation.objects.filter(latitude__isnull=False, longitude__isnull=False), params)
+
+        try:
+            zoom = int(params.get('zoom'))
+        except (TypeError, ValueError):
+            zoom = None
+        bbox = StationMapService.parse_bbox(params.get('bbox'))
+
+        clustered = False
+        if zoom is not None and zoom < StationMapService.CLUSTER_MAX_ZOOM and params.get('clusters') != '0':
+            show_clusters, min_cluster_size = StationMapService.cluster_settings()
+            clustered = show_clusters
+
+        if clustered:
+            features = StationMapService.cluster_features(queryset, bbox, zoom, min_cluster_size)
+        else:
+            if bbox:
+                queryset = StationMapService.within(queryset, bbox)
+            features = StationMapService.point_features(queryset)
+
+        return {
+            'type': 'FeatureCollection',
+            'clustered': clustered,
+            'zoom': zoom,
+            'features': features,
+        }
+
+    @staticmethod
+    def within(queryset, bbox):
+        """Stazioni dentro il riquadro (ovest, sud, est, nord)"""
+        west, south, east, north = bbox
+        return StationMapService.near(queryset, bbox).filter(
+            longitude__gte=west, longitude__lte=east, latitude__gte=south, latitude__lte=north)
+
+    @staticmethod
+    def near(queryset, bbox):
+        """
+        Prefiltro sulla colonna geohash indicizzata per un riquadro.
+
+        Limita le righe a quelle nelle celle geohash che coprono il riquadro,
+        con un range sull'indice per prefisso; il filtro esatto sulle
+        coordinate va applicato dopo. Le righe senza geohash (create con
+        bulk_create, prima di rebuild_spatial_index) restano incluse. Per
+        riquadri molto grandi il queryset resta invariato.
+
+        Args:
+            queryset: QuerySet di un modello con la colonna geohash
+            bbox: (ovest, sud, est, nord) in gradi
+
+        Returns:
+            QuerySet: Righe nelle celle del riquadro
+        """
+        prefixes = geohash.covering(*bbox)
+        if not prefixes:
+            return queryset
+        return queryset.filter(reduce(operator.or_, (Q(geohash__startswith=prefix) for prefix in prefixes), Q(geohash='')))
+
+    @staticmethod
+    def point_features(queryset):
+        """
+        Una feature per stazione, letta con values() senza istanziare i modelli.
+
+        Args:
+            queryset: QuerySet di ChargingStation
+
+        Returns:
+            list: Feature GeoJSON di tipo Point
+        """
+        labels = {key: str(label) for key, label in ChargingStation.STATUS_CHOICES}
+        features = []
+        for row in queryset.order_by().values(*StationMapService.POINT_FIELDS):
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [float(row['longitude']), float(row['latitude'])]},
+                'properties': {
+                    'id': row['id'],
+                    'name': row['name'],
+                    'identifier': row['identifier'],
+                    'address': row['address'],
+                    'status': row['status'],
+                    'status_display': labels.get(row['status'], row['status']),
+                    'power': float(row['total_power']),
+                    'charging_points': row['charging_points'],
+                    'installation_date': row['installation_date'].strftime('%d/%m/%Y') if row['installation_date'] else None,
+                    'subproject_id': row['sub_project_id'],
+                    'subproject_name': row['sub_project__name'],
+                    'project_id': row['sub_project__project_id'],
+                    'project_name': row['sub_project__project__name'],
+                },
+            })
+        return features
+
+    @staticmethod
+    def cluster_features(queryset, bbox, zoom, min_cluster_size):
+        """
+        Raggruppa le stazioni in celle di una griglia regolare.
+
+        Il riquadro viene allargato ai bordi delle celle, così una cella ha
+        sempre lo stesso contenuto qualunque sia la porzione visibile. Le
+        celle con meno di min_cluster_size stazioni vengono restituite come
+        stazioni singole.
+
+        Args:
+            queryset: QuerySet di ChargingStation già filtrato
+            bbox: (ovest, sud, est, nord) oppure None per tutta la mappa
+            zoom: Livello di zoom
+            min_cluster_size: Numero minimo di stazioni per formare un cluster
+
+        Returns:
+            list: Feature dei cluster (con point_count, total_power e status) e delle stazioni singole
+        """
+        size = StationMapService.cell_size(zoom)
+        if bbox:
+            # Riquadro allargato ai bordi delle celle
+            west, south, east, north = bbox
+            west, south, east, north = (
+                (west // size) * size, (south // size) * size, (east // size + 1) * size, (north // size + 1) * size)
+            queryset = StationMapService.near(queryset, (west, south, east, north)).filter(
+                longitude__gte=west, longitude__lt=east, latitude__gte=south, latitude__lt=north,
+            )
+        cells = queryset.annotate(
+            cell_x=Floor(Cast('longitude', FloatField()) / Value(size)),
+            cell_y=Floor(Cast('latitude', FloatField()) / Value(size)),
+        ).annotate(
+            cell_key=F('cell_x') * Value(StationMapService.CELL_KEY_FACTOR) + F('cell_y'),
+        )
+
+        statuses = [key for key, _label in ChargingStation.STATUS_CHOICES]
+        groups = cells.order_by().values('cell_x', 'cell_y').annotate(
+            point_count=Count('id'),
+            total_power=Sum('total_power'),
+            lat=Avg(Cast('latitude', FloatField())),
+            lng=Avg(Cast('longitude', FloatField())),
+            **{f'status_{status}': Count('id', filter=Q(status=status)) for status in statuses},
+        )
+
+        features = []
+        expansion_zoom = min(zoom + 2, StationMapService.CLUSTER_MAX_ZOOM)
+        for group in groups.filter(point_count__gte=min_cluster_size):
+            count = group['point_count']
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [group['lng'], group['lat']]},
+                'properties': {
+                    'cluster': True,
+                    'cluster_id': f"{zoom}:{int(group['cell_x'])}:{int(group['cell_y'])}",
+                    'point_count': count,
+                    'point_count_abbreviated': f'{count / 1000:.1f}k' if count >= 1000 else str(count),
+                    'total_power': float(group['total_power'] or 0),
+                    'status': {status: group[f'status_{status}'] for status in statuses if group[f'status_{status}']},
+                    'expansion_zoom': expansion_zoom,
+                },
+            })
+
+        # Le stazioni delle celle troppo piccole per un cluster, con una sottoquery sulle stesse celle
+        small_cells = cells.order_by().values('cell_key').annotate(
+            point_count=Count('id')).filter(point_count__lt=min_cluster_size).values('cell_key')
+        features.extend(StationMapService.point_features(cells.filter(cell_key__in=small_cells)))
+        return features
+
+
+class MarkerMapService:
+    """Dati GeoJSON dei marker personalizzati"""
+
+    # Campi letti per ogni marker (join su progetto, comune e autore)
+    FIELDS = (
+        'id', 'name', 'description', 'color', 'icon', 'popup_title', 'popup_content', 'latitude', 'longitude',
+        'project_id', 'project__name', 'municipality_id', 'municipality__name',
+        'created_by_id', 'created_by__first_name', 'created_by__last_name',
+    )
+
+    @staticmethod
+    def features(queryset):
+        """
+        Una feature per marker, letta con values().
+
+        Le proprietà non dipendono dall'utente: is_own_marker si ottiene
+        confrontando created_by_id con l'utente corrente.
+
+        Args:
+            queryset: QuerySet di CustomMarker
+
+        Returns:
+            list: Feature GeoJSON di tipo Point
+        """
+        features = []
+        for row in queryset.order_by().values(*MarkerMapService.FIELDS):
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [row['longitude'], row['latitude']]},
+                'properties': {
+                    'id': row['id'],
+                    'name': row['name'],
+                    'description': row['description'],
+                    'color': row['color'],
+                    'icon': row['icon'],
+                    'popup_title': row['popup_title'],
+                    'popup_content': row['popup_content'],
+                    'project_id': row['project_id'],
+                    'project_name': row['project__name'],
+                    'municipality_id': row['municipality_id'],
+                    'municipality_name': row['municipality__name'],
+                    'created_by_id': row['created_by_id'],
+                    'created_by': f"{row['created_by__first_name']} {row['created_by__last_name']}".strip(),
+                },
+            })
+        return features
+
+
+class MapTileService:
+    """
+    Tile GeoJSON z/x/y pre-renderizzati per stazioni e marker.
+
+    Ogni tile è salvato (corpo JSON, ETag e data di generazione) nella cache
+    MAP_TILE_CACHE, di norma su file e condivisa tra i processi. Quando una
+    stazione o un marker cambia vengono scartati solo i tile che contengono
+    la sua posizione (vecchia e nuova), uno per livello di zoom; le modifiche
+    che toccano tutti i tile (nomi di progetti, impostazioni della mappa)
+    cambiano invece la versione del layer.
+    """
+
+    LAYERS = ('stations', 'markers')
+
+    MAX_ZOOM = 18
+
+    # Latitudine massima della proiezione Web Mercator
+    MAX_LATITUDE = 85.0511287798
+
+    # Da incrementare quando cambiano le proprietà delle feature, per scartare i tile vecchi
+    FORMAT_VERSION = 2
+
+    @staticmethod
+    def get_cache():
+        """Restituisce la cache configurata per i tile della mappa"""
+        return caches[getattr(settings, 'MAP_TILE_CACHE', 'default')]
+
+    @staticmethod
+    def tile_bounds(z, x, y):
+        """
+        Riquadro geografico di un tile.
+
+        Args:
+            z, x, y: Coordinate del tile (schema XYZ)
+
+        Returns:
+            tuple: (ovest, sud, est, nord) in gradi
+        """
+        n = 2 ** z
+
+        def latitude(row):
+            return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+        return x / n * 360 - 180, latitude(y + 1), (x + 1) / n * 360 - 180, latitude(y)
+
+    @staticmethod
+    def tile_for(latitude, longitude, z):
+        """
+        Tile che contiene un punto a un livello di zoom.
+
+        Args:
+            latitude: Latitudine in gradi
+            longitude: Longitudine in gradi
+            z: Livello di zoom
+
+        Returns:
+            tuple: (x, y)
+        """
+        n = 2 ** z
+        latitude = max(-MapTileService.MAX_LATITUDE, min(MapTileService.MAX_LATITUDE, float(latitude)))
+        x = int((float(longitude) + 180) / 360 * n)
+        y = int((1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * n)
+        return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+    @staticmethod
+    def _version(layer):
+        cache = MapTileService.get_cache()
+        key = f'map_tiles:{layer}:version'
+        version = cache.get(key)
+        if version is None:
+            version = uuid.uuid4().hex[:12]
+            cache.add(key, version, None)
+            version = cache.get(key, version)
+        return version
+
+    @staticmethod
+    def _key(layer, version, z, x, y):
+        return f'map_tiles:{layer}:v{MapTileService.FORMAT_VERSION}:{version}:{z}:{x}:{y}'
+
+    @staticmethod
+    def get_tile(layer, z, x, y):
+        """
+        Restituisce un tile dalla cache, generandolo se manca.
+
+        Args:
+            layer: 'stations' o 'markers'
+            z, x, y: Coordinate del tile
+
+        Returns:
+            dict: 'body' (bytes JSON), 'etag' e 'last_modified' (timestamp)
+        """
+        cache = MapTileService.get_cache()
+        key = MapTileService._key(layer, MapTileService._version(layer), z, x, y)
+        tile = cache.get(key)
+        if tile is None:
+            tile = MapTileService.render(layer, z, x, y)
+            cache.set(key, tile, None)
+        return tile
+
+    @staticmethod
+    def render(layer, z, x, y):
+        """
+        Genera un tile.
+
+        I bordi sono semiaperti (ovest e sud inclusi), così ogni elemento
+        appartiene a un solo tile per livello di zoom e le stazioni vengono
+        raggruppate con la griglia di StationMapService solo all'interno del
+        tile.
+
+        Args:
+            layer: 'stations' o 'markers'
+            z, x, y: Coordinate del tile
+
+        Returns:
+            dict: Come per get_tile
+        """
+        from .models import CustomMarker
+
+        west, south, east, north = MapTileService.tile_bounds(z, x, y)
+        inside = {
+            'longitude__gte': west, 'longitude__lt': east,
+            'latitude__gte': south, 'latitude__lt': north,
+        }
+        if layer == 'stations':
+            queryset = StationMapService.near(ChargingStation.objects, (west, south, east, north)).filter(**inside)
+            show_clusters, min_cluster_size = StationMapService.cluster_settings()
+            if show_clusters and z < StationMapService.CLUSTER_MAX_ZOOM:
+                features = StationMapService.cluster_features(queryset, None, z, min_cluster_size)
+            else:
+                features = StationMapService.point_features(queryset)
+        else:
+            features = MarkerMapService.features(StationMapService.near(
+                CustomMarker.objects.filter(is_visible=True), (west, south, east, north)).filter(**inside))
+
+        body = json.dumps({
+            'type': 'FeatureCollection',
+            'tile': [z, x, y],
+            'features': features,
+        }, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')
+        return {
+            'body': body,
+            'etag': hashlib.sha1(body).hexdigest(),
+            'last_modified': time.time(),
+        }
+
+    @staticmethod
+    def invalidate_point(layer, latitude, longitude):
+        """
+        Scarta i tile (di ogni zoom) che contengono un punto.
+
+        Args:
+            layer: 'stations' o 'markers'
+            latitude: Latitudine in gradi
+            longitude: Longitudine in gradi
+        """
+        if latitude is None or longitude is None:
+            return
+        version = MapTileService._version(layer)
+        MapTileService.get_cache().delete_many([
+            MapTileService._key(layer, version, z, *MapTileService.tile_for(latitude, longitude, z))
+            for z in range(MapTileService.MAX_ZOOM + 1)
+        ])
+
+    @staticmethod
+    def invalidate_layer(layer):
+        """
+        Scarta tutti i tile di un layer cambiandone la versione.
+
+        Args:
+            layer: 'stations' o 'markers'
+        """
+        MapTileService.get_cache().set(f'map_tiles:{layer}:version', uuid.uuid4().hex[:12], None)
+
+    @staticmethod
+    def prerender(layer, max_zoom, progress=None):
+        """
+        Genera in anticipo i tile non vuoti fino a un livello di zoom.
+
+        Args:
+            layer: 'stations' o 'markers'
+            max_zoom: Ultimo livello di zoom da generare
+            progress: Funzione opzionale chiamata con (zoom, tile generati)
+
+        Returns:
+            int: Numero di tile generati
+        """
+        from .models import CustomMarker
+
+        if layer == 'stations':
+            points = ChargingStation.objects.filter(latitude__isnull=False, longitude__isnull=False)
+        else:
+            points = CustomMarker.objects.filter(is_visible=True)
+        points = list(points.values_list('latitude', 'longitude'))
+
+        rendered = 0
+        for z in range(max_zoom + 1):
+            tiles = {MapTileService.tile_for(latitude, longitude, z) for latitude, longitude in points}
+            for x, y in sorted(tiles):
+                MapTileService.get_tile(layer, z, x, y)
+            rendered += len(tiles)
+            if progress:
+                progress(z, len(tiles))
+        return rendered
+
+
+class SpatialIndex:
+    """
+    Indice spaziale in memoria di un insieme di punti.
+
+    Le coordinate sono convertite in vettori unitari 3D: la distanza in linea
+    retta tra due vettori cresce con la distanza sulla sfera, quindi un
+    cKDTree sui vettori risponde in modo esatto alle ricerche per raggio e
+    ai k più vicini anche lontano dall'equatore. Per i riquadri i punti sono
+    ordinati per longitudine e selezionati con una bisezione.
+    """
+
+    # Raggio medio terrestre (km)
+    EARTH_RADIUS_KM = 6371.0088
+
+    def __init__(self, ids, latitudes, longitudes, weights=None):
+        """
+        Args:
+            ids: Id dei punti
+            latitudes: Latitudini in gradi
+            longitudes: Longitudini in gradi
+            weights: Valori opzionali associati ai punti (es. potenza), nello stesso ordine
+        """
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        order = np.argsort(longitudes, kind='stable')
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)[order]
+        self.longitudes = longitudes[order]
+        self.weights = np.asarray(weights, dtype=np.float64)[order] if weights is not None else None
+        self.tree = cKDTree(self.to_xyz(self.latitudes, self.longitudes)) if self.ids.size else None
+
+    def __len__(self):
+        return self.ids.size
+
+    @staticmethod
+    def to_xyz(latitudes, longitudes):
+        """
+        Vettori unitari 3D dei punti.
+
+        Args:
+            latitudes: Latitudini in gradi (scalare o array)
+            longitudes: Longitudini in gradi (scalare o array)
+
+        Returns:
+            numpy.ndarray: Array (..., 3)
+        """
+        lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+        lng = np.radians(np.asarray(longitudes, dtype=np.float64))
+        cos_lat = np.cos(lat)
+        return np.stack([cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)], axis=-1)
+
+    @staticmethod
+    def haversine_km(latitudes, longitudes, other_latitudes, other_longitudes):
+        """
+        Distanza sulla sfera (formula dell'emisenoverso), elemento per elemento.
+
+        Args:
+            latitudes, longitudes: Coordinate in gradi (scalari o array)
+            other_latitudes, other_longitudes: Coordinate in gradi (scalari o array)
+
+        Returns:
+            numpy.ndarray: Distanze in km
+        """
+        lat1 = np.radians(np.asarray(latitudes, dtype=np.float64))
+        lat2 = np.radians(np.asarray(other_latitudes, dtype=np.float64))
+        dlat = lat2 - lat1
+        dlng = np.radians(np.asarray(other_longitudes, dtype=np.float64) - np.asarray(longitudes, dtype=np.float64))
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+        return 2 * SpatialIndex.EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+    @staticmethod
+    def chord(distance_km):
+        """Distanza in linea retta tra vettori unitari corrispondente a una distanza sulla sfera"""
+        return 2 * np.sin(np.minimum(np.asarray(distance_km, dtype=np.float64) / SpatialIndex.EARTH_RADIUS_KM, np.pi) / 2)
+
+    @staticmethod
+    def arc(chord):
+        """Distanza sulla sfera (km) corrispondente a una distanza tra vettori unitari"""
+        return 2 * SpatialIndex.EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+    def within_radius(self, latitude, longitude, radius_km):
+        """
+        Punti entro una distanza, dal più vicino.
+
+        Args:
+            latitude: Latitudine del centro
+            longitude: Longitudine del centro
+            radius_km: Raggio in chilometri
+
+        Returns:
+            tuple: (ids, distanze in km) come array numpy
+        """
+        if self.tree is None:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        center = self.to_xyz(latitude, longitude)
+        positions = np.asarray(self.tree.query_ball_point(center, float(self.chord(radius_km))), dtype=np.int64)
+        distances = self.arc(np.linalg.norm(self.tree.data[positions] - center, axis=1))
+        order = np.argsort(distances, kind='stable')
+        return self.ids[positions[order]], distances[order]
+
+    def nearest(self, latitude, longitude, k=1, max_distance_km=None):
+        """
+        I k punti più vicini.
+
+        Args:
+            latitude: Latitudine del centro
+            longitude: Longitudine del centro
+            k: Numero di punti
+            max_distance_km: Distanza massima opzionale
+
+        Returns:
+            tuple: (ids, distanze in km) come array numpy, dal più vicino
+        """
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        upper_bound = float(self.chord(max_distance_km)) if max_distance_km is not None else np.inf
+        chords, positions = self.tree.query(self.to_xyz(latitude, longitude), k=k, distance_upper_bound=upper_bound)
+        chords, positions = np.atleast_1d(chords), np.atleast_1d(positions)
+        found = positions < len(self)
+        return self.ids[positions[found]], self.arc(chords[found])
+
+    def within_bbox(self, west, south, east, north):
+        """
+        Punti dentro un riquadro.
+
+        Args:
+            west, south, east, north: Bordi del riquadro in gradi
+
+        Returns:
+            numpy.ndarray: Id dei punti
+        """
+        start = np.searchsorted(self.longitudes, west, side='left')
+        stop = np.searchsorted(self.longitudes, east, side='right')
+        latitudes = self.latitudes[start:stop]
+        return self.ids[start:stop][(latitudes >= south) & (latitudes <= north)]
+
+    def pairs_within(self, distance_km):
+        """
+        Coppie di punti più vicine di una distanza (es. siti duplicati).
+
+        Args:
+            distance_km: Distanza in chilometri
+
+        Returns:
+            tuple: (array (n, 2) di coppie di id, distanze in km)
+        """
+        if self.tree is None:
+            return np.empty((0, 2), dtype=np.int64), np.empty(0)
+        pairs = self.tree.query_pairs(float(self.chord(distance_km)), output_type='ndarray')
+        distances = self.arc(np.linalg.norm(self.tree.data[pairs[:, 0]] - self.tree.data[pairs[:, 1]], axis=1))
+        order = np.argsort(distances, kind='stable')
+        return self.ids[pairs[order]], distances[order]
+
+
+class SpatialIndexService:
+    """
+    Indici spaziali in memoria di stazioni, siti e marker, per processo.
+
+    Come per l'autocompletamento dei comuni, una versione per layer nel
+    database (vedi InMemoryData) viene cambiata quando un elemento viene
+    creato, spostato o eliminato, e l'indice viene ricostruito con una sola
+    query al primo uso successivo. I siti sono i sottoprogetti di cpo_core,
+    nella posizione approvata o, in mancanza, in quella proposta.
+    """
+
+    LAYERS = ('stations', 'sites', 'markers')
+
+    _indexes = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _data(layer):
+        """Dati in memoria di un layer"""
+        if layer not in SpatialIndexService.LAYERS:
+            raise ValueError(f"Layer spaziale non valido: {layer}")
+        with SpatialIndexService._lock:
+            if layer not in SpatialIndexService._indexes:
+                SpatialIndexService._indexes[layer] = InMemoryData(
+                    f'mapping:spatial_index:{layer}', lambda: SpatialIndexService.load(layer))
+            return SpatialIndexService._indexes[layer]
+
+    @staticmethod
+    def invalidate(layer):
+        """
+        Segnala a tutti i processi che le posizioni di un layer sono cambiate.
+
+        Args:
+            layer: Uno di LAYERS
+        """
+        SpatialIndexService._data(layer).invalidate()
+
+    @staticmethod
+    def get_index(layer):
+        """
+        Restituisce l'indice di un layer, ricostruendolo se non più valido.
+
+        Args:
+            layer: Uno di LAYERS
+
+        Returns:
+            SpatialIndex: Indice corrente
+        """
+        return SpatialIndexService._data(layer).get()
+
+    @staticmethod
+    def load(layer):
+        """
+        Costruisce l'indice di un layer dal database.
+
+        Args:
+            layer: Uno di LAYERS
+
+        Returns:
+            SpatialIndex: Nuovo indice
+        """
+        from cpo_core.models import SubProject as Site
+        from .models import CustomMarker
+
+        if layer == 'stations':
+            queryset = ChargingStation.objects.values_list('id', 'latitude', 'longitude')
+        elif layer == 'sites':
+            queryset = Site.objects.annotate(
+                lat=Coalesce('latitude_approved', 'latitude_proposed'),
+                lng=Coalesce('longitude_approved', 'longitude_proposed'),
+            ).values_list('id', 'lat', 'lng')
+            queryset = queryset.filter(lat__isnull=False, lng__isnull=False)
+        else:
+            queryset = CustomMarker.objects.values_list('id', 'latitude', 'longitude')
+        if layer != 'sites':
+            queryset = queryset.filter(latitude__isnull=False, longitude__isnull=False)
+
+        rows = list(queryset.order_by())
+        return SpatialIndex(
+            [row[0] for row in rows],
+            [float(row[1]) for row in rows],
+            [float(row[2]) for row in rows],
+        )
+
+    @staticmethod
+    def within_radius(layer, latitude, longitude, radius_km):
+        """
+        Elementi entro una distanza da un punto.
+
+        Args:
+            layer: Uno di LAYERS
+            latitude: Latitudine del centro
+            longitude: Longitudine del centro
+            radius_km: Raggio in chilometri
+
+        Returns:
+            list: Tuple (id, distanza in km), dal più vicino
+        """
+        ids, distances = SpatialIndexService.get_index(layer).within_radius(latitude, longitude, radius_km)
+        return list(zip(ids.tolist(), distances.tolist()))
+
+    @staticmethod
+    def nearest(layer, latitude, longitude, k=1, max_distance_km=None):
+        """
+        I k elementi più vicini a un punto.
+
+        Args:
+            layer: Uno di LAYERS
+            latitude: Latitudine del centro
+            longitude: Longitudine del centro
+            k: Numero di elementi
+            max_distance_km: Distanza massima opzionale
+
+        Returns:
+            list: Tuple (id, distanza in km), dal più vicino
+        """
+        ids, distances = SpatialIndexService.get_index(layer).nearest(latitude, longitude, k, max_distance_km)
+        return list(zip(ids.tolist(), distances.tolist()))
+
+    @staticmethod
+    def within_bbox(layer, bbox):
+        """
+        Elementi dentro un riquadro.
+
+        Args:
+            layer: Uno di LAYERS
+            bbox: (ovest, sud, est, nord) in gradi
+
+        Returns:
+            list: Id degli elementi
+        """
+        return SpatialIndexService.get_index(layer).within_bbox(*bbox).tolist()
+
+
+class CoverageAnalysisService:
+    """
+    Analisi della copertura di ricarica di tutti i comuni.
+
+    Per ogni comune con coordinate calcola la distanza dalla stazione
+    esistente o pianificata più vicina e la potenza installata entro il
+    raggio COVERAGE_RADIUS_KM per potenziale utente EV, e salva il risultato
+    in MunicipalityCoverage. Il calcolo è vettoriale: un cKDTree sulle
+    stazioni trova la più vicina a tutti i comuni in una sola chiamata e la
+    matrice sparsa delle coppie comune-stazione entro il raggio dà conteggi e
+    potenze con np.bincount. Quando una stazione cambia vengono ricalcolati
+    solo i comuni su cui può influire.
+    """
+
+    # Stati delle stazioni considerate (esistenti o pianificate)
+    STATION_STATUSES = ('planned', 'active', 'maintenance')
+
+    DEFAULT_RADIUS_KM = 10
+
+    # Soglie di kW per potenziale utente EV delle classi di copertura
+    # (1,3 kW per auto elettrica è l'obiettivo del regolamento AFIR)
+    CLASS_THRESHOLDS = ((0.3, 'critical'), (0.7, 'low'), (1.3, 'medium'))
+
+    UPDATE_FIELDS = (
+        'radius_km', 'nearest_station', 'nearest_station_km', 'stations_within', 'power_within_kw',
+        'potential_ev_users', 'kw_per_ev_user', 'coverage_class', 'updated_at',
+    )
+
+    @staticmethod
+    def radius_km():
+        """Raggio dell'analisi (impostazione COVERAGE_RADIUS_KM)"""
+        return float(getattr(settings, 'COVERAGE_RADIUS_KM', CoverageAnalysisService.DEFAULT_RADIUS_KM))
+
+    @staticmethod
+    def station_index(bbox=None):
+        """
+        Indice delle stazioni considerate, con la potenza come peso.
+
+        Args:
+            bbox: (ovest, sud, est, nord) opzionale per leggere solo una zona
+
+        Returns:
+            SpatialIndex: Stazioni esistenti o pianificate con coordinate
+        """
+        queryset = ChargingStation.objects.filter(
+            status__in=CoverageAnalysisService.STATION_STATUSES,
+            latitude__isnull=False, longitude__isnull=False,
+        )
+        if bbox:
+            queryset = StationMapService.within(queryset, bbox)
+        rows = list(queryset.order_by().values_list('id', 'latitude', 'longitude', 'total_power'))
+        return SpatialIndex(
+            [row[0] for row in rows],
+            [float(row[1]) for row in rows],
+            [float(row[2]) for row in rows],
+            weights=[float(row[3] or 0) for row in rows],
+        )
+
+    @staticmethod
+    def municipalities(region=None):
+        """
+        Comuni con coordinate, come array.
+
+        Args:
+            region: Regione opzionale a cui limitare i comuni
+
+        Returns:
+            dict: Array 'ids', 'latitudes', 'longitudes' ed 'ev_users'
+                (come Municipality.potential_ev_users)
+        """
+        from infrastructure.models import Municipality
+
+        queryset = Municipality.objects.filter(latitude__isnull=False, longitude__isnull=False)
+        if region:
+            queryset = queryset.filter(region=region)
+        rows = list(queryset.order_by('pk').values_list('pk', 'latitude', 'longitude', 'population', 'ev_adoption_rate'))
+        population = np.array([row[3] or 0 for row in rows], dtype=np.float64)
+        adoption = np.array([row[4] or 0 for row in rows], dtype=np.float64)
+        return {
+            'ids': np.array([row[0] for row in rows], dtype=np.int64),
+            'latitudes': np.array([row[1] for row in rows], dtype=np.float64),
+            'longitudes': np.array([row[2] for row in rows], dtype=np.float64),
+            'ev_users': np.floor(population * (adoption / 100)).astype(np.int64),
+        }
+
+    @staticmethod
+    def evaluate(municipalities, stations, radius_km):
+        """
+        Calcola la copertura di un insieme di comuni.
+
+        Args:
+            municipalities: Array dei comuni (come da municipalities())
+            stations: SpatialIndex delle stazioni con la potenza come peso
+            radius_km: Raggio in km
+
+        Returns:
+            dict: Array allineati ai comuni: 'nearest_ids' (-1 se non ci sono
+                stazioni), 'nearest_km', 'counts', 'power', 'kw_per_user' e 'classes'
+        """
+        size = municipalities['ids'].size
+        nearest_ids = np.full(size, -1, dtype=np.int64)
+        nearest_km = np.full(size, np.nan)
+        counts = np.zeros(size, dtype=np.int64)
+        power = np.zeros(size)
+
+        if size and len(stations):
+            latitudes, longitudes = municipalities['latitudes'], municipalities['longitudes']
+            points = SpatialIndex.to_xyz(latitudes, longitudes)
+            _chords, positions = stations.tree.query(points, k=1)
+            nearest_ids = stations.ids[positions]
+            nearest_km = SpatialIndex.haversine_km(
+                latitudes, longitudes, stations.latitudes[positions], stations.longitudes[positions])
+
+            pairs = cKDTree(points).sparse_distance_matrix(
+                stations.tree, float(SpatialIndex.chord(radius_km)), output_type='ndarray')
+            counts = np.bincount(pairs['i'], minlength=size)
+            power = np.bincount(pairs['i'], weights=stations.weights[pairs['j']], minlength=size)
+
+        ev_users = municipalities['ev_users']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            kw_per_user = np.where(ev_users > 0, power / ev_users, np.nan)
+
+        conditions = [counts == 0, ev_users == 0]
+        choices = ['none', 'adequate']
+        for threshold, label in CoverageAnalysisService.CLASS_THRESHOLDS:
+            conditions.append(kw_per_user < threshold)
+            choices.append(label)
+        classes = np.select(conditions, choices, default='adequate')
+
+        return {
+            'nearest_ids': nearest_ids, 'nearest_km': nearest_km, 'counts': counts,
+            'power': power, 'kw_per_user': kw_per_user, 'classes': classes,
+        }
+
+    @staticmethod
+    def save(municipalities, result, radius_km):
+        """Scrive (o aggiorna) le righe di MunicipalityCoverage dei comuni calcolati"""
+        from .models import MunicipalityCoverage
+
+        def optional(value):
+            return None if np.isnan(value) else round(float(value), 4)
+
+        rows = [
+            MunicipalityCoverage(
+                municipality_id=int(pk),
+                radius_km=radius_km,
+                nearest_station_id=int(nearest_id) if nearest_id >= 0 else None,
+                nearest_station_km=optional(nearest_km),
+                stations_within=int(count),
+                power_within_kw=round(float(power), 2),
+                potential_ev_users=int(ev_users),
+                kw_per_ev_user=optional(kw_per_user),
+                coverage_class=str(coverage_class),
+            )
+            for pk, nearest_id, nearest_km, count, power, ev_users, kw_per_user, coverage_class in zip(
+                municipalities['ids'], result['nearest_ids'], result['nearest_km'], result['counts'],
+                result['power'], municipalities['ev_users'], result['kw_per_user'], result['classes'])
+        ]
+        MunicipalityCoverage.objects.bulk_create(
+            rows,
+            batch_size=2000,
+            update_conflicts=True,
+            unique_fields=['municipality'],
+            update_fields=list(CoverageAnalysisService.UPDATE_FIELDS),
+        )
+        return len(rows)
+
+    @staticmethod
+    def compute(radius_km=None):
+        """
+        Ricalcola la copertura di tutti i comuni.
+
+        Args:
+            radius_km: Raggio in km (default COVERAGE_RADIUS_KM)
+
+        Returns:
+            dict: Numero di 'municipalities' e 'stations' considerati
+        """
+        from .models import MunicipalityCoverage
+
+        radius_km = radius_km or CoverageAnalysisService.radius_km()
+        municipalities = CoverageAnalysisService.municipalities()
+        stations = CoverageAnalysisService.station_index()
+        result = CoverageAnalysisService.evaluate(municipalities, stations, radius_km)
+        with transaction.atomic():
+            MunicipalityCoverage.objects.filter(
+                Q(municipality__latitude__isnull=True) | Q(municipality__longitude__isnull=True)).delete()
+            CoverageAnalysisService.save(municipalities, result, radius_km)
+        return {'municipalities': int(municipalities['ids'].size), 'stations': len(stations)}
+
+    @staticmethod
+    def update_station(station_id, previous=None, current=None):
+        """
+        Aggiorna la copertura dopo la modifica di una stazione.
+
+        Vengono ricalcolati i comuni entro il raggio della vecchia o della
+        nuova posizione, quelli che avevano questa stazione come più vicina
+        e quelli per cui la nuova posizione è più vicina della loro stazione
+        più vicina. Se l'analisi non è mai stata eseguita non fa nulla.
+
+        Args:
+            station_id: Id della stazione
+            previous: (latitudine, longitudine) prima della modifica, o None
+            current: (latitudine, longitudine) dopo la modifica, o None se la
+                stazione è stata eliminata o non è più considerata
+
+        Returns:
+            int: Numero di comuni ricalcolati
+        """
+        from .models import MunicipalityCoverage
+
+        if not MunicipalityCoverage.objects.exists():
+            return 0
+        radius_km = CoverageAnalysisService.radius_km()
+        municipalities = CoverageAnalysisService.municipalities()
+        known = {
+            pk: (nearest_id, nearest_km)
+            for pk, nearest_id, nearest_km in MunicipalityCoverage.objects.values_list(
+                'municipality_id', 'nearest_station_id', 'nearest_station_km')
+        }
+        rows = [known.get(pk, (None, None)) for pk in municipalities['ids'].tolist()]
+        nearest_ids = np.array([row[0] if row[0] is not None else -1 for row in rows], dtype=np.int64)
+        nearest_km = np.array([row[1] if row[1] is not None else np.nan for row in rows], dtype=np.float64)
+
+        # La cancellazione della stazione azzera prima nearest_station (SET_NULL)
+        affected = (nearest_ids == station_id) | ((nearest_ids < 0) & ~np.isnan(nearest_km))
+        for position, closer in ((previous, False), (current, True)):
+            if not position or None in position:
+                continue
+            distances = SpatialIndex.haversine_km(
+                municipalities['latitudes'], municipalities['longitudes'], float(position[0]), float(position[1]))
+            affected |= distances <= radius_km
+            if closer:
+                # Comuni senza stazione più vicina (NaN) o più lontani dalla loro
+                affected |= ~(distances >= nearest_km)
+
+        if not affected.any():
+            return 0
+        subset = {key: values[affected] for key, values in municipalities.items()}
+
+        # Basta leggere le stazioni a una distanza dai comuni pari al raggio o alla loro
+        # stazione più vicina; se una stazione più vicina non è garantita nella zona letta
+        # (es. è stata eliminata la più vicina) si usano tutte le stazioni
+        margin = max(radius_km, float(np.fmax.reduce(nearest_km[affected], initial=0)))
+        bbox = CoverageAnalysisService.expand_bbox(subset['latitudes'], subset['longitudes'], margin)
+        result = CoverageAnalysisService.evaluate(subset, CoverageAnalysisService.station_index(bbox), radius_km)
+        if not (result['nearest_km'] <= margin).all():
+            result = CoverageAnalysisService.evaluate(subset, CoverageAnalysisService.station_index(), radius_km)
+        return CoverageAnalysisService.save(subset, result, radius_km)
+
+    @staticmethod
+    def expand_bbox(latitudes, longitudes, distance_km):
+        """
+        Riquadro che contiene tutti i punti entro una distanza da un insieme di punti.
+
+        Args:
+            latitudes: Latitudini in gradi
+            longitudes: Longitudini in gradi
+            distance_km: Distanza in km
+
+        Returns:
+            tuple: (ovest, sud, est, nord) in gradi
+        """
+        angle = distance_km / SpatialIndex.EARTH_RADIUS_KM
+        south = max(float(latitudes.min()) - np.degrees(angle), -90.0)
+        north = min(float(latitudes.max()) + np.degrees(angle), 90.0)
+        # Massima differenza di longitudine entro la distanza, alla latitudine più lontana dall'equatore
+        ratio = np.sin(min(angle, np.pi / 2)) / np.cos(np.radians(max(abs(float(latitudes.min())), abs(float(latitudes.max())))))
+        if ratio >= 1:
+            return -180.0, south, 180.0, north
+        spread = float(np.degrees(np.arcsin(ratio)))
+        return max(float(longitudes.min()) - spread, -180.0), south, min(float(longitudes.max()) + spread, 180.0), north
+
+    @staticmethod
+    def update_municipality(municipality):
+        """
+        Aggiorna la copertura di un comune dopo la modifica di coordinate o popolazione.
+
+        Args:
+            municipality: Istanza di Municipality
+        """
+        from .models import MunicipalityCoverage
+
+        if not MunicipalityCoverage.objects.exists():
+            return
+        if municipality.latitude is None or municipality.longitude is None:
+            MunicipalityCoverage.objects.filter(municipality=municipality).delete()
+            return
+        radius_km = CoverageAnalysisService.radius_km()
+        subset = {
+            'ids': np.array([municipality.pk], dtype=np.int64),
+            'latitudes': np.array([municipality.latitude], dtype=np.float64),
+            'longitudes': np.array([municipality.longitude], dtype=np.float64),
+            'ev_users': np.array([municipality.potential_ev_users()], dtype=np.int64),
+        }
+        result = CoverageAnalysisService.evaluate(subset, CoverageAnalysisService.station_index(), radius_km)
+        CoverageAnalysisService.save(subset, result, radius_km)
+
+    @staticmethod
+    def geojson(params):
+        """
+        GeoJSON della copertura dei comuni per il layer della mappa.
+
+        Args:
+            params: QueryDict con bbox opzionale (ovest,sud,est,nord)
+
+        Returns:
+            dict: FeatureCollection con un punto per comune
+        """
+        from .models import MunicipalityCoverage
+
+        queryset = MunicipalityCoverage.objects.all()
+        bbox = StationMapService.parse_bbox(params.get('bbox'))
+        if bbox:
+            west, south, east, north = bbox
+            queryset = queryset.filter(
+                municipality__longitude__gte=west, municipality__longitude__lte=east,
+                municipality__latitude__gte=south, municipality__latitude__lte=north,
+            )
+
+        features = []
+        for row in queryset.order_by().values(
+                'municipality_id', 'municipality__name', 'municipality__province', 'municipality__latitude',
+                'municipality__longitude', 'municipality__population', 'nearest_station_km', 'stations_within',
+                'power_within_kw', 'potential_ev_users', 'kw_per_ev_user', 'coverage_class'):
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [row['municipality__longitude'], row['municipality__latitude']]},
+                'properties': {
+                    'id': row['municipality_id'],
+                    'name': row['municipality__name'],
+                    'province': row['municipality__province'],
+                    'population': row['municipality__population'] or 0,
+                    'nearest_km': row['nearest_station_km'],
+                    'stations': row['stations_within'],
+                    'power': row['power_within_kw'],
+                    'ev_users': row['potential_ev_users'],
+                    'kw_per_user': row['kw_per_ev_user'],
+                    'coverage_class': row['coverage_class'],
+                },
+            })
+        return {
+            'type': 'FeatureCollection',
+            'radius_km': CoverageAnalysisService.radius_km(),
+            'features': features,
+        }
+
+
+class SiteSelectionService:
+    """
+    Scelta dei siti per nuovi sottoprogetti che massimizzano la domanda coperta.
+
+    La domanda è data dai potenziali utenti EV dei comuni con coordinate; un
+    comune è coperto se una stazione considerata da CoverageAnalysisService o
+    un sito scelto è entro il raggio di servizio, e i comuni già coperti non
+    contano. La domanda coperta è una funzione submodulare, quindi la scelta
+    greedy garantisce almeno il 63% (1 - 1/e) dell'ottimo. La matrice sparsa
+    candidati x comuni viene costruita con un cKDTree; a ogni passo i guadagni
+    calcolati in precedenza sono limiti superiori validi (lazy greedy) e
+    vengono ricalcolati in blocco, con un prodotto matrice-vettore, solo per i
+    candidati con il limite più alto finché il migliore è aggiornato.
+    """
+
+    SOURCES = ('subprojects', 'markers', 'grid')
+
+    DEFAULT_GRID_SPACING_KM = 5
+
+    # Candidati ricalcolati insieme a ogni verifica del lazy greedy
+    LAZY_BATCH = 64
+
+    # Limite ai punti della griglia per non saturare la memoria
+    MAX_GRID_POINTS = 200000
+
+    @staticmethod
+    def candidates(source, demand, radius_km, grid_spacing_km=None, user=None):
+        """
+        Posizioni candidate utili, cioè entro il raggio da almeno un comune.
+
+        Args:
+            source: 'subprojects' (coordinate proposte dei sottoprogetti),
+                'markers' (marker personalizzati visibili o propri) o 'grid'
+            demand: Array dei comuni (come da CoverageAnalysisService.municipalities())
+            radius_km: Raggio di servizio
+            grid_spacing_km: Passo della griglia (solo per 'grid')
+            user: Utente che richiede l'analisi, per i marker non visibili
+
+        Returns:
+            dict: Array 'latitudes' e 'longitudes', liste 'ids' (None per la
+                griglia) e 'labels'
+        """
+        from cpo_core.models import SubProject
+        from .models import CustomMarker
+
+        if source not in SiteSelectionService.SOURCES:
+            raise ValueError(f"Origine dei candidati non valida: {source}")
+
+        ids, labels = [], []
+        if not demand['ids'].size:
+            latitudes = longitudes = np.empty(0)
+        elif source == 'grid':
+            latitudes, longitudes = SiteSelectionService.grid(
+                demand, radius_km, grid_spacing_km or SiteSelectionService.DEFAULT_GRID_SPACING_KM)
+            ids = [None] * latitudes.size
+            labels = [f"{lat:.4f}, {lng:.4f}" for lat, lng in zip(latitudes, longitudes)]
+        else:
+            if source == 'subprojects':
+                queryset = SubProject.objects.filter(latitude_proposed__isnull=False, longitude_proposed__isnull=False)
+                fields = ('id', 'name', 'latitude_proposed', 'longitude_proposed')
+            else:
+                visible = Q(is_visible=True)
+                if user is not None and user.is_authenticated:
+                    visible |= Q(created_by=user)
+                queryset = CustomMarker.objects.filter(visible)
+                fields = ('id', 'name', 'latitude', 'longitude')
+            rows = list(queryset.order_by('pk').values_list(*fields))
+            ids = [row[0] for row in rows]
+            labels = [row[1] for row in rows]
+            latitudes = np.array([float(row[2]) for row in rows], dtype=np.float64)
+            longitudes = np.array([float(row[3]) for row in rows], dtype=np.float64)
+
+        # Solo i candidati che coprono almeno un comune possono dare un guadagno
+        if latitudes.size:
+            tree = cKDTree(SpatialIndex.to_xyz(demand['latitudes'], demand['longitudes']))
+            chords, _ = tree.query(SpatialIndex.to_xyz(latitudes, longitudes), k=1,
+                                   distance_upper_bound=float(SpatialIndex.chord(radius_km)))
+            useful = np.isfinite(chords)
+        else:
+            useful = np.zeros(0, dtype=bool)
+        return {
+            'latitudes': latitudes[useful],
+            'longitudes': longitudes[useful],
+            'ids': [value for value, keep in zip(ids, useful) if keep],
+            'labels': [value for value, keep in zip(labels, useful) if keep],
+        }
+
+    @staticmethod
+    def grid(demand, radius_km, spacing_km):
+        """
+        Griglia regolare sul riquadro dei comuni, allargato del raggio.
+
+        Args:
+            demand: Array dei comuni
+            radius_km: Raggio di servizio
+            spacing_km: Passo della griglia in km
+
+        Returns:
+            tuple: (latitudini, longitudini) dei punti
+        """
+        west, south, east, north = CoverageAnalysisService.expand_bbox(
+            demand['latitudes'], demand['longitudes'], radius_km)
+        lat_step = math.degrees(spacing_km / SpatialIndex.EARTH_RADIUS_KM)
+        middle = math.radians((south + north) / 2)
+        lng_step = lat_step / max(math.cos(middle), 0.01)
+        rows = int((north - south) / lat_step) + 1
+        columns = int((east - west) / lng_step) + 1
+        if rows * columns > SiteSelectionService.MAX_GRID_POINTS:
+            raise ValueError(
+                f"Griglia troppo fitta ({rows * columns} punti): aumentare il passo o limitare la regione")
+        latitudes, longitudes = np.meshgrid(south + lat_step * np.arange(rows), west + lng_step * np.arange(columns),
+                                            indexing='ij')
+        return latitudes.ravel(), longitudes.ravel()
+
+    @staticmethod
+    def coverage_matrix(candidates, demand, radius_km):
+        """
+        Matrice sparsa (candidati x comuni) delle coppie entro il raggio.
+
+        Returns:
+            scipy.sparse.csr_matrix: 1 dove il candidato copre il comune
+        """
+        shape = (candidates['latitudes'].size, demand['ids'].size)
+        if not shape[0] or not shape[1]:
+            return sparse.csr_matrix(shape)
+        pairs = cKDTree(SpatialIndex.to_xyz(candidates['latitudes'], candidates['longitudes'])).sparse_distance_matrix(
+            cKDTree(SpatialIndex.to_xyz(demand['latitudes'], demand['longitudes'])),
+            float(SpatialIndex.chord(radius_km)), output_type='ndarray')
+        return sparse.csr_matrix((np.ones(pairs.size), (pairs['i'], pairs['j'])), shape=shape)
+
+    @staticmethod
+    def lazy_greedy(matrix, weights, k, batch=None):
+        """
+        Scelta greedy di k righe che massimizzano il peso delle colonne coperte.
+
+        Args:
+            matrix: Matrice sparsa CSR (candidati x comuni) di 0/1
+            weights: Domanda non ancora coperta per comune
+            k: Numero massimo di scelte
+            batch: Candidati ricalcolati insieme (default LAZY_BATCH)
+
+        Returns:
+            list: Tuple (indice del candidato, guadagno, comuni coperti) in
+                ordine di scelta; si ferma prima di k se nessun candidato
+                aggiunge domanda
+        """
+        batch = batch or SiteSelectionService.LAZY_BATCH
+        weights = np.asarray(weights, dtype=np.float64).copy()
+        size = matrix.shape[0]
+        bounds = matrix @ weights
+        stale = np.zeros(size, dtype=bool)
+        selected = np.zeros(size, dtype=bool)
+        picks = []
+        while len(picks) < k and size:
+            best = int(np.argmax(bounds))
+            if bounds[best] <= 0:
+                break
+            if stale[best]:
+                # Ricalcola i candidati non aggiornati con i limiti più alti
+                count = min(batch, int(stale.sum()))
+                scores = np.where(stale, bounds, -np.inf)
+                top = np.argpartition(-scores, count - 1)[:count]
+                top = top[stale[top]]
+                bounds[top] = matrix[top] @ weights
+                stale[top] = False
+                continue
+            covered = matrix.indices[matrix.indptr[best]:matrix.indptr[best + 1]]
+            covered = covered[weights[covered] > 0]
+            picks.append((best, float(bounds[best]), int(covered.size)))
+            weights[covered] = 0
+            selected[best] = True
+            bounds[best] = -np.inf
+            stale = ~selected
+        return picks
+
+    @staticmethod
+    def select(k, radius_km=None, source='subprojects', region=None, grid_spacing_km=None, user=None):
+        """
+        Sceglie fino a k siti che massimizzano i potenziali utenti EV coperti.
+
+        Args:
+            k: Numero di siti
+            radius_km: Raggio di servizio (default COVERAGE_RADIUS_KM)
+            source: Origine dei candidati (vedi candidates())
+            region: Regione opzionale a cui limitare i comuni
+            grid_spacing_km: Passo della griglia (solo per 'grid')
+            user: Utente che richiede l'analisi
+
+        Returns:
+            dict: Parametri, domanda totale, già coperta e coperta dopo le
+                scelte, e per ogni sito scelto il guadagno marginale
+        """
+        started = time.monotonic()
+        radius_km = float(radius_km or CoverageAnalysisService.radius_km())
+        demand = CoverageAnalysisService.municipalities(region=region)
+        weights = demand['ev_users'].astype(np.float64)
+
+        # La domanda già coperta dalle stazioni non conta
+        stations = CoverageAnalysisService.station_index()
+        existing = np.zeros(weights.size, dtype=bool)
+        if len(stations) and weights.size:
+            chords, _ = stations.tree.query(SpatialIndex.to_xyz(demand['latitudes'], demand['longitudes']), k=1,
+                                            distance_upper_bound=float(SpatialIndex.chord(radius_km)))
+            existing = np.isfinite(chords)
+        residual = np.where(existing, 0, weights)
+
+        candidates = SiteSelectionService.candidates(source, demand, radius_km, grid_spacing_km, user=user)
+        matrix = SiteSelectionService.coverage_matrix(candidates, demand, radius_km)
+        picks = SiteSelectionService.lazy_greedy(matrix, residual, k)
+
+        total = int(weights.sum())
+        covered = int(weights[existing].sum())
+        sites = []
+        for rank, (index, gain, municipalities) in enumerate(picks, start=1):
+            covered += int(gain)
+            sites.append({
+                'rank': rank,
+                'latitude': round(float(candidates['latitudes'][index]), 6),
+                'longitude': round(float(candidates['longitudes'][index]), 6),
+                'source_id': candidates['ids'][index],
+                'label': candidates['labels'][index],
+                'gain': int(gain),
+                'municipalities': municipalities,
+                'covered': covered,
+                'coverage_pct': round(covered / total * 100, 2) if total else 0,
+            })
+        return {
+            'k': k,
+            'radius_km': radius_km,
+            'source': source,
+            'region': region or '',
+            'grid_spacing_km': grid_spacing_km,
+            'municipalities': int(weights.size),
+            'candidates': int(matrix.shape[0]),
+            'total_demand': total,
+            'existing_covered': int(weights[existing].sum()),
+            'existing_pct': round(weights[existing].sum() / total * 100, 2) if total else 0,
+            'covered': covered,
+            'coverage_pct': round(covered / total * 100, 2) if total else 0,
+            'sites': sites,
+            'seconds': round(time.monotonic() - started, 3),
+        }
+
+    @staticmethod
+    def save_as_map(result, user, name, description='', is_public=False):
+        """
+        Salva i siti scelti come mappa salvata.
+
+        I marker personalizzati scelti come candidati vengono riutilizzati;
+        per gli altri siti viene creato un marker (visibile solo al creatore
+        se la mappa non è pubblica). I parametri e i guadagni sono salvati nei
+        filtri della mappa sotto 'site_selection'.
+
+        Args:
+            result: Risultato di select()
+            user: Creatore della mappa
+            name: Nome della mappa
+            description: Descrizione opzionale
+            is_public: Se la mappa (e i nuovi marker) sono visibili a tutti
+
+        Returns:
+            SavedMap: Mappa creata
+        """
+        from .models import CustomMarker, SavedMap
+
+        sites = result['sites']
+        with transaction.atomic():
+            markers = []
+            reused = {}
+            if result['source'] == 'markers':
+                reused = CustomMarker.objects.in_bulk([site['source_id'] for site in sites])
+            for site in sites:
+                marker = reused.get(site['source_id'])
+                if marker is None:
+                    marker = CustomMarker.objects.create(
+                        name=f"Sito {site['rank']}: {site['label']}"[:100],
+                        description=name,
+                        latitude=site['latitude'],
+                        longitude=site['longitude'],
+                        color='#1cc88a',
+                        icon='charging-station',
+                        is_visible=is_public,
+                        popup_title=f"Sito {site['rank']}",
+                        popup_content=(
+                            f"Nuovi utenti EV coperti: {site['gain']} "
+                            f"({site['municipalities']} comuni, copertura {site['coverage_pct']}%)"),
+                        created_by=user,
+                    )
+                markers.append(marker)
+
+            if sites:
+                latitudes = [site['latitude'] for site in sites]
+                longitudes = [site['longitude'] for site in sites]
+                span = max(max(latitudes) - min(latitudes), max(longitudes) - min(longitudes))
+                zoom = int(np.clip(math.floor(math.log2(360 / span)), 5, 14)) if span else 12
+                center = (sum(latitudes) / len(latitudes), sum(longitudes) / len(longitudes))
+            else:
+                map_settings = MapSettings.get_default()
+                center = ((map_settings.default_center_lat, map_settings.default_center_lng)
+                          if map_settings else (41.9028, 12.4964))
+                zoom = map_settings.default_zoom if map_settings else 6
+
+            saved_map = SavedMap.objects.create(
+                name=name,
+                description=description,
+                center_lat=center[0],
+                center_lng=center[1],
+                zoom=zoom,
+                filters={'site_selection': {key: value for key, value in result.items() if key != 'seconds'}},
+                is_public=is_public,
+                created_by=user,
+            )
+            saved_map.custom_markers.set(markers)
+        return saved_map
@@ -0,0 +1,108 @@
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from cpo_core.models import SubProject as Site
+from infrastructure.models import Municipality
+from infrastructure.signals import municipalities_imported
+from projects.models import ChargingStation
+from .geohash import encode
+from .models import CustomMarker, MapSettings
+from .services import CoverageAnalysisService, MapTileService, SpatialIndexService
+
+# Campi della posizione di ciascun modello con coordinate
+POSITION_FIELDS = {
+    ChargingStation: ('latitude', 'longitude'),
+    CustomMarker: ('latitude', 'longitude'),
+    Site: ('latitude_approved', 'longitude_approved', 'latitude_proposed', 'longitude_proposed'),
+}
+
+# Layer dell'indice spaziale e dei tile per ciascun modello
+SPATIAL_LAYERS = {ChargingStation: 'stations', CustomMarker: 'markers', Site: 'sites'}
+TILE_LAYERS = {ChargingStation: 'stations', CustomMarker: 'markers'}
+
+
+def _position(sender, values):
+    """Coordinate (latitudine, longitudine) dai valori dei campi della posizione"""
+    if sender is Site:
+        latitude_approved, longitude_approved, latitude_proposed, longitude_proposed = values
+        return (
+            latitude_approved if latitude_approved is not None else latitude_proposed,
+            longitude_approved if longitude_approved is not None else longitude_proposed,
+        )
+    return tuple(values)
+
+
+def _values(sender, instance):
+    return tuple(getattr(instance, field) for field in POSITION_FIELDS[sender])
+
+
+@receiver(pre_save, sender=ChargingStation)
+@receiver(pre_save, sender=CustomMarker)
+@receiver(pre_save, sender=Site)
+def track_position(sender, instance, **kwargs):
+    """Aggiorna il geohash e ricorda la posizione salvata, per capire se l'elemento si è spostato"""
+    instance._saved_position = None
+    if instance.pk:
+        previous = sender.objects.filter(pk=instance.pk).values_list(*POSITION_FIELDS[sender]).first()
+        instance._saved_position = _position(sender, previous) if previous else None
+    instance.geohash = encode(*_position(sender, _values(sender, instance)))
+
+
+@receiver([post_save, post_delete], sender=ChargingStation)
+@receiver([post_save, post_delete], sender=CustomMarker)
+@receiver([post_save, post_delete], sender=Site)
+def invalidate_spatial_index(sender, instance, **kwargs):
+    """Gli indici spaziali vanno ricostruiti solo se un elemento compare, si sposta o viene eliminato"""
+    position = _position(sender, _values(sender, instance))
+    if kwargs.get('created') is False and getattr(instance, '_saved_position', None) == position:
+        return
+    SpatialIndexService.invalidate(SPATIAL_LAYERS[sender])
+
+
+@receiver([post_save, post_delete], sender=ChargingStation)
+@receiver([post_save, post_delete], sender=CustomMarker)
+def invalidate_point_tiles(sender, instance, **kwargs):
+    """Scarta solo i tile che contengono la vecchia e la nuova posizione dell'elemento"""
+    layer = TILE_LAYERS[sender]
+    previous = getattr(instance, '_saved_position', None)
+    if previous and previous != (instance.latitude, instance.longitude):
+        MapTileService.invalidate_point(layer, *previous)
+    MapTileService.invalidate_point(layer, instance.latitude, instance.longitude)
+
+
+@receiver([post_save, post_delete], sender=ChargingStation)
+def update_station_coverage(sender, instance, **kwargs):
+    """Ricalcola la copertura dei comuni su cui la stazione influiva o influisce"""
+    current = None
+    if kwargs.get('created') is not None and instance.status in CoverageAnalysisService.STATION_STATUSES:
+        current = (instance.latitude, instance.longitude)
+    CoverageAnalysisService.update_station(instance.pk, getattr(instance, '_saved_position', None), current)
+
+
+@receiver(post_save, sender='infrastructure.Municipality')
+def update_municipality_coverage(sender, instance, **kwargs):
+    """Coordinate, popolazione e tasso di adozione cambiano la copertura del comune"""
+    CoverageAnalysisService.update_municipality(instance)
+
+
+@receiver(municipalities_imported)
+def recompute_imported_coverage(sender, stats, **kwargs):
+    """L'importazione in blocco dei comuni non invia post_save: copertura e marker vanno ricalcolati"""
+    if Municipality.objects.filter(latitude__isnull=False, longitude__isnull=False).exists():
+        CoverageAnalysisService.compute()
+    MapTileService.invalidate_layer('markers')
+
+
+@receiver([post_save, post_delete], sender=MapSettings)
+@receiver([post_save, post_delete], sender='projects.Project')
+@receiver([post_save, post_delete], sender='projects.SubProject')
+def invalidate_station_tiles(sender, instance, **kwargs):
+    """I nomi di progetti e sottoprogetti e le impostazioni dei cluster sono in tutti i tile delle stazioni"""
+    MapTileService.invalidate_layer('stations')
+
+
+@receiver([post_save, post_delete], sender='cpo_core.Project')
+@receiver([post_save, post_delete], sender='infrastructure.Municipality')
+def invalidate_marker_tiles(sender, instance, **kwargs):
+    """I tile dei marker riportano i nomi di progetto e comune collegati"""
+    MapTileService.invalidate_layer('markers')
@@ -0,0 +1,494 @@
+import datetime
+
+import numpy as np
+from scipy import sparse
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from infrastructure.models import Municipality as Comune
+from infrastructure.services import MunicipalityImportService
+from projects.models import ChargingStation, Municipality, Project, SubProject
+from . import geohash
+from .models import CustomMarker, MapSettings, MunicipalityCoverage, SavedMap
+from .services import (
+    CoverageAnalysisService, MapTileService, SiteSelectionService, SpatialIndex, SpatialIndexService,
+    StationMapService,
+)
+
+
+@override_settings(MAP_TILE_CACHE='default')
+class MappingTestCase(TestCase):
+    """Base dei test della mappa: i tile finiscono nella cache in memoria, non su file"""
+
+
+class StationGeoJSONTest(MappingTestCase):
+    """Test per l'API GeoJSON delle stazioni con bbox e cluster"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='mappa', password='password')
+        self.client.login(username='mappa', password='password')
+        self.url = reverse('mapping:api_stations_geojson')
+
+        project = Project.objects.create(name='Progetto Nord', start_date=datetime.date(2024, 1, 1))
+        municipality = Municipality.objects.create(name='Treviso', province='TV', region='Veneto')
+        self.subproject = SubProject.objects.create(
+            project=project, municipality=municipality, name='Centro', start_date=datetime.date(2024, 1, 1),
+            expected_completion_date=datetime.date(2024, 12, 31), budget=0, expected_revenue=0)
+
+        # Cinque stazioni vicine a Treviso, due a Roma
+        positions = [(45.66 + i * 0.001, 12.24 + i * 0.001, 'active' if i % 2 else 'planned') for i in range(5)]
+        positions += [(41.90, 12.49, 'planned'), (41.95, 12.55, 'active')]
+        ChargingStation.objects.bulk_create([
+            ChargingStation(
+                sub_project=self.subproject, name=f'Stazione {index}', identifier=f'ST-{index}', address='Via Roma',
+                latitude=lat, longitude=lng, status=status, total_power=22, station_cost=0, installation_cost=0,
+                connection_cost=0, energy_cost_kwh=0, charging_price_kwh=0, estimated_sessions_day=0,
+                avg_kwh_session=0)
+            for index, (lat, lng, status) in enumerate(positions)
+        ])
+
+    def test_points_inside_bbox_in_constant_queries(self):
+        """Verifica il filtro sul riquadro e le proprietà delle stazioni"""
+        with self.assertNumQueries(3):  # sessione, utente, stazioni
+            data = self.client.get(self.url, {'bbox': '12.0,45.0,13.0,46.0', 'zoom': 15}).json()
+        self.assertFalse(data['clustered'])
+        self.assertEqual(len(data['features']), 5)
+        properties = data['features'][0]['properties']
+        self.assertEqual(properties['project_name'], 'Progetto Nord')
+        self.assertEqual(properties['subproject_name'], 'Centro')
+        self.assertEqual(properties['power'], 22.0)
+
+        data = self.client.get(self.url).json()
+        self.assertEqual(len(data['features']), 7)
+
+    def test_low_zoom_returns_grid_clusters(self):
+        """Verifica i cluster della griglia e la dimensione minima dei cluster"""
+        data = self.client.get(self.url, {'bbox': '6.0,36.0,19.0,47.0', 'zoom': 6}).json()
+        self.assertTrue(data['clustered'])
+        clusters = [feature for feature in data['features'] if feature['properties'].get('cluster')]
+        points = [feature for feature in data['features'] if not feature['properties'].get('cluster')]
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual(clusters[0]['properties']['point_count'], 5)
+        self.assertEqual(clusters[0]['properties']['total_power'], 110.0)
+        self.assertEqual(clusters[0]['properties']['status'], {'planned': 3, 'active': 2})
+        self.assertEqual(len(points), 2)
+
+        MapSettings.objects.create(name='Default', is_default=True, created_by=self.user, min_cluster_size=2)
+        data = self.client.get(self.url, {'bbox': '6.0,36.0,19.0,47.0', 'zoom': 6}).json()
+        self.assertEqual(sorted(feature['properties']['point_count'] for feature in data['features']), [2, 5])
+
+        MapSettings.objects.filter(is_default=True).update(show_clusters=False)
+        data = self.client.get(self.url, {'bbox': '6.0,36.0,19.0,47.0', 'zoom': 6}).json()
+        self.assertFalse(data['clustered'])
+        self.assertEqual(len(data['features']), 7)
+
+    def test_cells_are_stable_across_viewports(self):
+        """Verifica che un cluster non cambi spostando il riquadro"""
+        size = StationMapService.cell_size(8)
+        full = self.client.get(self.url, {'bbox': '6.0,36.0,19.0,47.0', 'zoom': 8}).json()
+        cut = self.client.get(self.url, {'bbox': f'12.0,45.0,{12.24 + size / 10},46.0', 'zoom': 8}).json()
+        cluster = lambda data: [f['properties']['point_count'] for f in data['features'] if f['properties'].get('cluster')]
+        self.assertEqual(cluster(full), [5])
+        self.assertEqual(cluster(cut), [5])
+
+    def test_markers_filtered_by_subproject_municipality(self):
+        """Verifica che il filtro per sotto-progetto usi il comune del sotto-progetto"""
+        # Un comune con lo stesso id del sotto-progetto non deve bastare
+        padova = Comune.objects.create(pk=self.subproject.pk, name='Padova', province='PD')
+        treviso = Comune.objects.create(name='Treviso', province='tv')
+        for name, municipality in (('In comune', treviso), ('Altro comune', padova), ('Senza comune', None)):
+            CustomMarker.objects.create(name=name, latitude=45.66, longitude=12.24, created_by=self.user,
+                                        municipality=municipality)
+
+        url = reverse('mapping:api_markers_geojson')
+        features = self.client.get(url, {'subproject': self.subproject.pk}).json()['features']
+        self.assertEqual([f['properties']['name'] for f in features], ['In comune'])
+        self.assertEqual((features[0]['properties']['municipality_id'], features[0]['properties']['municipality_name']),
+                         (treviso.pk, 'Treviso'))
+        self.assertEqual(self.client.get(url, {'subproject': self.subproject.pk + 100}).json()['features'], [])
+        self.assertEqual(len(self.client.get(url, {'subproject': 'x'}).json()['features']), 3)
+
+
+class MapTileTest(MappingTestCase):
+    """Test per i tile GeoJSON pre-renderizzati e la loro invalidazione"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='tile', password='password')
+        self.client.login(username='tile', password='password')
+        MapTileService.invalidate_layer('stations')
+        MapTileService.invalidate_layer('markers')
+
+        project = Project.objects.create(name='Progetto Tile', start_date=datetime.date(2024, 1, 1))
+        municipality = Municipality.objects.create(name='Padova', province='PD', region='Veneto')
+        subproject = SubProject.objects.create(
+            project=project, municipality=municipality, name='Stazione', start_date=datetime.date(2024, 1, 1),
+            expected_completion_date=datetime.date(2024, 12, 31), budget=0, expected_revenue=0)
+        costs = dict(station_cost=0, installation_cost=0, connection_cost=0, energy_cost_kwh=0,
+                     charging_price_kwh=0, estimated_sessions_day=0, avg_kwh_session=0)
+        self.padova = ChargingStation.objects.create(
+            sub_project=subproject, name='Padova', identifier='PD-1', address='Via Roma',
+            latitude=45.41, longitude=11.88, total_power=22, **costs)
+        self.bari = ChargingStation.objects.create(
+            sub_project=subproject, name='Bari', identifier='BA-1', address='Via Roma',
+            latitude=41.12, longitude=16.87, total_power=50, **costs)
+
+    def _tile(self, layer, latitude, longitude, z, **headers):
+        x, y = MapTileService.tile_for(latitude, longitude, z)
+        name = 'mapping:api_stations_tile' if layer == 'stations' else 'mapping:api_markers_tile'
+        return self.client.get(reverse(name, kwargs={'z': z, 'x': x, 'y': y}), **headers)
+
+    def test_tile_bounds_contain_point(self):
+        """Verifica la conversione tra coordinate e tile Web Mercator"""
+        for z in (0, 6, 12, 18):
+            x, y = MapTileService.tile_for(45.41, 11.88, z)
+            west, south, east, north = MapTileService.tile_bounds(z, x, y)
+            self.assertTrue(west <= 11.88 < east and south <= 45.41 < north, z)
+        self.assertEqual(self._tile('stations', 45.41, 11.88, 19).status_code, 404)
+
+    def test_tile_served_from_cache_with_etag(self):
+        """Verifica contenuto, cache e risposta 304 di un tile"""
+        response = self._tile('stations', 45.41, 11.88, 15)
+        self.assertEqual(response['Content-Type'], 'application/geo+json')
+        features = response.json()['features']
+        self.assertEqual([feature['properties']['name'] for feature in features], ['Padova'])
+        self.assertEqual(features[0]['properties']['project_name'], 'Progetto Tile')
+
+        with self.assertNumQueries(2):  # sessione e utente: il tile arriva dalla cache
+            cached = self._tile('stations', 45.41, 11.88, 15)
+        self.assertEqual(cached.content, response.content)
+
+        not_modified = self._tile('stations', 45.41, 11.88, 15, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        # A zoom basso le due stazioni finiscono in tile diversi o in cluster
+        world = self.client.get(reverse('mapping:api_stations_tile', kwargs={'z': 0, 'x': 0, 'y': 0})).json()
+        self.assertEqual(sum(f['properties'].get('point_count', 1) for f in world['features']), 2)
+
+    def test_saves_invalidate_only_touched_tiles(self):
+        """Verifica che una modifica scarti solo i tile della vecchia e della nuova posizione"""
+        padova = self._tile('stations', 45.41, 11.88, 15)
+        bari = self._tile('stations', 41.12, 16.87, 15)
+
+        self.padova.total_power = 150
+        self.padova.save()
+        self.assertEqual(self._tile('stations', 41.12, 16.87, 15, HTTP_IF_NONE_MATCH=bari['ETag']).status_code, 304)
+        changed = self._tile('stations', 45.41, 11.88, 15, HTTP_IF_NONE_MATCH=padova['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()['features'][0]['properties']['power'], 150.0)
+
+        # Spostata da Padova a Bari: escono dal vecchio tile ed entrano nel nuovo
+        self.padova.latitude, self.padova.longitude = 41.1201, 16.8701
+        self.padova.save()
+        self.assertEqual(self._tile('stations', 45.41, 11.88, 15).json()['features'], [])
+        self.assertEqual(len(self._tile('stations', 41.12, 16.87, 15).json()['features']), 2)
+
+    def test_marker_tiles_only_visible_markers(self):
+        """Verifica i tile dei marker e l'API dei marker nascosti dell'utente"""
+        CustomMarker.objects.create(name='Pubblico', latitude=45.41, longitude=11.88, created_by=self.user)
+        tile = self._tile('markers', 45.41, 11.88, 10)
+        self.assertEqual([f['properties']['name'] for f in tile.json()['features']], ['Pubblico'])
+
+        CustomMarker.objects.create(name='Privato', latitude=45.41, longitude=11.88, created_by=self.user,
+                                    is_visible=False)
+        # Il tile viene rigenerato ma con lo stesso contenuto, quindi con lo stesso ETag
+        self.assertEqual(self._tile('markers', 45.41, 11.88, 10, HTTP_IF_NONE_MATCH=tile['ETag']).status_code, 304)
+
+        hidden = self.client.get(reverse('mapping:api_markers_geojson'), {'hidden': 1}).json()['features']
+        self.assertEqual([(f['properties']['name'], f['properties']['is_own_marker']) for f in hidden],
+                         [('Privato', True)])
+        self.assertEqual(len(self.client.get(reverse('mapping:api_markers_geojson')).json()['features']), 2)
+
+
+class SpatialIndexTest(MappingTestCase):
+    """Test per la colonna geohash e l'indice spaziale in memoria"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='spazio', password='password')
+        for layer in SpatialIndexService.LAYERS:
+            SpatialIndexService.invalidate(layer)
+        self.markers = {
+            name: CustomMarker.objects.create(name=name, latitude=lat, longitude=lng, created_by=self.user)
+            for name, lat, lng in (
+                ('Milano', 45.4642, 9.1900), ('Monza', 45.5845, 9.2744),
+                ('Bergamo', 45.6983, 9.6773), ('Roma', 41.9028, 12.4964),
+            )
+        }
+
+    def test_geohash_encoding_and_column(self):
+        """Verifica la codifica geohash e il suo aggiornamento al salvataggio"""
+        self.assertEqual(geohash.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        west, south, east, north = geohash.bounds('u4pruydqqvj')
+        self.assertTrue(west <= 10.40744 <= east and south <= 57.64911 <= north)
+
+        milano = self.markers['Milano']
+        milano.refresh_from_db()
+        self.assertEqual(milano.geohash, geohash.encode(45.4642, 9.1900))
+        self.assertEqual(CustomMarker.objects.filter(geohash__startswith=milano.geohash[:3]).count(), 3)
+
+    def test_bbox_prefilter_uses_geohash_column(self):
+        """Verifica che il prefiltro geohash coincida con il filtro sulle coordinate"""
+        rng = np.random.default_rng(11)
+        for west, south in rng.uniform((-170, -80), (160, 70), (200, 2)):
+            east, north = west + rng.choice([0.01, 0.3, 4]), south + rng.choice([0.01, 0.3, 4])
+            prefixes = geohash.covering(west, south, east, north)
+            self.assertLessEqual(len(prefixes), 32)
+            for lat, lng in zip(rng.uniform(south, north, 20), rng.uniform(west, east, 20)):
+                self.assertTrue(any(geohash.encode(lat, lng).startswith(prefix) for prefix in prefixes))
+        self.assertEqual(geohash.covering(-180, -90, 180, 90), [])
+
+        bbox = (9.0, 45.0, 9.5, 46.0)
+        queryset = StationMapService.within(CustomMarker.objects.all(), bbox)
+        self.assertIn('"geohash"', str(queryset.query))
+        self.assertEqual(sorted(queryset.values_list('name', flat=True)), ['Milano', 'Monza'])
+        self.assertEqual(StationMapService.near(CustomMarker.objects.all(), (-180, -90, 180, 90)).count(), 4)
+
+        # Le righe senza geohash (bulk_create) non vengono perse
+        CustomMarker.objects.bulk_create([CustomMarker(name='Lodi', latitude=45.31, longitude=9.50, created_by=self.user)])
+        self.assertEqual(StationMapService.within(CustomMarker.objects.all(), (9.0, 45.0, 9.6, 46.0)).count(), 3)
+        nearby = set(StationMapService.near(CustomMarker.objects.all(), bbox).values_list('name', flat=True))
+        self.assertTrue({'Milano', 'Monza', 'Lodi'} <= nearby)
+        self.assertNotIn('Roma', nearby)
+
+    def test_radius_nearest_and_bbox_queries(self):
+        """Verifica ricerca per raggio, k più vicini e riquadro contro le distanze esatte"""
+        ids = {name: marker.id for name, marker in self.markers.items()}
+        within = SpatialIndexService.within_radius('markers', 45.4642, 9.1900, 20)
+        self.assertEqual([pk for pk, _distance in within], [ids['Milano'], ids['Monza']])
+        self.assertAlmostEqual(within[1][1], 14.9, delta=0.1)
+
+        nearest = SpatialIndexService.nearest('markers', 45.0, 9.0, k=3)
+        self.assertEqual([pk for pk, _distance in nearest], [ids['Milano'], ids['Monza'], ids['Bergamo']])
+        self.assertEqual(SpatialIndexService.nearest('markers', 45.0, 9.0, k=5, max_distance_km=60)[0][0], ids['Milano'])
+        self.assertEqual(len(SpatialIndexService.nearest('markers', 45.0, 9.0, k=5, max_distance_km=60)), 1)
+
+        self.assertEqual(sorted(SpatialIndexService.within_bbox('markers', (9.0, 45.0, 9.5, 46.0))),
+                         sorted([ids['Milano'], ids['Monza']]))
+
+        # Confronto con la formula dell'emisenoverso su punti casuali
+        rng = np.random.default_rng(7)
+        lat, lng = rng.uniform(36, 47, 500), rng.uniform(6, 19, 500)
+        index = SpatialIndex(np.arange(500), lat, lng)
+        phi, dphi, dlambda = np.radians(lat), np.radians(lat - 43), np.radians(lng - 12)
+        exact = 2 * SpatialIndex.EARTH_RADIUS_KM * np.arcsin(np.sqrt(
+            np.sin(dphi / 2) ** 2 + np.cos(phi) * np.cos(np.radians(43)) * np.sin(dlambda / 2) ** 2))
+        found, distances = index.within_radius(43, 12, 150)
+        self.assertEqual(sorted(found.tolist()), np.flatnonzero(exact <= 150).tolist())
+        np.testing.assert_allclose(distances, exact[found], rtol=1e-9)
+
+    def test_index_follows_moves(self):
+        """Verifica che l'indice segua creazioni, spostamenti ed eliminazioni"""
+        self.assertEqual(len(SpatialIndexService.get_index('markers')), 4)
+        roma = self.markers['Roma']
+        roma.name = 'Roma Centro'
+        roma.save()
+        index = SpatialIndexService.get_index('markers')
+        self.assertIs(SpatialIndexService.get_index('markers'), index)
+
+        roma.latitude, roma.longitude = 45.47, 9.20
+        roma.save()
+        self.assertEqual(len(SpatialIndexService.within_radius('markers', 45.4642, 9.1900, 5)), 2)
+
+        pairs, _distances = SpatialIndexService.get_index('markers').pairs_within(2)
+        self.assertEqual(sorted(pairs[0].tolist()), sorted([roma.id, self.markers['Milano'].id]))
+
+        roma.delete()
+        self.assertEqual(len(SpatialIndexService.get_index('markers')), 3)
+
+
+class CoverageAnalysisTest(MappingTestCase):
+    """Test per l'analisi della copertura di ricarica dei comuni"""
+
+    FIELDS = ('municipality_id', 'nearest_station_id', 'nearest_station_km', 'stations_within',
+              'power_within_kw', 'potential_ev_users', 'kw_per_ev_user', 'coverage_class')
+
+    def setUp(self):
+        rng = np.random.default_rng(11)
+        Comune.objects.bulk_create([
+            Comune(name=f'Comune {index}', province='XX', population=int(population), ev_adoption_rate=2.5,
+                   latitude=float(lat), longitude=float(lng))
+            for index, (lat, lng, population) in enumerate(zip(
+                rng.uniform(44, 46, 300), rng.uniform(9, 12, 300), rng.integers(0, 50000, 300)))
+        ])
+        Comune.objects.create(name='Senza coordinate', province='XX', population=1000)
+
+        project = Project.objects.create(name='Rete', start_date=datetime.date(2024, 1, 1))
+        municipality = Municipality.objects.create(name='Verona', province='VR', region='Veneto')
+        self.subproject = SubProject.objects.create(
+            project=project, municipality=municipality, name='Lotto', start_date=datetime.date(2024, 1, 1),
+            expected_completion_date=datetime.date(2024, 12, 31), budget=0, expected_revenue=0)
+        statuses = ['planned', 'active', 'maintenance', 'inactive']
+        ChargingStation.objects.bulk_create([
+            self._station(index, float(lat), float(lng), statuses[index % 4], power=float(power))
+            for index, (lat, lng, power) in enumerate(zip(
+                rng.uniform(44, 46, 150), rng.uniform(9, 12, 150), rng.choice([7, 22, 50, 150], 150)))
+        ])
+
+    def _station(self, index, lat, lng, status='active', power=22):
+        return ChargingStation(
+            sub_project=self.subproject, name=f'Stazione {index}', identifier=f'CV-{index}', address='Via Roma',
+            latitude=round(lat, 6), longitude=round(lng, 6), status=status, total_power=power, station_cost=0,
+            installation_cost=0, connection_cost=0, energy_cost_kwh=0, charging_price_kwh=0,
+            estimated_sessions_day=0, avg_kwh_session=0)
+
+    def _rows(self):
+        return {row[0]: row for row in MunicipalityCoverage.objects.order_by('pk').values_list(*self.FIELDS)}
+
+    def test_full_compute_matches_brute_force(self):
+        """Verifica distanze, conteggi e potenze contro il calcolo diretto"""
+        stats = CoverageAnalysisService.compute(radius_km=15)
+        self.assertEqual(stats, {'municipalities': 300, 'stations': 113})
+
+        stations = list(ChargingStation.objects.exclude(status='inactive').values_list(
+            'id', 'latitude', 'longitude', 'total_power'))
+        lat = np.array([float(row[1]) for row in stations])
+        lng = np.array([float(row[2]) for row in stations])
+        for comune in Comune.objects.filter(latitude__isnull=False)[:40]:
+            distances = SpatialIndex.haversine_km(comune.latitude, comune.longitude, lat, lng)
+            coverage = comune.coverage
+            self.assertEqual(coverage.nearest_station_id, stations[int(np.argmin(distances))][0])
+            self.assertAlmostEqual(coverage.nearest_station_km, distances.min(), places=3)
+            self.assertEqual(coverage.stations_within, int((distances <= 15).sum()))
+            self.assertAlmostEqual(coverage.power_within_kw,
+                                   sum(float(row[3]) for row, d in zip(stations, distances) if d <= 15), places=2)
+            self.assertEqual(coverage.potential_ev_users, comune.potential_ev_users())
+        self.assertFalse(MunicipalityCoverage.objects.filter(municipality__name='Senza coordinate').exists())
+
+    def test_incremental_updates_match_full_compute(self):
+        """Verifica che gli aggiornamenti incrementali diano lo stesso risultato del ricalcolo completo"""
+        CoverageAnalysisService.compute()
+
+        def assert_consistent():
+            incremental = self._rows()
+            CoverageAnalysisService.compute()
+            self.assertEqual(incremental, self._rows())
+
+        station = self._station(999, 45.0, 10.5, power=150)
+        station.save()
+        assert_consistent()
+
+        station.latitude, station.longitude = 44.2, 9.3
+        station.save()
+        assert_consistent()
+
+        station.status = 'inactive'
+        station.save()
+        assert_consistent()
+
+        nearest = MunicipalityCoverage.objects.exclude(nearest_station=None).first().nearest_station
+        nearest.delete()
+        assert_consistent()
+
+        comune = Comune.objects.get(name='Comune 0')
+        comune.population = 90000
+        comune.save()
+        assert_consistent()
+
+    def test_municipality_import_recomputes_coverage(self):
+        """Verifica che l'importazione in blocco dei comuni ricalcoli la copertura tramite il segnale"""
+        CoverageAnalysisService.compute()
+        MunicipalityImportService.import_records([
+            {'codice': '023091', 'nome': 'Verona', 'provincia': 'VR', 'lat': '45.0', 'lng': '10.5',
+             'popolazione': '250000'},
+        ])
+        coverage = MunicipalityCoverage.objects.get(municipality__istat_code='023091')
+        self.assertEqual(coverage.potential_ev_users, 5000)
+        self.assertIsNotNone(coverage.nearest_station_id)
+
+    def test_coverage_geojson_api(self):
+        """Verifica il layer GeoJSON della copertura con filtro sul riquadro"""
+        User.objects.create_user(username='copertura', password='password')
+        self.client.login(username='copertura', password='password')
+        CoverageAnalysisService.compute()
+        url = reverse('mapping:api_coverage_geojson')
+        data = self.client.get(url).json()
+        self.assertEqual(len(data['features']), 300)
+        self.assertEqual(data['radius_km'], CoverageAnalysisService.DEFAULT_RADIUS_KM)
+        self.assertIn(data['features'][0]['properties']['coverage_class'],
+                      dict(MunicipalityCoverage.COVERAGE_CLASS_CHOICES))
+
+        inside = Comune.objects.filter(latitude__range=(44, 45), longitude__range=(9, 10)).count()
+        data = self.client.get(url, {'bbox': '9,44,10,45'}).json()
+        self.assertEqual(len(data['features']), inside)
+
+
+class SiteSelectionTest(MappingTestCase):
+    """Test per la scelta dei siti che massimizzano la domanda coperta"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='siti', password='password')
+        # Potenziali utenti EV: 1000, 500, 800 e 300
+        for name, lat, lng, population in (('A', 45.0, 10.0, 10000), ('B', 45.0, 10.5, 5000),
+                                           ('C', 46.0, 11.0, 8000), ('D', 46.05, 11.05, 3000)):
+            Comune.objects.create(name=name, province='XX', region='Nord', population=population,
+                                  ev_adoption_rate=10, latitude=lat, longitude=lng)
+        Comune.objects.create(name='E', province='YY', region='Sud', population=50000, ev_adoption_rate=10,
+                              latitude=40.0, longitude=16.0)
+
+        project = Project.objects.create(name='Rete', start_date=datetime.date(2024, 1, 1))
+        municipality = Municipality.objects.create(name='Verona', province='VR', region='Veneto')
+        subproject = SubProject.objects.create(
+            project=project, municipality=municipality, name='Lotto', start_date=datetime.date(2024, 1, 1),
+            expected_completion_date=datetime.date(2024, 12, 31), budget=0, expected_revenue=0)
+        ChargingStation.objects.create(
+            sub_project=subproject, name='Esistente', identifier='CV-1', address='Via Roma', latitude=45.01,
+            longitude=10.0, status='active', total_power=22, station_cost=0, installation_cost=0, connection_cost=0,
+            energy_cost_kwh=0, charging_price_kwh=0, estimated_sessions_day=0, avg_kwh_session=0)
+
+        self.markers = {
+            name: CustomMarker.objects.create(name=name, latitude=lat, longitude=lng, created_by=self.user)
+            for name, lat, lng in (('Vicino A', 45.0, 10.02), ('Vicino B', 45.0, 10.52),
+                                   ('Tra C e D', 46.02, 11.02), ('Solo C', 46.0, 10.98), ('Lontano', 30.0, 30.0))
+        }
+
+    def test_lazy_greedy_matches_plain_greedy(self):
+        """Verifica scelte e guadagni marginali contro il greedy che ricalcola tutto"""
+        rng = np.random.default_rng(5)
+        dense = (rng.random((400, 300)) < 0.03).astype(float)
+        weights = rng.integers(0, 1000, 300).astype(float)
+        picks = SiteSelectionService.lazy_greedy(sparse.csr_matrix(dense), weights, 25, batch=8)
+
+        residual = weights.copy()
+        for index, gain, municipalities in picks:
+            gains = dense @ residual
+            self.assertEqual(gain, gains.max())
+            self.assertEqual(gains[index], gain)
+            self.assertEqual(municipalities, int(((dense[index] > 0) & (residual > 0)).sum()))
+            residual[dense[index] > 0] = 0
+        self.assertEqual(len(picks), 25)
+        self.assertEqual([gain for _, gain, _ in picks], sorted((gain for _, gain, _ in picks), reverse=True))
+
+    def test_select_skips_covered_demand(self):
+        """Verifica che la domanda già coperta e i candidati inutili non contino"""
+        result = SiteSelectionService.select(3, radius_km=10, source='markers', region='Nord', user=self.user)
+        self.assertEqual((result['municipalities'], result['candidates']), (4, 4))
+        self.assertEqual((result['total_demand'], result['existing_covered']), (2600, 1000))
+        self.assertEqual([(site['label'], site['gain'], site['municipalities']) for site in result['sites']],
+                         [('Tra C e D', 1100, 2), ('Vicino B', 500, 1)])
+        self.assertEqual((result['covered'], result['coverage_pct']), (2600, 100))
+
+        result = SiteSelectionService.select(1, radius_km=10, source='grid', grid_spacing_km=2)
+        self.assertEqual(result['sites'][0]['gain'], 5000)
+        self.assertIsNone(result['sites'][0]['source_id'])
+
+    def test_save_as_map(self):
+        """Verifica la mappa salvata con i marker riutilizzati o creati"""
+        self.client.login(username='siti', password='password')
+        params = {'k': 2, 'radius_km': 10, 'source': 'markers', 'region': 'Nord', 'grid_spacing_km': ''}
+        response = self.client.get(reverse('mapping:site_selection'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['result']['sites']), 2)
+
+        response = self.client.post(reverse('mapping:site_selection'), dict(params, name='Nuovi siti'))
+        saved_map = SavedMap.objects.get(name='Nuovi siti')
+        self.assertRedirects(response, reverse('mapping:map_view_saved', kwargs={'map_id': saved_map.pk}),
+                             fetch_redirect_response=False)
+        self.assertEqual(set(saved_map.custom_markers.values_list('name', flat=True)), {'Tra C e D', 'Vicino B'})
+        self.assertEqual(saved_map.filters['site_selection']['sites'][0]['gain'], 1100)
+
+        result = SiteSelectionService.select(1, radius_km=10, source='grid', grid_spacing_km=2, region='Nord')
+        saved_map = SiteSelectionService.save_as_map(result, self.user, 'Griglia')
+        marker = saved_map.custom_markers.get()
+        self.assertFalse(marker.is_visible)
+        self.assertEqual((marker.latitude, marker.longitude), (result['sites'][0]['latitude'],
+                                                               result['sites'][0]['longitude']))
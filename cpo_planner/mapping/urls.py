@@ -61,6 +61,11 @@ urlpatterns = [
          views.SavedMapDeleteView.as_view(), 
          name='saved_map_delete'),
     
+    # Scelta dei siti di nuovi sotto-progetti
+    path('selezione-siti/', 
+         views.SiteSelectionView.as_view(), 
+         name='site_selection'),
+    
     # API per dati GeoJSON
     path('api/stazioni/', 
          views.get_stations_geojson, 
@@ -68,6 +73,15 @@ urlpatterns = [
     path('api/marker/', 
          views.get_custom_markers_geojson, 
          name='api_markers_geojson'),
+    path('api/stazioni/tile/<int:z>/<int:x>/<int:y>/', 
+         views.get_stations_tile, 
+         name='api_stations_tile'),
+    path('api/marker/tile/<int:z>/<int:x>/<int:y>/', 
+         views.get_markers_tile, 
+         name='api_markers_tile'),
+    path('api/copertura/', 
+         views.get_coverage_geojson, 
+         name='api_coverage_geojson'),
     path('api/mappa/<int:map_id>/', 
          views.get_saved_map_data, 
          name='api_saved_map_data'),
@@ -12,12 +12,17 @@ from django.contrib import messages
 from django.db.models import Q
 from django.utils.translation import gettext_lazy as _
 from django.core.serializers import serialize
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 
 from projects.models import Project, SubProject, ChargingStation
 from .models import MapSettings, CustomMarker, SavedMap
+from .services import (
+    StationMapService, MarkerMapService, MapTileService, CoverageAnalysisService, SiteSelectionService
+)
 from .forms import (
     MapSettingsForm, CustomMarkerForm, SavedMapForm,
-    MapFilterForm, SavedMapFilterForm
+    MapFilterForm, SavedMapFilterForm, SiteSelectionForm, SiteSelectionSaveForm
 )
 
 class MapView(LoginRequiredMixin, TemplateView):
@@ -56,6 +61,7 @@ class MapView(LoginRequiredMixin, TemplateView):
         
         # Aggiungi marker personalizzati pubblici
         context['custom_markers'] = CustomMarker.objects.filter(is_visible=True).count()
+        context['coverage_radius_km'] = CoverageAnalysisService.radius_km()
         
         # Se è passato un ID di un progetto, filtra solo le stazioni di quel progetto
         project_id = self.kwargs.get('project_id')
@@ -373,152 +379,120 @@ class SavedMapDeleteView(LoginRequiredMixin, DeleteView):
     def get_success_url(self):
         return reverse('mapping:saved_map_list')
 
+class SiteSelectionView(LoginRequiredMixin, TemplateView):
+    """
+    Vista per la scelta dei siti di nuovi sotto-progetti.
+    
+    In GET calcola i siti che massimizzano i potenziali utenti EV coperti
+    con i parametri del form; in POST ricalcola la stessa scelta e la salva
+    come mappa.
+    """
+    template_name = 'mapping/site_selection.html'
+    
+    def select(self, form):
+        data = form.cleaned_data
+        return SiteSelectionService.select(
+            data['k'],
+            radius_km=data['radius_km'],
+            source=data['source'],
+            region=data['region'] or None,
+            grid_spacing_km=data['grid_spacing_km'],
+            user=self.request.user,
+        )
+    
+    def get(self, request, *args, **kwargs):
+        form = SiteSelectionForm(request.GET if 'k' in request.GET else None)
+        result = None
+        if form.is_bound and form.is_valid():
+            try:
+                result = self.select(form)
+            except ValueError as e:
+                form.add_error(None, str(e))
+        return self.render_to_response(self.get_context_data(
+            form=form, result=result, save_form=SiteSelectionSaveForm()))
+    
+    def post(self, request, *args, **kwargs):
+        form = SiteSelectionForm(request.POST)
+        save_form = SiteSelectionSaveForm(request.POST)
+        if form.is_valid() and save_form.is_valid():
+            try:
+                result = self.select(form)
+            except ValueError as e:
+                form.add_error(None, str(e))
+            else:
+                saved_map = SiteSelectionService.save_as_map(
+                    result, request.user, save_form.cleaned_data['name'],
+                    description=save_form.cleaned_data['description'],
+                    is_public=save_form.cleaned_data['is_public'],
+                )
+                messages.success(request, _('Mappa salvata con successo.'))
+                return redirect('mapping:map_view_saved', map_id=saved_map.pk)
+        return self.render_to_response(self.get_context_data(form=form, result=None, save_form=save_form))
+
 @login_required
 def get_stations_geojson(request):
-    """API per ottenere i dati GeoJSON delle stazioni di ricarica"""
-    # Ottieni parametri di filtro
-    status = request.GET.getlist('status[]', None)
-    min_power = request.GET.get('min_power', None)
-    max_power = request.GET.get('max_power', None)
-    project_id = request.GET.get('project', None)
-    subproject_id = request.GET.get('subproject', None)
-    min_connectors = request.GET.get('min_connectors', None)
-    
-    # Base queryset
-    queryset = ChargingStation.objects.all()
-    
-    # Applica filtri
-    if status:
-        queryset = queryset.filter(status__in=status)
-    
-    if min_power:
-        try:
-            queryset = queryset.filter(power__gte=float(min_power))
-        except (ValueError, TypeError):
-            pass
-    
-    if max_power:
-        try:
-            queryset = queryset.filter(power__lte=float(max_power))
-        except (ValueError, TypeError):
-            pass
-    
-    if project_id:
-        try:
-            queryset = queryset.filter(subproject__project_id=int(project_id))
-        except (ValueError, TypeError):
-            pass
+    """
+    API per ottenere i dati GeoJSON delle stazioni di ricarica.
     
-    if subproject_id:
-        try:
-            queryset = queryset.filter(subproject_id=int(subproject_id))
-        except (ValueError, TypeError):
-            pass
-    
-    if min_connectors:
-        try:
-            queryset = queryset.filter(connectors__gte=int(min_connectors))
-        except (ValueError, TypeError):
-            pass
-    
-    # Ottieni solo le stazioni con coordinate valide
-    queryset = queryset.filter(latitude__isnull=False, longitude__isnull=False)
-    
-    # Prepara la risposta GeoJSON
-    features = []
-    for station in queryset:
-        # Crea le proprietà per il popup
-        properties = {
-            'id': station.id,
-            'name': station.name,
-            'location': station.location,
-            'address': station.address,
-            'status': station.status,
-            'status_display': station.get_status_display(),
-            'power': station.power,
-            'connectors': station.connectors,
-            'charging_points': station.charging_points,
-            'installation_date': station.installation_date.strftime('%d/%m/%Y') if station.installation_date else None,
-            'subproject_id': station.subproject_id if station.subproject else None,
-            'subproject_name': station.subproject.name if station.subproject else None,
-            'project_id': station.subproject.project_id if station.subproject and station.subproject.project else None,
-            'project_name': station.subproject.project.name if station.subproject and station.subproject.project else None,
-        }
-        
-        # Crea il feature GeoJSON
-        feature = {
-            'type': 'Feature',
-            'geometry': {
-                'type': 'Point',
-                'coordinates': [station.longitude, station.latitude]
-            },
-            'properties': properties
-        }
-        
-        features.append(feature)
-    
-    geojson = {
-        'type': 'FeatureCollection',
-        'features': features
-    }
-    
-    return JsonResponse(geojson)
+    Con i parametri bbox (ovest,sud,est,nord) e zoom restituisce solo le
+    stazioni visibili, raggruppate in cluster ai livelli di zoom bassi.
+    """
+    return JsonResponse(StationMapService.geojson(request.GET))
+
+@login_required
+def get_coverage_geojson(request):
+    """
+    API per il layer della copertura di ricarica dei comuni.
+    
+    Restituisce i comuni analizzati (nel riquadro bbox, se indicato) con la
+    classe di copertura calcolata da CoverageAnalysisService.
+    """
+    return JsonResponse(CoverageAnalysisService.geojson(request.GET))
 
 @login_required
 def get_custom_markers_geojson(request):
-    """API per ottenere i dati GeoJSON dei marker personalizzati"""
-    # Base queryset - solo marker visibili e creati dall'utente
-    queryset = CustomMarker.objects.filter(
-        Q(is_visible=True) | Q(created_by=request.user)
-    )
+    """
+    API per ottenere i dati GeoJSON dei marker personalizzati.
+    
+    Con il parametro hidden restituisce solo i marker nascosti dell'utente,
+    che non fanno parte dei tile condivisi.
+    """
+    if request.GET.get('hidden'):
+        queryset = CustomMarker.objects.filter(is_visible=False, created_by=request.user)
+    else:
+        # Base queryset - solo marker visibili e creati dall'utente
+        queryset = CustomMarker.objects.filter(
+            Q(is_visible=True) | Q(created_by=request.user)
+        )
     
     # Filtra per progetto se specificato
     project_id = request.GET.get('project', None)
     if project_id:
         try:
-            queryset = queryset.filter(Q(project_id=int(project_id)) | Q(subproject__project_id=int(project_id)))
+            queryset = queryset.filter(project_id=int(project_id))
         except (ValueError, TypeError):
             pass
     
-    # Filtra per sotto-progetto se specificato
+    # Filtra per sotto-progetto se specificato: i marker sono legati a un comune
+    # (di infrastructure), quindi si usa il comune del sotto-progetto
     subproject_id = request.GET.get('subproject', None)
     if subproject_id:
         try:
-            queryset = queryset.filter(subproject_id=int(subproject_id))
+            subproject = SubProject.objects.select_related('municipality').filter(pk=int(subproject_id)).first()
         except (ValueError, TypeError):
             pass
+        else:
+            if subproject is None:
+                queryset = queryset.none()
+            else:
+                queryset = queryset.filter(
+                    municipality__name__iexact=subproject.municipality.name,
+                    municipality__province__iexact=subproject.municipality.province,
+                )
     
-    # Prepara la risposta GeoJSON
-    features = []
-    for marker in queryset:
-        # Crea le proprietà per il popup
-        properties = {
-            'id': marker.id,
-            'name': marker.name,
-            'description': marker.description,
-            'color': marker.color,
-            'icon': marker.icon,
-            'popup_title': marker.popup_title,
-            'popup_content': marker.popup_content,
-            'project_id': marker.project_id if marker.project else None,
-            'project_name': marker.project.name if marker.project else None,
-            'subproject_id': marker.subproject_id if marker.subproject else None,
-            'subproject_name': marker.subproject.name if marker.subproject else None,
-            'created_by': marker.created_by.get_full_name(),
-            'is_own_marker': marker.created_by_id == request.user.id
-        }
-        
-        # Crea il feature GeoJSON
-        feature = {
-            'type': 'Feature',
-            'geometry': {
-                'type': 'Point',
-                'coordinates': [marker.longitude, marker.latitude]
-            },
-            'properties': properties
-        }
-        
-        features.append(feature)
+    features = MarkerMapService.features(queryset)
+    for feature in features:
+        feature['properties']['is_own_marker'] = feature['properties']['created_by_id'] == request.user.id
     
     geojson = {
         'type': 'FeatureCollection',
@@ -527,6 +501,33 @@ def get_custom_markers_geojson(request):
     
     return JsonResponse(geojson)
 
+def _tile_response(request, layer, z, x, y):
+    """Risponde con un tile dalla cache, o con 304 se il browser ha già quella versione"""
+    if not 0 <= z <= MapTileService.MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise Http404(_('Tile non valido'))
+    
+    tile = MapTileService.get_tile(layer, z, x, y)
+    etag = '"%s"' % tile['etag']
+    last_modified = int(tile['last_modified'])
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(tile['body'], content_type='application/geo+json')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Il browser deve sempre chiedere conferma: i tile cambiano con i dati
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@login_required
+def get_stations_tile(request, z, x, y):
+    """API per un tile z/x/y pre-renderizzato delle stazioni (cluster ai livelli di zoom bassi)"""
+    return _tile_response(request, 'stations', z, x, y)
+
+@login_required
+def get_markers_tile(request, z, x, y):
+    """API per un tile z/x/y pre-renderizzato dei marker visibili"""
+    return _tile_response(request, 'markers', z, x, y)
+
 @login_required
 def get_saved_map_data(request, map_id):
     """API per ottenere i dati di una mappa salvata"""
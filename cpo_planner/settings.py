@@ -152,6 +152,38 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Cache: il backend dei risultati delle analisi finanziarie è configurabile
+# (es. django.core.cache.backends.filebased.FileBasedCache per condividerli tra processi)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'financial_analysis': {
+        'BACKEND': os.environ.get('FINANCIAL_ANALYSIS_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('FINANCIAL_ANALYSIS_CACHE_LOCATION', 'financial-analysis'),
+        'TIMEOUT': None,
+    },
+    # Tile GeoJSON pre-renderizzati della mappa, su file per condividerli tra i processi
+    'map_tiles': {
+        'BACKEND': os.environ.get('MAP_TILE_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('MAP_TILE_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache', 'map_tiles')),
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    # Snapshot delle metriche della dashboard, condiviso tra i processi web e refresh_dashboard
+    'dashboard': {
+        'BACKEND': os.environ.get('DASHBOARD_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('DASHBOARD_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache', 'dashboard')),
+    },
+}
+FINANCIAL_ANALYSIS_CACHE = 'financial_analysis'
+MAP_TILE_CACHE = 'map_tiles'
+DASHBOARD_CACHE = 'dashboard'
+
+# Secondi tra due controlli della versione (nel database) di prezzi PUN, comuni
+# e indici spaziali tenuti in memoria da ogni processo
+MEMORY_DATA_CHECK_SECONDS = 10
+
 # Configurazione Crispy Forms
 CRISPY_TEMPLATE_PACK = 'bootstrap5'
 CRISPY_ALLOWED_TEMPLATE_PACKS = 'bootstrap5'
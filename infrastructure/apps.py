@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class InfrastructureConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'infrastructure'
+
+    def ready(self):
+        """Importa i segnali quando l'app è pronta"""
+        import infrastructure.signals
@@ -182,7 +182,7 @@ class EnergyPriceProjectionForm(forms.Form):
     months_ahead = forms.IntegerField(
         label=_("Mesi da proiettare"),
         min_value=1,
-        max_value=36,
+        max_value=300,
         initial=12,
         widget=forms.NumberInput(attrs={'class': 'form-control'})
     )
@@ -259,17 +259,19 @@ class StationUsageProfileForm(forms.ModelForm):
         model = StationUsageProfile
         fields = [
             'name', 'description', 'customer_profile',
-            'weekday_morning_usage', 'weekday_afternoon_usage', 'weekday_evening_usage',
-            'weekend_morning_usage', 'weekend_afternoon_usage', 'weekend_evening_usage',
+            'weekday_night_usage', 'weekday_morning_usage', 'weekday_afternoon_usage', 'weekday_evening_usage',
+            'weekend_night_usage', 'weekend_morning_usage', 'weekend_afternoon_usage', 'weekend_evening_usage',
             'avg_session_duration', 'avg_energy_per_session', 'avg_daily_sessions'
         ]
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
             'customer_profile': forms.Select(attrs={'class': 'form-select'}),
+            'weekday_night_usage': forms.NumberInput(attrs={'class': 'form-control', 'step': '1'}),
             'weekday_morning_usage': forms.NumberInput(attrs={'class': 'form-control', 'step': '1'}),
             'weekday_afternoon_usage': forms.NumberInput(attrs={'class': 'form-control', 'step': '1'}),
             'weekday_evening_usage': forms.NumberInput(attrs={'class': 'form-control', 'step': '1'}),
+            'weekend_night_usage': forms.NumberInput(attrs={'class': 'form-control', 'step': '1'}),
             'weekend_morning_usage': forms.NumberInput(attrs={'class': 'form-control', 'step': '1'}),
             'weekend_afternoon_usage': forms.NumberInput(attrs={'class': 'form-control', 'step': '1'}),
             'weekend_evening_usage': forms.NumberInput(attrs={'class': 'form-control', 'step': '1'}),
@@ -1,36 +1,63 @@
 import os
-import pandas as pd
-from io import StringIO
-import numpy as np
-import requests
-import json
-import time  # Corretto l'import di time
-from django.core.management.base import BaseCommand
-from django.conf import settings
+import time
+
 from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
 from infrastructure.models import Municipality
+from infrastructure.services import MunicipalityImportService
+
 
 class Command(BaseCommand):
-    help = 'Scarica e importa comuni italiani con popolazione nel database'
+    help = 'Importa i comuni italiani con popolazione nel database'
     
     """
-    Comando per l'importazione della lista dei comuni italiani con dati demografici reali.
+    Comando per l'importazione della lista dei comuni italiani con dati demografici.
+    
+    Fonti dati, in ordine di preferenza:
+    1. File locale CSV o JSON indicato con --from-file (es. export ISTAT
+       "Elenco-comuni-italiani.csv" o il JSON di matteocontrini/comuni-json)
+    2. Snapshot locale (impostazione MUNICIPALITY_SNAPSHOT, creato con --save-snapshot)
+    3. Download da matteocontrini/comuni-json, con fallback sull'elenco ISTAT
     
-    Fonti dati:
-    1. Lista comuni: ISTAT "Elenco-comuni-italiani.csv"
-       URL: https://www.istat.it/storage/codici-unita-amministrative/Elenco-comuni-italiani.csv
-       
-    2. Dati demografici: Usare il dataset di matteocontrini che contiene già i dati demografici
-       URL: https://raw.githubusercontent.com/matteocontrini/comuni-json/master/comuni.json
+    I comuni esistenti vengono aggiornati in base al codice ISTAT; con
+    --replace vengono invece cancellati e reimportati.
     """
 
+    # Intervallo minimo tra due aggiornamenti del progresso in cache (secondi)
+    PROGRESS_INTERVAL = 0.5
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--force', 
             action='store_true', 
-            help='Sovrascrive i dati esistenti',
+            help='Importa anche se ci sono già comuni, aggiornando quelli esistenti',
+        )
+        parser.add_argument(
+            '--replace',
+            action='store_true',
+            help='Cancella tutti i comuni esistenti (e i dati collegati) prima di importare',
+        )
+        parser.add_argument(
+            '--from-file',
+            help='File CSV o JSON locale da importare',
+        )
+        parser.add_argument(
+            '--download',
+            action='store_true',
+            help='Scarica i dati anche se esiste uno snapshot locale',
+        )
+        parser.add_argument(
+            '--save-snapshot',
+            action='store_true',
+            help='Salva i dati letti come snapshot locale per le importazioni senza rete',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=MunicipalityImportService.BATCH_SIZE,
+            help='Righe scritte per ogni blocco',
         )
-        
         parser.add_argument(
             '--debug', 
             action='store_true', 
@@ -39,227 +66,82 @@ class Command(BaseCommand):
 
     def update_progress(self, progress, message="", current_count=None, total_count=None):
         """Aggiorna il progresso dell'importazione nella cache"""
-        # Crea un dizionario di base con i valori richiesti
         progress_data = {
             'progress': progress,
             'message': message,
             'timestamp': time.time()
         }
-        
-        # Aggiungi i conteggi se disponibili
         if current_count is not None:
             progress_data['current_count'] = current_count
         if total_count is not None:
             progress_data['total_count'] = total_count
         
-        # Salva nella cache
         cache.set('import_progress', progress_data, timeout=3600)  # timeout di 1 ora
-        
-        # Log alla console
         self.stdout.write(f"Progresso: {progress}% - {message}")
 
     def handle(self, *args, **options):
-        force = options['force']
-        debug = options.get('debug', False)
+        started = time.time()
+        replace = options['replace']
         
         # Controlla se ci sono già dati nel database
         existing_count = Municipality.objects.count()
-        if existing_count > 0 and not force:
+        if existing_count > 0 and not (options['force'] or replace):
             self.stdout.write(
-                self.style.WARNING(f'Ci sono già {existing_count} comuni nel database. Usa --force per sovrascriverli.')
+                self.style.WARNING(f'Ci sono già {existing_count} comuni nel database. Usa --force per aggiornarli.')
             )
             return
-            
-        # Se force è True, cancella i comuni esistenti
-        if force and existing_count > 0:
-            self.update_progress(2, f"Cancellazione di {existing_count} comuni esistenti...")
-            self.stdout.write(self.style.WARNING(f'Cancellazione di {existing_count} comuni esistenti...'))
-            Municipality.objects.all().delete()
         
-        # Scarica i dati da matteocontrini/comuni-json che include già i dati demografici
-        self.update_progress(5, "Scaricamento dati demografici da fonte diretta...")
-        self.stdout.write("Scaricamento dati demografici da fonte diretta...")
-        url_source = "https://raw.githubusercontent.com/matteocontrini/comuni-json/master/comuni.json"
+        self.update_progress(5, "Lettura dati dei comuni...")
+        records, source = self.load_records(options)
+        if options['debug'] and records:
+            self.stdout.write(f"Esempio di record: {records[0]}")
         
-        try:
-            # Aggiorna il progresso: inizio download
-            self.update_progress(10, "Download dati in corso...")
-            response = requests.get(url_source)
-            response.raise_for_status()
-            
-            comuni_json = response.json()
-            
-            # Analizziamo la struttura di un campione
-            if debug and len(comuni_json) > 0:
-                sample = comuni_json[0]
-                self.stdout.write(f"Esempio di struttura dati: {json.dumps(sample, indent=2)}")
-            
-            # Convertiamo JSON in DataFrame
-            self.update_progress(15, "Processamento dati...")
-            df = pd.DataFrame(comuni_json)
-            
-            # Verifica quali colonne esistono
-            if debug:
-                self.stdout.write(f"Colonne disponibili: {df.columns.tolist()}")
-                
-            # Verifica se esiste la colonna popolazione
-            if 'popolazione' in df.columns:
-                # Statistiche sulla popolazione
-                num_with_pop = df['popolazione'].count()
-                avg_pop = df['popolazione'].mean()
-                missing_pop = df['popolazione'].isna().sum()
-                
-                self.stdout.write(f"Comuni con dati demografici: {num_with_pop}")
-                self.stdout.write(f"Popolazione media: {avg_pop:.1f}")
-                self.stdout.write(f"Comuni senza popolazione: {missing_pop}")
-                self.update_progress(20, f"Trovati {num_with_pop} comuni con dati demografici")
-            else:
-                self.stdout.write(self.style.WARNING("Colonna 'popolazione' non trovata nei dati"))
-                self.update_progress(20, "Dati demografici non trovati. Utilizzo valori predefiniti.")
-            
-            # Rinomina le colonne per adattarle al modello
-            colonne_mappate = {
-                'nome': 'Comune',
-                'sigla': 'SiglaProvincia',
-                'provincia': 'Provincia',
-                'regione': 'Regione',
-                'popolazione': 'Popolazione'  # Questa colonna esiste nel dataset
-            }
-            
-            # Rinomina solo le colonne che esistono
-            for old_col, new_col in colonne_mappate.items():
-                if old_col in df.columns:
-                    df = df.rename(columns={old_col: new_col})
-                elif debug:
-                    self.stdout.write(f"Colonna '{old_col}' non trovata nei dati")
-            
-            # Assicurati che tutte le colonne necessarie esistano
-            required_cols = ['Comune', 'Provincia', 'Regione', 'Popolazione']
-            for col in required_cols:
-                if col not in df.columns:
-                    if col == 'Popolazione':
-                        df[col] = 0  # Default a 0 se non c'è popolazione
-                    else:
-                        df[col] = ''  # Default a stringa vuota per campi di testo
-            
-            # Converte la popolazione a interi
-            df['Popolazione'] = df['Popolazione'].fillna(0).astype(int)
-            
-            # Aggiorna il progresso prima dell'importazione
-            self.update_progress(25, "Preparazione importazione...")
-            
-            # Importa nel database
-            total_comuni = len(df)
-            self.stdout.write(f"Avvio importazione di {total_comuni} comuni...")
-            self.update_progress(30, f"Avvio importazione di {total_comuni} comuni...")
-            
-            count = 0
-            for _, row in df.iterrows():
-                try:
-                    Municipality.objects.create(
-                        name=row['Comune'],
-                        province=row['Provincia'],
-                        region=row['Regione'],
-                        population=row['Popolazione']
-                        # ev_adoption_rate rimane al valore predefinito 2.0
-                    )
-                    count += 1
-                    
-                    # Calcola percentuale di avanzamento
-                    progress = int((count / total_comuni) * 100)
-                    
-                    # Aggiorna la progress bar ogni 100 comuni o ogni percentuale
-                    if count % 100 == 0 or progress % 5 == 0:
-                        # Calcoliamo il progresso totale: 30% (pre-import) + 65% * percentuale_importazione
-                        total_progress = 30 + int((progress / 100) * 65)
-                        # Nel ciclo di importazione, quando aggiorni il progresso:
-                        self.update_progress(
-                            total_progress, 
-                            f"Importati {count}/{total_comuni} comuni... ({progress}%)", 
-                            current_count=count, 
-                            total_count=total_comuni
-                        )
-                        self.stdout.write(f"Importati {count}/{total_comuni} comuni... ({progress}%)")
-                        
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"Errore importazione comune {row['Comune']}: {str(e)}"))
-                    
-            # Controlla quanti comuni hanno popolazione 0
-            zero_pop = len(df[df['Popolazione'] == 0])
-            if zero_pop > 0:
-                self.stdout.write(self.style.WARNING(f"{zero_pop} comuni senza dati demografici (popolazione = 0)"))
-                
-            self.stdout.write(self.style.SUCCESS(f'Importati con successo {count} comuni italiani'))
-            self.update_progress(95, f'Importati con successo {count} comuni italiani')
-            
-            # Completamento finale
-            self.update_progress(100, f'Importazione completata! {count} comuni importati.')
-            
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Errore durante lo scaricamento dei dati: {str(e)}"))
-            self.update_progress(30, f"Errore durante lo scaricamento dei dati: {str(e)}")
-            
-            # In caso di fallimento totale, prova con la fonte ISTAT originale
-            self.stdout.write("Tentativo con fonte ISTAT originale...")
-            self.update_progress(35, "Tentativo con fonte ISTAT originale...")
-            self.istat_fallback()
-            
-    def istat_fallback(self):
-        """
-        Metodo di fallback usando i dati ISTAT originali
-        """
-        self.update_progress(40, "Download dati ISTAT in corso...")
-        url_comuni = "https://www.istat.it/storage/codici-unita-amministrative/Elenco-comuni-italiani.csv"
+        if options['save_snapshot']:
+            path = MunicipalityImportService.save_snapshot(records)
+            self.stdout.write(f"Snapshot salvato in {path}")
+        
+        total = len(records)
+        self.update_progress(20, f"Avvio importazione di {total} comuni da {source}...", 0, total)
+        
+        last_update = [0.0]
+        
+        def report(done, count):
+            # Al massimo un aggiornamento ogni PROGRESS_INTERVAL secondi, più quello finale
+            now = time.time()
+            if done < count and now - last_update[0] < self.PROGRESS_INTERVAL:
+                return
+            last_update[0] = now
+            self.update_progress(20 + int(done / count * 75), f"Importati {done}/{count} comuni...", done, count)
+        
+        stats = MunicipalityImportService.import_records(
+            records, replace=replace, batch_size=options['batch_size'], progress=report)
+        
+        zero_pop = Municipality.objects.filter(population=0).count()
+        if zero_pop:
+            self.stdout.write(self.style.WARNING(f"{zero_pop} comuni senza dati demografici (popolazione = 0)"))
+        
+        message = (f"Importazione completata! {stats['inserted']} comuni inseriti, {stats['updated']} aggiornati"
+                   f" in {time.time() - started:.1f}s")
+        if stats['skipped']:
+            message += f" ({stats['skipped']} righe senza nome ignorate)"
+        self.stdout.write(self.style.SUCCESS(message))
+        self.update_progress(100, message, stats['total'], stats['total'])
+
+    def load_records(self, options):
+        """Legge i record dal file indicato, dallo snapshot o dalla rete"""
+        path = options['from_file']
+        if path:
+            if not os.path.exists(path):
+                raise CommandError(f'File non trovato: {path}')
+            return MunicipalityImportService.read_source(path), path
+        
+        snapshot = MunicipalityImportService.snapshot_path()
+        if os.path.exists(snapshot) and not options['download']:
+            return MunicipalityImportService.read_source(snapshot), snapshot
         
+        self.update_progress(10, "Download dati in corso...")
         try:
-            # Scarica i dati dei comuni
-            response_comuni = requests.get(url_comuni)
-            response_comuni.raise_for_status()
-            
-            # Leggi i dati come DataFrame, gestendo la codifica corretta
-            self.update_progress(45, "Processamento dati ISTAT...")
-            df_comuni = pd.read_csv(StringIO(response_comuni.content.decode('latin1')), sep=';')
-            
-            # Rinomina le colonne per chiarezza
-            colonne_mappate = {
-                'Denominazione in italiano': 'Comune',
-                'Denominazione dell\'Unità territoriale sovracomunale \n(valida a fini statistici)': 'Provincia',
-                'Denominazione Regione': 'Regione',
-                'Codice Comune formato alfanumerico': 'Codice_Comune'
-            }
-            
-            df_comuni = df_comuni.rename(columns=colonne_mappate)
-            df_comuni['Popolazione'] = 0  # Impostato a 0 poiché non ci sono dati demografici
-            
-            # Seleziona solo le colonne necessarie
-            df_finale = df_comuni[['Comune', 'Provincia', 'Regione', 'Popolazione']]
-            
-            # Importa nel database
-            total_comuni = len(df_finale)
-            self.stdout.write(f"Avvio importazione di {total_comuni} comuni (metodo fallback)...")
-            self.update_progress(50, f"Avvio importazione di {total_comuni} comuni (metodo fallback)...")
-            
-            count = 0
-            for _, row in df_finale.iterrows():
-                Municipality.objects.create(
-                    name=row['Comune'],
-                    province=row['Provincia'],
-                    region=row.get('Regione', ''),
-                    population=0  # Popolazione 0 per tutti i comuni dal metodo fallback
-                )
-                count += 1
-                
-                # Aggiorna il progresso ogni 100 comuni
-                if count % 100 == 0:
-                    progress = int((count / total_comuni) * 100)
-                    total_progress = 50 + int((progress / 100) * 45)  # Dal 50% al 95%
-                    self.update_progress(total_progress, f"Importati {count}/{total_comuni} comuni...")
-                    self.stdout.write(f"Importati {count}/{total_comuni} comuni...")
-                    
-            self.stdout.write(self.style.WARNING(f'Importati {count} comuni italiani senza dati demografici'))
-            self.update_progress(100, f'Importati {count} comuni italiani senza dati demografici')
-            
+            return MunicipalityImportService.download(), 'download'
         except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Importazione fallita completamente: {str(e)}"))
-            self.update_progress(100, f"Importazione fallita: {str(e)}")
-            return None
\ No newline at end of file
+            self.update_progress(100, f"Importazione fallita: {e}")
+            raise CommandError(f"Errore durante lo scaricamento dei dati: {e}")
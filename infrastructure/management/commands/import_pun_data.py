@@ -0,0 +1,70 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from infrastructure.services import PunDataService
+
+
+class Command(BaseCommand):
+    help = 'Importa i dati PUN orari (da file GME o dal servizio di download) con upsert in blocco'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from-file',
+            help='Export GME locale (CSV o XML) da importare in streaming',
+        )
+        parser.add_argument(
+            '--start-date',
+            help='Data di inizio del download (AAAA-MM-GG), default 7 giorni fa',
+        )
+        parser.add_argument(
+            '--end-date',
+            help='Data di fine del download (AAAA-MM-GG), default oggi',
+        )
+        parser.add_argument(
+            '--zone',
+            action='append',
+            dest='zones',
+            help='Zona da importare dal file (ripetibile), default tutte',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=PunDataService.INGEST_BATCH_SIZE,
+            help='Righe scritte per ogni blocco',
+        )
+
+    def handle(self, *args, **options):
+        started = time.time()
+
+        if options['from_file']:
+            path = options['from_file']
+            if not os.path.exists(path):
+                raise CommandError(f'File non trovato: {path}')
+            rows = PunDataService.read_gme_export(path, zones=options['zones'])
+            stats = PunDataService.ingest_pun_data(rows, batch_size=options['batch_size'])
+            source = path
+        else:
+            end_date = self._parse_date(options['end_date']) or datetime.now().date()
+            start_date = self._parse_date(options['start_date']) or end_date - timedelta(days=7)
+            if start_date > end_date:
+                raise CommandError('La data di inizio è successiva alla data di fine')
+            stats = PunDataService.download_pun_data(start_date=start_date, end_date=end_date)
+            if not stats:
+                raise CommandError('Errore durante lo scaricamento dei dati PUN')
+            source = f'{start_date} - {end_date}'
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Dati PUN importati da {source}: {stats['inserted']} inseriti, "
+            f"{stats['updated']} aggiornati in {time.time() - started:.1f}s"
+        ))
+
+    def _parse_date(self, value):
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Data non valida: {value} (formato AAAA-MM-GG)')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from infrastructure.services import PunRollupService
+
+
+class Command(BaseCommand):
+    help = 'Ricostruisce gli aggregati giornalieri e mensili dei dati PUN dai dati orari'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--restamp-holidays',
+            action='store_true',
+            help='Corregge prima in F3 le ore festive importate con la fascia dei giorni feriali',
+        )
+
+    def handle(self, *args, **options):
+        if options['restamp_holidays']:
+            updated = PunRollupService.restamp_holidays()
+            self.stdout.write(f'Ore festive riportate in F3: {updated}')
+        days = PunRollupService.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Aggregati PUN ricostruiti: {days} aggregati giornalieri'))
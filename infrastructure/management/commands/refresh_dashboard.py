@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from infrastructure.services import DashboardMetricsService
+
+
+class Command(BaseCommand):
+    help = 'Ricalcola lo snapshot in cache delle metriche della dashboard (da pianificare periodicamente)'
+
+    def handle(self, *args, **options):
+        started = time.time()
+        snapshot = DashboardMetricsService.refresh()
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshot della dashboard aggiornato in {time.time() - started:.2f}s: "
+            f"{snapshot['total_projects']} progetti, {snapshot['total_stations']} stazioni"
+        ))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from infrastructure.models import ChargingStation, ElectricityTariff, StationUsageProfile
+from infrastructure.services import EnergyBillService
+
+
+class Command(BaseCommand):
+    help = 'Simula ora per ora la bolletta energetica annua delle stazioni di ricarica'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help='Anno simulato, default anno corrente')
+        parser.add_argument('--tariff', type=int, help='ID della tariffa elettrica, default la prima attiva')
+        parser.add_argument('--profile', type=int, help='ID del profilo di utilizzo, default il primo')
+        parser.add_argument('--project', type=int, help='Limita la simulazione alle stazioni di un progetto')
+        parser.add_argument('--zone', help='Zona di mercato PUN, default media delle zone')
+
+    def handle(self, *args, **options):
+        tariff = self._get(ElectricityTariff, options['tariff'])
+        profile = self._get(StationUsageProfile, options['profile'])
+
+        stations = ChargingStation.objects.order_by('project', 'code')
+        if options['project']:
+            stations = stations.filter(project_id=options['project'])
+
+        result = EnergyBillService.simulate_stations(
+            stations, tariff=tariff, profile=profile, year=options['year'], zone=options['zone'])
+        if result is None:
+            raise CommandError('Servono almeno una tariffa elettrica attiva e un profilo di utilizzo')
+        if not result['stations']:
+            self.stdout.write('Nessuna stazione da simulare')
+            return
+
+        for index, station in enumerate(result['stations']):
+            self.stdout.write(
+                f"{station.code}: {result['annual_kwh'][index]:.0f} kWh, "
+                f"energia € {result['annual_energy_cost'][index]:.2f} "
+                f"({result['average_price'][index]:.4f} €/kWh), "
+                f"totale € {result['annual_total'][index]:.2f}"
+            )
+
+        shares = ', '.join(f'{band} {share:.1%}' for band, share in zip(('F1', 'F2', 'F3'), result['timeband_shares']))
+        self.stdout.write(self.style.SUCCESS(
+            f"Bolletta {result['year']} per {len(result['stations'])} stazioni: "
+            f"{result['annual_kwh'].sum():.0f} kWh, totale € {result['annual_total'].sum():.2f} ({shares})"
+        ))
+
+    def _get(self, model, pk):
+        if pk is None:
+            return None
+        try:
+            return model.objects.get(pk=pk)
+        except model.DoesNotExist:
+            raise CommandError(f'{model._meta.verbose_name} {pk} non trovato')
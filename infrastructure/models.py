@@ -2,6 +2,9 @@ from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from decimal import Decimal
+import uuid
+
+from .timebands import timeband
 
 class GlobalSettings(models.Model):
     """Impostazioni globali dell'applicazione"""
@@ -62,10 +65,13 @@ class GlobalSettings(models.Model):
 
 class Municipality(models.Model):
     name = models.CharField(_("Nome Comune"), max_length=100)
+    istat_code = models.CharField(_("Codice ISTAT"), max_length=6, unique=True, blank=True, null=True)
     province = models.CharField(_("Provincia"), max_length=100)
     region = models.CharField(_("Regione"), max_length=100, blank=True)
     population = models.IntegerField(_("Popolazione"), blank=True, null=True)
     ev_adoption_rate = models.FloatField(_("Tasso di adozione EV (%)"), default=2.0)
+    latitude = models.FloatField(_("Latitudine"), blank=True, null=True)
+    longitude = models.FloatField(_("Longitudine"), blank=True, null=True)
     logo = models.ImageField(_("Logo Comune"), upload_to="municipality_logos", blank=True, null=True)
     
     class Meta:
@@ -273,31 +279,94 @@ class PunData(models.Model):
     
     @staticmethod
     def get_timeband(date, hour):
-        """Determina la fascia oraria F1, F2 o F3 in base a data e ora"""
-        import datetime
-        weekday = date.weekday()  # 0=lunedì, 6=domenica
+        """Determina la fascia oraria F1, F2 o F3 in base a data e ora (festivi in F3)"""
+        return timeband(date, hour)
+
+class PunRollup(models.Model):
+    """
+    Aggregati giornalieri e mensili dei dati PUN per zona e fascia oraria.
+    
+    Mantenuti dall'importazione dei dati PUN (vedi PunRollupService): le
+    statistiche si leggono da qui invece di aggregare i dati orari. Somma e
+    numero di ore permettono di combinare più righe in una media esatta.
+    """
+    PERIOD_CHOICES = [
+        ('day', _('Giornaliero')),
+        ('month', _('Mensile')),
+    ]
+    # 'ALL' aggrega tutte le fasce orarie
+    TIMEBAND_CHOICES = PunData.TIMEBAND_CHOICES + [('ALL', _('Tutte le fasce'))]
+    
+    period = models.CharField(_("Periodo"), max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField(_("Inizio periodo"))
+    zone = models.CharField(_("Zona di mercato"), max_length=10)
+    timeband = models.CharField(_("Fascia oraria"), max_length=3, choices=TIMEBAND_CHOICES)
+    
+    hours = models.PositiveIntegerField(_("Ore"))
+    price_sum = models.DecimalField(_("Somma prezzi (€/MWh)"), max_digits=14, decimal_places=4)
+    min_price = models.DecimalField(_("Prezzo minimo (€/MWh)"), max_digits=8, decimal_places=4)
+    avg_price = models.DecimalField(_("Prezzo medio (€/MWh)"), max_digits=8, decimal_places=4)
+    max_price = models.DecimalField(_("Prezzo massimo (€/MWh)"), max_digits=8, decimal_places=4)
+    
+    class Meta:
+        verbose_name = _("Aggregato PUN")
+        verbose_name_plural = _("Aggregati PUN")
+        ordering = ["-period_start", "zone", "timeband"]
+        unique_together = ('period', 'period_start', 'zone', 'timeband')
         
-        # F3: domeniche e festivi (tutto il giorno)
-        if weekday == 6:
-            return 'F3'
-            
-        # F1: lunedì-venerdì 8:00-19:00 (esclusi festivi)
-        if 0 <= weekday <= 4 and 8 <= hour < 19:
-            return 'F1'
-            
-        # F2: lunedì-venerdì 7:00-8:00 e 19:00-23:00, sabato 7:00-23:00
-        if (0 <= weekday <= 4 and (7 == hour or 19 <= hour < 23)) or \
-           (weekday == 5 and 7 <= hour < 23):
-            return 'F2'
-            
-        # F3: tutto il resto (lunedì-sabato 23:00-7:00)
-        return 'F3'
+    def __str__(self):
+        return f"PUN {self.get_period_display()} {self.period_start} {self.zone} {self.timeband}: {self.avg_price} €/MWh"
+
+class DataVersion(models.Model):
+    """
+    Versione di un insieme di dati tenuto in memoria dai processi.
+    
+    Tabelle e indici in memoria (prezzi PUN, comuni, indici spaziali) sono
+    ricostruiti quando la versione cambia. La versione sta nel database e non
+    nella cache di Django, che con LocMemCache è separata per processo: così
+    anche le modifiche fatte dai comandi di gestione raggiungono i processi web.
+    """
+    key = models.CharField(_("Chiave"), max_length=100, primary_key=True)
+    # Valore casuale: dopo un rollback non può coincidere con una versione già letta
+    version = models.CharField(_("Versione"), max_length=32)
+    updated_at = models.DateTimeField(_("Ultima modifica"), auto_now=True)
+    
+    class Meta:
+        verbose_name = _("Versione dati")
+        verbose_name_plural = _("Versioni dati")
+    
+    def __str__(self):
+        return f"{self.key}: {self.version}"
+    
+    @classmethod
+    def bump(cls, key):
+        """
+        Cambia la versione di un insieme di dati.
+        
+        Returns:
+            str: Nuova versione
+        """
+        version = uuid.uuid4().hex
+        cls.objects.update_or_create(key=key, defaults={'version': version})
+        return version
+    
+    @classmethod
+    def current(cls, key):
+        """Versione corrente di un insieme di dati (stringa vuota se mai modificato)"""
+        return cls.objects.filter(key=key).values_list('version', flat=True).first() or ''
 
 class EnergyPriceProjection(models.Model):
     """Proiezioni di prezzi energetici basate su dati PUN storici e inflazione"""
+    METHOD_CHOICES = [
+        ('inflation', _('Media recente + inflazione')),
+        ('seasonal', _('Profilo stagionale + inflazione')),
+    ]
+    
     created_at = models.DateTimeField(_("Data creazione"), auto_now_add=True)
     year = models.IntegerField(_("Anno di riferimento"))
     month = models.IntegerField(_("Mese di riferimento"), choices=[(i, i) for i in range(1, 13)])
+    zone = models.CharField(_("Zona"), max_length=10, blank=True, default='',
+                            help_text=_("Zona di mercato; vuoto = media delle zone"))
     
     # Prezzi medi proiettati per fascia
     f1_price = models.DecimalField(_("Prezzo medio F1 (€/kWh)"), max_digits=6, decimal_places=4)
@@ -307,7 +376,12 @@ class EnergyPriceProjection(models.Model):
     # Prezzo medio proiettato generale
     avg_price = models.DecimalField(_("Prezzo medio (€/kWh)"), max_digits=6, decimal_places=4)
     
+    # Intervallo di incertezza (10° e 90° percentile) del prezzo medio
+    avg_price_low = models.DecimalField(_("Prezzo medio P10 (€/kWh)"), max_digits=6, decimal_places=4, null=True, blank=True)
+    avg_price_high = models.DecimalField(_("Prezzo medio P90 (€/kWh)"), max_digits=6, decimal_places=4, null=True, blank=True)
+    
     # Parametri usati per la proiezione
+    method = models.CharField(_("Metodo"), max_length=10, choices=METHOD_CHOICES, default='inflation')
     inflation_rate = models.DecimalField(_("Tasso inflazione applicato (%)"), max_digits=5, decimal_places=2)
     base_period_start = models.DateField(_("Inizio periodo base"))
     base_period_end = models.DateField(_("Fine periodo base"))
@@ -317,11 +391,12 @@ class EnergyPriceProjection(models.Model):
     class Meta:
         verbose_name = _("Proiezione prezzi energia")
         verbose_name_plural = _("Proiezioni prezzi energia")
-        ordering = ["-year", "-month"]
-        unique_together = ('year', 'month')
+        ordering = ["-year", "-month", "zone"]
+        unique_together = ('year', 'month', 'zone')
         
     def __str__(self):
-        return f"Proiezione {self.month}/{self.year}: media {self.avg_price} €/kWh"
+        zone = f" {self.zone}" if self.zone else ""
+        return f"Proiezione {self.month}/{self.year}{zone}: media {self.avg_price} €/kWh"
 
 class ElectricityTariff(models.Model):
     name = models.CharField(_("Nome tariffa"), max_length=100)
@@ -368,74 +443,61 @@ class ElectricityTariff(models.Model):
     def __str__(self):
         return f"{self.name} - {self.provider}"
     
+    def get_fixed_energy_cost(self, power_kw=None):
+        """Costo €/kWh della tariffa a prezzo fisso per la fascia di potenza"""
+        if not power_kw:
+            return float(self.cost_tier2)  # Default tier
+            
+        if power_kw <= 7:
+            return float(self.cost_tier1)
+        elif power_kw <= 22:
+            return float(self.cost_tier2)
+        elif power_kw <= 50:
+            return float(self.cost_tier3)
+        elif power_kw <= 150:
+            return float(self.cost_tier4)
+        else:
+            return float(self.cost_tier5)
+    
     def get_current_energy_cost(self, power_kw=None, date=None, hour=None, use_projections=True):
         """
         Calcola il costo attuale dell'energia in base al tipo di tariffa.
-        Per tariffe indicizzate PUN, usa i dati PUN più recenti o proiezioni.
+        Per tariffe indicizzate PUN, usa i dati PUN più recenti o proiezioni
+        (letti dalla tabella in memoria di TariffPricingService).
         """
         from datetime import datetime
         
         # Se è una tariffa a prezzo fisso, usa i tier in base alla potenza
         if self.tariff_type == 'fixed':
-            if not power_kw:
-                return float(self.cost_tier2)  # Default tier
-                
-            if power_kw <= 7:
-                return float(self.cost_tier1)
-            elif power_kw <= 22:
-                return float(self.cost_tier2)
-            elif power_kw <= 50:
-                return float(self.cost_tier3)
-            elif power_kw <= 150:
-                return float(self.cost_tier4)
-            else:
-                return float(self.cost_tier5)
+            return self.get_fixed_energy_cost(power_kw)
         
         # Per tariffe indicizzate PUN
         if self.tariff_type == 'pun':
-            current_date = date or datetime.now().date()
-            current_hour = hour or datetime.now().hour
-            
-            # Determina la fascia oraria
-            timeband = PunData.get_timeband(current_date, current_hour)
-            
-            # Ottieni la commissione corretta in base alla fascia oraria
-            if timeband == 'F1':
-                commission = float(self.pun_fee_f1)
-            elif timeband == 'F2':
-                commission = float(self.pun_fee_f2)
-            else:  # F3
-                commission = float(self.pun_fee_f3)
+            now = datetime.now()
+            current_date = date or now.date()
+            current_hour = hour if hour is not None else now.hour
             
-            # Cerca il dato PUN più recente per questa fascia
-            latest_pun = PunData.objects.filter(timeband=timeband).order_by('-date', '-hour').first()
-            
-            # Se esiste un dato PUN recente, usalo
-            if latest_pun:
-                pun_price = float(latest_pun.price) / 1000  # Converti da €/MWh a €/kWh
-                return pun_price + commission
-            
-            # Se non ci sono dati PUN recenti ma è richiesta una proiezione
-            if use_projections:
-                # Cerca la proiezione più recente per l'anno/mese corrente o futuri
-                projection = EnergyPriceProjection.objects.filter(
-                    year__gte=current_date.year,
-                    month__gte=current_date.month if current_date.year == datetime.now().year else 1
-                ).order_by('year', 'month').first()
-                
-                if projection:
-                    if timeband == 'F1':
-                        base_price = float(projection.f1_price)
-                    elif timeband == 'F2':
-                        base_price = float(projection.f2_price)
-                    else:  # F3
-                        base_price = float(projection.f3_price)
-                    return base_price + commission
+            return float(self.price_for(
+                [datetime(current_date.year, current_date.month, current_date.day, current_hour)],
+                use_projections=use_projections,
+            )[0])
+    
+    def price_for(self, hours, power_kw=None, zone=None, use_projections=True):
+        """
+        Costo dell'energia per un array di ore, senza query per ogni ora.
+        
+        Args:
+            hours: Array di ore (datetime o datetime64[h])
+            power_kw: Potenza della stazione, per le tariffe a prezzo fisso
+            zone: Zona di mercato PUN (None = media delle zone)
+            use_projections: Se usare le proiezioni quando mancano i dati PUN
             
-            # Fallback se non ci sono dati PUN né proiezioni
-            # Usa un valore medio PUN stimato più la commissione
-            default_pun_prices = {'F1': 0.15, 'F2': 0.13, 'F3': 0.11}  # valori medi stimati in €/kWh
-            return default_pun_prices.get(timeband, 0.13) + commission
+        Returns:
+            numpy.ndarray: Costi in €/kWh
+        """
+        from .services import TariffPricingService
+        return TariffPricingService.price_for(
+            self, hours, power_kw=power_kw, zone=zone, use_projections=use_projections)
     
     class Meta:
         verbose_name = _("Tariffa elettrica")
@@ -542,9 +604,11 @@ class StationUsageProfile(models.Model):
     description = models.TextField(_("Descrizione"), blank=True)
     
     # Ore di utilizzo medie
+    weekday_night_usage = models.IntegerField(_("Utilizzo feriale notte (%)"), default=10)
     weekday_morning_usage = models.IntegerField(_("Utilizzo feriale mattina (%)"), default=30)
     weekday_afternoon_usage = models.IntegerField(_("Utilizzo feriale pomeriggio (%)"), default=50)
     weekday_evening_usage = models.IntegerField(_("Utilizzo feriale sera (%)"), default=20)
+    weekend_night_usage = models.IntegerField(_("Utilizzo weekend notte (%)"), default=10)
     weekend_morning_usage = models.IntegerField(_("Utilizzo weekend mattina (%)"), default=40)
     weekend_afternoon_usage = models.IntegerField(_("Utilizzo weekend pomeriggio (%)"), default=60)
     weekend_evening_usage = models.IntegerField(_("Utilizzo weekend sera (%)"), default=30)
@@ -1,14 +1,31 @@
+import bisect
+import csv
+import io
+import json
+import os
+import re
+import unicodedata
 import requests
 import random
-from decimal import Decimal
+import xml.etree.ElementTree as ET
+from decimal import Decimal, InvalidOperation
 from datetime import datetime, timedelta
-from decimal import Decimal
 import logging
+import threading
+import time
+import numpy as np
+import pandas as pd
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
+from django.core.cache import caches
 
-from .models import PunData, EnergyPriceProjection, GlobalSettings
-from django.db import models
+from .models import (
+    PunData, PunRollup, EnergyPriceProjection, GlobalSettings, ElectricityTariff, StationUsageProfile,
+    Municipality, DataVersion,
+)
+from .timebands import TIMEBAND_CODES, holidays, timeband_codes, non_working_days
+from django.db import models, transaction
+from django.db.models.functions import TruncMonth
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +34,12 @@ class PunDataService:
     
     GME_API_BASE_URL = "https://www.mercatoelettrico.org/it/WebService/MGP_Prezzi.asmx"
     
+    # Righe scritte per ogni bulk_create durante l'importazione
+    INGEST_BATCH_SIZE = 5000
+    
+    # Colonne di prezzo degli esiti MGP del GME (PUN nazionale e zone di mercato)
+    GME_ZONES = ('PUN', 'NAT', 'NORD', 'CNOR', 'CSUD', 'SUD', 'CALA', 'SICI', 'SARD')
+    
     @staticmethod
     def download_pun_data(start_date=None, end_date=None):
         """
@@ -27,7 +50,8 @@ class PunDataService:
             end_date: Data di fine (datetime.date), default oggi
             
         Returns:
-            bool: True se il download è avvenuto con successo, False altrimenti
+            dict: Conteggi 'inserted', 'updated' e 'total' se il download è
+                avvenuto con successo, False altrimenti
         """
         try:
             if not start_date:
@@ -44,33 +68,195 @@ class PunDataService:
             # o scaricare i dati dal loro portale
             fake_data = PunDataService._generate_test_data(start_date, end_date)
             
-            # Salva i dati nel database
-            saved_count = 0
-            for data_item in fake_data:
-                obj, created = PunData.objects.update_or_create(
-                    date=data_item['date'],
-                    hour=data_item['hour'],
-                    zone=data_item['zone'],
-                    defaults={
-                        'price': data_item['price'],
-                        'timeband': data_item['timeband']
-                    }
-                )
-                if created:
-                    saved_count += 1
+            # Salva i dati nel database in blocchi
+            stats = PunDataService.ingest_pun_data(fake_data)
                     
-            logger.info(f"Saved {saved_count} new PUN data entries")
-            return True
+            logger.info(f"Saved {stats['inserted']} new and {stats['updated']} updated PUN data entries")
+            return stats
             
         except Exception as e:
             logger.error(f"Error downloading PUN data: {e}")
             return False
     
+    @staticmethod
+    def ingest_pun_data(rows, batch_size=None):
+        """
+        Importa dati PUN con upsert in blocco, in un'unica transazione.
+        
+        Le righe vengono raccolte in blocchi e scritte con
+        bulk_create(update_conflicts=True): una query di lettura e una di
+        scrittura per blocco invece di due per riga. All'interno di un blocco
+        vale l'ultima riga per (data, ora, zona).
+        
+        Args:
+            rows: Iterabile di dizionari con 'date', 'hour', 'zone', 'price'
+                ed eventualmente 'timeband' (altrimenti calcolata)
+            batch_size: Righe per blocco (default INGEST_BATCH_SIZE)
+            
+        Returns:
+            dict: Conteggi 'inserted', 'updated' e 'total'
+        """
+        batch_size = batch_size or PunDataService.INGEST_BATCH_SIZE
+        stats = {'inserted': 0, 'updated': 0}
+        
+        with transaction.atomic():
+            batch = {}
+            for row in rows:
+                batch[(row['date'], row['hour'], row['zone'])] = row
+                if len(batch) >= batch_size:
+                    PunDataService._write_pun_batch(batch, stats)
+                    batch = {}
+            if batch:
+                PunDataService._write_pun_batch(batch, stats)
+        
+        # I prezzi in memoria dei processi non sono più validi
+        TariffPricingService.invalidate()
+        
+        stats['total'] = stats['inserted'] + stats['updated']
+        return stats
+    
+    @staticmethod
+    def _write_pun_batch(batch, stats):
+        """
+        Scrive un blocco di righe PUN e aggiorna i conteggi.
+        
+        Args:
+            batch: Dizionario (data, ora, zona) -> riga
+            stats: Conteggi da aggiornare
+        """
+        dates = [key[0] for key in batch]
+        existing = set(
+            PunData.objects
+            .filter(date__gte=min(dates), date__lte=max(dates), zone__in={key[2] for key in batch})
+            .values_list('date', 'hour', 'zone')
+        )
+        
+        # Fasce di tutte le ore del blocco dal calendario precalcolato
+        hours = (np.array(dates, dtype='datetime64[D]').astype('datetime64[h]')
+                 + np.array([key[1] for key in batch], dtype=np.int64))
+        timebands = timeband_codes(hours)
+        
+        objects = [
+            PunData(
+                date=date,
+                hour=hour,
+                zone=zone,
+                price=Decimal(str(row['price'])).quantize(Decimal('0.0001')),
+                timeband=row.get('timeband') or TIMEBAND_CODES[code],
+            )
+            for ((date, hour, zone), row), code in zip(batch.items(), timebands)
+        ]
+        PunData.objects.bulk_create(
+            objects,
+            update_conflicts=True,
+            unique_fields=['date', 'hour', 'zone'],
+            update_fields=['price', 'timeband'],
+        )
+        
+        updated = len(existing.intersection(batch))
+        stats['updated'] += updated
+        stats['inserted'] += len(batch) - updated
+        
+        # Aggiorna gli aggregati dei soli giorni e zone toccati dal blocco
+        PunRollupService.refresh(min(dates), max(dates), zones={key[2] for key in batch})
+    
+    @staticmethod
+    def read_gme_export(path, zones=None):
+        """
+        Legge in streaming un export dei prezzi MGP del GME (CSV o XML).
+        
+        Sono supportati il formato del GME, con una riga per ora e una colonna
+        di prezzo per zona ('Data' AAAAMMGG, 'Ora' 1-24, 'PUN', 'NORD', ...),
+        e il formato a righe con colonne data, ora (0-23), zona e prezzo.
+        I prezzi possono usare la virgola come separatore decimale.
+        
+        Args:
+            path: Percorso del file (.xml oppure CSV con separatore ',' o ';')
+            zones: Zone da importare (default: tutte quelle presenti)
+            
+        Yields:
+            dict: Righe con 'date', 'hour', 'zone' e 'price'
+        """
+        zones = {zone.upper() for zone in zones} if zones else None
+        if os.path.splitext(path)[1].lower() == '.xml':
+            records = PunDataService._read_gme_xml(path)
+        else:
+            records = PunDataService._read_gme_csv(path)
+        
+        skipped = 0
+        for record in records:
+            try:
+                rows = list(PunDataService._parse_gme_record(record))
+            except (KeyError, ValueError, InvalidOperation):
+                skipped += 1
+                continue
+            for row in rows:
+                if zones is None or row['zone'] in zones:
+                    yield row
+        
+        if skipped:
+            logger.warning(f"Skipped {skipped} invalid records in {path}")
+    
+    @staticmethod
+    def _read_gme_csv(path):
+        """Righe di un CSV come dizionari con intestazioni in minuscolo"""
+        with open(path, newline='', encoding='utf-8-sig') as handle:
+            sample = handle.read(4096)
+            handle.seek(0)
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+            for record in csv.DictReader(handle, dialect=dialect):
+                yield {(key or '').strip().lower(): (value or '').strip() for key, value in record.items()}
+    
+    @staticmethod
+    def _read_gme_xml(path):
+        """Elementi di un XML del GME (es. <Prezzi>) come dizionari, senza caricare il file"""
+        for _event, element in ET.iterparse(path, events=('end',)):
+            children = list(element)
+            if children and all(len(child) == 0 for child in children):
+                record = {child.tag.split('}')[-1].lower(): (child.text or '').strip() for child in children}
+                if 'data' in record or 'date' in record:
+                    yield record
+                element.clear()
+    
+    @staticmethod
+    def _parse_gme_record(record):
+        """Converte un record dell'export GME in una o più righe PUN"""
+        date = PunDataService._parse_gme_date(record.get('data') or record['date'])
+        if 'ora' in record:
+            # Il GME numera le ore da 1 a 24 (25 nel giorno del cambio d'ora)
+            hour = int(record['ora']) - 1
+        else:
+            hour = int(record['hour'])
+        if not 0 <= hour <= 23:
+            raise ValueError(f"Ora non valida: {hour}")
+        
+        zone = record.get('zona') or record.get('zone')
+        if zone:
+            price = record.get('prezzo') or record['price']
+            yield {'date': date, 'hour': hour, 'zone': zone.upper(),
+                   'price': Decimal(price.replace(',', '.'))}
+            return
+        
+        for key, value in record.items():
+            if key.upper() in PunDataService.GME_ZONES and value:
+                yield {'date': date, 'hour': hour, 'zone': key.upper(),
+                       'price': Decimal(value.replace(',', '.'))}
+    
+    @staticmethod
+    def _parse_gme_date(value):
+        """Date nei formati AAAAMMGG, AAAA-MM-GG e GG/MM/AAAA"""
+        for date_format in ('%Y%m%d', '%Y-%m-%d', '%d/%m/%Y'):
+            try:
+                return datetime.strptime(value, date_format).date()
+            except ValueError:
+                continue
+        raise ValueError(f"Data non valida: {value}")
+    
     @staticmethod
     def generate_projections(months_ahead=12):
         """
-        Genera proiezioni del PUN per i prossimi mesi basandosi sui dati storici
-        e applicando il tasso di inflazione.
+        Genera proiezioni del PUN per i prossimi mesi con il profilo
+        stagionale dei dati storici (vedi PunProjectionService).
         
         Args:
             months_ahead: Numero di mesi per cui generare proiezioni
@@ -79,77 +265,17 @@ class PunDataService:
             bool: True se la generazione è avvenuta con successo, False altrimenti
         """
         try:
-            # Ottieni impostazioni globali per il tasso di inflazione
-            settings = GlobalSettings.get_active()
-            inflation_rate = float(settings.inflation_rate)
-            
-            # Ottieni ultimi 3 mesi di dati come base
-            today = datetime.now().date()
-            start_date = (datetime.now() - timedelta(days=90)).date()
-            
-            # Calcola medie per fascia oraria
-            pun_data = PunData.objects.filter(date__gte=start_date)
-            
-            # Se non ci sono abbastanza dati, genera dati di test
-            if pun_data.count() < 100:
-                PunDataService.download_pun_data(
-                    start_date=start_date,
-                    end_date=today
-                )
-                pun_data = PunData.objects.filter(date__gte=start_date)
-            
-            # Calcola medie per fascia
-            f1_avg = pun_data.filter(timeband='F1').aggregate(avg=models.Avg('price'))['avg'] or Decimal('250.0')
-            f2_avg = pun_data.filter(timeband='F2').aggregate(avg=models.Avg('price'))['avg'] or Decimal('230.0')
-            f3_avg = pun_data.filter(timeband='F3').aggregate(avg=models.Avg('price'))['avg'] or Decimal('200.0')
-            
-            # Converti da €/MWh a €/kWh
-            f1_avg_kwh = f1_avg / 1000
-            f2_avg_kwh = f2_avg / 1000
-            f3_avg_kwh = f3_avg / 1000
-            
-            # Calcola media generale
-            avg_price_kwh = (f1_avg_kwh + f2_avg_kwh + f3_avg_kwh) / 3
-            
-            # Genera proiezioni per i mesi futuri
-            current_year = today.year
-            current_month = today.month
-            
-            for i in range(months_ahead):
-                # Calcola mese e anno target
-                target_month = ((current_month + i) % 12) or 12  # Assicura che sia tra 1-12
-                target_year = current_year + ((current_month + i - 1) // 12)
-                
-                # Applica inflazione mensile 
-                # Formula: prezzo * (1 + tasso_inflazione/100/12)^numero_mesi
-                inflation_factor = (1 + inflation_rate/100/12) ** i
-                
-                projected_f1 = f1_avg_kwh * Decimal(str(inflation_factor))
-                projected_f2 = f2_avg_kwh * Decimal(str(inflation_factor))
-                projected_f3 = f3_avg_kwh * Decimal(str(inflation_factor))
-                projected_avg = avg_price_kwh * Decimal(str(inflation_factor))
-                
-                # Salva la proiezione
-                EnergyPriceProjection.objects.update_or_create(
-                    year=target_year,
-                    month=target_month,
-                    defaults={
-                        'f1_price': projected_f1.quantize(Decimal('0.0001')),
-                        'f2_price': projected_f2.quantize(Decimal('0.0001')),
-                        'f3_price': projected_f3.quantize(Decimal('0.0001')),
-                        'avg_price': projected_avg.quantize(Decimal('0.0001')),
-                        'inflation_rate': inflation_rate,
-                        'base_period_start': start_date,
-                        'base_period_end': today
-                    }
-                )
-            
-            logger.info(f"Generated {months_ahead} months of PUN projections")
-            return True
-            
+            written = PunProjectionService.generate(months_ahead=months_ahead)
         except Exception as e:
             logger.error(f"Error generating PUN projections: {e}")
             return False
+        
+        if not written:
+            logger.warning("No PUN history available: projections not generated")
+            return False
+        
+        logger.info(f"Generated {months_ahead} months of PUN projections ({written} rows)")
+        return True
     
     @staticmethod
     def _generate_test_data(start_date, end_date):
@@ -163,8 +289,6 @@ class PunDataService:
         Returns:
             list: Lista di dizionari con dati PUN simulati
         """
-        import random
-        
         data = []
         current_date = start_date
         
@@ -183,10 +307,16 @@ class PunDataService:
         # Zone di mercato
         zones = ["NORD", "CNOR", "CSUD", "SUD", "SICI", "SARD"]
         
+        # Fasce orarie dell'intero periodo, una riga per giorno
+        first_hour = np.datetime64(start_date, 'D').astype('datetime64[h]')
+        days = (end_date - start_date).days + 1
+        timebands = timeband_codes(first_hour + np.arange(max(days, 0) * 24)).reshape(-1, 24)
+        
         while current_date <= end_date:
+            day_timebands = timebands[(current_date - start_date).days]
             for hour in range(24):
                 # Determina la fascia oraria
-                timeband = PunData.get_timeband(current_date, hour)
+                timeband = TIMEBAND_CODES[day_timebands[hour]]
                 
                 # Genera prezzo con fluttuazione
                 base_price = base_prices[timeband]
@@ -244,4 +374,1650 @@ class PunDataService:
             
             current_date += timedelta(days=1)
         
-        return data
\ No newline at end of file
+        return data
+
+
+class PunRollupService:
+    """Servizio per gli aggregati giornalieri e mensili dei dati PUN (PunRollup)"""
+    
+    TIMEBANDS = ('F1', 'F2', 'F3', 'ALL')
+    
+    PRICE_PRECISION = Decimal('0.0001')
+    
+    @staticmethod
+    def refresh(start_date, end_date, zones=None):
+        """
+        Ricalcola gli aggregati giornalieri dei giorni indicati e quelli
+        mensili dei mesi che li contengono.
+        
+        Args:
+            start_date: Primo giorno da ricalcolare
+            end_date: Ultimo giorno da ricalcolare
+            zones: Zone da ricalcolare (default: tutte)
+        """
+        hourly = PunData.objects.filter(date__gte=start_date, date__lte=end_date)
+        if zones:
+            hourly = hourly.filter(zone__in=zones)
+        
+        daily = {}
+        for row in (hourly.values('date', 'zone', 'timeband')
+                    .annotate(hours=models.Count('id'), price_sum=models.Sum('price'),
+                              min_price=models.Min('price'), max_price=models.Max('price'))
+                    .order_by()):
+            for timeband in (row['timeband'], 'ALL'):
+                PunRollupService._combine(daily, (row['date'], row['zone'], timeband), row)
+        
+        month_start = start_date.replace(day=1)
+        next_month = (end_date.replace(day=1) + timedelta(days=32)).replace(day=1)
+        rollups = PunRollup.objects.all()
+        if zones:
+            rollups = rollups.filter(zone__in=zones)
+        
+        with transaction.atomic():
+            # Una fascia può sparire da un giorno (es. ore riassegnate a F3): si riscrive da zero
+            rollups.filter(period='day', period_start__gte=start_date, period_start__lte=end_date).delete()
+            PunRollupService._upsert('day', daily)
+            
+            # Gli aggregati mensili si ricalcolano dai giornalieri (al massimo 31 per zona e fascia)
+            days = rollups.filter(period='day', period_start__gte=month_start, period_start__lt=next_month)
+            monthly = {}
+            for row in (days.annotate(month=TruncMonth('period_start'))
+                        .values('month', 'zone', 'timeband')
+                        .annotate(hours=models.Sum('hours'), price_sum=models.Sum('price_sum'),
+                                  min_price=models.Min('min_price'), max_price=models.Max('max_price'))
+                        .order_by()):
+                PunRollupService._combine(monthly, (row['month'], row['zone'], row['timeband']), row)
+            rollups.filter(period='month', period_start__gte=month_start, period_start__lt=next_month).delete()
+            PunRollupService._upsert('month', monthly)
+    
+    @staticmethod
+    def rebuild():
+        """
+        Ricostruisce tutti gli aggregati dai dati orari.
+        
+        Returns:
+            int: Numero di aggregati giornalieri creati
+        """
+        bounds = PunData.objects.aggregate(first=models.Min('date'), last=models.Max('date'))
+        with transaction.atomic():
+            PunRollup.objects.all().delete()
+            if bounds['first']:
+                PunRollupService.refresh(bounds['first'], bounds['last'])
+        return PunRollup.objects.filter(period='day').count()
+    
+    @staticmethod
+    def restamp_holidays():
+        """
+        Riporta in F3 le ore festive salvate con la fascia dei giorni feriali
+        e ricalcola gli aggregati dei giorni corretti.
+        
+        Returns:
+            int: Numero di righe PUN corrette
+        """
+        bounds = PunData.objects.aggregate(first=models.Min('date'), last=models.Max('date'))
+        if not bounds['first']:
+            return 0
+        
+        days = sorted(
+            day
+            for year in range(bounds['first'].year, bounds['last'].year + 1)
+            for day in holidays(year)
+        )
+        with transaction.atomic():
+            stale = PunData.objects.filter(date__in=days).exclude(timeband='F3')
+            changed_days = sorted(set(stale.values_list('date', flat=True)))
+            updated = stale.update(timeband='F3')
+            for day in changed_days:
+                PunRollupService.refresh(day, day)
+        
+        if updated:
+            TariffPricingService.invalidate()
+        return updated
+    
+    @staticmethod
+    def _combine(target, key, row):
+        """Somma ore e prezzi e aggiorna minimo e massimo di un aggregato"""
+        current = target.get(key)
+        if current is None:
+            target[key] = {field: row[field] for field in ('hours', 'price_sum', 'min_price', 'max_price')}
+            return
+        current['hours'] += row['hours']
+        current['price_sum'] += row['price_sum']
+        current['min_price'] = min(current['min_price'], row['min_price'])
+        current['max_price'] = max(current['max_price'], row['max_price'])
+    
+    @staticmethod
+    def _upsert(period, aggregates):
+        """Scrive gli aggregati di un periodo con un upsert in blocco"""
+        quantize = PunRollupService.PRICE_PRECISION
+        objects = [
+            PunRollup(
+                period=period,
+                period_start=period_start.date() if isinstance(period_start, datetime) else period_start,
+                zone=zone,
+                timeband=timeband,
+                hours=values['hours'],
+                price_sum=Decimal(values['price_sum']).quantize(quantize),
+                min_price=Decimal(values['min_price']).quantize(quantize),
+                avg_price=(Decimal(values['price_sum']) / values['hours']).quantize(quantize),
+                max_price=Decimal(values['max_price']).quantize(quantize),
+            )
+            for (period_start, zone, timeband), values in aggregates.items()
+        ]
+        PunRollup.objects.bulk_create(
+            objects,
+            batch_size=PunDataService.INGEST_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['period', 'period_start', 'zone', 'timeband'],
+            update_fields=['hours', 'price_sum', 'min_price', 'avg_price', 'max_price'],
+        )
+    
+    @staticmethod
+    def _period_filter(start_date=None, end_date=None):
+        """
+        Filtro che copre l'intervallo con i mesi interi e i giorni ai bordi.
+        
+        Args:
+            start_date: Primo giorno (None = dall'inizio dei dati)
+            end_date: Ultimo giorno (None = fino alla fine dei dati)
+            
+        Returns:
+            Q: Filtro su PunRollup
+        """
+        Q = models.Q
+        if start_date is None and end_date is None:
+            return Q(period='month')
+        
+        # Primo mese interamente compreso nell'intervallo e primo giorno dopo l'ultimo
+        first_month = None
+        if start_date is not None:
+            first_month = start_date if start_date.day == 1 else (start_date.replace(day=1) + timedelta(days=32)).replace(day=1)
+        after_months = None
+        if end_date is not None:
+            next_day = end_date + timedelta(days=1)
+            after_months = next_day if next_day.day == 1 else end_date.replace(day=1)
+        
+        if first_month is not None and after_months is not None and first_month >= after_months:
+            return Q(period='day', period_start__gte=start_date, period_start__lte=end_date)
+        
+        condition = Q(period='month')
+        if first_month is not None:
+            condition &= Q(period_start__gte=first_month)
+            condition |= Q(period='day', period_start__gte=start_date, period_start__lt=first_month)
+        if after_months is not None:
+            condition = (condition & Q(period_start__lt=after_months)) | \
+                Q(period='day', period_start__gte=after_months, period_start__lte=end_date)
+        return condition
+    
+    @staticmethod
+    def statistics(start_date=None, end_date=None, zone=None):
+        """
+        Minimo, media e massimo del PUN per fascia oraria in un intervallo.
+        
+        Legge gli aggregati mensili per i mesi interi e i giornalieri per i
+        giorni ai bordi, con un'unica query indipendente dallo storico orario.
+        
+        Args:
+            start_date: Primo giorno (None = dall'inizio dei dati)
+            end_date: Ultimo giorno (None = fino alla fine dei dati)
+            zone: Zona di mercato (None = tutte le zone)
+            
+        Returns:
+            dict: Per fascia ('F1', 'F2', 'F3', 'ALL') 'hours', 'min', 'avg' e 'max'
+                in €/MWh (None se non ci sono dati)
+        """
+        rollups = PunRollup.objects.filter(PunRollupService._period_filter(start_date, end_date))
+        if zone:
+            rollups = rollups.filter(zone=zone)
+        
+        result = {timeband: {'hours': 0, 'min': None, 'avg': None, 'max': None}
+                  for timeband in PunRollupService.TIMEBANDS}
+        for row in (rollups.values('timeband')
+                    .annotate(hours=models.Sum('hours'), price_sum=models.Sum('price_sum'),
+                              min_price=models.Min('min_price'), max_price=models.Max('max_price'))
+                    .order_by()):
+            if row['hours']:
+                result[row['timeband']] = {
+                    'hours': row['hours'],
+                    'min': row['min_price'],
+                    'avg': (Decimal(row['price_sum']) / row['hours']).quantize(PunRollupService.PRICE_PRECISION),
+                    'max': row['max_price'],
+                }
+        return result
+    
+    @staticmethod
+    def series(period='month', start_date=None, end_date=None, zone=None, timeband='ALL'):
+        """
+        Serie storica degli aggregati giornalieri o mensili.
+        
+        Args:
+            period: 'day' o 'month'
+            start_date: Primo periodo (incluso)
+            end_date: Ultimo periodo (incluso)
+            zone: Zona di mercato (None = media su tutte le zone)
+            timeband: Fascia oraria o 'ALL'
+            
+        Returns:
+            list: Dizionari con 'period_start', 'hours', 'min', 'avg' e 'max'
+        """
+        rollups = PunRollup.objects.filter(period=period, timeband=timeband)
+        if start_date:
+            rollups = rollups.filter(period_start__gte=start_date)
+        if end_date:
+            rollups = rollups.filter(period_start__lte=end_date)
+        if zone:
+            rollups = rollups.filter(zone=zone)
+        
+        return [
+            {
+                'period_start': row['period_start'],
+                'hours': row['hours'],
+                'min': row['min_price'],
+                'avg': (Decimal(row['price_sum']) / row['hours']).quantize(PunRollupService.PRICE_PRECISION),
+                'max': row['max_price'],
+            }
+            for row in (rollups.values('period_start')
+                        .annotate(hours=models.Sum('hours'), price_sum=models.Sum('price_sum'),
+                                  min_price=models.Min('min_price'), max_price=models.Max('max_price'))
+                        .order_by('period_start'))
+        ]
+    
+    @staticmethod
+    def zone_hours():
+        """
+        Numero di ore di dati per zona.
+        
+        Returns:
+            list: Dizionari con 'zone' e 'count'
+        """
+        return list(
+            PunRollup.objects.filter(period='month', timeband='ALL')
+            .values('zone')
+            .annotate(count=models.Sum('hours'))
+            .order_by('zone')
+        )
+
+
+class PunPriceTable:
+    """
+    Prezzi PUN orari e proiezioni mensili caricati in memoria.
+    
+    I prezzi sono in €/kWh in una matrice (zona, ora) a partire dalla prima
+    ora disponibile, con NaN per le ore mancanti. Ordine delle ricerche:
+    prezzo dell'ora; per i mesi successivi agli ultimi dati, la proiezione
+    del mese; ultimo prezzo disponibile della fascia; la prima proiezione
+    dal mese richiesto in poi; infine i valori medi stimati. Le proiezioni
+    della zona hanno la precedenza su quelle della media delle zone.
+    """
+    
+    # Valori medi stimati in €/kWh per fascia, se non ci sono dati né proiezioni
+    DEFAULT_PRICES = np.array([0.15, 0.13, 0.11])
+    
+    def __init__(self, zones=(), origin=None, prices=None, projections=None):
+        """
+        Args:
+            zones: Zone delle righe di prices
+            origin: Prima ora della matrice (datetime64[h])
+            prices: Matrice (zona, ora) dei prezzi in €/kWh
+            projections: Dizionario zona ('' = media delle zone) -> (mesi come
+                anno * 12 + mese - 1 ordinati, matrice (mese, fascia) in €/kWh)
+        """
+        self.zones = {zone: row for row, zone in enumerate(zones)}
+        self.origin = origin
+        self.prices = prices if prices is not None else np.empty((0, 0))
+        self.projections = {
+            zone: (np.asarray(months, dtype=np.int64), np.asarray(values, dtype=float).reshape(-1, 3))
+            for zone, (months, values) in (projections or {}).items()
+        }
+        # Ultimo mese con dati orari: dopo si preferiscono le proiezioni
+        self.last_month = (
+            (origin + self.prices.shape[1] - 1).astype('datetime64[M]').astype(np.int64) + 1970 * 12
+            if origin is not None else None
+        )
+        
+        # Senza zona si usa la media delle zone disponibili per ogni ora
+        counts = (~np.isnan(self.prices)).sum(axis=0)
+        totals = np.nansum(self.prices, axis=0)
+        self.national = np.divide(totals, counts, out=np.full(totals.shape, np.nan), where=counts > 0)
+        
+        bands = timeband_codes(origin + np.arange(self.prices.shape[1])) if origin is not None else np.empty(0, int)
+        self.latest = {zone: self._latest_by_band(self.prices[row], bands) for zone, row in self.zones.items()}
+        self.latest[None] = self._latest_by_band(self.national, bands)
+    
+    @staticmethod
+    def _latest_by_band(row, bands):
+        """Ultimo prezzo disponibile per ciascuna fascia"""
+        latest = np.full(3, np.nan)
+        for band in range(3):
+            available = np.flatnonzero((bands == band) & ~np.isnan(row))
+            if available.size:
+                latest[band] = row[available[-1]]
+        return latest
+    
+    @classmethod
+    def load(cls):
+        """
+        Carica dal database tutti i dati PUN e le proiezioni (due query).
+        
+        Returns:
+            PunPriceTable: Tabella dei prezzi
+        """
+        rows = list(PunData.objects.order_by().values_list('zone', 'date', 'hour', 'price'))
+        if rows:
+            zone_names, dates, hours, prices = zip(*rows)
+            zones = sorted(set(zone_names))
+            zone_index = np.searchsorted(zones, zone_names)
+            stamps = np.array(dates, dtype='datetime64[D]').astype('datetime64[h]') + np.array(hours)
+            origin = stamps.min()
+            offsets = (stamps - origin).astype(np.int64)
+            matrix = np.full((len(zones), offsets.max() + 1), np.nan)
+            matrix[zone_index, offsets] = np.array(prices, dtype=float) / 1000  # €/MWh -> €/kWh
+        else:
+            zones, origin, matrix = (), None, None
+        
+        projections = {}
+        for zone, year, month, *band_prices in (
+                EnergyPriceProjection.objects.order_by('zone', 'year', 'month')
+                .values_list('zone', 'year', 'month', 'f1_price', 'f2_price', 'f3_price')):
+            months, values = projections.setdefault(zone, ([], []))
+            months.append(year * 12 + month - 1)
+            values.append([float(price) for price in band_prices])
+        
+        return cls(zones=zones, origin=origin, prices=matrix, projections=projections)
+    
+    def _projected(self, hours, bands, zone, exact):
+        """Prezzi proiettati per le ore indicate (NaN se non disponibili)"""
+        months, values = self.projections.get(zone if zone in self.projections else '', ((), ()))
+        result = np.full(hours.shape, np.nan)
+        if not len(months):
+            return result
+        
+        wanted = hours.astype('datetime64[M]').astype(np.int64) + 1970 * 12
+        position = np.minimum(np.searchsorted(months, wanted), len(months) - 1)
+        found = months[position] == wanted if exact else months[position] >= wanted
+        result[found] = values[position[found], bands[found]]
+        return result
+    
+    def pun_prices(self, hours, zone=None, use_projections=True):
+        """
+        Prezzo PUN (senza commissioni) per un array di ore.
+        
+        Args:
+            hours: Array di ore (convertibile in datetime64[h])
+            zone: Zona di mercato; None o una zona senza dati usano la media delle zone
+            use_projections: Se usare le proiezioni quando mancano i dati PUN
+            
+        Returns:
+            tuple: (prezzi in €/kWh, indici delle fasce orarie)
+        """
+        hours = np.asarray(hours, dtype='datetime64[h]')
+        bands = timeband_codes(hours)
+        row = self.prices[self.zones[zone]] if zone in self.zones else self.national
+        latest = self.latest[zone if zone in self.zones else None]
+        
+        prices = np.full(hours.shape, np.nan)
+        if self.origin is not None:
+            offsets = (hours - self.origin).astype(np.int64)
+            inside = (offsets >= 0) & (offsets < row.size)
+            prices[inside] = row[offsets[inside]]
+        
+        if use_projections and self.projections and self.last_month is not None:
+            future = np.isnan(prices) & (hours.astype('datetime64[M]').astype(np.int64) + 1970 * 12 > self.last_month)
+            prices[future] = self._projected(hours[future], bands[future], zone, exact=True)
+        
+        missing = np.isnan(prices)
+        prices[missing] = latest[bands[missing]]
+        
+        missing = np.isnan(prices)
+        if use_projections and self.projections and missing.any():
+            prices[missing] = self._projected(hours[missing], bands[missing], zone, exact=False)
+        
+        missing = np.isnan(prices)
+        prices[missing] = self.DEFAULT_PRICES[bands[missing]]
+        return prices, bands
+
+
+class InMemoryData:
+    """
+    Dati caricati una volta per processo e ricaricati quando cambia la loro DataVersion.
+    
+    La versione nel database viene letta al più ogni MEMORY_DATA_CHECK_SECONDS
+    secondi: le modifiche fatte da altri processi (web o comandi di gestione)
+    si vedono entro quel ritardo, quelle del processo stesso subito.
+    """
+    
+    DEFAULT_CHECK_SECONDS = 10
+    
+    def __init__(self, key, loader):
+        """
+        Args:
+            key: Chiave della DataVersion
+            loader: Funzione senza argomenti che carica i dati dal database
+        """
+        self.key = key
+        self.loader = loader
+        self._value = None
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def check_seconds():
+        """Intervallo tra due letture della versione (impostazione MEMORY_DATA_CHECK_SECONDS)"""
+        return float(getattr(settings, 'MEMORY_DATA_CHECK_SECONDS', InMemoryData.DEFAULT_CHECK_SECONDS))
+    
+    def invalidate(self):
+        """Segnala a tutti i processi che i dati sono cambiati"""
+        version = DataVersion.bump(self.key)
+        with self._lock:
+            self._value = None
+            self._version = version
+            self._checked_at = time.monotonic()
+    
+    def get(self):
+        """
+        Restituisce i dati, ricaricandoli se la versione è cambiata.
+        
+        Returns:
+            object: Valore restituito dal loader
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is None or now - self._checked_at >= self.check_seconds():
+                version = DataVersion.current(self.key)
+                self._checked_at = now
+                if version != self._version:
+                    self._value = None
+                    self._version = version
+            if self._value is None:
+                self._value = self.loader()
+            return self._value
+
+
+class TariffPricingService:
+    """
+    Prezzi delle tariffe elettriche calcolati in memoria.
+    
+    Ogni processo tiene una PunPriceTable; la versione dei prezzi nel database
+    viene cambiata a ogni importazione PUN o generazione delle proiezioni, e la
+    tabella viene ricaricata al primo uso successivo (vedi InMemoryData).
+    """
+    
+    _table = InMemoryData('infrastructure:pun_price_table', PunPriceTable.load)
+    
+    @staticmethod
+    def invalidate():
+        """Segnala a tutti i processi che i prezzi PUN o le proiezioni sono cambiati"""
+        TariffPricingService._table.invalidate()
+    
+    @staticmethod
+    def get_price_table():
+        """
+        Restituisce la tabella dei prezzi, ricaricandola se non più valida.
+        
+        Returns:
+            PunPriceTable: Tabella dei prezzi corrente
+        """
+        return TariffPricingService._table.get()
+    
+    @staticmethod
+    def price_for(tariff, hours, power_kw=None, zone=None, use_projections=True):
+        """
+        Costo dell'energia di una tariffa per un array di ore.
+        
+        Args:
+            tariff: ElectricityTariff
+            hours: Array di ore (convertibile in datetime64[h])
+            power_kw: Potenza della stazione, per le tariffe a prezzo fisso
+            zone: Zona di mercato PUN (None = media delle zone)
+            use_projections: Se usare le proiezioni quando mancano i dati PUN
+            
+        Returns:
+            numpy.ndarray: Costi in €/kWh
+        """
+        hours = np.asarray(hours, dtype='datetime64[h]')
+        if tariff.tariff_type != 'pun':
+            return np.full(hours.shape, tariff.get_fixed_energy_cost(power_kw))
+        
+        prices, bands = TariffPricingService.get_price_table().pun_prices(
+            hours, zone=zone, use_projections=use_projections)
+        fees = np.array([float(tariff.pun_fee_f1), float(tariff.pun_fee_f2), float(tariff.pun_fee_f3)])
+        return prices + fees[bands]
+
+
+class EnergyBillService:
+    """
+    Simulazione oraria della bolletta energetica delle stazioni.
+    
+    Il profilo di utilizzo viene espanso in una curva di carico sulle 8760
+    (o 8784) ore dell'anno e moltiplicato per i prezzi orari della tariffa:
+    PUN o proiezioni più la commissione di fascia, oppure il prezzo fisso
+    per fascia di potenza. La curva è la stessa per tutte le stazioni, che
+    differiscono solo per energia annua e prezzo: l'intero portafoglio si
+    calcola con operazioni su array (stazioni, mesi).
+    """
+    
+    # Fasce di utilizzo dei profili sull'intera giornata: (nome, ora di inizio, ora di fine)
+    USAGE_SLOTS = (('night', 0, 6), ('morning', 6, 12), ('afternoon', 12, 18), ('evening', 18, 24))
+    
+    # Quota massima della capacità teorica (come in StationUsageProfile.calculate_monthly_usage)
+    MAX_CAPACITY_FACTOR = 0.85
+    
+    @staticmethod
+    def year_hours(year):
+        """
+        Ore di un anno solare.
+        
+        Args:
+            year: Anno
+            
+        Returns:
+            numpy.ndarray: Ore datetime64[h] dal 1° gennaio al 31 dicembre
+        """
+        return np.arange(np.datetime64(f'{year}-01-01T00', 'h'), np.datetime64(f'{year + 1}-01-01T00', 'h'))
+    
+    @staticmethod
+    def load_shape(profile, hours):
+        """
+        Curva di carico normalizzata di un profilo di utilizzo.
+        
+        Le percentuali di ciascuna fascia (feriale o weekend e festivi) sono ripartite
+        in modo uniforme sulle sue ore; la curva somma a 1 sull'intero periodo.
+        
+        Args:
+            profile: StationUsageProfile
+            hours: Array di ore (convertibile in datetime64[h])
+            
+        Returns:
+            numpy.ndarray: Quota dell'energia per ogni ora
+        """
+        hours = np.asarray(hours, dtype='datetime64[h]')
+        hour = hours.astype(np.int64) % 24
+        # I festivi seguono il profilo del weekend
+        weekend = non_working_days(hours)
+        
+        weights = np.zeros(hours.shape)
+        for slot, start, end in EnergyBillService.USAGE_SLOTS:
+            in_slot = (hour >= start) & (hour < end)
+            weekday_usage = getattr(profile, f'weekday_{slot}_usage')
+            weekend_usage = getattr(profile, f'weekend_{slot}_usage')
+            weights[in_slot] = np.where(weekend[in_slot], weekend_usage, weekday_usage) / (end - start)
+        
+        total = weights.sum()
+        if not total:
+            return np.full(hours.shape, 1 / max(hours.size, 1))
+        return weights / total
+    
+    @staticmethod
+    def timeband_shares(profile, year):
+        """
+        Quota dell'energia prelevata in F1, F2 e F3 con un profilo di utilizzo.
+        
+        Args:
+            profile: StationUsageProfile
+            year: Anno del calendario
+            
+        Returns:
+            numpy.ndarray: Quote per fascia (F1, F2, F3), somma 1
+        """
+        hours = EnergyBillService.year_hours(year)
+        shape = EnergyBillService.load_shape(profile, hours)
+        return np.bincount(timeband_codes(hours), weights=shape, minlength=3)
+    
+    @staticmethod
+    def simulate(power_kw, tariff, profile, year=None, zone=None, use_projections=True):
+        """
+        Bolletta energetica annua e mensile di un insieme di stazioni.
+        
+        Args:
+            power_kw: Potenza di ciascuna stazione (kW)
+            tariff: ElectricityTariff applicata
+            profile: StationUsageProfile applicato
+            year: Anno simulato (default anno corrente)
+            zone: Zona di mercato PUN (None = media delle zone)
+            use_projections: Se usare le proiezioni quando mancano i dati PUN
+            
+        Returns:
+            dict: Array per stazione: 'monthly_kwh', 'monthly_energy_cost',
+                'monthly_fixed_cost' e 'monthly_total' (stazioni x 12),
+                'annual_kwh', 'annual_energy_cost', 'annual_total' e
+                'average_price'; inoltre 'year' e 'timeband_shares'
+        """
+        year = year or datetime.now().year
+        power = np.asarray(power_kw, dtype=float).reshape(-1)
+        hours = EnergyBillService.year_hours(year)
+        shape = EnergyBillService.load_shape(profile, hours)
+        month_starts = np.flatnonzero(np.diff(hours.astype('datetime64[M]').astype(np.int64), prepend=-1))
+        
+        # Energia annua: sessioni medie per i giorni dell'anno, limitata dalla potenza
+        daily_kwh = float(profile.avg_daily_sessions) * float(profile.avg_energy_per_session)
+        annual_kwh = np.minimum(
+            daily_kwh * hours.size / 24,
+            power * hours.size * EnergyBillService.MAX_CAPACITY_FACTOR,
+        )
+        monthly_kwh = annual_kwh[:, None] * np.add.reduceat(shape, month_starts)
+        
+        if tariff.tariff_type == 'pun':
+            # Costo mensile per kWh annuo, uguale per tutte le stazioni
+            prices = tariff.price_for(hours, zone=zone, use_projections=use_projections)
+            monthly_energy_cost = annual_kwh[:, None] * np.add.reduceat(shape * prices, month_starts)
+        else:
+            levels, inverse = np.unique(power, return_inverse=True)
+            prices = np.array([tariff.get_fixed_energy_cost(level) for level in levels])[inverse]
+            monthly_energy_cost = monthly_kwh * prices[:, None]
+        
+        fixed = float(tariff.connection_fee) + power * float(tariff.power_fee)
+        monthly_fixed_cost = np.repeat(fixed[:, None], month_starts.size, axis=1)
+        monthly_total = monthly_energy_cost + monthly_fixed_cost
+        annual_energy_cost = monthly_energy_cost.sum(axis=1)
+        
+        return {
+            'year': year,
+            'timeband_shares': np.bincount(timeband_codes(hours), weights=shape, minlength=3),
+            'monthly_kwh': monthly_kwh,
+            'monthly_energy_cost': monthly_energy_cost,
+            'monthly_fixed_cost': monthly_fixed_cost,
+            'monthly_total': monthly_total,
+            'annual_kwh': annual_kwh,
+            'annual_energy_cost': annual_energy_cost,
+            'annual_total': monthly_total.sum(axis=1),
+            'average_price': np.divide(annual_energy_cost, annual_kwh,
+                                       out=np.zeros_like(annual_kwh), where=annual_kwh > 0),
+        }
+    
+    @staticmethod
+    def simulate_stations(stations, tariff=None, profile=None, **kwargs):
+        """
+        Bolletta energetica di un elenco di ChargingStation.
+        
+        Args:
+            stations: ChargingStation (infrastructure) da simulare
+            tariff: ElectricityTariff (default la prima tariffa attiva)
+            profile: StationUsageProfile (default il primo profilo)
+            **kwargs: Altri argomenti di simulate
+            
+        Returns:
+            dict: Risultato di simulate con in più 'stations', oppure None se
+                mancano tariffa o profilo
+        """
+        tariff = tariff or ElectricityTariff.objects.filter(active=True).first()
+        profile = profile or StationUsageProfile.objects.first()
+        if not tariff or not profile:
+            return None
+        
+        stations = list(stations)
+        result = EnergyBillService.simulate([station.max_power for station in stations], tariff, profile, **kwargs)
+        result['stations'] = stations
+        return result
+
+
+class PunProjectionService:
+    """
+    Proiezioni mensili del PUN per zona e fascia oraria.
+    
+    Dallo storico mensile (aggregati PunRollup) di ogni serie zona/fascia, in
+    scala logaritmica, si stimano:
+        - il profilo stagionale: scarto medio di ogni mese dell'anno dalla
+          media mobile centrata di 12 mesi;
+        - il livello attuale: media destagionalizzata degli ultimi 12 mesi;
+        - la volatilità: deviazione standard dei residui.
+    La proiezione è livello + stagionalità, cresciuta con l'inflazione delle
+    impostazioni globali; l'intervallo P10-P90 si allarga con l'orizzonte.
+    Tutte le serie sono calcolate insieme su array (mesi x serie); la zona
+    vuota è la media delle zone pesata sulle ore.
+    """
+    
+    # Osservazioni minime di un mese dell'anno per stimarne la stagionalità
+    MIN_SEASONAL_OBSERVATIONS = 2
+    
+    # Mesi usati per stimare il livello attuale dei prezzi
+    LEVEL_MONTHS = 12
+    
+    # Quantile della normale standard al 90° percentile
+    Z_90 = 1.2816
+    
+    @staticmethod
+    def history(zones=None):
+        """
+        Prezzi medi mensili per zona e fascia dagli aggregati PUN.
+        
+        Args:
+            zones: Zone da considerare (default: tutte)
+            
+        Returns:
+            pandas.DataFrame: Prezzi in €/kWh, un mese per riga e una colonna
+                per (zona, fascia), oppure None se non ci sono dati
+        """
+        rollups = PunRollup.objects.filter(period='month', timeband__in=TIMEBAND_CODES)
+        if zones:
+            rollups = rollups.filter(zone__in=zones)
+        frame = pd.DataFrame.from_records(
+            rollups.values_list('period_start', 'zone', 'timeband', 'hours', 'price_sum'),
+            columns=['month', 'zone', 'timeband', 'hours', 'price_sum'],
+        )
+        if frame.empty:
+            return None
+        
+        frame['price_sum'] = frame['price_sum'].astype(float)
+        national = frame.groupby(['month', 'timeband'], as_index=False)[['hours', 'price_sum']].sum()
+        national['zone'] = ''
+        frame = pd.concat([frame, national], ignore_index=True)
+        frame['price'] = frame['price_sum'] / frame['hours'] / 1000  # €/MWh -> €/kWh
+        
+        table = frame.pivot_table(index='month', columns=['zone', 'timeband'], values='price')
+        table.index = pd.PeriodIndex(table.index, freq='M')
+        return table.reindex(pd.period_range(table.index.min(), table.index.max(), freq='M'))
+    
+    @staticmethod
+    def fit(history):
+        """
+        Stima stagionalità, livello e volatilità di ogni serie.
+        
+        Args:
+            history: DataFrame restituito da history
+            
+        Returns:
+            dict: 'seasonal' (12 x serie, log), 'level' e 'sigma' per serie
+        """
+        log_prices = np.log(history)
+        months = history.index.month
+        
+        trend = log_prices.rolling(12, center=True, min_periods=12).mean()
+        deviation = log_prices - trend
+        by_month = deviation.groupby(months)
+        seasonal = (by_month.mean()
+                    .where(by_month.count() >= PunProjectionService.MIN_SEASONAL_OBSERVATIONS)
+                    .reindex(range(1, 13))
+                    .fillna(0.0))
+        seasonal -= seasonal.mean()
+        
+        seasonal_by_row = seasonal.loc[months].to_numpy()
+        deseasonalized = log_prices - seasonal_by_row
+        level = deseasonalized.apply(lambda series: series.dropna().iloc[-PunProjectionService.LEVEL_MONTHS:].mean())
+        sigma = (deviation - seasonal_by_row).std(ddof=1).fillna(0.0)
+        
+        return {
+            'seasonal': seasonal.to_numpy(),
+            'level': level.to_numpy(),
+            'sigma': sigma.to_numpy(),
+        }
+    
+    @staticmethod
+    def project(history, months_ahead, start=None, inflation_rate=0):
+        """
+        Proietta i prezzi di tutte le serie per i mesi richiesti.
+        
+        Args:
+            history: DataFrame restituito da history
+            months_ahead: Numero di mesi da proiettare
+            start: Primo mese (default mese corrente)
+            inflation_rate: Inflazione annua in %
+            
+        Returns:
+            list: Dizionari con 'year', 'month', 'zone', prezzi per fascia,
+                'avg_price', 'avg_price_low' e 'avg_price_high' in €/kWh
+        """
+        model = PunProjectionService.fit(history)
+        periods = pd.period_range(pd.Period(start or datetime.now().date(), freq='M'), periods=months_ahead, freq='M')
+        step = np.arange(months_ahead)
+        
+        # Livello + stagionalità, con inflazione composta mensilmente (mesi x serie)
+        growth = (1 + float(inflation_rate) / 100 / 12) ** step
+        prices = np.exp(model['level'] + model['seasonal'][periods.month - 1]) * growth[:, None]
+        spread = model['sigma'] * np.sqrt(1 + (step[:, None] + 1) / 12)
+        
+        # Ore di ciascuna fascia in ogni mese, per la media ponderata
+        first_hour = np.datetime64(periods[0].start_time.date(), 'h')
+        hours = np.arange(first_hour, np.datetime64((periods[-1] + 1).start_time.date(), 'h'))
+        month_of_hour = (hours.astype('datetime64[M]') - first_hour.astype('datetime64[M]')).astype(np.int64)
+        band_hours = np.bincount(month_of_hour * 3 + timeband_codes(hours), minlength=months_ahead * 3)
+        weights = band_hours.reshape(months_ahead, 3) / band_hours.reshape(months_ahead, 3).sum(axis=1, keepdims=True)
+        
+        columns = list(history.columns)
+        projections = []
+        for zone in dict.fromkeys(zone for zone, _band in columns):
+            index = [columns.index((zone, band)) if (zone, band) in columns else None for band in TIMEBAND_CODES]
+            # Le fasce senza storico della zona usano la media delle fasce disponibili
+            available = [position for position in index if position is not None]
+            band_prices = np.stack([prices[:, position] if position is not None else prices[:, available].mean(axis=1)
+                                    for position in index], axis=1)
+            band_spread = np.stack([spread[:, position] if position is not None else spread[:, available].max(axis=1)
+                                    for position in index], axis=1)
+            average = (band_prices * weights).sum(axis=1)
+            average_spread = (band_spread * weights).sum(axis=1)
+            
+            for row, period in enumerate(periods):
+                projections.append({
+                    'year': period.year,
+                    'month': period.month,
+                    'zone': zone,
+                    'f1_price': band_prices[row, 0],
+                    'f2_price': band_prices[row, 1],
+                    'f3_price': band_prices[row, 2],
+                    'avg_price': average[row],
+                    'avg_price_low': average[row] * np.exp(-PunProjectionService.Z_90 * average_spread[row]),
+                    'avg_price_high': average[row] * np.exp(PunProjectionService.Z_90 * average_spread[row]),
+                })
+        return projections
+    
+    @staticmethod
+    def generate(months_ahead=12, zones=None):
+        """
+        Calcola e salva le proiezioni con un unico upsert in blocco.
+        
+        Args:
+            months_ahead: Numero di mesi da proiettare
+            zones: Zone da proiettare (default: tutte, più la media delle zone)
+            
+        Returns:
+            int: Numero di proiezioni salvate (0 se manca lo storico)
+        """
+        history = PunProjectionService.history(zones)
+        if history is None:
+            return 0
+        
+        inflation_rate = GlobalSettings.get_active().inflation_rate
+        projections = PunProjectionService.project(history, months_ahead, inflation_rate=inflation_rate)
+        
+        quantize = Decimal('0.0001')
+        price_fields = ('f1_price', 'f2_price', 'f3_price', 'avg_price', 'avg_price_low', 'avg_price_high')
+        base_period_start = history.index[0].start_time.date()
+        base_period_end = history.index[-1].end_time.date()
+        objects = [
+            EnergyPriceProjection(
+                year=projection['year'],
+                month=projection['month'],
+                zone=projection['zone'],
+                method='seasonal',
+                inflation_rate=inflation_rate,
+                base_period_start=base_period_start,
+                base_period_end=base_period_end,
+                **{field: Decimal(str(projection[field])).quantize(quantize) for field in price_fields},
+            )
+            for projection in projections
+        ]
+        EnergyPriceProjection.objects.bulk_create(
+            objects,
+            batch_size=PunDataService.INGEST_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['year', 'month', 'zone'],
+            update_fields=list(price_fields) + ['method', 'inflation_rate', 'base_period_start', 'base_period_end'],
+        )
+        TariffPricingService.invalidate()
+        return len(objects)
+
+
+class MunicipalityImportService:
+    """
+    Importazione in blocco dei comuni italiani da file locali (CSV o JSON).
+    
+    Le righe vengono normalizzate sui campi del modello e scritte a blocchi
+    con bulk_create/bulk_update in un'unica transazione. In modalità upsert
+    i comuni esistenti sono riconosciuti dal codice ISTAT (o, se non
+    l'hanno ancora, da nome e provincia) e aggiornati senza cancellarli.
+    """
+    
+    # Fonti remote usate solo se non c'è un file locale o uno snapshot
+    SOURCE_URL = "https://raw.githubusercontent.com/matteocontrini/comuni-json/master/comuni.json"
+    ISTAT_URL = "https://www.istat.it/storage/codici-unita-amministrative/Elenco-comuni-italiani.csv"
+    
+    # Righe scritte per ogni blocco
+    BATCH_SIZE = 2000
+    
+    # Nomi delle colonne delle fonti note per ciascun campo del modello
+    FIELD_ALIASES = {
+        'istat_code': ('istat_code', 'codice', 'Codice Comune formato alfanumerico', 'Codice Istat'),
+        'name': ('name', 'nome', 'Comune', 'Denominazione in italiano', 'Denominazione (Italiana e straniera)'),
+        'province': ('province', 'provincia', 'Provincia',
+                     "Denominazione dell'Unità territoriale sovracomunale \n(valida a fini statistici)",
+                     "Denominazione dell'Unità territoriale sovracomunale (valida a fini statistici)"),
+        'region': ('region', 'regione', 'Regione', 'Denominazione Regione'),
+        'population': ('population', 'popolazione', 'Popolazione', 'Popolazione legale'),
+        'latitude': ('latitude', 'lat', 'latitudine', 'Latitudine'),
+        'longitude': ('longitude', 'lng', 'lon', 'longitudine', 'Longitudine'),
+    }
+    
+    UPDATE_FIELDS = ('istat_code', 'name', 'province', 'region', 'population', 'latitude', 'longitude')
+    
+    # Campi che le fonti possono non riportare: i valori già noti non vengono cancellati
+    KEPT_FIELDS = ('population', 'latitude', 'longitude')
+    
+    @staticmethod
+    def snapshot_path():
+        """Percorso dello snapshot locale dei comuni (impostazione MUNICIPALITY_SNAPSHOT)"""
+        return getattr(settings, 'MUNICIPALITY_SNAPSHOT',
+                       os.path.join(os.path.dirname(__file__), 'data', 'municipalities.json'))
+    
+    @staticmethod
+    def read_source(path):
+        """
+        Legge un elenco di comuni da un file CSV o JSON.
+        
+        Args:
+            path: Percorso del file
+            
+        Returns:
+            list: Record della fonte (dizionari con le colonne originali)
+        """
+        with open(path, 'rb') as handle:
+            content = handle.read()
+        if path.lower().endswith('.json'):
+            return MunicipalityImportService.parse_json(content)
+        return MunicipalityImportService.parse_csv(content)
+    
+    @staticmethod
+    def parse_json(content):
+        """Record da un JSON (lista di oggetti, eventualmente sotto la chiave 'comuni')"""
+        data = json.loads(content)
+        if isinstance(data, dict):
+            data = data.get('comuni') or data.get('municipalities') or []
+        return data
+    
+    @staticmethod
+    def parse_csv(content):
+        """Record da un CSV UTF-8 o Latin-1 separato da ';' o ','"""
+        try:
+            text = content.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            text = content.decode('latin1')
+        header = text.split('\n', 1)[0]
+        delimiter = ';' if header.count(';') >= header.count(',') else ','
+        return list(csv.DictReader(io.StringIO(text), delimiter=delimiter))
+    
+    @staticmethod
+    def download():
+        """
+        Scarica l'elenco dei comuni (con popolazione) o, in caso di errore,
+        l'elenco ISTAT senza dati demografici.
+        
+        Returns:
+            list: Record della fonte
+        """
+        try:
+            response = requests.get(MunicipalityImportService.SOURCE_URL, timeout=30)
+            response.raise_for_status()
+            return MunicipalityImportService.parse_json(response.content)
+        except Exception as e:
+            logger.warning(f"Municipality source unavailable ({e}), falling back to ISTAT")
+            response = requests.get(MunicipalityImportService.ISTAT_URL, timeout=30)
+            response.raise_for_status()
+            return MunicipalityImportService.parse_csv(response.content)
+    
+    @staticmethod
+    def normalize(record):
+        """
+        Riporta un record della fonte sui campi del modello.
+        
+        Args:
+            record: Dizionario con le colonne della fonte
+            
+        Returns:
+            dict: Valori dei campi (popolazione e coordinate None se la fonte
+                non le riporta), oppure None se manca il nome
+        """
+        values = {}
+        for field, aliases in MunicipalityImportService.FIELD_ALIASES.items():
+            value = next((record[alias] for alias in aliases if record.get(alias) not in (None, '')), None)
+            # Le fonti JSON annidano provincia e regione come {'codice': ..., 'nome': ...}
+            if isinstance(value, dict):
+                value = value.get('nome') or value.get('name')
+            values[field] = value.strip() if isinstance(value, str) else value
+        
+        if not values['name']:
+            return None
+        
+        code = values['istat_code']
+        values['istat_code'] = str(code).zfill(6) if code not in (None, '') else None
+        population = values['population']
+        try:
+            if isinstance(population, str):
+                # Separatore delle migliaia all'italiana
+                population = population.replace('.', '').replace(' ', '')
+            values['population'] = int(population) if population not in (None, '') else None
+        except (TypeError, ValueError):
+            values['population'] = None
+        for field in ('latitude', 'longitude'):
+            coordinate = values[field]
+            try:
+                if isinstance(coordinate, str):
+                    coordinate = coordinate.replace(',', '.')
+                values[field] = float(coordinate) if coordinate not in (None, '') else None
+            except (TypeError, ValueError):
+                values[field] = None
+        values['province'] = values['province'] or ''
+        values['region'] = values['region'] or ''
+        return values
+    
+    @staticmethod
+    def save_snapshot(records, path=None):
+        """
+        Salva i record normalizzati come snapshot JSON per gli ambienti senza rete.
+        
+        Args:
+            records: Record della fonte
+            path: Percorso dello snapshot (default snapshot_path())
+            
+        Returns:
+            str: Percorso scritto
+        """
+        path = path or MunicipalityImportService.snapshot_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        rows = [row for row in map(MunicipalityImportService.normalize, records) if row]
+        with open(path, 'w', encoding='utf-8') as handle:
+            json.dump(rows, handle, ensure_ascii=False)
+        return path
+    
+    @staticmethod
+    def import_records(records, replace=False, batch_size=None, progress=None):
+        """
+        Importa i comuni in blocco.
+        
+        Args:
+            records: Record della fonte
+            replace: Se True cancella tutti i comuni (e i dati collegati) prima
+                dell'importazione, altrimenti aggiorna quelli esistenti
+            batch_size: Righe per blocco (default BATCH_SIZE)
+            progress: Funzione chiamata a ogni blocco con (righe elaborate, totale)
+            
+        Returns:
+            dict: Conteggi 'inserted', 'updated', 'skipped' e 'total'
+        """
+        batch_size = batch_size or MunicipalityImportService.BATCH_SIZE
+        rows = [MunicipalityImportService.normalize(record) for record in records]
+        stats = {'inserted': 0, 'updated': 0, 'skipped': rows.count(None)}
+        
+        # Ultima riga per codice ISTAT (o nome e provincia) se la fonte ha duplicati
+        unique = {}
+        for row in filter(None, rows):
+            unique[row['istat_code'] or (row['name'].lower(), row['province'].lower())] = row
+        rows = list(unique.values())
+        
+        with transaction.atomic():
+            if replace:
+                Municipality.objects.all().delete()
+                by_code, by_name = {}, {}
+            else:
+                kept = MunicipalityImportService.KEPT_FIELDS
+                by_code = {
+                    code: (pk, dict(zip(kept, values)))
+                    for pk, code, *values in Municipality.objects.filter(istat_code__isnull=False)
+                    .values_list('pk', 'istat_code', *kept)
+                }
+                by_name = {
+                    (name.lower(), province.lower()): (pk, dict(zip(kept, values)))
+                    for pk, name, province, *values in Municipality.objects.filter(istat_code__isnull=True)
+                    .values_list('pk', 'name', 'province', *kept)
+                }
+            
+            for start in range(0, len(rows), batch_size):
+                upserted, created, renamed = [], [], []
+                for row in rows[start:start + batch_size]:
+                    key = (row['name'].lower(), row['province'].lower())
+                    match = by_code.get(row['istat_code']) or by_name.pop(key, None)
+                    if match:
+                        # Le fonti senza dati demografici o coordinate non cancellano quelli noti
+                        row = dict(row, **{
+                            field: value for field, value in match[1].items() if row[field] is None
+                        })
+                    if row['population'] is None:
+                        row = dict(row, population=0)
+                    
+                    if (row['istat_code'] and row['istat_code'] in by_code) or not match:
+                        target = upserted if row['istat_code'] else created
+                        target.append(Municipality(**row))
+                    else:
+                        # Comune già presente senza codice ISTAT: aggiornato per chiave primaria
+                        renamed.append(Municipality(pk=match[0], **row))
+                
+                # Un solo INSERT ... ON CONFLICT (istat_code) per i comuni con codice
+                Municipality.objects.bulk_create(
+                    upserted,
+                    batch_size=batch_size,
+                    update_conflicts=True,
+                    unique_fields=['istat_code'],
+                    update_fields=[field for field in MunicipalityImportService.UPDATE_FIELDS if field != 'istat_code'],
+                )
+                Municipality.objects.bulk_create(created, batch_size=batch_size)
+                Municipality.objects.bulk_update(renamed, MunicipalityImportService.UPDATE_FIELDS, batch_size=batch_size)
+                
+                existing = sum(1 for municipality in upserted if municipality.istat_code in by_code)
+                stats['updated'] += existing + len(renamed)
+                stats['inserted'] += len(upserted) - existing + len(created)
+                if progress:
+                    progress(min(start + batch_size, len(rows)), len(rows))
+        
+        # bulk_create e bulk_update non inviano segnali
+        MunicipalitySearchService.invalidate()
+        MunicipalityPortfolioService.invalidate()
+        
+        stats['total'] = stats['inserted'] + stats['updated']
+        
+        # Le altre app aggiornano i propri dati derivati (es. la copertura della mappa)
+        from .signals import municipalities_imported
+        municipalities_imported.send(sender=MunicipalityImportService, stats=stats)
+        return stats
+
+
+def fold_text(value):
+    """
+    Normalizza un testo per la ricerca: minuscolo, senza accenti e con
+    apostrofi, trattini e spazi multipli ridotti a un solo spazio.
+    
+    Args:
+        value: Testo da normalizzare
+        
+    Returns:
+        str: Testo normalizzato
+    """
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return re.sub(r"[\s'’`\-./]+", ' ', stripped.lower()).strip()
+
+
+class MunicipalityIndex:
+    """
+    Indice in memoria dei comuni per l'autocompletamento.
+    
+    Le chiavi (nome normalizzato, nome senza spazi, singole parole del nome,
+    provincia e codice ISTAT) sono in una lista ordinata: la ricerca per
+    prefisso è una bisezione. Se i risultati non bastano, i nomi vengono
+    confrontati con la query tollerando uno o due errori di battitura, con
+    una distanza di edit vettoriale su tutti i comuni.
+    """
+    
+    # Caratteri dei nomi considerati nella ricerca approssimata
+    FUZZY_WIDTH = 32
+    
+    def __init__(self, rows):
+        """
+        Args:
+            rows: Tuple (id, nome, provincia, codice ISTAT, popolazione, URL logo)
+        """
+        self.ids = [row[0] for row in rows]
+        self.rows = {row[0]: row for row in rows}
+        self.population = np.array([row[4] or 0 for row in rows], dtype=np.int64)
+        
+        names = [fold_text(row[1]) for row in rows]
+        keys = []
+        for position, (row, name) in enumerate(zip(rows, names)):
+            # Livello 0: inizio del nome; livello 1: parola, provincia o codice
+            keys.append((name, 0, position))
+            keys.append((name.replace(' ', ''), 0, position))
+            keys.extend((word, 1, position) for word in name.split(' ')[1:] if len(word) > 1)
+            keys.append((fold_text(row[2]), 1, position))
+            if row[3]:
+                keys.append((row[3], 1, position))
+        keys.sort()
+        self.keys = [key[0] for key in keys]
+        self.positions = np.array([key[2] for key in keys], dtype=np.int64)
+        # Punteggio di ordinamento di ogni chiave: livello, poi popolazione decrescente
+        self.scores = np.array([key[1] for key in keys], dtype=np.int64) << 40
+        self.scores -= self.population[self.positions] if keys else 0
+        
+        # Matrice (caratteri x comuni) dei nomi per la ricerca approssimata
+        encoded = np.zeros((self.FUZZY_WIDTH, len(names)), dtype=np.uint8)
+        for position, name in enumerate(names):
+            data = name.encode('ascii', 'replace')[:self.FUZZY_WIDTH]
+            encoded[:len(data), position] = np.frombuffer(data, dtype=np.uint8)
+        self.encoded = encoded
+    
+    @classmethod
+    def load(cls):
+        """
+        Costruisce l'indice con una sola query.
+        
+        Returns:
+            MunicipalityIndex: Indice dei comuni
+        """
+        storage = Municipality._meta.get_field('logo').storage
+        rows = [
+            (pk, name, province, istat_code, population, storage.url(logo) if logo else None)
+            for pk, name, province, istat_code, population, logo in Municipality.objects.order_by()
+            .values_list('id', 'name', 'province', 'istat_code', 'population', 'logo')
+        ]
+        return cls(rows)
+    
+    def _prefix_matches(self, query):
+        """Chiavi (posizioni, punteggi) che iniziano con la query"""
+        start = bisect.bisect_left(self.keys, query)
+        end = bisect.bisect_left(self.keys, query + '\uffff')
+        return self.positions[start:end], self.scores[start:end]
+    
+    def _fuzzy_matches(self, query, max_distance):
+        """Posizioni dei comuni il cui nome inizia con la query a meno di max_distance errori"""
+        target = np.frombuffer(query.encode('ascii', 'replace')[:self.FUZZY_WIDTH], dtype=np.uint8)
+        width = min(self.FUZZY_WIDTH, target.size + max_distance)
+        names = self.encoded[:width]
+        
+        # Distanza di edit tra la query e ogni prefisso del nome (una colonna per comune)
+        previous = np.repeat(np.arange(width + 1, dtype=np.int16)[:, None], names.shape[1], axis=1)
+        for index, char in enumerate(target, start=1):
+            current = np.empty_like(previous)
+            current[0] = index
+            np.minimum(previous[1:] + 1, previous[:-1] + (names != char), out=current[1:])
+            for column in range(1, width + 1):
+                np.minimum(current[column], current[column - 1] + 1, out=current[column])
+            previous = current
+        return np.flatnonzero(previous.min(axis=0) <= max_distance)
+    
+    def search(self, query, limit=10):
+        """
+        Cerca i comuni per prefisso (anche di una parola, della provincia o
+        del codice ISTAT), senza accenti e con tolleranza agli errori.
+        
+        Args:
+            query: Testo digitato
+            limit: Numero massimo di risultati
+            
+        Returns:
+            list: Tuple dei comuni, prima per livello di corrispondenza poi
+                per popolazione decrescente
+        """
+        folded = fold_text(query)
+        if not folded:
+            return []
+        
+        positions, scores = self._prefix_matches(folded)
+        if ' ' in folded:
+            compact_positions, compact_scores = self._prefix_matches(folded.replace(' ', ''))
+            positions = np.concatenate([positions, compact_positions])
+            scores = np.concatenate([scores, compact_scores])
+        
+        if np.unique(positions).size < limit and len(folded) >= 3:
+            fuzzy = self._fuzzy_matches(folded, 1 if len(folded) < 6 else 2)
+            positions = np.concatenate([positions, fuzzy])
+            scores = np.concatenate([scores, (2 << 40) - self.population[fuzzy]])
+        
+        # Miglior punteggio per comune, poi i primi per punteggio
+        order = np.argsort(scores, kind='stable')
+        unique_positions, first = np.unique(positions[order], return_index=True)
+        best = unique_positions[np.argsort(first)][:limit]
+        return [self.rows[self.ids[position]] for position in best]
+    
+    def get(self, pk):
+        """Tupla del comune con questo id, oppure None"""
+        return self.rows.get(pk)
+
+
+class MunicipalitySearchService:
+    """
+    Autocompletamento dei comuni servito da un indice in memoria per processo.
+    
+    Come per TariffPricingService, la versione dei comuni nel database viene
+    cambiata al salvataggio o all'importazione dei comuni e l'indice viene
+    ricostruito al primo uso successivo.
+    """
+    
+    _index = InMemoryData('infrastructure:municipality_index', MunicipalityIndex.load)
+    
+    @staticmethod
+    def invalidate():
+        """Segnala a tutti i processi che l'elenco dei comuni è cambiato"""
+        MunicipalitySearchService._index.invalidate()
+    
+    @staticmethod
+    def get_index():
+        """
+        Restituisce l'indice dei comuni, ricostruendolo se non più valido.
+        
+        Returns:
+            MunicipalityIndex: Indice corrente
+        """
+        return MunicipalitySearchService._index.get()
+    
+    @staticmethod
+    def _as_result(row):
+        pk, name, province, _code, population, logo_url = row
+        return {'id': pk, 'text': f"{name} ({province})", 'population': population, 'logo_url': logo_url}
+    
+    @staticmethod
+    def search(query, limit=10):
+        """
+        Risultati dell'autocompletamento per il testo digitato.
+        
+        Args:
+            query: Testo digitato
+            limit: Numero massimo di risultati
+            
+        Returns:
+            list: Dizionari con 'id', 'text', 'population' e 'logo_url'
+        """
+        index = MunicipalitySearchService.get_index()
+        return [MunicipalitySearchService._as_result(row) for row in index.search(query, limit)]
+    
+    @staticmethod
+    def get(pk):
+        """
+        Risultato dell'autocompletamento per un singolo comune.
+        
+        Args:
+            pk: Id del comune
+            
+        Returns:
+            dict: Come per search, oppure None se il comune non esiste
+        """
+        row = MunicipalitySearchService.get_index().get(pk)
+        return MunicipalitySearchService._as_result(row) if row else None
+
+
+class DashboardMetricsService:
+    """
+    Metriche della dashboard principale, calcolate con poche query aggregate.
+    
+    Lo snapshot viene salvato nella cache DASHBOARD_CACHE, di norma su file e
+    condivisa tra i processi, e invalidato dai segnali di progetti,
+    sottoprogetti e colonnine; il comando refresh_dashboard lo ricalcola
+    periodicamente in modo che la pagina non attenda le query.
+    """
+    
+    CACHE_KEY = 'infrastructure:dashboard_snapshot'
+    
+    # Durata massima dello snapshot anche senza invalidazioni (secondi)
+    CACHE_TIMEOUT = 15 * 60
+    
+    # Chiavi del contesto -> stati di Project
+    PROJECT_STATUSES = {
+        'planning_projects': 'planning',
+        'in_progress_projects': 'in_progress',
+        'completed_projects': 'completed',
+        'paused_projects': 'suspended',
+        'cancelled_projects': 'closed',
+    }
+    
+    # Chiavi del contesto -> stati di Charger
+    CHARGER_STATUSES = {
+        'planned_stations': 'planned',
+        'installing_stations': 'installing',
+        'active_stations': 'operational',
+        'maintenance_stations': 'maintenance',
+        'inactive_stations': 'offline',
+    }
+    
+    # Limiti superiori (kW) delle classi AC 7, AC 22, DC 50 e DC 150; oltre è DC 350
+    POWER_CLASSES = (7, 22, 50, 150)
+    
+    RECENT_PROJECTS = 5
+    
+    @staticmethod
+    def get_cache():
+        """Restituisce la cache configurata per lo snapshot della dashboard"""
+        return caches[getattr(settings, 'DASHBOARD_CACHE', 'default')]
+    
+    @staticmethod
+    def invalidate():
+        """Scarta lo snapshot: verrà ricalcolato alla prossima richiesta"""
+        DashboardMetricsService.get_cache().delete(DashboardMetricsService.CACHE_KEY)
+    
+    @staticmethod
+    def get_snapshot():
+        """
+        Restituisce lo snapshot delle metriche, calcolandolo se non è in cache.
+        
+        Returns:
+            dict: Metriche della dashboard (vedi compute)
+        """
+        snapshot = DashboardMetricsService.get_cache().get(DashboardMetricsService.CACHE_KEY)
+        if snapshot is None:
+            snapshot = DashboardMetricsService.refresh()
+        return snapshot
+    
+    @staticmethod
+    def refresh():
+        """
+        Ricalcola lo snapshot e lo salva in cache.
+        
+        Returns:
+            dict: Metriche della dashboard
+        """
+        snapshot = DashboardMetricsService.compute()
+        DashboardMetricsService.get_cache().set(
+            DashboardMetricsService.CACHE_KEY, snapshot, DashboardMetricsService.CACHE_TIMEOUT)
+        return snapshot
+    
+    @staticmethod
+    def compute():
+        """
+        Calcola contatori, potenze, marker della mappa e progetti recenti.
+        
+        Returns:
+            dict: Valori serializzabili pronti per il contesto del template
+        """
+        from cpo_core.models import Project, SubProject
+        from cpo_core.models.subproject import Charger
+        from django.db.models import Count, Q, Sum
+        
+        project_counts = Project.objects.aggregate(
+            total_projects=Count('id'),
+            **{key: Count('id', filter=Q(status=status))
+               for key, status in DashboardMetricsService.PROJECT_STATUSES.items()},
+        )
+        
+        limits = (0,) + DashboardMetricsService.POWER_CLASSES
+        power_filters = [Q(power_kw__gt=lower, power_kw__lte=upper) for lower, upper in zip(limits, limits[1:])]
+        power_filters.append(Q(power_kw__gt=limits[-1]))
+        charger_counts = Charger.objects.aggregate(
+            chargers=Count('id'),
+            power=Sum('power_kw'),
+            **{key: Count('id', filter=Q(status=status))
+               for key, status in DashboardMetricsService.CHARGER_STATUSES.items()},
+            **{f'power_class_{index}': Count('id', filter=condition)
+               for index, condition in enumerate(power_filters)},
+        )
+        subproject_counts = SubProject.objects.aggregate(
+            subprojects=Count('id'),
+            power=Sum('power_kw'),
+            municipalities=Count('municipality', distinct=True),
+        )
+        
+        # Se non ci sono colonnine, usa la potenza dei sottoprogetti
+        total_power = float(charger_counts['power'] or 0) or float(subproject_counts['power'] or 0)
+        station_counts = {key: charger_counts[key] for key in DashboardMetricsService.CHARGER_STATUSES}
+        if not any(station_counts.values()):
+            # Valori di esempio per i grafici quando non ci sono colonnine
+            station_counts.update(planned_stations=1, active_stations=2)
+        power_distribution = [charger_counts[f'power_class_{index}'] for index in range(len(power_filters))]
+        if not any(power_distribution):
+            power_distribution = [1, 1, 1, 0, 0]
+        
+        return {
+            **project_counts,
+            **station_counts,
+            'total_stations': max(subproject_counts['subprojects'], charger_counts['chargers']),
+            'total_municipalities': subproject_counts['municipalities'],
+            'total_power': int(total_power),
+            'power_distribution': power_distribution,
+            'stations_with_coords': DashboardMetricsService._map_stations(),
+            'recent_projects': DashboardMetricsService._recent_projects(),
+        }
+    
+    @staticmethod
+    def _map_stations():
+        """Marker dei sottoprogetti con coordinate (approvate o, in mancanza, proposte)"""
+        from cpo_core.models import SubProject
+        from django.db.models.functions import Coalesce
+        
+        rows = SubProject.objects.annotate(
+            lat=Coalesce('latitude_approved', 'latitude_proposed'),
+            lng=Coalesce('longitude_approved', 'longitude_proposed'),
+        ).filter(lat__isnull=False, lng__isnull=False).values_list(
+            'id', 'name', 'project__name', 'municipality__name', 'lat', 'lng', 'power_kw', 'address'
+        ).order_by('id')
+        
+        stations = [{
+            'id': pk,
+            'code': name,
+            'name': name,
+            'project': {'name': project or (f'Progetto {municipality}' if municipality else 'Progetto sconosciuto')},
+            'latitude': float(lat),
+            'longitude': float(lng),
+            'power_kw': float(power_kw or 50),
+            'location': address or (f'Indirizzo in {municipality}' if municipality else 'Indirizzo non disponibile'),
+            'status': 'active',
+        } for pk, name, project, municipality, lat, lng, power_kw, address in rows]
+        
+        if not stations:
+            # Punto di esempio (centrato in Italia) per non lasciare vuota la mappa
+            sample = Municipality.objects.values_list('name', flat=True).first()
+            if sample:
+                stations.append({
+                    'id': 1,
+                    'code': f'{sample[:3].upper()}-001',
+                    'name': f'Stazione {sample}',
+                    'project': {'name': f'Progetto {sample}'},
+                    'latitude': 45.0,
+                    'longitude': 12.0,
+                    'power_kw': 50,
+                    'location': f'Centro di {sample}',
+                    'status': 'active',
+                })
+        return stations
+    
+    @staticmethod
+    def _recent_projects():
+        """Ultimi progetti, con i soli campi mostrati nella tabella della dashboard"""
+        from cpo_core.models import Project
+        
+        labels = dict(Project.STATUS_CHOICES)
+        rows = Project.objects.order_by('-id').values_list(
+            'id', 'name', 'status', 'region', 'municipality__name'
+        )[:DashboardMetricsService.RECENT_PROJECTS]
+        return [{
+            'id': pk,
+            'name': name,
+            'region': region,
+            'municipality': {'name': municipality} if municipality else None,
+            'get_status_display': str(labels.get(status, status)),
+            'get_status_color': 'primary',
+            'completion_percentage': 50,
+        } for pk, name, status, region, municipality in rows]
+
+
+class MunicipalityPortfolioService:
+    """
+    Aggregati dei comuni coinvolti nei sottoprogetti.
+    
+    I valori per comune sono calcolati con sottoquery correlate nella stessa
+    query della pagina; il riepilogo per regione (e i totali) è tenuto in
+    memoria da ogni processo e la sua versione nel database viene cambiata
+    dai segnali di comuni, sottoprogetti e colonnine (vedi InMemoryData).
+    """
+    
+    _summary = InMemoryData('infrastructure:municipality_portfolio_summary',
+                            lambda: MunicipalityPortfolioService.compute_summary())
+    
+    TOP_MUNICIPALITIES = 5
+    
+    @staticmethod
+    def invalidate():
+        """Segnala a tutti i processi che il riepilogo per regione è cambiato"""
+        MunicipalityPortfolioService._summary.invalidate()
+    
+    @staticmethod
+    def annotate(queryset):
+        """
+        Aggiunge ai comuni i totali dei loro sottoprogetti e colonnine.
+        
+        Args:
+            queryset: QuerySet di Municipality
+            
+        Returns:
+            QuerySet: Con subproject_count, charger_count, station_count,
+                total_power e total_budget
+        """
+        from cpo_core.models import SubProject
+        from cpo_core.models.subproject import Charger
+        from django.db.models import Case, Count, F, OuterRef, Subquery, Sum, When
+        from django.db.models.functions import Coalesce
+        
+        def aggregate(model, field, value, output_field):
+            rows = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(value=value)
+            return Coalesce(Subquery(rows.values('value')), 0, output_field=output_field)
+        
+        amount = models.DecimalField(max_digits=14, decimal_places=2)
+        return queryset.annotate(
+            subproject_count=aggregate(SubProject, 'municipality', Count('id'), models.IntegerField()),
+            charger_count=aggregate(Charger, 'subproject__municipality', Count('id'), models.IntegerField()),
+            total_power=aggregate(SubProject, 'municipality', Sum('power_kw'), amount),
+            total_budget=aggregate(SubProject, 'municipality', Sum('budget'), amount),
+        ).annotate(
+            # Le colonnine, se presenti, altrimenti i sottoprogetti
+            station_count=Case(When(charger_count__gt=0, then=F('charger_count')), default=F('subproject_count')),
+        )
+    
+    @staticmethod
+    def municipalities():
+        """
+        Comuni con almeno un sottoprogetto, con gli aggregati di annotate.
+        
+        Returns:
+            QuerySet: Comuni ordinati per nome e provincia
+        """
+        from cpo_core.models import SubProject
+        
+        queryset = Municipality.objects.filter(
+            id__in=SubProject.objects.order_by().values('municipality_id')
+        )
+        return MunicipalityPortfolioService.annotate(queryset).order_by('name', 'province')
+    
+    @staticmethod
+    def get_summary():
+        """
+        Riepilogo per regione e totali del portafoglio, calcolato una volta per versione.
+        
+        Returns:
+            dict: 'regions' (lista per regione con municipalities, population,
+                subprojects, chargers, power e budget), 'top_municipalities',
+                'total_population', 'total_projects', 'total_subprojects' e
+                'total_chargers'
+        """
+        return MunicipalityPortfolioService._summary.get()
+    
+    @staticmethod
+    def compute_summary():
+        """Calcola il riepilogo restituito da get_summary"""
+        from cpo_core.models import SubProject
+        from cpo_core.models.subproject import Charger
+        from django.db.models import Count, Sum
+        from projects.models import Project
+        
+        regions = {}
+        
+        def region(name):
+            return regions.setdefault(name or '', {
+                'name': name or '', 'municipalities': 0, 'population': 0,
+                'subprojects': 0, 'chargers': 0, 'power': 0.0, 'budget': 0.0,
+            })
+        
+        municipalities = Municipality.objects.filter(
+            id__in=SubProject.objects.order_by().values('municipality_id')
+        ).order_by().values('region').annotate(count=Count('id'), population=Sum('population'))
+        for row in municipalities:
+            entry = region(row['region'])
+            entry['municipalities'] = row['count']
+            entry['population'] = row['population'] or 0
+        
+        subprojects = SubProject.objects.order_by().values('municipality__region').annotate(
+            count=Count('id'), power=Sum('power_kw'), budget=Sum('budget'))
+        for row in subprojects:
+            entry = region(row['municipality__region'])
+            entry['subprojects'] = row['count']
+            entry['power'] = float(row['power'] or 0)
+            entry['budget'] = float(row['budget'] or 0)
+        
+        chargers = Charger.objects.filter(subproject__isnull=False).order_by().values(
+            'subproject__municipality__region').annotate(count=Count('id'))
+        for row in chargers:
+            region(row['subproject__municipality__region'])['chargers'] = row['count']
+        
+        # Comuni con più colonnine (o sottoprogetti, se non ci sono colonnine)
+        top = MunicipalityPortfolioService.municipalities().order_by('-station_count', 'name').values_list(
+            'name', 'station_count')[:MunicipalityPortfolioService.TOP_MUNICIPALITIES]
+        
+        return {
+            'regions': sorted(regions.values(), key=lambda entry: -entry['municipalities']),
+            'top_municipalities': [{'name': name, 'total_stations': stations} for name, stations in top],
+            'total_population': sum(entry['population'] for entry in regions.values()),
+            'total_projects': Project.objects.count(),
+            'total_subprojects': sum(entry['subprojects'] for entry in regions.values()),
+            'total_chargers': sum(entry['chargers'] for entry in regions.values()),
+        }
@@ -0,0 +1,32 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal, receiver
+
+from .models import Municipality
+from .services import DashboardMetricsService, MunicipalityPortfolioService, MunicipalitySearchService
+
+# Inviato da MunicipalityImportService dopo un'importazione in blocco dei comuni
+# (bulk_create e bulk_update non inviano post_save), con l'argomento stats
+municipalities_imported = Signal()
+
+
+@receiver([post_save, post_delete], sender=Municipality)
+def invalidate_municipality_index(sender, instance, **kwargs):
+    """Quando cambia un comune, l'indice dell'autocompletamento va ricostruito"""
+    MunicipalitySearchService.invalidate()
+
+
+@receiver([post_save, post_delete], sender='cpo_core.Project')
+@receiver([post_save, post_delete], sender='cpo_core.SubProject')
+@receiver([post_save, post_delete], sender='cpo_core.Charger')
+def invalidate_dashboard_snapshot(sender, instance, **kwargs):
+    """Progetti, sottoprogetti e colonnine cambiano i contatori della dashboard"""
+    DashboardMetricsService.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Municipality)
+@receiver([post_save, post_delete], sender='projects.Project')
+@receiver([post_save, post_delete], sender='cpo_core.SubProject')
+@receiver([post_save, post_delete], sender='cpo_core.Charger')
+def invalidate_portfolio_summary(sender, instance, **kwargs):
+    """Il riepilogo per regione dei comuni dipende da comuni, progetti, sottoprogetti e colonnine"""
+    MunicipalityPortfolioService.invalidate()
@@ -0,0 +1,90 @@
+import io
+import shutil
+import tempfile
+from datetime import date
+from decimal import Decimal
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from cpo_core.models import Project, SubProject
+from cpo_core.models.subproject import Charger
+from infrastructure.models import Municipality
+from infrastructure.services import DashboardMetricsService
+from projects.models import Project as PlanningProject
+
+
+@override_settings(MAP_TILE_CACHE='default', DASHBOARD_CACHE='default')
+class DashboardMetricsTest(TestCase):
+    """Test per lo snapshot delle metriche della dashboard"""
+
+    def setUp(self):
+        DashboardMetricsService.invalidate()
+        self.municipality = Municipality.objects.create(name="Comune Test", province="TV", population=10000)
+        self.project = Project.objects.create(name="Progetto Test", status='in_progress', municipality=self.municipality)
+        Project.objects.create(name="Progetto Sospeso", status='suspended')
+        planning_project = PlanningProject.objects.create(
+            name="Progetto Test", start_date=date(2024, 1, 1), expected_completion_date=date(2025, 1, 1))
+        self.subproject = SubProject.objects.create(
+            name="Stazione Centro", project=planning_project, municipality=self.municipality,
+            start_date=date(2024, 1, 1), planned_completion_date=date(2024, 6, 1),
+            latitude_proposed=Decimal('45.1'), longitude_proposed=Decimal('12.2'))
+        for code, power, status in (('C1', 22, 'operational'), ('C2', 150, 'operational'), ('C3', 7, 'planned')):
+            Charger.objects.create(subproject=self.subproject, code=code, power_kw=power, status=status)
+
+    def test_snapshot_counts_with_few_queries(self):
+        """Verifica i contatori aggregati e il numero di query"""
+        with CaptureQueriesContext(connection) as queries:
+            snapshot = DashboardMetricsService.get_snapshot()
+        self.assertLessEqual(len(queries), 5)
+
+        self.assertEqual(snapshot['total_projects'], 2)
+        self.assertEqual(snapshot['in_progress_projects'], 1)
+        self.assertEqual(snapshot['paused_projects'], 1)
+        self.assertEqual(snapshot['active_stations'], 2)
+        self.assertEqual(snapshot['planned_stations'], 1)
+        self.assertEqual(snapshot['total_stations'], 3)
+        self.assertEqual(snapshot['total_municipalities'], 1)
+        self.assertEqual(snapshot['total_power'], 179)
+        self.assertEqual(snapshot['power_distribution'], [1, 1, 0, 1, 0])
+        self.assertEqual([(s['latitude'], s['project']['name']) for s in snapshot['stations_with_coords']],
+                         [(45.1, 'Progetto Test')])
+        self.assertEqual(snapshot['recent_projects'][1]['municipality'], {'name': 'Comune Test'})
+
+    def test_cached_until_models_change(self):
+        """Verifica che la cache eviti le query e venga invalidata dai segnali"""
+        DashboardMetricsService.get_snapshot()
+        with self.assertNumQueries(0):
+            DashboardMetricsService.get_snapshot()
+
+        Charger.objects.create(subproject=self.subproject, code='C4', power_kw=50, status='maintenance')
+        snapshot = DashboardMetricsService.get_snapshot()
+        self.assertEqual(snapshot['maintenance_stations'], 1)
+        self.assertEqual(snapshot['total_power'], 229)
+
+        self.project.delete()
+        self.subproject.delete()
+        snapshot = DashboardMetricsService.get_snapshot()
+        self.assertEqual(snapshot['total_projects'], 1)
+        self.assertEqual(snapshot['total_stations'], 0)
+        self.assertEqual(snapshot['stations_with_coords'][0]['code'], 'COM-001')
+
+    def test_snapshot_shared_between_processes(self):
+        """Verifica che refresh_dashboard e le invalidazioni valgano per gli altri processi"""
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        with override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'dashboard': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        }, DASHBOARD_CACHE='dashboard'):
+            # Un'altra istanza sulla stessa cartella, come in un altro processo web
+            other_process = FileBasedCache(location, {})
+
+            call_command('refresh_dashboard', stdout=io.StringIO())
+            self.assertEqual(other_process.get(DashboardMetricsService.CACHE_KEY)['total_stations'], 3)
+
+            Charger.objects.create(subproject=self.subproject, code='C4', power_kw=50, status='maintenance')
+            self.assertIsNone(other_process.get(DashboardMetricsService.CACHE_KEY))
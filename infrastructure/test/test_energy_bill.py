@@ -0,0 +1,73 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.test import TestCase
+
+from infrastructure.models import ElectricityTariff, EnergyPriceProjection, PunData, StationUsageProfile
+from infrastructure.services import EnergyBillService, TariffPricingService
+
+
+class EnergyBillTest(TestCase):
+    """Test per la simulazione oraria della bolletta energetica"""
+
+    def setUp(self):
+        TariffPricingService.invalidate()
+        self.profile = StationUsageProfile.objects.create(
+            name='Misto', avg_daily_sessions=Decimal('4.00'), avg_energy_per_session=Decimal('20.00'))
+
+    def test_fixed_tariff_bill(self):
+        """Verifica energia annua, limite di potenza e costi fissi con tariffa a prezzo fisso"""
+        tariff = ElectricityTariff.objects.create(
+            name='Fisso', provider='Test', valid_from=date(2024, 1, 1),
+            connection_fee=Decimal('50.00'), power_fee=Decimal('1.50'))
+        result = EnergyBillService.simulate([3, 22, 100], tariff, self.profile, year=2024)
+
+        # 80 kWh al giorno per 366 giorni; a 3 kW si arriva all'85% della capacità
+        np.testing.assert_allclose(result['annual_kwh'], [3 * 8784 * 0.85, 80 * 366, 80 * 366])
+        np.testing.assert_allclose(result['monthly_kwh'].sum(axis=1), result['annual_kwh'])
+        np.testing.assert_allclose(result['average_price'], [0.25, 0.30, 0.40])
+        np.testing.assert_allclose(result['monthly_fixed_cost'][:, 0], [54.5, 83.0, 200.0])
+        np.testing.assert_allclose(
+            result['annual_total'], result['annual_kwh'] * [0.25, 0.30, 0.40] + 12 * np.array([54.5, 83.0, 200.0]))
+        self.assertAlmostEqual(result['timeband_shares'].sum(), 1.0)
+
+    def test_pun_tariff_bill_matches_hourly_loop(self):
+        """Verifica la bolletta PUN contro un calcolo ora per ora"""
+        tariff = ElectricityTariff.objects.create(
+            name='PUN', provider='Test', tariff_type='pun', valid_from=date(2024, 1, 1),
+            pun_fee_f1=Decimal('0.0300'), pun_fee_f2=Decimal('0.0200'), pun_fee_f3=Decimal('0.0100'))
+        for month in range(1, 13):
+            EnergyPriceProjection.objects.create(
+                year=2025, month=month, f1_price=Decimal('0.2000') + month / Decimal(100),
+                f2_price=Decimal('0.1500'), f3_price=Decimal('0.1000'), avg_price=Decimal('0.1500'),
+                inflation_rate=Decimal('2.00'), base_period_start=date(2024, 1, 1), base_period_end=date(2024, 12, 31))
+
+        result = EnergyBillService.simulate([22, 50], tariff, self.profile, year=2025)
+
+        shape = EnergyBillService.load_shape(self.profile, EnergyBillService.year_hours(2025))
+        fees = {'F1': 0.03, 'F2': 0.02, 'F3': 0.01}
+        prices = {'F2': 0.15, 'F3': 0.10}
+        expected = 0
+        start = datetime(2025, 1, 1)
+        for offset, share in enumerate(shape):
+            moment = start + timedelta(hours=offset)
+            band = PunData.get_timeband(moment.date(), moment.hour)
+            price = 0.2 + moment.month / 100 if band == 'F1' else prices[band]
+            expected += share * (price + fees[band])
+
+        np.testing.assert_allclose(result['average_price'], [expected, expected])
+        np.testing.assert_allclose(result['annual_energy_cost'], result['annual_kwh'] * expected)
+        self.assertEqual(result['monthly_energy_cost'].shape, (2, 12))
+
+    def test_load_shape_covers_the_whole_day(self):
+        """Verifica che la curva di carico copra anche le ore notturne (F3)"""
+        hours = np.arange(np.datetime64('2025-03-04T00', 'h'), np.datetime64('2025-03-05T00', 'h'))
+        shape = EnergyBillService.load_shape(self.profile, hours)
+        self.assertTrue((shape > 0).all())
+        # Martedì feriale: notte, mattina, pomeriggio e sera al 10, 30, 50 e 20%
+        np.testing.assert_allclose(shape.reshape(4, 6).sum(axis=1), np.array([10, 30, 50, 20]) / 110)
+
+        self.profile.weekday_night_usage = 0
+        shape = EnergyBillService.load_shape(self.profile, hours)
+        self.assertEqual(shape[:6].sum(), 0)
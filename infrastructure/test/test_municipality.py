@@ -1,9 +1,24 @@
-from django.test import TestCase, Client
+import json
+import os
+import shutil
+import tempfile
+from datetime import date
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.models import User
-from infrastructure.models import Municipality
+from infrastructure.models import DataVersion, Municipality
+from infrastructure.services import MunicipalityImportService, MunicipalityPortfolioService, MunicipalitySearchService
 from cpo_core.forms import MunicipalityForm
+from cpo_core.models import SubProject
+from cpo_core.models.subproject import Charger
+from projects.models import Project
 
+@override_settings(MAP_TILE_CACHE='default')
 class MunicipalityModelTest(TestCase):
     """Test per il modello Municipality"""
     
@@ -63,6 +78,7 @@ class MunicipalityFormTest(TestCase):
         self.assertIn('name', form.errors)
         self.assertIn('population', form.errors)
 
+@override_settings(MAP_TILE_CACHE='default')
 class MunicipalityViewTest(TestCase):
     """Test per le view di Municipality"""
     
@@ -164,4 +180,213 @@ class MunicipalityViewTest(TestCase):
         # Verifica che la richiesta sia stata completata con successo
         self.assertEqual(response.status_code, 200)
         # Verifica che il comune sia stato eliminato
-        self.assertFalse(Municipality.objects.filter(id=municipality_to_delete.id).exists())
\ No newline at end of file
+        self.assertFalse(Municipality.objects.filter(id=municipality_to_delete.id).exists())
+
+
+@override_settings(MAP_TILE_CACHE='default')
+class MunicipalityImportTest(TestCase):
+    """Test per l'importazione in blocco dei comuni"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, name, content, encoding='utf-8'):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w', encoding=encoding) as handle:
+            handle.write(content)
+        return path
+
+    def test_json_import_then_upsert_by_istat_code(self):
+        """Verifica l'importazione da JSON e l'aggiornamento senza duplicati"""
+        comuni = [
+            {'nome': 'Agliè', 'codice': '001001', 'provincia': {'codice': '001', 'nome': 'Torino'},
+             'regione': {'codice': '01', 'nome': 'Piemonte'}, 'popolazione': 2621},
+            {'nome': 'Airasca', 'codice': '001002', 'provincia': {'codice': '001', 'nome': 'Torino'},
+             'regione': {'codice': '01', 'nome': 'Piemonte'}, 'popolazione': 3630},
+        ]
+        path = self._write('comuni.json', json.dumps(comuni))
+        stats = MunicipalityImportService.import_records(MunicipalityImportService.read_source(path))
+        self.assertEqual(stats, {'inserted': 2, 'updated': 0, 'skipped': 0, 'total': 2})
+        aglie = Municipality.objects.get(istat_code='001001')
+        self.assertEqual((aglie.name, aglie.province, aglie.region, aglie.population),
+                         ('Agliè', 'Torino', 'Piemonte', 2621))
+
+        comuni[0]['popolazione'] = 2700
+        comuni.append({'nome': 'Ala di Stura', 'codice': '001003', 'provincia': {'nome': 'Torino'},
+                       'regione': {'nome': 'Piemonte'}, 'popolazione': 462})
+        path = self._write('comuni.json', json.dumps(comuni))
+        call_command('import_municipalities', from_file=path, force=True, stdout=open(os.devnull, 'w'))
+        self.assertEqual(Municipality.objects.count(), 3)
+        aglie.refresh_from_db()
+        self.assertEqual(aglie.population, 2700)
+
+    def test_istat_csv_matches_existing_municipalities_by_name(self):
+        """Verifica la lettura del CSV ISTAT (Latin-1) e l'assegnazione del codice ai comuni esistenti"""
+        existing = Municipality.objects.create(name='Agliè', province='Torino', population=10)
+        path = self._write('Elenco-comuni-italiani.csv', (
+            'Codice Comune formato alfanumerico;Denominazione in italiano;'
+            '"Denominazione dell\'Unità territoriale sovracomunale \n(valida a fini statistici)";Denominazione Regione\n'
+            '001001;Agliè;Torino;Piemonte\n'
+            '1002;Airasca;Torino;Piemonte\n'
+            ';;Torino;Piemonte\n'
+        ), encoding='latin1')
+        stats = MunicipalityImportService.import_records(MunicipalityImportService.read_source(path), batch_size=1)
+        self.assertEqual(stats, {'inserted': 1, 'updated': 1, 'skipped': 1, 'total': 2})
+        existing.refresh_from_db()
+        self.assertEqual((existing.istat_code, existing.region, existing.population), ('001001', 'Piemonte', 10))
+        self.assertTrue(Municipality.objects.filter(istat_code='001002', name='Airasca').exists())
+
+    def test_coordinates_imported_and_kept(self):
+        """Verifica l'importazione delle coordinate e che le fonti senza coordinate non le cancellino"""
+        path = self._write('comuni.csv', 'codice;nome;provincia;lat;lng\n001001;Agliè;Torino;45,3634;7,7683\n')
+        MunicipalityImportService.import_records(MunicipalityImportService.read_source(path))
+        aglie = Municipality.objects.get(istat_code='001001')
+        self.assertEqual((aglie.latitude, aglie.longitude), (45.3634, 7.7683))
+
+        path = self._write('comuni.csv', 'codice;nome;provincia;popolazione\n001001;Agliè;Torino;2621\n')
+        MunicipalityImportService.import_records(MunicipalityImportService.read_source(path))
+        aglie.refresh_from_db()
+        self.assertEqual((aglie.latitude, aglie.longitude, aglie.population), (45.3634, 7.7683, 2621))
+
+
+
+@override_settings(MAP_TILE_CACHE='default')
+class MunicipalityAutocompleteTest(TestCase):
+    """Test per l'autocompletamento dei comuni da indice in memoria"""
+
+    def setUp(self):
+        for name, province, code, population in (
+            ('Agliè', 'Torino', '001001', 2621),
+            ('Ala di Stura', 'Torino', '001003', 462),
+            ('Torino', 'Torino', '001272', 848885),
+            ('Torre Pellice', 'Torino', '001275', 4530),
+            ("Sant'Agata di Militello", 'Messina', '083084', 12600),
+        ):
+            Municipality.objects.create(name=name, province=province, istat_code=code, population=population)
+        self.user = User.objects.create_user(username='autocomplete', password='password')
+        self.client = Client()
+        self.url = reverse('infrastructure:municipality-autocomplete')
+
+    def _names(self, query):
+        return [result['text'] for result in MunicipalitySearchService.search(query)]
+
+    def test_search_is_accent_insensitive_ranked_and_fuzzy(self):
+        """Verifica accenti, parole interne, ordinamento per popolazione ed errori di battitura"""
+        self.assertEqual(self._names('AGLIE'), ['Agliè (Torino)'])
+        self.assertEqual(self._names('stura'), ['Ala di Stura (Torino)'])
+        self.assertEqual(self._names('sant ag'), ["Sant'Agata di Militello (Messina)"])
+        self.assertEqual(self._names('santag'), ["Sant'Agata di Militello (Messina)"])
+        self.assertEqual(self._names('001272'), ['Torino (Torino)'])
+        # Prima i nomi che iniziano con la query, per popolazione; poi le province
+        self.assertEqual(self._names('tor')[:2], ['Torino (Torino)', 'Torre Pellice (Torino)'])
+        self.assertEqual(self._names('tornio')[0], 'Torino (Torino)')
+
+    def test_view_uses_index_and_follows_changes(self):
+        """Verifica che la vista non interroghi il database e che l'indice segua le modifiche"""
+        self.client.login(username='autocomplete', password='password')
+        MunicipalitySearchService.get_index()
+        with self.assertNumQueries(0):
+            MunicipalitySearchService.search('ala')
+        response = self.client.get(self.url, {'q': 'ala'})
+        self.assertEqual(response.json()['results'][0]['text'], 'Ala di Stura (Torino)')
+
+        ala = Municipality.objects.get(istat_code='001003')
+        ala.name = 'Ala di Stura Nuova'
+        ala.save()
+        response = self.client.get(self.url, {'id': ala.pk})
+        self.assertEqual(response.json()['results'][0]['text'], 'Ala di Stura Nuova (Torino)')
+
+    def test_index_follows_version_changed_by_other_processes(self):
+        """Verifica che l'indice segua la versione nel database e non la cache del processo"""
+        MunicipalitySearchService.get_index()
+        # Modifica senza segnali e nuova versione, come da un comando in un altro processo
+        Municipality.objects.filter(istat_code='001003').update(name='Ala Rinominata')
+        DataVersion.bump('infrastructure:municipality_index')
+        cache.clear()
+        
+        with self.settings(MEMORY_DATA_CHECK_SECONDS=3600):
+            self.assertEqual(self._names('ala')[0], 'Ala di Stura (Torino)')
+        with self.settings(MEMORY_DATA_CHECK_SECONDS=0):
+            self.assertEqual(self._names('ala')[0], 'Ala Rinominata (Torino)')
+            with self.assertNumQueries(1):
+                MunicipalitySearchService.get_index()
+
+
+@override_settings(MAP_TILE_CACHE='default')
+class MunicipalityListAggregatesTest(TestCase):
+    """Test per gli aggregati della lista dei comuni"""
+
+    def setUp(self):
+        MunicipalityPortfolioService.invalidate()
+        self.user = User.objects.create_user(username='portfolio', password='password')
+        self.client = Client()
+        self.client.login(username='portfolio', password='password')
+        self.url = reverse('infrastructure:municipality-list')
+        self.project = Project.objects.create(
+            name='Progetto', start_date=date(2024, 1, 1), expected_completion_date=date(2025, 1, 1))
+        Municipality.objects.create(name='Senza Progetti', province='PD', region='Veneto', population=500)
+
+    def _add(self, name, region, population, powers, chargers=0):
+        municipality = Municipality.objects.create(name=name, province='XX', region=region, population=population)
+        for index, power in enumerate(powers):
+            subproject = SubProject.objects.create(
+                name=f'{name} {index}', project=self.project, municipality=municipality, power_kw=power,
+                start_date=date(2024, 1, 1), planned_completion_date=date(2024, 6, 1))
+            for number in range(chargers):
+                Charger.objects.create(subproject=subproject, code=f'{name}-{index}-{number}', power_kw=22)
+        return municipality
+
+    def test_aggregates_per_municipality_and_region(self):
+        """Verifica i totali per comune, per regione e il top per stazioni"""
+        treviso = self._add('Treviso', 'Veneto', 80000, [22, 50], chargers=2)
+        self._add('Padova', 'Veneto', 200000, [11])
+        self._add('Udine', 'Friuli', 100000, [150, 50, 22])
+
+        row = MunicipalityPortfolioService.municipalities().get(pk=treviso.pk)
+        self.assertEqual((row.subproject_count, row.charger_count, row.station_count), (2, 4, 4))
+        self.assertEqual(float(row.total_power), 72)
+
+        summary = MunicipalityPortfolioService.get_summary()
+        veneto = summary['regions'][0]
+        self.assertEqual((veneto['name'], veneto['municipalities'], veneto['population']), ('Veneto', 2, 280000))
+        self.assertEqual((veneto['subprojects'], veneto['chargers'], veneto['power']), (3, 4, 83.0))
+        self.assertEqual(summary['top_municipalities'][:2],
+                         [{'name': 'Treviso', 'total_stations': 4}, {'name': 'Udine', 'total_stations': 3}])
+        self.assertEqual(summary['total_population'], 380000)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['paginator'].count, 3)
+        self.assertEqual(response.context['municipality_data'][treviso.pk],
+                         {'projects_count': 2, 'stations_count': 4})
+        self.assertEqual(response.context['total_stations'], 4)
+
+    def test_summary_follows_version_changed_by_other_processes(self):
+        """Verifica che il riepilogo segua la versione nel database e non la cache del processo"""
+        self._add('Treviso', 'Veneto', 80000, [22])
+        self.assertEqual(MunicipalityPortfolioService.get_summary()['total_population'], 80000)
+        # Modifica senza segnali e nuova versione, come da un altro processo web
+        Municipality.objects.filter(name='Treviso').update(population=90000)
+        DataVersion.bump('infrastructure:municipality_portfolio_summary')
+        cache.clear()
+
+        with self.settings(MEMORY_DATA_CHECK_SECONDS=3600):
+            self.assertEqual(MunicipalityPortfolioService.get_summary()['total_population'], 80000)
+        with self.settings(MEMORY_DATA_CHECK_SECONDS=0):
+            self.assertEqual(MunicipalityPortfolioService.get_summary()['total_population'], 90000)
+
+    def test_query_count_does_not_grow_with_portfolio(self):
+        """Verifica che il numero di query non dipenda dal numero di comuni"""
+        def page_queries():
+            self.client.get(self.url)  # il riepilogo viene salvato in cache
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(self.url)
+            return len(queries)
+
+        self._add('Comune 0', 'Veneto', 1000, [22], chargers=1)
+        small = page_queries()
+        for index in range(1, 40):
+            self._add(f'Comune {index}', 'Veneto' if index % 2 else 'Lazio', 1000, [22], chargers=1)
+        self.assertEqual(page_queries(), small)
@@ -0,0 +1,185 @@
+import math
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db import models
+from django.test import TestCase
+
+from infrastructure.models import EnergyPriceProjection, PunData, PunRollup
+from infrastructure.services import PunDataService, PunProjectionService, PunRollupService, TariffPricingService
+
+
+class PunDataIngestionTest(TestCase):
+    """Test per l'importazione in blocco dei dati PUN"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write(content)
+        return path
+
+    def test_upsert_counts_inserted_and_updated_rows(self):
+        """Verifica conteggi, timeband calcolata e aggiornamento dei prezzi"""
+        rows = [
+            {'date': date(2024, 3, 4), 'hour': hour, 'zone': 'NORD', 'price': 100 + hour}
+            for hour in range(24)
+        ]
+        stats = PunDataService.ingest_pun_data(rows, batch_size=10)
+        self.assertEqual(stats, {'inserted': 24, 'updated': 0, 'total': 24})
+        self.assertEqual(PunData.objects.get(date=date(2024, 3, 4), hour=9).timeband, 'F1')
+        self.assertEqual([row.timeband for row in PunData.objects.order_by('hour')],
+                         [PunData.get_timeband(date(2024, 3, 4), hour) for hour in range(24)])
+
+        rows[9]['price'] = 250
+        rows.append({'date': date(2024, 3, 5), 'hour': 0, 'zone': 'NORD', 'price': 90})
+        stats = PunDataService.ingest_pun_data(rows, batch_size=10)
+        self.assertEqual(stats, {'inserted': 1, 'updated': 24, 'total': 25})
+        self.assertEqual(PunData.objects.count(), 25)
+        self.assertEqual(PunData.objects.get(date=date(2024, 3, 4), hour=9).price, Decimal('250.0000'))
+
+    def test_reads_gme_csv_and_xml_exports(self):
+        """Verifica la lettura degli export GME (ore 1-24, virgola decimale)"""
+        csv_path = self._write('pun.csv', (
+            'Data;Ora;PUN;NORD;SICI\n'
+            '20240101;1;98,50;97,10;105,00\n'
+            '20240101;24;88,00;87,00;\n'
+            '20240101;25;80,00;80,00;80,00\n'
+        ))
+        rows = list(PunDataService.read_gme_export(csv_path))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0], {'date': date(2024, 1, 1), 'hour': 0, 'zone': 'PUN', 'price': Decimal('98.50')})
+        self.assertEqual({row['hour'] for row in rows}, {0, 23})
+
+        xml_path = self._write('pun.xml', (
+            '<?xml version="1.0"?><NewDataSet>'
+            '<Prezzi><Data>20240102</Data><Mercato>MGP</Mercato><Ora>8</Ora><PUN>120,25</PUN><NORD>119,00</NORD></Prezzi>'
+            '<Prezzi><Data>20240102</Data><Mercato>MGP</Mercato><Ora>9</Ora><PUN>130,00</PUN><NORD>128,00</NORD></Prezzi>'
+            '</NewDataSet>'
+        ))
+        rows = list(PunDataService.read_gme_export(xml_path, zones=['nord']))
+        self.assertEqual([(row['hour'], row['price']) for row in rows], [(7, Decimal('119.00')), (8, Decimal('128.00'))])
+
+        stats = PunDataService.ingest_pun_data(PunDataService.read_gme_export(xml_path))
+        self.assertEqual(stats['inserted'], 4)
+
+
+class PunRollupTest(TestCase):
+    """Test per gli aggregati giornalieri e mensili dei dati PUN"""
+
+    def setUp(self):
+        start = date(2024, 1, 20)
+        self.rows = [
+            {'date': start + timedelta(days=day), 'hour': hour, 'zone': zone,
+             'price': 100 + day + hour * 2 + (5 if zone == 'SICI' else 0)}
+            for day in range(45)
+            for hour in range(24)
+            for zone in ('NORD', 'SICI')
+        ]
+        PunDataService.ingest_pun_data(self.rows, batch_size=500)
+
+    def _expected(self, queryset):
+        values = queryset.aggregate(avg=models.Avg('price'), low=models.Min('price'),
+                                    high=models.Max('price'), hours=models.Count('id'))
+        return values['hours'], round(float(values['avg']), 4), values['low'], values['high']
+
+    def _actual(self, stats):
+        return stats['hours'], float(stats['avg']), stats['min'], stats['max']
+
+    def test_statistics_match_hourly_aggregates(self):
+        """Verifica che gli aggregati diano gli stessi valori dei dati orari"""
+        ranges = [
+            (None, None),
+            (date(2024, 1, 25), None),
+            (None, date(2024, 2, 10)),
+            (date(2024, 1, 25), date(2024, 2, 29)),
+            (date(2024, 2, 3), date(2024, 2, 9)),
+        ]
+        for start, end in ranges:
+            hourly = PunData.objects.all()
+            if start:
+                hourly = hourly.filter(date__gte=start)
+            if end:
+                hourly = hourly.filter(date__lte=end)
+            stats = PunRollupService.statistics(start_date=start, end_date=end)
+            self.assertEqual(self._actual(stats['ALL']), self._expected(hourly), (start, end))
+            self.assertEqual(self._actual(stats['F1']), self._expected(hourly.filter(timeband='F1')), (start, end))
+
+        self.assertEqual(
+            PunRollupService.zone_hours(),
+            [{'zone': 'NORD', 'count': 45 * 24}, {'zone': 'SICI', 'count': 45 * 24}])
+
+    def test_rollups_follow_ingestion(self):
+        """Verifica l'aggiornamento incrementale dopo una nuova importazione"""
+        PunDataService.ingest_pun_data([{'date': date(2024, 2, 5), 'hour': 12, 'zone': 'NORD', 'price': 900}])
+
+        day = PunRollup.objects.get(period='day', period_start=date(2024, 2, 5), zone='NORD', timeband='ALL')
+        self.assertEqual(day.max_price, Decimal('900.0000'))
+        month = PunRollupService.series('month', zone='NORD')
+        self.assertEqual([row['period_start'] for row in month], [date(2024, 1, 1), date(2024, 2, 1), date(2024, 3, 1)])
+        self.assertEqual(month[1]['max'], Decimal('900.0000'))
+
+        PunRollup.objects.all().delete()
+        PunRollupService.rebuild()
+        self.assertEqual(PunRollupService.series('month', zone='NORD'), month)
+
+
+class PunProjectionTest(TestCase):
+    """Test per le proiezioni stagionali del PUN"""
+
+    def setUp(self):
+        TariffPricingService.invalidate()
+        self.base = {'F1': 100, 'F2': 80, 'F3': 60}
+        rollups = []
+        for year in (2021, 2022, 2023):
+            for month in range(1, 13):
+                season = 0.2 * math.cos(2 * math.pi * (month - 1) / 12)
+                for timeband, base in self.base.items():
+                    price = Decimal(base * math.exp(season)).quantize(Decimal('0.0001'))
+                    rollups.append(PunRollup(
+                        period='month', period_start=date(year, month, 1), zone='NORD', timeband=timeband,
+                        hours=100, price_sum=price * 100, min_price=price, avg_price=price, max_price=price))
+        PunRollup.objects.bulk_create(rollups)
+
+    def test_projection_follows_seasonal_profile(self):
+        """Verifica stagionalità, livello e intervallo di una serie senza rumore"""
+        history = PunProjectionService.history()
+        projections = PunProjectionService.project(history, 24, start=date(2024, 1, 1), inflation_rate=0)
+        self.assertEqual(len(projections), 48)  # NORD e media delle zone
+
+        nord = [row for row in projections if row['zone'] == 'NORD']
+        january, july = nord[0], nord[6]
+        self.assertAlmostEqual(january['f1_price'], 0.1 * math.exp(0.2), places=4)
+        self.assertAlmostEqual(july['f3_price'], 0.06 * math.exp(-0.2), places=4)
+        self.assertAlmostEqual(nord[12]['f2_price'], january['f2_price'], places=6)
+        self.assertLessEqual(january['avg_price_low'], january['avg_price'])
+        self.assertGreaterEqual(january['avg_price_high'], january['avg_price'])
+
+    def test_generate_upserts_and_feeds_tariff_prices(self):
+        """Verifica il salvataggio in blocco e l'uso delle proiezioni di zona"""
+        self.assertTrue(PunDataService.generate_projections(months_ahead=240))
+        self.assertTrue(PunDataService.generate_projections(months_ahead=240))
+        self.assertEqual(EnergyPriceProjection.objects.count(), 480)
+        self.assertEqual(set(EnergyPriceProjection.objects.values_list('method', flat=True)), {'seasonal'})
+
+        projection = EnergyPriceProjection.objects.filter(zone='NORD').order_by('-year', '-month').first()
+        hour = np.datetime64(f'{projection.year}-{projection.month:02d}-01T03', 'h')
+        prices, bands = TariffPricingService.get_price_table().pun_prices([hour], zone='NORD')
+        self.assertEqual(bands[0], 2)
+        self.assertAlmostEqual(prices[0], float(projection.f3_price))
+
+    def test_no_history_generates_nothing(self):
+        """Verifica che senza storico non vengano generati dati fittizi"""
+        PunRollup.objects.all().delete()
+        self.assertFalse(PunDataService.generate_projections(months_ahead=12))
+        self.assertFalse(PunData.objects.exists())
+        self.assertFalse(EnergyPriceProjection.objects.exists())
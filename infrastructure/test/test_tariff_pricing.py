@@ -0,0 +1,61 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.test import TestCase
+
+from infrastructure.models import ElectricityTariff, EnergyPriceProjection, PunData
+from infrastructure.services import PunDataService, TariffPricingService
+from infrastructure.timebands import timeband_codes
+
+
+class TariffPricingTest(TestCase):
+    """Test per i prezzi delle tariffe calcolati in memoria"""
+
+    def setUp(self):
+        TariffPricingService.invalidate()
+        self.tariff = ElectricityTariff.objects.create(
+            name='PUN', provider='Test', tariff_type='pun', valid_from=date(2024, 1, 1),
+            pun_fee_f1=Decimal('0.0300'), pun_fee_f2=Decimal('0.0200'), pun_fee_f3=Decimal('0.0100'))
+
+    def test_timeband_codes_match_scalar_rule(self):
+        """Verifica la fascia vettoriale contro PunData.get_timeband"""
+        start = datetime(2024, 3, 4)
+        hours = [start + timedelta(hours=offset) for offset in range(24 * 14)]
+        expected = [PunData.get_timeband(hour.date(), hour.hour) for hour in hours]
+        codes = timeband_codes(np.array(hours, dtype='datetime64[h]'))
+        self.assertEqual([('F1', 'F2', 'F3')[code] for code in codes], expected)
+
+    def test_price_lookup_order_and_invalidation(self):
+        """Verifica prezzo orario, ultimo prezzo di fascia, proiezioni e invalidazione"""
+        # Senza dati: valori medi stimati più la commissione
+        self.assertAlmostEqual(self.tariff.get_current_energy_cost(date=date(2024, 3, 4), hour=9), 0.18)
+
+        EnergyPriceProjection.objects.create(
+            year=2024, month=6, f1_price=Decimal('0.2000'), f2_price=Decimal('0.1800'),
+            f3_price=Decimal('0.1500'), avg_price=Decimal('0.1800'), inflation_rate=Decimal('2.00'),
+            base_period_start=date(2024, 1, 1), base_period_end=date(2024, 3, 31))
+        TariffPricingService.invalidate()
+        # La prima proiezione dal mese richiesto in poi
+        self.assertAlmostEqual(self.tariff.get_current_energy_cost(date=date(2024, 3, 4), hour=9), 0.23)
+        self.assertAlmostEqual(self.tariff.get_current_energy_cost(date=date(2024, 7, 1), hour=9), 0.18)
+        self.assertAlmostEqual(
+            self.tariff.get_current_energy_cost(date=date(2024, 3, 4), hour=9, use_projections=False), 0.18)
+
+        PunDataService.ingest_pun_data([
+            {'date': date(2024, 3, 4), 'hour': hour, 'zone': zone, 'price': 100 + hour + offset}
+            for hour in range(24)
+            for zone, offset in (('NORD', 0), ('SUD', 10))
+        ])
+        with self.assertNumQueries(2):
+            TariffPricingService.get_price_table()
+        hours = np.array(['2024-03-04T09', '2024-03-04T23', '2024-03-11T10'], dtype='datetime64[h]')
+        with self.assertNumQueries(0):
+            nord = self.tariff.price_for(hours, zone='NORD')
+            national = self.tariff.price_for(hours)
+        # Ora presente, poi ultimo prezzo della fascia (F1 alle 18)
+        np.testing.assert_allclose(nord, [0.109 + 0.03, 0.123 + 0.01, 0.118 + 0.03])
+        np.testing.assert_allclose(national, [0.114 + 0.03, 0.128 + 0.01, 0.123 + 0.03])
+
+        fixed = ElectricityTariff.objects.create(name='Fisso', provider='Test', valid_from=date(2024, 1, 1))
+        np.testing.assert_allclose(fixed.price_for(hours, power_kw=50), [0.35] * 3)
@@ -0,0 +1,48 @@
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from django.test import TestCase
+
+from infrastructure.models import PunData
+from infrastructure.services import PunDataService, PunRollupService
+from infrastructure.timebands import easter_sunday, non_working_days, timeband, timeband_codes, year_timebands
+
+
+class TimebandCalendarTest(TestCase):
+    """Test per il calendario delle fasce orarie con le festività nazionali"""
+
+    def test_holidays_are_f3(self):
+        """Verifica Pasqua, Pasquetta e festività fisse in F3"""
+        self.assertEqual(easter_sunday(2024), date(2024, 3, 31))
+        self.assertEqual(easter_sunday(2025), date(2025, 4, 20))
+        self.assertEqual(len(year_timebands(2024)), 8784)
+        self.assertEqual(len(year_timebands(2025)), 8760)
+
+        self.assertEqual(timeband(date(2024, 4, 1), 10), 'F3')   # Lunedì dell'Angelo
+        self.assertEqual(timeband(date(2024, 4, 2), 10), 'F1')
+        self.assertEqual(timeband(date(2024, 12, 25), 20), 'F3')
+        self.assertEqual(timeband(date(2025, 8, 16), 12), 'F2')  # Sabato dopo Ferragosto
+        self.assertEqual(PunData.get_timeband(datetime(2025, 6, 2, 9), 9), 'F3')
+
+    def test_vectorized_lookup_matches_scalar(self):
+        """Verifica la ricerca vettoriale su ore di anni diversi"""
+        start = datetime(2024, 12, 20)
+        hours = [start + timedelta(hours=offset) for offset in range(24 * 20)]
+        codes = timeband_codes(np.array(hours, dtype='datetime64[h]'))
+        self.assertEqual(codes.dtype, np.uint8)
+        self.assertEqual([('F1', 'F2', 'F3')[code] for code in codes],
+                         [timeband(hour.date(), hour.hour) for hour in hours])
+
+        days = np.array(['2025-01-06T12', '2025-01-07T12', '2025-01-11T12'], dtype='datetime64[h]')
+        self.assertEqual(non_working_days(days).tolist(), [True, False, True])
+
+    def test_restamp_holidays(self):
+        """Verifica la correzione delle ore festive salvate come feriali"""
+        PunDataService.ingest_pun_data([
+            {'date': date(2024, 12, 25), 'hour': 10, 'zone': 'NORD', 'price': 100, 'timeband': 'F1'},
+            {'date': date(2024, 12, 27), 'hour': 10, 'zone': 'NORD', 'price': 100},
+        ])
+        self.assertEqual(PunRollupService.restamp_holidays(), 1)
+        self.assertEqual(set(PunData.objects.values_list('timeband', flat=True)), {'F1', 'F3'})
+        stats = PunRollupService.statistics(zone='NORD')
+        self.assertEqual((stats['F1']['hours'], stats['F3']['hours']), (1, 1))
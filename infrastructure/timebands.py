@@ -0,0 +1,157 @@
+"""
+Calendario delle fasce orarie F1, F2 e F3 con le festività nazionali.
+
+Le fasce di ogni anno sono precalcolate una sola volta in un array uint8 di
+8760 (o 8784) ore, in modo che PUN, tariffe e profili di carico possano
+ricavare la fascia di interi array di ore senza chiamate Python per ora.
+
+Regole (ARERA):
+    F1: lunedì-venerdì 8-19, esclusi i festivi
+    F2: lunedì-venerdì 7-8 e 19-23, sabato 7-23, esclusi i festivi
+    F3: tutte le altre ore, le domeniche e i festivi
+"""
+from datetime import date, timedelta
+from functools import lru_cache
+
+import numpy as np
+
+
+# Nomi delle fasce, nell'ordine dei codici usati negli array
+TIMEBAND_CODES = ('F1', 'F2', 'F3')
+
+# Festività nazionali a data fissa (mese, giorno)
+FIXED_HOLIDAYS = (
+    (1, 1),    # Capodanno
+    (1, 6),    # Epifania
+    (4, 25),   # Festa della Liberazione
+    (5, 1),    # Festa del Lavoro
+    (6, 2),    # Festa della Repubblica
+    (8, 15),   # Ferragosto
+    (11, 1),   # Ognissanti
+    (12, 8),   # Immacolata Concezione
+    (12, 25),  # Natale
+    (12, 26),  # Santo Stefano
+)
+
+
+def easter_sunday(year):
+    """
+    Data della Pasqua nel calendario gregoriano (algoritmo di Meeus/Jones/Butcher).
+
+    Args:
+        year: Anno
+
+    Returns:
+        date: Domenica di Pasqua
+    """
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+@lru_cache(maxsize=None)
+def holidays(year):
+    """
+    Festività nazionali di un anno, compreso il Lunedì dell'Angelo.
+
+    Args:
+        year: Anno
+
+    Returns:
+        frozenset: Date festive
+    """
+    days = {date(year, month, day) for month, day in FIXED_HOLIDAYS}
+    days.add(easter_sunday(year) + timedelta(days=1))
+    return frozenset(days)
+
+
+@lru_cache(maxsize=None)
+def year_timebands(year):
+    """
+    Codici di fascia di tutte le ore di un anno.
+
+    Args:
+        year: Anno
+
+    Returns:
+        numpy.ndarray: Array uint8 (sola lettura) di 8760 o 8784 indici in
+            TIMEBAND_CODES, a partire dalla mezzanotte del 1° gennaio
+    """
+    start = np.datetime64(f'{year}-01-01', 'D')
+    days = np.arange(start, np.datetime64(f'{year + 1}-01-01', 'D'))
+    # Il 01/01/1970 era un giovedì (weekday 3)
+    weekday = (days.astype(np.int64) + 3) % 7
+    holiday = np.zeros(days.size, dtype=bool)
+    holiday[[(day - date(year, 1, 1)).days for day in holidays(year)]] = True
+
+    hour = np.arange(24)
+    weekdays = ((weekday <= 4) & ~holiday)[:, None]
+    saturdays = ((weekday == 5) & ~holiday)[:, None]
+    f1 = weekdays & (hour >= 8) & (hour < 19)
+    f2 = (weekdays & ((hour == 7) | ((hour >= 19) & (hour < 23)))) | (saturdays & (hour >= 7) & (hour < 23))
+
+    codes = np.where(f1, 0, np.where(f2, 1, 2)).astype(np.uint8).reshape(-1)
+    codes.flags.writeable = False
+    return codes
+
+
+def timeband_codes(hours):
+    """
+    Codici di fascia per un array di ore.
+
+    Args:
+        hours: Array di ore (convertibile in datetime64[h])
+
+    Returns:
+        numpy.ndarray: Indici uint8 in TIMEBAND_CODES (0=F1, 1=F2, 2=F3)
+    """
+    hours = np.asarray(hours, dtype='datetime64[h]')
+    codes = np.empty(hours.shape, dtype=np.uint8)
+    years = hours.astype('datetime64[Y]')
+    for year in np.unique(years):
+        in_year = years == year
+        offsets = (hours[in_year] - year.astype('datetime64[h]')).astype(np.int64)
+        codes[in_year] = year_timebands(int(year.astype(np.int64)) + 1970)[offsets]
+    return codes
+
+
+def timeband(day, hour):
+    """
+    Fascia oraria di una singola ora.
+
+    Args:
+        day: Data (o datetime)
+        hour: Ora (0-23)
+
+    Returns:
+        str: 'F1', 'F2' o 'F3'
+    """
+    offset = (day.toordinal() - date(day.year, 1, 1).toordinal()) * 24 + hour
+    return TIMEBAND_CODES[year_timebands(day.year)[offset]]
+
+
+def non_working_days(hours):
+    """
+    Indica le ore che cadono di sabato, domenica o in un giorno festivo.
+
+    Args:
+        hours: Array di ore (convertibile in datetime64[h])
+
+    Returns:
+        numpy.ndarray: Array booleano
+    """
+    hours = np.asarray(hours, dtype='datetime64[h]')
+    days = hours.astype('datetime64[D]')
+    weekend = (days.astype(np.int64) + 3) % 7 >= 5
+    years = range(int(days.min().astype('datetime64[Y]').astype(np.int64)) + 1970,
+                  int(days.max().astype('datetime64[Y]').astype(np.int64)) + 1971) if days.size else ()
+    festive = np.array(sorted(day for year in years for day in holidays(year)), dtype='datetime64[D]')
+    return weekend | np.isin(days, festive)
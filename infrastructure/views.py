@@ -16,7 +16,6 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.cache import cache
 from django.core.management import call_command
-from django.db import models
 from django.db.models import Avg, Count, Sum
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
@@ -45,13 +44,15 @@ from .forms import (
     ElectricityTariffForm, ManagementFeeForm, StationUsageProfileForm, ChargingStationTemplateForm,
     GlobalSettingsForm, EnergyPriceProjectionForm
 )
-from .services import PunDataService
+from .services import (
+    PunDataService, PunRollupService, MunicipalitySearchService, DashboardMetricsService,
+    MunicipalityPortfolioService,
+)
 from .reports import MunicipalityReportGenerator, ChargingProjectReportGenerator, ChargingStationSheetGenerator
 
 # Related application imports
 from projects.models import Project
 from cpo_core.models import SubProject
-from cpo_core.models.subproject import Charger
 
 # Funzione per aggiornare l'avanzamento dell'importazione
 def update_import_progress(progress, message="", current_count=0, total_count=7904):
@@ -71,27 +72,9 @@ def run_import_command_with_progress(force=False):
         # Imposta lo stato iniziale
         update_import_progress(0, "Inizializzazione importazione...")
         
-        # Ottieni il numero totale di comuni prima dell'importazione
-        existing_count = Municipality.objects.count()
-        if force and existing_count > 0:
-            update_import_progress(2, f"Cancellazione di {existing_count} comuni esistenti...")
-            Municipality.objects.all().delete()
-        
-        # Per prima cosa, scarica i dati senza importarli (5-15% progresso)
-        update_import_progress(5, "Scaricamento dati dei comuni italiani in corso...")
-        
-        # In una situazione reale, qui scaricheresti e processeresti i dati
-        # Per questo esempio, simuliamo un progresso incrementale
-        
-        # Importa i comuni (15-95% progresso)
-        # Nel comando reale, dovresti modificare import_municipalities.py per chiamare
-        # update_import_progress a intervalli regolari
-        
-        # Esegui il comando effettivo di importazione
+        # Il comando aggiorna il progresso in cache; con force i comuni
+        # esistenti vengono aggiornati in base al codice ISTAT, senza cancellarli
         from django.core.management import call_command
-        
-        # Questa chiamata dovrebbe essere modificata per supportare il reporting del progresso
-        # Nel frattempo, usiamo un altro thread per simulare l'avanzamento
         call_command('import_municipalities', force=force)
         
         # Imposta il progresso finale
@@ -127,17 +110,8 @@ class ChargingStationTemplatePrintPDFView(LoginRequiredMixin, DetailView):
         if active_tariff and default_profile:
             monthly_kwh = default_profile.calculate_monthly_usage(template.power_kw)
             
-            # Determina il costo in base alla potenza
-            if template.power_kw <= 7:
-                kwh_cost = float(active_tariff.cost_tier1)
-            elif template.power_kw <= 22:
-                kwh_cost = float(active_tariff.cost_tier2)
-            elif template.power_kw <= 50:
-                kwh_cost = float(active_tariff.cost_tier3)
-            elif template.power_kw <= 150:
-                kwh_cost = float(active_tariff.cost_tier4)
-            else:
-                kwh_cost = float(active_tariff.cost_tier5)
+            # Determina il costo in base alla potenza (o al PUN per le tariffe indicizzate)
+            kwh_cost = active_tariff.get_current_energy_cost(power_kw=template.power_kw)
                 
             monthly_energy_cost = monthly_kwh * kwh_cost
             monthly_fixed_cost = float(active_tariff.connection_fee) + (template.power_kw * float(active_tariff.power_fee))
@@ -172,44 +146,23 @@ class ChargingStationTemplatePrintPDFView(LoginRequiredMixin, DetailView):
         return response
     
 def municipality_autocomplete(request):
-    """Fornisce funzionalità di autocompletamento per i comuni"""
+    """Fornisce funzionalità di autocompletamento per i comuni (indice in memoria)"""
     query = request.GET.get('q', '')
     municipality_id = request.GET.get('id')
     
     # Se viene fornito un ID specifico, restituisci i dettagli di quel comune
     if municipality_id:
         try:
-            m = Municipality.objects.get(pk=municipality_id)
-            results = [{
-                'id': m.id, 
-                'text': f"{m.name} ({m.province})", 
-                'population': m.population,
-                'logo_url': m.logo.url if m.logo else None
-            }]
-            return JsonResponse({'results': results})
-        except Municipality.DoesNotExist:
-            return JsonResponse({'results': []})
+            result = MunicipalitySearchService.get(int(municipality_id))
+        except ValueError:
+            result = None
+        return JsonResponse({'results': [result] if result else []})
     
     # Altrimenti esegui la ricerca per nome
     if len(query) < 2:
         return JsonResponse({'results': []})
     
-    # Cerca comuni che iniziano con la stringa di ricerca
-    municipalities = Municipality.objects.filter(
-        name__istartswith=query
-    ).values('id', 'name', 'province', 'population')[:10]
-    
-    results = []
-    for m in municipalities:
-        municipality = Municipality.objects.get(pk=m['id'])
-        results.append({
-            'id': m['id'], 
-            'text': f"{m['name']} ({m['province']})", 
-            'population': m['population'],
-            'logo_url': municipality.logo.url if municipality.logo else None
-        })
-    
-    return JsonResponse({'results': results})
+    return JsonResponse({'results': MunicipalitySearchService.search(query, limit=10)})
 
 @login_required
 def municipality_details(request, municipality_id):
@@ -350,83 +303,36 @@ class MunicipalityListView(LoginRequiredMixin, ListView):
     model = Municipality
     context_object_name = 'municipality_list'
     template_name = 'infrastructure/municipality_list.html'
+    paginate_by = 25
 
     def get_queryset(self):
-        # Ottieni gli ID dei comuni coinvolti nei sottoprogetti
-        municipality_ids = SubProject.objects.values_list('municipality_id', flat=True).distinct()
-        
-        # Restituisci solo i comuni che hanno sottoprogetti associati
-        return Municipality.objects.filter(id__in=municipality_ids)
+        # Solo i comuni che hanno sottoprogetti associati, con i loro totali già aggregati
+        return MunicipalityPortfolioService.municipalities()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Ottieni l'elenco filtrato di comuni
-        municipalities = context['municipality_list']
-        
-        # Calcola la popolazione totale dei comuni nei progetti
-        total_population = municipalities.aggregate(Sum('population'))['population__sum'] or 0
-        context['total_population'] = total_population
-        
-        # Calcola il numero di progetti e stazioni per ogni comune
-        municipality_data = {}
-        for mun in municipalities:
-            # Conta i sottoprogetti per questo comune
-            subprojects = SubProject.objects.filter(municipality_id=mun.id)
-            subproject_count = subprojects.count()
-            
-            # Conta le colonnine collegate ai sottoprogetti di questo comune
-            charger_count = 0
-            for sp in subprojects:
-                charger_count += sp.chargers.count()
-            
-            # Salva i dati per questo comune
-            municipality_data[mun.id] = {
-                'projects_count': subproject_count,
-                'stations_count': charger_count if charger_count > 0 else subproject_count
+        # Numero di progetti e stazioni dei comuni della pagina (dagli aggregati della query)
+        context['municipality_data'] = {
+            mun.id: {
+                'projects_count': mun.subproject_count,
+                'stations_count': mun.station_count,
             }
+            for mun in context['municipality_list']
+        }
         
-        # Aggiungi questi dati al contesto
-        context['municipality_data'] = municipality_data
-        
-        # Conta progetti attivi
-        active_projects = Project.objects.count()
-        context['active_projects'] = active_projects
-        
-        # Conta sottoprogetti (stazioni) totali
-        total_stations = SubProject.objects.count()
-        context['total_stations'] = total_stations
-        
-        # Conta colonnine totali
-        total_chargers = Charger.objects.count()
-        if total_chargers > 0:
-            context['total_stations'] = total_chargers  # Se ci sono colonnine, mostriamo quelle piuttosto che i sottoprogetti
-        
-        # Dati per la distribuzione regionale
-        regions = municipalities.values('region').annotate(count=Count('id')).order_by('-count')
-        context['region_data'] = []
-        for region in regions:
-            if region['region']:  # Assicurati che ci sia un valore per la regione
-                context['region_data'].append({
-                    'name': region['region'],
-                    'count': region['count']
-                })
-        
-        # Top 5 comuni per stazioni/colonnine
-        context['top_municipalities'] = []
-        
-        # Crea una lista di comuni ordinata per numero di colonnine/stazioni
-        top_mun_list = []
-        for mun_id, data in municipality_data.items():
-            mun = Municipality.objects.get(id=mun_id)
-            top_mun_list.append({
-                'name': mun.name,
-                'total_stations': data['stations_count']
-            })
-        
-        # Ordina la lista e prendi i primi 5
-        top_mun_list.sort(key=lambda x: x['total_stations'], reverse=True)
-        context['top_municipalities'] = top_mun_list[:5]
+        # Totali, distribuzione regionale e top 5 arrivano dal riepilogo in cache
+        summary = MunicipalityPortfolioService.get_summary()
+        context['total_population'] = summary['total_population']
+        context['active_projects'] = summary['total_projects']
+        # Se ci sono colonnine, mostriamo quelle piuttosto che i sottoprogetti
+        context['total_stations'] = summary['total_chargers'] or summary['total_subprojects']
+        context['region_summary'] = summary['regions']
+        context['region_data'] = [
+            {'name': region['name'], 'count': region['municipalities']}
+            for region in summary['regions'] if region['name']
+        ]
+        context['top_municipalities'] = summary['top_municipalities']
         
         return context
 
@@ -1028,62 +934,9 @@ def dashboard(request):
     """Dashboard principale dell'infrastruttura"""
     import json
     from datetime import datetime, timedelta
-    import random
-    from cpo_core.models import Project, SubProject
-    from cpo_core.models.subproject import Charger
-    from decimal import Decimal
-    
-    # Definiamo un encoder JSON personalizzato per gestire i Decimal
-    class DecimalEncoder(json.JSONEncoder):
-        def default(self, obj):
-            if isinstance(obj, Decimal):
-                return float(obj)
-            return super(DecimalEncoder, self).default(obj)
     
-    # Conta i progetti e le stazioni
-    projects_count = Project.objects.count()
-    stations_count = SubProject.objects.count()
-    chargers_count = Charger.objects.count()
-    municipalities_with_projects = Municipality.objects.filter(
-        id__in=SubProject.objects.values_list('municipality_id', flat=True).distinct()
-    ).count()
-    
-    # Seleziona il numero più alto tra stazioni e colonnine 
-    display_stations_count = max(stations_count, chargers_count)
-    
-    # Statistiche di base
-    active_projects = Project.objects.filter(status='in_progress').count()
-    
-    # Calcola potenza totale installata
-    total_power = 0
-    # Somma la potenza di tutte le colonnine
-    for charger in Charger.objects.all():
-        if charger.power_kw:
-            total_power += float(charger.power_kw)
-    # Se non ci sono colonnine, usa la potenza dei sottoprogetti
-    if total_power == 0:
-        for sp in SubProject.objects.all():
-            if sp.power_kw:
-                total_power += float(sp.power_kw)
-    
-    # Progetti per stato
-    planning_projects = Project.objects.filter(status='planning').count()
-    in_progress_projects = Project.objects.filter(status='in_progress').count()
-    completed_projects = Project.objects.filter(status='completed').count()
-    paused_projects = Project.objects.filter(status='suspended').count() 
-    cancelled_projects = Project.objects.filter(status='closed').count()
-    
-    # Stazioni per stato
-    planned_stations = Charger.objects.filter(status='planned').count()
-    installing_stations = Charger.objects.filter(status='installing').count()
-    active_stations = Charger.objects.filter(status='operational').count()
-    maintenance_stations = Charger.objects.filter(status='maintenance').count()
-    inactive_stations = Charger.objects.filter(status='offline').count()
-    
-    # Se non ci sono colonnine, imposta almeno alcuni valori di esempio
-    if planned_stations + installing_stations + active_stations + maintenance_stations + inactive_stations == 0:
-        planned_stations = 1
-        active_stations = 2
+    # Contatori, potenze, marker e progetti recenti arrivano dallo snapshot in cache
+    metrics = DashboardMetricsService.get_snapshot()
     
     # Dati finanziari di esempio per grafici
     total_investment = 150000  # Valore di esempio fisso
@@ -1091,76 +944,6 @@ def dashboard(request):
     average_roi = 15.0         # Percentuale ROI media (esempio)
     investment_return_time = 5.5  # Anni per recuperare l'investimento (esempio)
     
-    # Dati stazioni con coordinate
-    stations_with_coords = []
-    # Aggiungi un marker per ogni sottoprogetto che ha coordinate
-    for sp in SubProject.objects.filter(
-        latitude_approved__isnull=False, 
-        longitude_approved__isnull=False
-    ).prefetch_related('project', 'project__organization'):
-        stations_with_coords.append({
-            'id': sp.id,
-            'code': sp.name,
-            'name': sp.name,
-            'project': {'name': sp.project.name} if sp.project else {'name': 'Progetto sconosciuto'},
-            'latitude': sp.latitude_approved,
-            'longitude': sp.longitude_approved,
-            'power_kw': sp.power_kw or 50,
-            'location': sp.address or 'Indirizzo non disponibile',
-            'status': 'active'  # Default status for display
-        })
-    
-    # Cerca di ottenere comuni specifici per mostrare punti sulla mappa
-    try:
-        # Cerca comuni con progetti
-        municipalities_with_subprojects = Municipality.objects.filter(
-            id__in=SubProject.objects.values_list('municipality_id', flat=True)
-        )
-        
-        # Se ci sono comuni con progetti, visualizzali sulla mappa
-        if municipalities_with_subprojects.exists():
-            for mun in municipalities_with_subprojects[:5]:  # Limitiamo a 5 per non sovraccaricare
-                # Ottieni i sottoprogetti di questo comune
-                mun_subprojects = SubProject.objects.filter(municipality=mun)
-                
-                for sp in mun_subprojects:
-                    # Usa le coordinate proposte se quelle approvate non ci sono
-                    lat = sp.latitude_approved if sp.latitude_approved else (sp.latitude_proposed if sp.latitude_proposed else None)
-                    lng = sp.longitude_approved if sp.longitude_approved else (sp.longitude_proposed if sp.longitude_proposed else None)
-                    
-                    if lat and lng:
-                        stations_with_coords.append({
-                            'id': sp.id,
-                            'code': sp.name,
-                            'name': sp.name,
-                            'project': {'name': sp.project.name} if sp.project else {'name': f'Progetto {mun.name}'},
-                            'latitude': lat,
-                            'longitude': lng,
-                            'power_kw': sp.power_kw or 50,
-                            'location': sp.address or f'Indirizzo in {mun.name}',
-                            'status': 'active'
-                        })
-        
-        # Se non ci sono punti, aggiungi un punto di esempio (solo se non ci sono altri punti)
-        if not stations_with_coords:
-            # Ottieni un comune qualsiasi per un punto di esempio
-            sample_municipality = Municipality.objects.order_by('?').first()
-            if sample_municipality:
-                stations_with_coords.append({
-                    'id': 1,
-                    'code': f'{sample_municipality.name[:3].upper()}-001',
-                    'name': f'Stazione {sample_municipality.name}',
-                    'project': {'name': f'Progetto {sample_municipality.name}'},
-                    'latitude': 45.0,  # Coordinate di esempio (centrate in Italia)
-                    'longitude': 12.0,
-                    'power_kw': 50,
-                    'location': f'Centro di {sample_municipality.name}',
-                    'status': 'active'
-                })
-    except Exception as e:
-        # In caso di errore, non blocchiamo il rendering della dashboard
-        print(f"Errore nel caricamento delle stazioni per la mappa: {e}")
-    
     # Dati crescita mensile (ultimi 12 mesi)
     today = datetime.now()
     months = []
@@ -1183,24 +966,6 @@ def dashboard(request):
     financial_investments = [50000, 70000, 100000, 60000, 40000]
     financial_revenues = [10000, 40000, 90000, 120000, 150000]
     
-    # Distribuzione della potenza
-    power_distribution = [1, 1, 1, 0, 0]  # Default values
-    
-    # Progetti recenti - prendi solo quelli del modello cpo_core
-    recent_projects = Project.objects.all().order_by('-id')[:5]
-    
-    # Per ciascun progetto recente, assicurati che abbia attributi necessari per il template
-    for project in recent_projects:
-        if not hasattr(project, 'municipality'):
-            # Se il progetto non ha un comune associato, imposta region come attributo
-            project.region = 'Veneto'
-        if not hasattr(project, 'completion_percentage'):
-            # Aggiungi un metodo per il calcolo della percentuale di completamento
-            project.completion_percentage = 50
-        if not hasattr(project, 'get_status_color'):
-            # Aggiungi un metodo per determinare il colore dello stato
-            project.get_status_color = lambda: 'primary'
-    
     # Calcola percentuali di crescita per le statistiche
     new_projects_percent = 15  # Valore esempio
     new_stations_percent = 20  # Valore esempio
@@ -1212,10 +977,10 @@ def dashboard(request):
     
     context = {
         # KPI principali
-        'total_projects': projects_count,
-        'total_stations': display_stations_count,
-        'total_municipalities': municipalities_with_projects,
-        'total_power': int(total_power),
+        'total_projects': metrics['total_projects'],
+        'total_stations': metrics['total_stations'],
+        'total_municipalities': metrics['total_municipalities'],
+        'total_power': metrics['total_power'],
         
         # Percentuali di crescita
         'new_projects_percent': new_projects_percent,
@@ -1223,19 +988,9 @@ def dashboard(request):
         'new_power_percent': new_power_percent,
         'new_municipalities_percent': new_municipalities_percent,
         
-        # Dati progetti per stato
-        'planning_projects': planning_projects,
-        'in_progress_projects': in_progress_projects,
-        'completed_projects': completed_projects,
-        'paused_projects': paused_projects,
-        'cancelled_projects': cancelled_projects,
-        
-        # Dati stazioni per stato
-        'planned_stations': planned_stations,
-        'installing_stations': installing_stations,
-        'active_stations': active_stations,
-        'maintenance_stations': maintenance_stations,
-        'inactive_stations': inactive_stations,
+        # Dati progetti e stazioni per stato
+        **{key: metrics[key] for key in DashboardMetricsService.PROJECT_STATUSES},
+        **{key: metrics[key] for key in DashboardMetricsService.CHARGER_STATUSES},
         
         # Dati finanziari
         'total_investment': total_investment,
@@ -1245,18 +1000,18 @@ def dashboard(request):
         
         # Dati per grafici
         'station_types': {'ac': 2, 'dc': 1},  # Esempio di tipi di stazioni
-        'stations_with_coords': json.dumps(stations_with_coords, cls=DecimalEncoder),  # Passa come JSON per debugging
-        'stations_with_coords_raw': stations_with_coords,  # Passa anche i dati raw per il rendering dei marker
-        'growth_months': json.dumps(months, cls=DecimalEncoder),
-        'growth_stations': json.dumps(growth_stations, cls=DecimalEncoder),
-        'growth_power': json.dumps(growth_power, cls=DecimalEncoder),
-        'financial_years': json.dumps(financial_years, cls=DecimalEncoder),
-        'financial_investments': json.dumps(financial_investments, cls=DecimalEncoder),
-        'financial_revenues': json.dumps(financial_revenues, cls=DecimalEncoder),
-        'power_distribution': json.dumps(power_distribution, cls=DecimalEncoder),
+        'stations_with_coords': json.dumps(metrics['stations_with_coords']),  # Passa come JSON per debugging
+        'stations_with_coords_raw': metrics['stations_with_coords'],  # Passa anche i dati raw per il rendering dei marker
+        'growth_months': json.dumps(months),
+        'growth_stations': json.dumps(growth_stations),
+        'growth_power': json.dumps(growth_power),
+        'financial_years': json.dumps(financial_years),
+        'financial_investments': json.dumps(financial_investments),
+        'financial_revenues': json.dumps(financial_revenues),
+        'power_distribution': json.dumps(metrics['power_distribution']),
         
         # Dati progetti recenti
-        'recent_projects': recent_projects,
+        'recent_projects': metrics['recent_projects'],
         
         # Prossime attività
         'upcoming_tasks': upcoming_tasks,
@@ -1416,10 +1171,11 @@ class PunDataListView(LoginRequiredMixin, ListView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Calcola prezzo medio per fascia
-        f1_avg = PunData.objects.filter(timeband='F1').aggregate(avg=models.Avg('price'))['avg'] or 0
-        f2_avg = PunData.objects.filter(timeband='F2').aggregate(avg=models.Avg('price'))['avg'] or 0
-        f3_avg = PunData.objects.filter(timeband='F3').aggregate(avg=models.Avg('price'))['avg'] or 0
+        # Calcola prezzo medio per fascia dagli aggregati mensili
+        statistics = PunRollupService.statistics()
+        f1_avg = statistics['F1']['avg'] or 0
+        f2_avg = statistics['F2']['avg'] or 0
+        f3_avg = statistics['F3']['avg'] or 0
         
         # Converti da €/MWh a €/kWh per visualizzazione
         context['f1_avg_kwh'] = f1_avg / 1000
@@ -1427,7 +1183,7 @@ class PunDataListView(LoginRequiredMixin, ListView):
         context['f3_avg_kwh'] = f3_avg / 1000
         
         # Conta dati per zona
-        context['data_by_zone'] = PunData.objects.values('zone').annotate(count=models.Count('id'))
+        context['data_by_zone'] = PunRollupService.zone_hours()
         
         # Aggiungi filtri correnti al contesto
         context['current_filters'] = {
@@ -1476,8 +1232,19 @@ class EnergyPriceProjectionListView(LoginRequiredMixin, ListView):
     context_object_name = 'projections'
     template_name = 'infrastructure/energy_projection_list.html'
     
+    def get_zone(self):
+        # Zona vuota = proiezioni della media delle zone
+        return self.request.GET.get('zone', '')
+    
+    def get_queryset(self):
+        return super().get_queryset().filter(zone=self.get_zone())
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        context['selected_zone'] = self.get_zone()
+        context['zones'] = list(
+            EnergyPriceProjection.objects.exclude(zone='').order_by('zone').values_list('zone', flat=True).distinct()
+        )
         
         # Ottieni inflazione dalle impostazioni
         settings = GlobalSettings.get_active()
@@ -1490,7 +1257,8 @@ class EnergyPriceProjectionListView(LoginRequiredMixin, ListView):
         try:
             current_projection = EnergyPriceProjection.objects.get(
                 year=current_year,
-                month=current_month
+                month=current_month,
+                zone=self.get_zone()
             )
             context['current_projection'] = current_projection
         except EnergyPriceProjection.DoesNotExist:
@@ -1639,17 +1407,8 @@ class ChargingStationTemplateDetailView(LoginRequiredMixin, DetailView):
         if active_tariff and default_profile:
             monthly_kwh = default_profile.calculate_monthly_usage(self.object.power_kw)
             
-            # Determina il costo in base alla potenza
-            if self.object.power_kw <= 7:
-                kwh_cost = float(active_tariff.cost_tier1)
-            elif self.object.power_kw <= 22:
-                kwh_cost = float(active_tariff.cost_tier2)
-            elif self.object.power_kw <= 50:
-                kwh_cost = float(active_tariff.cost_tier3)
-            elif self.object.power_kw <= 150:
-                kwh_cost = float(active_tariff.cost_tier4)
-            else:
-                kwh_cost = float(active_tariff.cost_tier5)
+            # Determina il costo in base alla potenza (o al PUN per le tariffe indicizzate)
+            kwh_cost = active_tariff.get_current_energy_cost(power_kw=self.object.power_kw)
                 
             monthly_energy_cost = monthly_kwh * kwh_cost
             monthly_fixed_cost = float(active_tariff.connection_fee) + (self.object.power_kw * float(active_tariff.power_fee))
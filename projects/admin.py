@@ -2,9 +2,9 @@
 from django.contrib import admin
 from .models import (
     Project, SubProject, Municipality, ChargingStation,
-    FinancialParameters, FinancialAnalysis, PhotovoltaicSystem,
+    FinancialConfig, FinancialParameters, FinancialAnalysis, PhotovoltaicSystem,
     ProjectTimeline, StationTimeline, EnergyContract, ProjectEnergyContract,
-    FailureSimulation, ProjectDocument, StationDocument
+    FailureSimulation, ReliabilityProfile, ProjectDocument, StationDocument
 )
 
 class SubProjectInline(admin.TabularInline):
@@ -51,6 +51,12 @@ class ChargingStationAdmin(admin.ModelAdmin):
     list_filter = ('status', 'power_type', 'sub_project__municipality')
     search_fields = ('name', 'identifier', 'address')
 
+@admin.register(FinancialConfig)
+class FinancialConfigAdmin(admin.ModelAdmin):
+    list_display = ('name', 'is_default', 'discount_rate', 'updated_at')
+    list_filter = ('is_default',)
+    search_fields = ('name',)
+
 @admin.register(FinancialParameters)
 class FinancialParametersAdmin(admin.ModelAdmin):
     list_display = ('project', 'investment_years', 'loan_amount', 'loan_interest_rate')
@@ -96,6 +102,12 @@ class FailureSimulationAdmin(admin.ModelAdmin):
     list_display = ('project', 'total_failures', 'total_repair_costs', 'total_revenue_loss')
     search_fields = ('project__name',)
 
+@admin.register(ReliabilityProfile)
+class ReliabilityProfileAdmin(admin.ModelAdmin):
+    list_display = ('name', 'brand', 'model', 'power_type', 'curve', 'shape', 'scale_years')
+    list_filter = ('curve', 'power_type')
+    search_fields = ('name', 'brand', 'model')
+
 @admin.register(ProjectDocument)
 class ProjectDocumentAdmin(admin.ModelAdmin):
     list_display = ('title', 'project', 'document_type', 'created_at')
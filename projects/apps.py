@@ -5,4 +5,8 @@ from django.utils.translation import gettext_lazy as _
 class ProjectsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'projects'
-    verbose_name = _('Progetti')
\ No newline at end of file
+    verbose_name = _('Progetti')
+    
+    def ready(self):
+        """Importa i segnali quando l'app è pronta"""
+        import projects.signals
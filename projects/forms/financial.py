@@ -22,6 +22,9 @@ class FinancialParametersForm(forms.ModelForm):
             'charging_price_increase_rate',
             'failure_probability',
             'repair_cost_percentage',
+            'failure_analysis_method',
+            'monte_carlo_runs',
+            'random_seed',
         ]
         
         widgets = {
@@ -37,6 +40,9 @@ class FinancialParametersForm(forms.ModelForm):
             'charging_price_increase_rate': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.1'}),
             'failure_probability': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.1'}),
             'repair_cost_percentage': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.1'}),
+            'failure_analysis_method': forms.Select(attrs={'class': 'form-control'}),
+            'monte_carlo_runs': forms.NumberInput(attrs={'class': 'form-control', 'step': '1000'}),
+            'random_seed': forms.NumberInput(attrs={'class': 'form-control'}),
         }
         
         labels = {
@@ -52,6 +58,9 @@ class FinancialParametersForm(forms.ModelForm):
             'charging_price_increase_rate': _('Aumento annuo prezzo ricarica (%)'),
             'failure_probability': _('Probabilità guasto annuale (%)'),
             'repair_cost_percentage': _('Costo riparazione (%)'),
+            'failure_analysis_method': _('Metodo analisi guasti'),
+            'monte_carlo_runs': _('Repliche Monte Carlo'),
+            'random_seed': _('Seme casuale'),
         }
         
     def __init__(self, *args, **kwargs):
@@ -81,4 +90,7 @@ class FinancialParametersForm(forms.ModelForm):
         self.failure_fields = [
             'failure_probability',
             'repair_cost_percentage',
+            'failure_analysis_method',
+            'monte_carlo_runs',
+            'random_seed',
         ]
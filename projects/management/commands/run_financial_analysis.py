@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from projects.models import Project
+from projects.services.portfolio import run_portfolio_analysis
+
+
+class Command(BaseCommand):
+    help = 'Ricalcola le analisi finanziarie dei progetti in blocco'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Analizza tutti i progetti del portafoglio',
+        )
+
+        parser.add_argument(
+            '--project',
+            type=int,
+            action='append',
+            dest='project_ids',
+            help='ID del progetto da analizzare (ripetibile)',
+        )
+
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Numero di processi per i calcoli (default: 1, nessun pool)',
+        )
+
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Dimensione dei blocchi per bulk_update',
+        )
+
+    def handle(self, *args, **options):
+        if options['all']:
+            queryset = Project.objects.all()
+        elif options['project_ids']:
+            queryset = Project.objects.filter(pk__in=options['project_ids'])
+        else:
+            raise CommandError('Specificare --all oppure almeno un --project')
+
+        if options['workers'] < 1:
+            raise CommandError('--workers deve essere almeno 1')
+
+        start = time.time()
+        analyses = run_portfolio_analysis(
+            queryset,
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+        )
+        elapsed = time.time() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Aggiornate {len(analyses)} analisi finanziarie in {elapsed:.1f}s'
+        ))
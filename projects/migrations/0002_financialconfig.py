@@ -0,0 +1,40 @@
+from django.db import migrations, models
+import django.core.validators
+import django.db.models.deletion
+import projects.models.financial
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FinancialConfig',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(default='Default', max_length=100, verbose_name='Nome configurazione')),
+                ('is_default', models.BooleanField(default=False, verbose_name='Configurazione predefinita')),
+                ('discount_rate', models.DecimalField(decimal_places=2, default=5.0, help_text='Tasso di sconto annuale per il calcolo del NPV in %', max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(50)], verbose_name='Tasso di sconto')),
+                ('seasonal_adjustments', models.JSONField(default=projects.models.financial.default_seasonal_adjustments, help_text="Fattori moltiplicativi per mese (chiavi '1'-'12')", verbose_name='Aggiustamenti stagionali')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Data creazione')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Data aggiornamento')),
+            ],
+            options={
+                'verbose_name': 'Configurazione finanziaria',
+                'verbose_name_plural': 'Configurazioni finanziarie',
+            },
+        ),
+        migrations.AddField(
+            model_name='financialparameters',
+            name='config',
+            field=models.ForeignKey(blank=True, help_text='Se vuota, viene usata la configurazione predefinita', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='parameters', to='projects.financialconfig', verbose_name='Configurazione'),
+        ),
+        migrations.AddField(
+            model_name='financialparameters',
+            name='apply_seasonal_adjustments',
+            field=models.BooleanField(default=True, help_text='Applica i fattori stagionali ai flussi di cassa mensili', verbose_name='Applica aggiustamenti stagionali'),
+        ),
+    ]
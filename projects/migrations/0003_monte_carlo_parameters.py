@@ -0,0 +1,22 @@
+from django.db import migrations, models
+import django.core.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0002_financialconfig'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='financialparameters',
+            name='monte_carlo_runs',
+            field=models.PositiveIntegerField(default=10000, help_text='Numero di repliche della simulazione guasti', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100000)], verbose_name='Repliche Monte Carlo'),
+        ),
+        migrations.AddField(
+            model_name='financialparameters',
+            name='random_seed',
+            field=models.PositiveIntegerField(default=42, help_text='Seme della simulazione guasti: a parità di seme i risultati sono identici', verbose_name='Seme casuale'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0003_monte_carlo_parameters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='financialanalysis',
+            name='sensitivity_analysis',
+            field=models.JSONField(blank=True, default=dict, help_text='NPV e IRR al variare dei driver (dati per grafici tornado e spider)', verbose_name='Analisi di sensibilità'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0004_financialanalysis_sensitivity_analysis'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='financialanalysis',
+            name='monthly_cash_flow',
+            field=models.JSONField(default=dict, help_text="Flussi di cassa mensili in formato JSON (intero orizzonte dell'investimento)", verbose_name='Flussi di cassa mensili'),
+        ),
+    ]
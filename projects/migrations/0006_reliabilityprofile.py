@@ -0,0 +1,42 @@
+from django.db import migrations, models
+import django.core.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0005_alter_financialanalysis_monthly_cash_flow'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReliabilityProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Nome profilo')),
+                ('brand', models.CharField(blank=True, help_text='Vuoto = qualsiasi marca', max_length=100, verbose_name='Marca')),
+                ('model', models.CharField(blank=True, help_text='Vuoto = qualsiasi modello', max_length=100, verbose_name='Modello')),
+                ('power_type', models.CharField(blank=True, choices=[('ac', 'AC'), ('dc', 'DC'), ('ac_dc', 'AC/DC')], help_text='Vuoto = qualsiasi tipo di potenza', max_length=10, verbose_name='Tipo di potenza')),
+                ('curve', models.CharField(choices=[('weibull', 'Weibull'), ('bathtub', 'Vasca da bagno (mortalità infantile + casuali + usura)')], default='weibull', max_length=10, verbose_name='Curva di guasto')),
+                ('shape', models.FloatField(default=1.5, help_text='Parametro di forma (beta): < 1 guasti precoci, 1 costante, > 1 usura', validators=[django.core.validators.MinValueValidator(0.1), django.core.validators.MaxValueValidator(10)], verbose_name='Forma Weibull')),
+                ('scale_years', models.FloatField(default=12.0, help_text='Parametro di scala (eta) in anni', validators=[django.core.validators.MinValueValidator(0.1)], verbose_name='Scala Weibull (anni)')),
+                ('infant_shape', models.FloatField(default=0.5, help_text='Forma Weibull (< 1) dei guasti precoci, solo per la curva a vasca da bagno', validators=[django.core.validators.MinValueValidator(0.1), django.core.validators.MaxValueValidator(1)], verbose_name='Forma mortalità infantile')),
+                ('infant_scale_years', models.FloatField(default=50.0, help_text='Scala Weibull dei guasti precoci, solo per la curva a vasca da bagno', validators=[django.core.validators.MinValueValidator(0.1)], verbose_name='Scala mortalità infantile (anni)')),
+                ('random_failure_rate', models.FloatField(default=0.02, help_text='Tasso costante di guasti casuali, solo per la curva a vasca da bagno', validators=[django.core.validators.MinValueValidator(0)], verbose_name='Guasti casuali (per anno)')),
+                ('repair_cost_percentage', models.DecimalField(decimal_places=2, default=10.0, help_text='Costo medio di un intervento come % del costo della colonnina', max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)], verbose_name='Costo riparazione %')),
+                ('downtime_days', models.DecimalField(decimal_places=1, default=3.0, help_text='Giorni medi di inattività per guasto', max_digits=5, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Fermo medio (giorni)')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Data creazione')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Data aggiornamento')),
+            ],
+            options={
+                'verbose_name': 'Profilo di affidabilità',
+                'verbose_name_plural': 'Profili di affidabilità',
+                'ordering': ['brand', 'model', 'power_type'],
+            },
+        ),
+        migrations.AddField(
+            model_name='financialparameters',
+            name='failure_analysis_method',
+            field=models.CharField(choices=[('analytic', 'Analitico (valori attesi)'), ('monte_carlo', 'Simulazione Monte Carlo')], default='analytic', help_text='Il metodo analitico calcola i costi attesi in forma chiusa; la simulazione Monte Carlo aggiunge le bande percentili', max_length=20, verbose_name='Metodo analisi guasti'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+def fill_geohash(apps, schema_editor):
+    from cpo_planner.mapping.geohash import encode
+
+    ChargingStation = apps.get_model('projects', 'ChargingStation')
+    stations = list(ChargingStation.objects.filter(latitude__isnull=False, longitude__isnull=False))
+    for station in stations:
+        station.geohash = encode(station.latitude, station.longitude)
+    ChargingStation.objects.bulk_update(stations, ['geohash'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0006_reliabilityprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chargingstation',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=12, verbose_name='Geohash'),
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+    ]
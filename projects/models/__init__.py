@@ -5,11 +5,12 @@ from .project import project_logo_path
 from .subproject import SubProject
 from .municipality import Municipality
 from .charging_station import ChargingStation
-from .financial import FinancialParameters, FinancialAnalysis
+from .financial import FinancialConfig, FinancialParameters, FinancialAnalysis
 from .photovoltaic import PhotovoltaicSystem
 from .timeline import ProjectTimeline, StationTimeline
 from .energy_contract import EnergyContract, ProjectEnergyContract
 from .failure_simulation import FailureSimulation
+from .reliability import ReliabilityProfile
 from .document import ProjectDocument, StationDocument
 
 # Assicurarsi che i modelli siano registrati in Django
@@ -18,6 +19,7 @@ __all__ = [
     'SubProject',
     'Municipality',
     'ChargingStation',
+    'FinancialConfig',
     'FinancialParameters',
     'FinancialAnalysis',
     'PhotovoltaicSystem',
@@ -26,6 +28,7 @@ __all__ = [
     'EnergyContract',
     'ProjectEnergyContract',
     'FailureSimulation',
+    'ReliabilityProfile',
     'ProjectDocument',
     'StationDocument',
 ]
\ No newline at end of file
@@ -16,6 +16,8 @@ class ChargingStation(models.Model):
     address = models.CharField(_('Indirizzo'), max_length=255)
     latitude = models.DecimalField(_('Latitudine'), max_digits=9, decimal_places=6, null=True, blank=True)
     longitude = models.DecimalField(_('Longitudine'), max_digits=9, decimal_places=6, null=True, blank=True)
+    # Cella geohash delle coordinate, aggiornata al salvataggio (vedi mapping.signals)
+    geohash = models.CharField(_('Geohash'), max_length=12, blank=True, default='', db_index=True, editable=False)
     
     # Dettagli Tecnici
     POWER_TYPE_CHOICES = [
@@ -110,18 +110,40 @@ class EnergyContract(models.Model):
         verbose_name=_('Progetti')
     )
     
-    def get_weighted_average_price(self):
+    def get_timeband_weights(self, profile=None, year=None):
+        """
+        Quote di consumo per fascia F1, F2 e F3.
+        
+        Args:
+            profile: StationUsageProfile da cui ricavare le quote con la
+                simulazione oraria (default pesi indicativi 50/30/20)
+            year: Anno del calendario (default anno corrente)
+            
+        Returns:
+            tuple: Pesi Decimal (F1, F2, F3)
+        """
+        if profile is None:
+            # Pesi indicativi per le fasce in assenza di un profilo di utilizzo
+            return Decimal('0.5'), Decimal('0.3'), Decimal('0.2')
+        
+        from datetime import date
+        from infrastructure.services import EnergyBillService
+        shares = EnergyBillService.timeband_shares(profile, year or date.today().year)
+        return tuple(Decimal(str(round(float(share), 6))) for share in shares)
+    
+    def get_weighted_average_price(self, profile=None, year=None):
         """
         Calcola il prezzo medio ponderato in caso di tariffe a fasce
+        
+        Args:
+            profile: StationUsageProfile che determina i pesi delle fasce
+            year: Anno del calendario
         """
         if self.tariff_type == 'fixed':
             return self.energy_price_kwh
         
         if self.tariff_type == 'time_bands' and self.energy_price_f1 and self.energy_price_f2 and self.energy_price_f3:
-            # Pesi indicativi per le fasce (da personalizzare in base alle statistiche di utilizzo)
-            f1_weight = Decimal('0.5')  # 50% in F1
-            f2_weight = Decimal('0.3')  # 30% in F2
-            f3_weight = Decimal('0.2')  # 20% in F3
+            f1_weight, f2_weight, f3_weight = self.get_timeband_weights(profile, year)
             
             return (
                 (self.energy_price_f1 * f1_weight) + 
@@ -131,11 +153,11 @@ class EnergyContract(models.Model):
         
         return self.energy_price_kwh
     
-    def calculate_monthly_cost(self, kwh_consumption, power_kw):
+    def calculate_monthly_cost(self, kwh_consumption, power_kw, profile=None):
         """
         Calcola il costo mensile in base al consumo e alla potenza
         """
-        energy_cost = kwh_consumption * self.get_weighted_average_price()
+        energy_cost = kwh_consumption * self.get_weighted_average_price(profile)
         power_cost = power_kw * self.power_cost_kw
         total_cost = energy_cost + power_cost + self.fixed_monthly_cost
         
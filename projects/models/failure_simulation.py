@@ -4,6 +4,8 @@ from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
 
+import numpy as np
+
 class FailureSimulation(models.Model):
     """
     Modello per la simulazione dei guasti delle colonnine
@@ -126,143 +128,158 @@ class FailureSimulation(models.Model):
     created_at = models.DateTimeField(_('Data creazione'), auto_now_add=True)
     updated_at = models.DateTimeField(_('Data aggiornamento'), auto_now=True)
     
-    def run_simulation(self, years=10):
+    def run_simulation(self, years=10, seed=None, store_events=True):
         """
-        Esegue la simulazione dei guasti per il periodo specificato
+        Esegue la simulazione dei guasti per il periodo specificato.
+        
+        Guasti, tipi di guasto e fermi di tutte le stazioni per tutti gli anni
+        sono estratti in blocco; i risultati sono salvati come totali per anno
+        più una tabella degli eventi a colonne (opzionale).
+        
+        Args:
+            years: Numero di anni da simulare
+            seed: Seme del generatore casuale (per risultati riproducibili)
+            store_events: Se salvare la tabella dei guasti per stazione
+            
+        Returns:
+            dict: Risultati della simulazione
         """
-        from random import random
+        from .charging_station import ChargingStation
+        from ..services.monte_carlo import FAILURE_TYPES, simulate_failure_events, aggregate_failure_events
         
-        # Ottieni tutte le stazioni di ricarica associate a questo progetto
-        stations = []
-        for subproject in self.project.subproject_set.all():
-            stations.extend(list(subproject.chargingstation_set.all()))
+        # Una sola query con i soli campi necessari alla simulazione
+        rows = list(
+            ChargingStation.objects
+            .filter(sub_project__project=self.project)
+            .order_by('pk')
+            .values_list('id', 'name', 'station_cost', 'charging_price_kwh',
+                         'avg_kwh_session', 'estimated_sessions_day')
+        )
+        total_stations = len(rows)
+        station_ids = [str(row[0]) for row in rows]
+        station_names = [row[1] for row in rows]
+        values = np.array([row[2:] for row in rows], dtype=float).reshape(total_stations, 4)
+        station_costs = values[:, 0]
+        daily_revenues = values[:, 1] * values[:, 2] * values[:, 3]
         
-        total_stations = len(stations)
-        yearly_results = []
+        # Tasso di guasto per anno, limitato al 100%
+        year_numbers = np.arange(1, years + 1)
+        failure_rates = np.minimum(
+            float(self.failure_rate_year1) * (1 + float(self.failure_rate_increase) / 100 * (year_numbers - 1)) / 100,
+            1.0
+        )
         
-        total_failures = 0
-        total_repair_costs = Decimal('0.00')
-        total_revenue_loss = Decimal('0.00')
+        events = simulate_failure_events(
+            failure_rates,
+            station_costs,
+            daily_revenues,
+            type_probabilities=(float(self.minor_repair_percentage) / 100,
+                                float(self.major_repair_percentage) / 100),
+            repair_cost_fractions=(float(self.minor_repair_cost_percentage) / 100,
+                                   float(self.major_repair_cost_percentage) / 100,
+                                   1.0),
+            downtime_days=(self.average_downtime_minor,
+                           self.average_downtime_major,
+                           self.average_downtime_replacement),
+            seed=seed,
+        )
+        totals = aggregate_failure_events(events, years)
         
-        # Esegui la simulazione per ogni anno
-        for year in range(1, years + 1):
-            # Calcola il tasso di guasto per l'anno corrente
-            failure_rate = self.failure_rate_year1 * (1 + (self.failure_rate_increase / 100) * (year - 1)) / 100
-            
-            # Limita il tasso di guasto massimo al 100%
-            failure_rate = min(failure_rate, 1.0)
-            
-            year_failures = 0
-            year_repair_costs = Decimal('0.00')
-            year_revenue_loss = Decimal('0.00')
-            
-            # Simula i guasti per ogni stazione
-            station_failures = []
-            for station in stations:
-                # Determina se la stazione avrà un guasto quest'anno
-                if random() < failure_rate:
-                    # Determina il tipo di guasto
-                    failure_type = self._determine_failure_type()
-                    
-                    # Calcola i costi di riparazione
-                    repair_cost = self._calculate_repair_cost(station, failure_type)
-                    
-                    # Calcola la perdita di ricavi dovuta al downtime
-                    downtime = self._get_downtime(failure_type)
-                    revenue_loss = self._calculate_revenue_loss(station, downtime)
-                    
-                    year_failures += 1
-                    year_repair_costs += repair_cost
-                    year_revenue_loss += revenue_loss
-                    
-                    station_failures.append({
-                        'station_id': station.id,
-                        'station_name': station.name,
-                        'failure_type': failure_type,
-                        'repair_cost': float(repair_cost),
-                        'downtime_days': downtime,
-                        'revenue_loss': float(revenue_loss),
-                    })
-            
+        yearly_results = []
+        for index, year in enumerate(year_numbers.tolist()):
+            failures = int(totals['failures'][index])
+            repair_costs = round(float(totals['repair_costs'][index]), 2)
+            revenue_loss = round(float(totals['revenue_loss'][index]), 2)
             yearly_results.append({
                 'year': year,
-                'failure_rate': float(failure_rate),
-                'failures': year_failures,
-                'repair_costs': float(year_repair_costs),
-                'revenue_loss': float(year_revenue_loss),
+                'failure_rate': float(failure_rates[index]),
+                'failures': failures,
+                'failures_by_type': {
+                    failure_type: int(totals[failure_type][index]) for failure_type in FAILURE_TYPES
+                },
+                'repair_costs': repair_costs,
+                'revenue_loss': revenue_loss,
+                'total_impact': round(repair_costs + revenue_loss, 2),
+                'downtime_days': int(totals['downtime_days'][index]),
                 'total_stations': total_stations,
-                'failure_percentage': year_failures / total_stations * 100 if total_stations > 0 else 0,
-                'station_failures': station_failures
+                'failure_percentage': failures / total_stations * 100 if total_stations > 0 else 0,
             })
-            
-            total_failures += year_failures
-            total_repair_costs += year_repair_costs
-            total_revenue_loss += year_revenue_loss
         
-        # Aggiorna i campi del modello con i risultati
+        total_failures = int(events['year'].size)
+        total_repair_costs = round(float(totals['repair_costs'].sum()), 2)
+        total_revenue_loss = round(float(totals['revenue_loss'].sum()), 2)
+        
         self.simulation_results = {
             'yearly_results': yearly_results,
             'summary': {
                 'total_failures': total_failures,
-                'total_repair_costs': float(total_repair_costs),
-                'total_revenue_loss': float(total_revenue_loss),
-                'total_impact': float(total_repair_costs + total_revenue_loss),
-                'average_yearly_failures': total_failures / years,
-                'average_yearly_costs': float(total_repair_costs / years),
+                'total_repair_costs': total_repair_costs,
+                'total_revenue_loss': total_revenue_loss,
+                'total_impact': round(total_repair_costs + total_revenue_loss, 2),
+                'average_yearly_failures': total_failures / years if years else 0,
+                'average_yearly_costs': total_repair_costs / years if years else 0,
                 'average_failures_per_station': total_failures / total_stations if total_stations > 0 else 0
-            }
+            },
+            'stations': {'id': station_ids, 'name': station_names},
+            'failure_types': list(FAILURE_TYPES),
+            'events': {
+                'year': (events['year'] + 1).tolist(),
+                'station': events['station'].tolist(),
+                'type': events['type'].tolist(),
+                'repair_cost': np.round(events['repair_cost'], 2).tolist(),
+                'downtime_days': events['downtime_days'].tolist(),
+                'revenue_loss': np.round(events['revenue_loss'], 2).tolist(),
+            } if store_events else None,
         }
         
         self.total_failures = total_failures
-        self.total_repair_costs = total_repair_costs
-        self.total_revenue_loss = total_revenue_loss
+        self.total_repair_costs = Decimal(str(total_repair_costs))
+        self.total_revenue_loss = Decimal(str(total_revenue_loss))
         self.save()
         
         return self.simulation_results
     
-    def _determine_failure_type(self):
+    def station_failures_by_year(self, limit=None):
         """
-        Determina il tipo di guasto in base alle probabilità configurate
+        Ricostruisce dalla tabella degli eventi il dettaglio dei guasti per anno.
+        
+        Args:
+            limit: Numero massimo di guasti per anno (i più costosi), None = tutti
+            
+        Returns:
+            dict: Lista di guasti per anno, ciascuno con stazione, tipo,
+                costo di riparazione, fermo e perdita di ricavi
         """
-        from random import random
+        results = self.simulation_results or {}
+        events = results.get('events')
+        if not events or not events['year']:
+            return {}
         
-        rand = random() * 100
+        names = results['stations']['name']
+        ids = results['stations']['id']
+        failure_types = results['failure_types']
         
-        if rand < self.minor_repair_percentage:
-            return 'minor'
-        elif rand < (self.minor_repair_percentage + self.major_repair_percentage):
-            return 'major'
-        else:
-            return 'replacement'
-    
-    def _calculate_repair_cost(self, station, failure_type):
-        """
-        Calcola il costo di riparazione in base al tipo di guasto
-        """
-        if failure_type == 'minor':
-            return station.station_cost * (self.minor_repair_cost_percentage / 100)
-        elif failure_type == 'major':
-            return station.station_cost * (self.major_repair_cost_percentage / 100)
-        else:  # replacement
-            return station.station_cost
-    
-    def _get_downtime(self, failure_type):
-        """
-        Restituisce il downtime in base al tipo di guasto
-        """
-        if failure_type == 'minor':
-            return self.average_downtime_minor
-        elif failure_type == 'major':
-            return self.average_downtime_major
-        else:  # replacement
-            return self.average_downtime_replacement
-    
-    def _calculate_revenue_loss(self, station, downtime_days):
-        """
-        Calcola la perdita di ricavi durante il downtime
-        """
-        daily_revenue = station.charging_price_kwh * station.avg_kwh_session * station.estimated_sessions_day
-        return daily_revenue * downtime_days
+        year = np.asarray(events['year'])
+        impact = np.asarray(events['repair_cost']) + np.asarray(events['revenue_loss'])
+        # Ordine per anno e, nello stesso anno, per impatto decrescente
+        order = np.lexsort((-impact, year))
+        if limit is not None:
+            sorted_years = year[order]
+            rank = np.arange(order.size) - np.searchsorted(sorted_years, sorted_years)
+            order = order[rank < limit]
+        
+        details = {}
+        for index in order.tolist():
+            station = events['station'][index]
+            details.setdefault(events['year'][index], []).append({
+                'station_id': ids[station],
+                'station_name': names[station],
+                'failure_type': failure_types[events['type'][index]],
+                'repair_cost': events['repair_cost'][index],
+                'downtime_days': events['downtime_days'][index],
+                'revenue_loss': events['revenue_loss'][index],
+            })
+        return details
     
     def __str__(self):
         return f"Simulazione guasti: {self.project.name}"
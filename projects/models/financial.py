@@ -5,6 +5,59 @@ from django.utils.translation import gettext_lazy as _
 from projects.models import Project
 from .charging_station import ChargingStation
 
+
+def default_seasonal_adjustments():
+    """Fattori stagionali neutri (1.0) per tutti i mesi"""
+    return {str(month): 1.0 for month in range(1, 13)}
+
+
+class FinancialConfig(models.Model):
+    """Configurazione del modello finanziario (tasso di sconto e stagionalità)"""
+    
+    name = models.CharField(_('Nome configurazione'), max_length=100, default="Default")
+    is_default = models.BooleanField(_('Configurazione predefinita'), default=False)
+    
+    discount_rate = models.DecimalField(
+        _('Tasso di sconto'),
+        max_digits=5, 
+        decimal_places=2, 
+        default=5.0,
+        validators=[MinValueValidator(0), MaxValueValidator(50)],
+        help_text=_("Tasso di sconto annuale per il calcolo del NPV in %")
+    )
+    seasonal_adjustments = models.JSONField(
+        _('Aggiustamenti stagionali'),
+        default=default_seasonal_adjustments,
+        help_text=_("Fattori moltiplicativi per mese (chiavi '1'-'12')")
+    )
+    
+    created_at = models.DateTimeField(_('Data creazione'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('Data aggiornamento'), auto_now=True)
+    
+    def __str__(self):
+        return self.name
+    
+    def save(self, *args, **kwargs):
+        """Assicura che ci sia sempre una sola configurazione predefinita"""
+        if self.is_default:
+            FinancialConfig.objects.exclude(pk=self.pk).update(is_default=False)
+        super().save(*args, **kwargs)
+    
+    @classmethod
+    def get_default(cls):
+        """Ottiene la configurazione predefinita, o ne crea una nuova se non esiste"""
+        try:
+            return cls.objects.get(is_default=True)
+        except cls.DoesNotExist:
+            config = cls(name="Default", is_default=True)
+            config.save()
+            return config
+    
+    class Meta:
+        verbose_name = _("Configurazione finanziaria")
+        verbose_name_plural = _("Configurazioni finanziarie")
+
+
 class FinancialParameters(models.Model):
     """Parametri finanziari globali per il calcolo del ROI e delle previsioni finanziarie"""
     
@@ -114,6 +167,44 @@ class FinancialParameters(models.Model):
         validators=[MinValueValidator(0), MaxValueValidator(100)],
         help_text=_("Costo medio di riparazione come % del costo della colonnina")
     )
+    monte_carlo_runs = models.PositiveIntegerField(
+        _('Repliche Monte Carlo'),
+        default=10000,
+        validators=[MinValueValidator(1), MaxValueValidator(100000)],
+        help_text=_("Numero di repliche della simulazione guasti")
+    )
+    random_seed = models.PositiveIntegerField(
+        _('Seme casuale'),
+        default=42,
+        help_text=_("Seme della simulazione guasti: a parità di seme i risultati sono identici")
+    )
+    FAILURE_ANALYSIS_CHOICES = [
+        ('analytic', _('Analitico (valori attesi)')),
+        ('monte_carlo', _('Simulazione Monte Carlo')),
+    ]
+    failure_analysis_method = models.CharField(
+        _('Metodo analisi guasti'),
+        max_length=20,
+        choices=FAILURE_ANALYSIS_CHOICES,
+        default='analytic',
+        help_text=_("Il metodo analitico calcola i costi attesi in forma chiusa; "
+                    "la simulazione Monte Carlo aggiunge le bande percentili")
+    )
+    
+    # Configurazione del modello finanziario
+    config = models.ForeignKey(
+        FinancialConfig,
+        on_delete=models.SET_NULL,
+        null=True, blank=True,
+        related_name='parameters',
+        verbose_name=_('Configurazione'),
+        help_text=_("Se vuota, viene usata la configurazione predefinita")
+    )
+    apply_seasonal_adjustments = models.BooleanField(
+        _('Applica aggiustamenti stagionali'),
+        default=True,
+        help_text=_("Applica i fattori stagionali ai flussi di cassa mensili")
+    )
     
     created_at = models.DateTimeField(_('Data creazione'), auto_now_add=True)
     updated_at = models.DateTimeField(_('Data aggiornamento'), auto_now=True)
@@ -221,7 +312,7 @@ class FinancialAnalysis(models.Model):
     monthly_cash_flow = models.JSONField(
         _('Flussi di cassa mensili'),
         default=dict,
-        help_text=_("Flussi di cassa mensili in formato JSON (primi 24 mesi)")
+        help_text=_("Flussi di cassa mensili in formato JSON (intero orizzonte dell'investimento)")
     )
     loan_schedule = models.JSONField(
         _('Piano ammortamento prestito'),
@@ -233,6 +324,12 @@ class FinancialAnalysis(models.Model):
         default=dict,
         help_text=_("Simulazione di guasti e riparazioni in formato JSON")
     )
+    sensitivity_analysis = models.JSONField(
+        _('Analisi di sensibilità'),
+        default=dict,
+        blank=True,
+        help_text=_("NPV e IRR al variare dei driver (dati per grafici tornado e spider)")
+    )
     
     created_at = models.DateTimeField(_('Data creazione'), auto_now_add=True)
     updated_at = models.DateTimeField(_('Data aggiornamento'), auto_now=True)
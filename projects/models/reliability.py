@@ -0,0 +1,118 @@
+# cpo_planner/projects/models/reliability.py
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+from django.core.validators import MinValueValidator, MaxValueValidator
+
+
+class ReliabilityProfile(models.Model):
+    """
+    Curva di affidabilità (tasso di guasto in funzione dell'età) per un tipo di colonnina.
+
+    Il profilo si applica alle colonnine con la marca, il modello e il tipo di
+    potenza indicati; i campi vuoti valgono per qualsiasi valore. A parità di
+    corrispondenza vince il profilo più specifico.
+    """
+    CURVE_CHOICES = [
+        ('weibull', _('Weibull')),
+        ('bathtub', _('Vasca da bagno (mortalità infantile + casuali + usura)')),
+    ]
+    POWER_TYPE_CHOICES = [
+        ('ac', _('AC')),
+        ('dc', _('DC')),
+        ('ac_dc', _('AC/DC')),
+    ]
+
+    name = models.CharField(_('Nome profilo'), max_length=100)
+    brand = models.CharField(_('Marca'), max_length=100, blank=True,
+                             help_text=_('Vuoto = qualsiasi marca'))
+    model = models.CharField(_('Modello'), max_length=100, blank=True,
+                             help_text=_('Vuoto = qualsiasi modello'))
+    power_type = models.CharField(_('Tipo di potenza'), max_length=10, choices=POWER_TYPE_CHOICES, blank=True,
+                                  help_text=_('Vuoto = qualsiasi tipo di potenza'))
+
+    curve = models.CharField(_('Curva di guasto'), max_length=10, choices=CURVE_CHOICES, default='weibull')
+
+    # Usura (Weibull): tasso di guasto crescente per forma > 1
+    shape = models.FloatField(
+        _('Forma Weibull'),
+        default=1.5,
+        validators=[MinValueValidator(0.1), MaxValueValidator(10)],
+        help_text=_('Parametro di forma (beta): < 1 guasti precoci, 1 costante, > 1 usura')
+    )
+    scale_years = models.FloatField(
+        _('Scala Weibull (anni)'),
+        default=12.0,
+        validators=[MinValueValidator(0.1)],
+        help_text=_('Parametro di scala (eta) in anni')
+    )
+
+    # Componenti aggiuntive della curva a vasca da bagno
+    infant_shape = models.FloatField(
+        _('Forma mortalità infantile'),
+        default=0.5,
+        validators=[MinValueValidator(0.1), MaxValueValidator(1)],
+        help_text=_('Forma Weibull (< 1) dei guasti precoci, solo per la curva a vasca da bagno')
+    )
+    infant_scale_years = models.FloatField(
+        _('Scala mortalità infantile (anni)'),
+        default=50.0,
+        validators=[MinValueValidator(0.1)],
+        help_text=_('Scala Weibull dei guasti precoci, solo per la curva a vasca da bagno')
+    )
+    random_failure_rate = models.FloatField(
+        _('Guasti casuali (per anno)'),
+        default=0.02,
+        validators=[MinValueValidator(0)],
+        help_text=_('Tasso costante di guasti casuali, solo per la curva a vasca da bagno')
+    )
+
+    # Conseguenze di un guasto
+    repair_cost_percentage = models.DecimalField(
+        _('Costo riparazione %'),
+        max_digits=5,
+        decimal_places=2,
+        default=10.0,
+        validators=[MinValueValidator(0), MaxValueValidator(100)],
+        help_text=_('Costo medio di un intervento come % del costo della colonnina')
+    )
+    downtime_days = models.DecimalField(
+        _('Fermo medio (giorni)'),
+        max_digits=5,
+        decimal_places=1,
+        default=3.0,
+        validators=[MinValueValidator(0)],
+        help_text=_('Giorni medi di inattività per guasto')
+    )
+
+    created_at = models.DateTimeField(_('Data creazione'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('Data aggiornamento'), auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    def matches(self, brand, model, power_type):
+        """
+        Verifica se il profilo si applica a una colonnina.
+
+        Args:
+            brand: Marca della colonnina
+            model: Modello della colonnina
+            power_type: Tipo di potenza della stazione
+
+        Returns:
+            bool: True se tutti i campi valorizzati del profilo corrispondono
+        """
+        return all(
+            not expected or (actual or '').strip().lower() == expected.strip().lower()
+            for expected, actual in ((self.brand, brand), (self.model, model), (self.power_type, power_type))
+        )
+
+    @property
+    def specificity(self):
+        """Punteggio di specificità: marca e modello contano più del tipo di potenza"""
+        return 4 * bool(self.brand) + 2 * bool(self.model) + bool(self.power_type)
+
+    class Meta:
+        verbose_name = _('Profilo di affidabilità')
+        verbose_name_plural = _('Profili di affidabilità')
+        ordering = ['brand', 'model', 'power_type']
@@ -1,4 +1,5 @@
 # Importa i servizi per renderli disponibili
 from .financial_analysis import FinancialAnalysisService
+from .portfolio import run_portfolio_analysis
 
-__all__ = ['FinancialAnalysisService']
+__all__ = ['FinancialAnalysisService', 'run_portfolio_analysis']
@@ -0,0 +1,260 @@
+from functools import lru_cache
+
+import numpy as np
+
+
+SCHEDULE_KEYS = ('payment', 'interest', 'principal', 'prepayment', 'balance')
+
+
+def annuity_payment(balance, rate, periods, balloon=0.0):
+    """
+    Calcola la rata costante che porta il debito al valore residuo indicato.
+
+    Args:
+        balance: Debito iniziale (scalare o array)
+        rate: Tasso per periodo (frazione)
+        periods: Numero di rate
+        balloon: Debito residuo da rimborsare in un'unica soluzione alla fine
+
+    Returns:
+        np.ndarray: Rata per periodo
+    """
+    balance = np.asarray(balance, dtype=float)
+    rate = np.asarray(rate, dtype=float)
+    periods = np.maximum(np.asarray(periods, dtype=float), 1.0)
+    balloon = np.asarray(balloon, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        discount = np.power(1.0 + rate, -periods)
+        amortizing = (balance - balloon * discount) * rate / (1.0 - discount)
+    return np.where(rate > 0, amortizing, (balance - balloon) / periods)
+
+
+def annuity_balance(balance, rate, payment, k):
+    """
+    Debito residuo dopo k rate costanti.
+
+    Args:
+        balance: Debito iniziale
+        rate: Tasso per periodo (frazione)
+        payment: Rata per periodo
+        k: Numero di rate pagate (scalare o array)
+
+    Returns:
+        np.ndarray: Debito residuo
+    """
+    balance = np.asarray(balance, dtype=float)
+    rate = np.asarray(rate, dtype=float)
+    growth = np.power(1.0 + rate, k)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        amortizing = balance * growth - payment * (growth - 1.0) / rate
+    return np.where(rate > 0, amortizing, balance - payment * k)
+
+
+def _build_schedule(principal, rate, periods, interest_only, balloon, prepayments):
+    """
+    Piano di ammortamento a rata costante (metodo francese) per periodi.
+
+    Il piano è diviso in segmenti dal preammortamento e dalle estinzioni
+    parziali; ogni segmento è calcolato in forma chiusa. Dopo un'estinzione
+    parziale la durata resta invariata e la rata viene ricalcolata.
+    """
+    schedule = {key: np.zeros(periods + 1) for key in SCHEDULE_KEYS}
+    schedule['balance'][0] = principal
+
+    breakpoints = sorted({0, min(interest_only, periods), periods} |
+                         {p for p in prepayments if 0 < p < periods})
+    balance = principal
+    for start, end in zip(breakpoints[:-1], breakpoints[1:]):
+        k = np.arange(1, end - start + 1)
+        if end <= interest_only:
+            # Preammortamento: solo interessi, il debito non cambia
+            balances = np.full(k.size, balance)
+            payment = balance * rate
+        else:
+            payment = float(annuity_payment(balance, rate, periods - start, balloon))
+            balances = annuity_balance(balance, rate, payment, k)
+
+        previous = np.concatenate([[balance], balances[:-1]])
+        rows = slice(start + 1, end + 1)
+        schedule['interest'][rows] = previous * rate
+        schedule['payment'][rows] = payment
+        schedule['principal'][rows] = payment - previous * rate
+        schedule['balance'][rows] = balances
+        balance = float(balances[-1])
+
+        if end < periods and end in prepayments:
+            extra = min(float(prepayments[end]), balance)
+            schedule['prepayment'][end] = extra
+            balance -= extra
+            schedule['balance'][end] = balance
+
+    # Maxi-rata finale (o rimborso in unica soluzione se non c'è ammortamento)
+    if periods > 0:
+        residual = schedule['balance'][periods]
+        schedule['payment'][periods] += residual
+        schedule['principal'][periods] += residual
+        schedule['balance'][periods] = 0.0
+
+    return schedule
+
+
+@lru_cache(maxsize=1024)
+def _cached_schedule(principal, annual_rate, term_years, pre_amortization_years,
+                     periods_per_year, balloon, prepayments):
+    periods = term_years * periods_per_year
+    schedule = _build_schedule(
+        principal,
+        annual_rate / periods_per_year,
+        periods,
+        pre_amortization_years * periods_per_year,
+        balloon,
+        dict(prepayments),
+    )
+    for values in schedule.values():
+        values.setflags(write=False)
+    return schedule
+
+
+def loan_schedule(principal, annual_rate, term_years, pre_amortization_years=0,
+                  periods_per_year=12, balloon=0.0, prepayments=None):
+    """
+    Calcola il piano di ammortamento per periodo (memoizzato per parametri).
+
+    La durata comprende il preammortamento, durante il quale si pagano solo
+    gli interessi; le rate successive sono costanti.
+
+    Args:
+        principal: Importo del prestito
+        annual_rate: Tasso annuo nominale (frazione)
+        term_years: Durata complessiva in anni (preammortamento incluso)
+        pre_amortization_years: Anni di solo interessi
+        periods_per_year: Rate per anno (12 = mensili)
+        balloon: Maxi-rata finale (debito residuo rimborsato all'ultima rata)
+        prepayments: Estinzioni parziali {periodo: importo}, dopo la rata del periodo
+
+    Returns:
+        dict: Array di sola lettura con forma (periodi + 1,) per ogni voce
+            di SCHEDULE_KEYS (periodo 0 = erogazione)
+    """
+    return _cached_schedule(
+        float(principal),
+        float(annual_rate),
+        int(term_years),
+        int(pre_amortization_years),
+        int(periods_per_year),
+        float(balloon),
+        tuple(sorted((int(p), float(a)) for p, a in (prepayments or {}).items())),
+    )
+
+
+def to_annual(schedule, periods_per_year):
+    """
+    Aggrega un piano per periodo in un piano annuale.
+
+    Args:
+        schedule: Piano restituito da loan_schedule
+        periods_per_year: Rate per anno del piano
+
+    Returns:
+        dict: Array con forma (..., anni + 1,); l'anno 0 contiene solo il debito iniziale
+    """
+    annual = {}
+    for key in SCHEDULE_KEYS:
+        values = np.asarray(schedule[key])
+        head = values[..., :1]
+        body = values[..., 1:].reshape(values.shape[:-1] + (-1, periods_per_year))
+        if key == 'balance':
+            annual[key] = np.concatenate([head, body[..., -1]], axis=-1)
+        else:
+            annual[key] = np.concatenate([np.zeros_like(head), body.sum(axis=-1)], axis=-1)
+    return annual
+
+
+def annual_loan_schedule(principal, annual_rate, term_years, pre_amortization_years=0,
+                         periods_per_year=12, balloon=0.0, prepayments=None):
+    """
+    Piano di ammortamento annuale nel formato JSON di FinancialAnalysis.
+
+    Args:
+        principal: Importo del prestito
+        annual_rate: Tasso annuo nominale (frazione)
+        term_years: Durata complessiva in anni (preammortamento incluso)
+        pre_amortization_years: Anni di solo interessi
+        periods_per_year: Rate per anno su cui si basa il calcolo
+        balloon: Maxi-rata finale
+        prepayments: Estinzioni parziali {periodo: importo}
+
+    Returns:
+        dict: Liste annuali 'years', 'payment', 'interest', 'principal',
+            'prepayment' e 'balance'
+    """
+    if float(principal) <= 0 or int(term_years) <= 0:
+        return {'years': [], **{key: [] for key in SCHEDULE_KEYS}}
+
+    schedule = loan_schedule(principal, annual_rate, term_years, pre_amortization_years,
+                             periods_per_year, balloon, prepayments)
+    annual = to_annual(schedule, periods_per_year)
+    result = {'years': list(range(int(term_years) + 1))}
+    for key in SCHEDULE_KEYS:
+        result[key] = np.round(annual[key], 2).tolist()
+    return result
+
+
+def loan_schedules_batch(principals, annual_rates, term_years, pre_amortization_years=0,
+                         periods_per_year=12, balloons=0.0):
+    """
+    Calcola in blocco i piani di ammortamento di più prestiti.
+
+    Tutti i prestiti sono valutati insieme in forma chiusa; i piani più brevi
+    sono completati con zeri fino alla durata massima. Le estinzioni parziali
+    non sono supportate in blocco (usare loan_schedule).
+
+    Args:
+        principals: Importi dei prestiti, forma (L,)
+        annual_rates: Tassi annui nominali (frazione), scalare o (L,)
+        term_years: Durate complessive in anni, scalare o (L,)
+        pre_amortization_years: Anni di solo interessi, scalare o (L,)
+        periods_per_year: Rate per anno (uguale per tutti i prestiti)
+        balloons: Maxi-rate finali, scalare o (L,)
+
+    Returns:
+        dict: Array con forma (L, periodi massimi + 1) per ogni voce di SCHEDULE_KEYS
+    """
+    principals = np.atleast_1d(np.asarray(principals, dtype=float))
+    shape = principals.shape
+    rate = np.broadcast_to(np.asarray(annual_rates, dtype=float), shape) / periods_per_year
+    periods = np.broadcast_to(np.asarray(term_years, dtype=int), shape) * periods_per_year
+    interest_only = np.minimum(
+        np.broadcast_to(np.asarray(pre_amortization_years, dtype=int), shape) * periods_per_year, periods)
+    balloons = np.broadcast_to(np.asarray(balloons, dtype=float), shape)
+
+    max_periods = int(periods.max()) if periods.size else 0
+    k = np.arange(max_periods + 1)[None, :]
+
+    P, r, n, g = principals[:, None], rate[:, None], periods[:, None], interest_only[:, None]
+    payment = annuity_payment(P, r, n - g, balloons[:, None])
+
+    # Debito residuo: costante nel preammortamento, poi ammortamento a rata costante
+    amortized = annuity_balance(P, r, payment, np.maximum(k - g, 0))
+    balance = np.where(k <= g, P, amortized)
+    balance = np.where(k <= n, balance, 0.0)
+
+    previous = np.concatenate([balance[:, :1], balance[:, :-1]], axis=1)
+    active = (k >= 1) & (k <= n)
+    interest = np.where(active, previous * r, 0.0)
+    payments = np.where(active, np.where(k <= g, interest, payment), 0.0)
+
+    # Maxi-rata o rimborso finale del residuo all'ultima rata
+    final = k == n
+    residual = np.where(final, balance, 0.0)
+    payments = payments + residual
+    balance = np.where(final, 0.0, balance)
+
+    return {
+        'payment': payments,
+        'interest': interest,
+        'principal': payments - interest,
+        'prepayment': np.zeros_like(payments),
+        'balance': balance,
+    }
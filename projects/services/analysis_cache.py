@@ -0,0 +1,215 @@
+import hashlib
+import json
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+
+from ..models.financial import FinancialAnalysis
+from .reliability import station_identity
+
+
+CACHE_PREFIX = 'financial_analysis'
+
+# Da incrementare quando cambia la logica di calcolo, per scartare i risultati vecchi
+CACHE_VERSION = 4
+
+# Campi delle stazioni che entrano nel calcolo (costi e utilizzo)
+STATION_INPUT_FIELDS = (
+    'station_cost',
+    'installation_cost',
+    'connection_cost',
+    'design_cost',
+    'permit_cost',
+    'other_costs',
+    'energy_cost_kwh',
+    'charging_price_kwh',
+    'estimated_sessions_day',
+    'avg_kwh_session',
+    'power_type',
+    'activation_date',
+    'installation_date',
+)
+
+# Campi del sotto-progetto che influenzano i ricavi delle stazioni (disponibilità)
+SUBPROJECT_INPUT_FIELDS = (
+    'weekly_market_day',
+    'local_festival_days',
+    'rainy_days',
+)
+
+PARAMETER_EXCLUDED_FIELDS = ('id', 'project', 'config', 'created_at', 'updated_at')
+
+PROFILE_EXCLUDED_FIELDS = ('created_at', 'updated_at')
+
+
+def get_cache():
+    """Restituisce la cache configurata per le analisi finanziarie"""
+    return caches[getattr(settings, 'FINANCIAL_ANALYSIS_CACHE', 'default')]
+
+
+def _station_inputs(station, by_charger=False):
+    """Valori di input di una singola stazione"""
+    values = {field: getattr(station, field, None) for field in STATION_INPUT_FIELDS}
+    if by_charger:
+        # Marca e modello scelgono il profilo di affidabilità della stazione
+        values['identity'] = station_identity(station)
+    subproject = getattr(station, 'subproject', None)
+    if subproject is not None:
+        values.update({field: getattr(subproject, field, None) for field in SUBPROJECT_INPUT_FIELDS})
+    values['id'] = station.pk
+    return values
+
+
+def analysis_inputs(service):
+    """
+    Raccoglie tutti gli input di un'analisi finanziaria in forma serializzabile.
+
+    Args:
+        service: Istanza di FinancialAnalysisService
+
+    Returns:
+        dict: Input dell'analisi
+    """
+    params = service.params
+    config = service.financial_model.config
+
+    profiles = service.get_reliability_profiles()
+    by_charger = any(profile.brand or profile.model for profile in profiles)
+    stations = sorted(
+        (_station_inputs(station, by_charger) for station in service._get_stations()),
+        key=lambda values: str(values['id'])
+    )
+
+    return {
+        'version': CACHE_VERSION,
+        'owner': _owner(service),
+        'parameters': {
+            field.name: field.value_from_object(params)
+            for field in params._meta.concrete_fields
+            if field.name not in PARAMETER_EXCLUDED_FIELDS
+        },
+        'config': {
+            'discount_rate': config.discount_rate,
+            'seasonal_adjustments': config.seasonal_adjustments,
+        },
+        'stations': stations,
+        'reliability_profiles': [
+            {
+                field.name: field.value_from_object(profile)
+                for field in profile._meta.concrete_fields
+                if field.name not in PROFILE_EXCLUDED_FIELDS
+            }
+            for profile in sorted(profiles, key=lambda profile: profile.pk)
+        ],
+        # I flussi mensili partono dal mese corrente
+        'start_month': date.today().strftime('%Y-%m'),
+    }
+
+
+def inputs_digest(inputs):
+    """
+    Calcola un hash stabile degli input.
+
+    Args:
+        inputs: Dizionario restituito da analysis_inputs
+
+    Returns:
+        str: Digest SHA-256 esadecimale
+    """
+    payload = json.dumps(inputs, sort_keys=True, default=_json_default, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _json_default(value):
+    """Normalizza i valori non JSON (Decimal('1.00') e 1.0 devono dare lo stesso hash)"""
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def _owner(service):
+    """Identifica il progetto o la stazione a cui appartiene l'analisi"""
+    if service.project:
+        return {'project': service.project.pk}
+    return {'charging_station': service.charging_station.pk}
+
+
+def _owner_key(project_id=None, station_id=None):
+    if project_id is not None:
+        return f'{CACHE_PREFIX}:project:{project_id}'
+    return f'{CACHE_PREFIX}:station:{station_id}'
+
+
+def _result_key(digest):
+    return f'{CACHE_PREFIX}:result:{digest}'
+
+
+def get_cached_analysis(service, digest):
+    """
+    Restituisce l'analisi salvata per questi input, se presente in cache.
+
+    Args:
+        service: Istanza di FinancialAnalysisService
+        digest: Digest degli input
+
+    Returns:
+        FinancialAnalysis: Analisi salvata, oppure None
+    """
+    analysis_id = get_cache().get(_result_key(digest))
+    if analysis_id is None:
+        return None
+
+    # Il filtro sul proprietario protegge da righe cancellate o riassegnate
+    return FinancialAnalysis.objects.filter(pk=analysis_id, **_owner(service)).first()
+
+
+def store_analysis(service, digest, analysis):
+    """
+    Registra in cache l'analisi calcolata per questi input.
+
+    Args:
+        service: Istanza di FinancialAnalysisService
+        digest: Digest degli input
+        analysis: FinancialAnalysis salvata
+    """
+    cache = get_cache()
+    owner = _owner(service)
+    owner_key = _owner_key(owner.get('project'), owner.get('charging_station'))
+
+    # Il risultato precedente dello stesso proprietario non è più raggiungibile
+    previous = cache.get(owner_key)
+    if previous and previous != digest:
+        cache.delete(_result_key(previous))
+
+    cache.set_many({
+        _result_key(digest): analysis.pk,
+        owner_key: digest,
+    })
+
+
+def _invalidate(owner_keys):
+    cache = get_cache()
+    digests = cache.get_many(owner_keys)
+    cache.delete_many(list(owner_keys) + [_result_key(digest) for digest in digests.values()])
+
+
+def invalidate_projects(project_ids):
+    """
+    Invalida le analisi in cache dei progetti indicati.
+
+    Args:
+        project_ids: ID dei progetti
+    """
+    _invalidate([_owner_key(project_id=project_id) for project_id in project_ids])
+
+
+def invalidate_stations(station_ids):
+    """
+    Invalida le analisi in cache delle stazioni indicate.
+
+    Args:
+        station_ids: ID delle stazioni (projects.ChargingStation)
+    """
+    _invalidate([_owner_key(station_id=station_id) for station_id in station_ids])
@@ -0,0 +1,267 @@
+import numpy as np
+
+
+YEARLY_CASH_FLOW_KEYS = (
+    'revenue',
+    'operational_costs',
+    'maintenance_costs',
+    'repair_costs',
+    'loan_payments',
+    'net_cash_flow',
+    'cumulative_cash_flow',
+)
+
+
+def growth_factors(rate, periods):
+    """
+    Calcola i fattori di crescita composti (1 + rate) ** t per t = 0..periods-1.
+
+    Args:
+        rate: Tasso per periodo (scalare o array con asse finale di lunghezza 1)
+        periods: Numero di periodi
+
+    Returns:
+        np.ndarray: Fattori di crescita con forma (..., periods)
+    """
+    exponents = np.arange(periods, dtype=float)
+    return np.power(1.0 + np.asarray(rate, dtype=float), exponents)
+
+
+def yearly_cash_flow_arrays(total_investment, base_revenue, base_energy_cost, years,
+                            market_growth=0.0, inflation=0.0, maintenance_percentage=0.0,
+                            energy_price_increase=0.0, charging_price_increase=0.0,
+                            loan_payments=None, repair_costs=None):
+    """
+    Calcola in un unico passaggio vettoriale i flussi di cassa annuali.
+
+    Tutti i parametri numerici possono essere scalari o array con forma (N, 1):
+    in questo caso il risultato contiene N serie indipendenti (es. scenari).
+    L'anno 0 contiene solo l'investimento iniziale (negativo).
+
+    Args:
+        total_investment: Investimento totale iniziale
+        base_revenue: Ricavi annuali del primo anno
+        base_energy_cost: Costi operativi annuali del primo anno
+        years: Numero di anni dell'investimento
+        market_growth: Tasso di crescita del mercato (frazione)
+        inflation: Tasso di inflazione (frazione)
+        maintenance_percentage: Manutenzione annua come frazione dell'investimento
+        energy_price_increase: Aumento annuo del prezzo dell'energia (frazione)
+        charging_price_increase: Aumento annuo del prezzo di ricarica (frazione)
+        loan_payments: Rate del prestito indicizzate per anno (indice 0 = anno 0)
+        repair_costs: Costi attesi di riparazione per gli anni 1..years
+
+    Returns:
+        dict: Array con forma (..., years + 1) per ogni voce di YEARLY_CASH_FLOW_KEYS
+    """
+    total_investment = np.asarray(total_investment, dtype=float)
+    base_revenue = np.asarray(base_revenue, dtype=float)
+    base_energy_cost = np.asarray(base_energy_cost, dtype=float)
+
+    market_factor = growth_factors(market_growth, years)
+    inflation_factor = growth_factors(inflation, years)
+    energy_price_factor = growth_factors(energy_price_increase, years)
+    charging_price_factor = growth_factors(charging_price_increase, years)
+
+    revenue = np.round(base_revenue * market_factor * charging_price_factor, 2)
+    operational_costs = np.round(base_energy_cost * market_factor * energy_price_factor, 2)
+    maintenance_costs = np.round(
+        total_investment * np.asarray(maintenance_percentage, dtype=float) * inflation_factor, 2)
+
+    # Le rate oltre la durata del prestito sono nulle, quelle oltre l'orizzonte ignorate
+    payments = np.zeros(years + 1)
+    if loan_payments is not None:
+        loan_payments = np.asarray(loan_payments, dtype=float)
+        n = min(len(loan_payments), years + 1)
+        payments[:n] = loan_payments[:n]
+    payments[0] = 0.0
+    payments = np.round(payments[1:], 2)
+
+    repairs = np.zeros(years)
+    if repair_costs is not None:
+        repair_costs = np.asarray(repair_costs, dtype=float)
+        n = min(repair_costs.shape[-1], years)
+        repairs = np.zeros(repair_costs.shape[:-1] + (years,))
+        repairs[..., :n] = repair_costs[..., :n]
+    repairs = np.round(repairs, 2)
+
+    shape = np.broadcast_shapes(revenue.shape, operational_costs.shape,
+                                maintenance_costs.shape, repairs.shape, payments.shape)
+
+    def with_year_zero(values, first=0.0):
+        values = np.broadcast_to(values, shape)
+        head = np.broadcast_to(np.asarray(first, dtype=float), shape[:-1] + (1,))
+        return np.concatenate([head, values], axis=-1)
+
+    net = revenue - operational_costs - maintenance_costs - repairs - payments
+    net_cash_flow = with_year_zero(np.round(net, 2), first=-total_investment)
+    cumulative_cash_flow = np.round(np.cumsum(net_cash_flow, axis=-1), 2)
+
+    return {
+        'revenue': with_year_zero(revenue),
+        'operational_costs': with_year_zero(operational_costs),
+        'maintenance_costs': with_year_zero(maintenance_costs),
+        'repair_costs': with_year_zero(repairs),
+        'loan_payments': with_year_zero(payments),
+        'net_cash_flow': net_cash_flow,
+        'cumulative_cash_flow': cumulative_cash_flow,
+    }
+
+
+MONTHLY_CASH_FLOW_KEYS = (
+    'revenue',
+    'operational_costs',
+    'maintenance_costs',
+    'repair_costs',
+    'loan_payments',
+    'net_cash_flow',
+    'cumulative_cash_flow',
+    'seasonal_factors',
+)
+
+
+def calendar_months(start_year, start_month, count):
+    """
+    Restituisce anno e mese di calendario di count mesi consecutivi.
+
+    Args:
+        start_year: Anno del primo mese
+        start_month: Mese (1-12) del primo mese
+        count: Numero di mesi
+
+    Returns:
+        tuple: (anni, mesi 1-12) come array
+    """
+    index = start_year * 12 + (start_month - 1) + np.arange(count)
+    years, months = np.divmod(index, 12)
+    return years, months + 1
+
+
+def monthly_cash_flow_arrays(total_investment, base_revenue, base_energy_cost, years,
+                             start_year, start_month, seasonal_factors=None,
+                             market_growth=0.0, inflation=0.0, maintenance_percentage=0.0,
+                             energy_price_increase=0.0, charging_price_increase=0.0,
+                             loan_payments=None, repair_costs=None):
+    """
+    Calcola in un unico passaggio vettoriale i flussi di cassa mensili sull'intero orizzonte.
+
+    Il mese 0 è il mese di calendario iniziale e contiene solo l'investimento;
+    i mesi 1..years*12 seguono il calendario reale. I tassi annuali sono
+    ripartiti su base mensile (tasso / 12) e i costi di riparazione annuali
+    sono divisi in dodicesimi.
+
+    Args:
+        total_investment: Investimento totale iniziale
+        base_revenue: Ricavi annuali del primo anno
+        base_energy_cost: Costi operativi annuali del primo anno
+        years: Numero di anni dell'investimento
+        start_year: Anno del mese 0
+        start_month: Mese (1-12) del mese 0
+        seasonal_factors: Dodici fattori stagionali (gennaio-dicembre), None = nessuno
+        market_growth: Tasso annuo di crescita del mercato (frazione)
+        inflation: Tasso annuo di inflazione (frazione)
+        maintenance_percentage: Manutenzione annua come frazione dell'investimento
+        energy_price_increase: Aumento annuo del prezzo dell'energia (frazione)
+        charging_price_increase: Aumento annuo del prezzo di ricarica (frazione)
+        loan_payments: Rate mensili del prestito indicizzate per mese (indice 0 = mese 0)
+        repair_costs: Costi attesi di riparazione per gli anni 1..years
+
+    Returns:
+        dict: Array con forma (months + 1,) per ogni voce di MONTHLY_CASH_FLOW_KEYS,
+            più 'calendar_years' e 'calendar_months'
+    """
+    months = years * 12
+    total_investment = float(total_investment)
+
+    calendar_year, calendar_month = calendar_months(start_year, start_month, months + 1)
+
+    if seasonal_factors is None:
+        factors = np.ones(12)
+    else:
+        factors = np.round(np.asarray(seasonal_factors, dtype=float), 2)
+    seasonal = factors[calendar_month[1:] - 1]
+
+    market_factor = growth_factors(market_growth / 12, months)
+    inflation_factor = growth_factors(inflation / 12, months)
+    energy_price_factor = growth_factors(energy_price_increase / 12, months)
+    charging_price_factor = growth_factors(charging_price_increase / 12, months)
+
+    revenue = np.round(float(base_revenue) / 12 * market_factor * charging_price_factor * seasonal, 2)
+    operational_costs = np.round(float(base_energy_cost) / 12 * market_factor * energy_price_factor * seasonal, 2)
+    maintenance_costs = np.round(total_investment * maintenance_percentage / 12 * inflation_factor, 2)
+
+    # Anno dell'investimento (1..years) a cui appartiene ciascun mese
+    year_of_month = np.arange(months) // 12 + 1
+
+    # Le rate oltre la durata del prestito sono nulle, quelle oltre l'orizzonte ignorate
+    payments = np.zeros(months + 1)
+    if loan_payments is not None:
+        loan_payments = np.asarray(loan_payments, dtype=float)
+        n = min(len(loan_payments), months + 1)
+        payments[:n] = loan_payments[:n]
+    payments = np.round(payments[1:], 2)
+
+    yearly_repairs = np.zeros(years)
+    if repair_costs is not None:
+        repair_costs = np.asarray(repair_costs, dtype=float)
+        n = min(len(repair_costs), years)
+        yearly_repairs[:n] = repair_costs[:n]
+    repairs = np.round(yearly_repairs[year_of_month - 1] / 12, 2)
+
+    net = np.round(revenue - operational_costs - maintenance_costs - repairs - payments, 2)
+
+    def with_month_zero(values, first=0.0):
+        return np.concatenate([[first], values])
+
+    net_cash_flow = with_month_zero(net, first=-total_investment)
+
+    return {
+        'revenue': with_month_zero(revenue),
+        'operational_costs': with_month_zero(operational_costs),
+        'maintenance_costs': with_month_zero(maintenance_costs),
+        'repair_costs': with_month_zero(repairs),
+        'loan_payments': with_month_zero(payments),
+        'net_cash_flow': net_cash_flow,
+        'cumulative_cash_flow': np.round(np.cumsum(net_cash_flow), 2),
+        'seasonal_factors': with_month_zero(seasonal, first=1.0),
+        'calendar_years': calendar_year,
+        'calendar_months': calendar_month,
+    }
+
+
+def to_monthly_cash_flow_dict(arrays):
+    """
+    Converte gli array mensili nel formato JSON colonnare di FinancialAnalysis.
+
+    Args:
+        arrays: Dizionario restituito da monthly_cash_flow_arrays
+
+    Returns:
+        dict: Etichette 'YYYY-MM' e una lista per ogni voce
+    """
+    cash_flow = {
+        'months': [
+            f'{year:04d}-{month:02d}'
+            for year, month in zip(arrays['calendar_years'].tolist(), arrays['calendar_months'].tolist())
+        ]
+    }
+    for key in MONTHLY_CASH_FLOW_KEYS:
+        cash_flow[key] = arrays[key].tolist()
+    return cash_flow
+
+
+def to_cash_flow_dict(arrays, years):
+    """
+    Converte gli array di una singola serie nel formato JSON di FinancialAnalysis.
+
+    Args:
+        arrays: Dizionario restituito da yearly_cash_flow_arrays (serie singola)
+        years: Numero di anni dell'investimento
+
+    Returns:
+        dict: Flussi di cassa annuali con liste di float
+    """
+    cash_flow = {'years': list(range(years + 1))}
+    for key in YEARLY_CASH_FLOW_KEYS:
+        cash_flow[key] = [float(value) for value in np.ravel(arrays[key])]
+    return cash_flow
@@ -1,12 +1,41 @@
 import numpy as np
 import numpy_financial as npf
 from decimal import Decimal
-import random
-from datetime import date, timedelta, datetime
+from datetime import date, datetime
 from calendar import monthrange
 
 from ..models.financial import FinancialParameters, FinancialAnalysis, FinancialConfig
 from ..models.charging_station import ChargingStation
+from ..models.reliability import ReliabilityProfile
+from .cash_flow import (
+    yearly_cash_flow_arrays, to_cash_flow_dict,
+    monthly_cash_flow_arrays, to_monthly_cash_flow_dict,
+)
+from .monte_carlo import simulate_failures, summarize_simulation, UNREPAIRABLE_PROBABILITY
+from .reliability import fleet_parameters, expected_fleet_costs, sample_fleet_costs
+from .sensitivity import run_sensitivity, expected_repair_costs
+from .irr_solver import evaluate_cash_flows
+from .amortization import loan_schedule, annual_loan_schedule
+from . import analysis_cache
+
+
+def station_investment(station):
+    """
+    Restituisce l'investimento iniziale di una stazione di ricarica.
+    
+    Le stazioni dei progetti (projects.ChargingStation) espongono
+    calculate_total_investment, quelle dei sotto-progetti (cpo_core.ChargingStation)
+    calculate_total_cost.
+    
+    Args:
+        station: Istanza di ChargingStation
+        
+    Returns:
+        Decimal: Investimento iniziale della stazione
+    """
+    if hasattr(station, 'calculate_total_investment'):
+        return station.calculate_total_investment()
+    return station.calculate_total_cost()
 
 
 class FinancialModel:
@@ -70,6 +99,20 @@ class FinancialModel:
             
         return monthly_factors
     
+    def get_seasonal_factors(self, enable_adjustments=True):
+        """
+        Restituisce i fattori stagionali da gennaio a dicembre.
+        
+        Args:
+            enable_adjustments: Se False, restituisce tutti fattori unitari
+            
+        Returns:
+            list: Dodici fattori stagionali
+        """
+        if not enable_adjustments:
+            return [1.0] * 12
+        return [float(self.seasonal_factors.get(str(month), 1.0)) for month in range(1, 13)]
+    
     def calculate_npv(self, cash_flows, discount_rate=None):
         """
         Calcola il Valore Attuale Netto (NPV).
@@ -143,6 +186,26 @@ class FinancialModel:
             
         return payback
     
+    def calculate_batch_metrics(self, cash_flows, discount_rate=None):
+        """
+        Calcola NPV, IRR, payback e indice di redditività per più serie insieme.
+        
+        A differenza di calculate_irr, le serie per cui l'IRR non converge non
+        vengono azzerate: l'IRR resta NaN e il flag 'irr_converged' è False.
+        
+        Args:
+            cash_flows: Matrice di flussi di cassa (serie × periodi)
+            discount_rate: Tasso di sconto, scalare o uno per serie (se None, usa quello predefinito)
+            
+        Returns:
+            dict: Array per serie con 'npv', 'irr' (in percentuale), 'irr_converged',
+                'payback' e 'profitability_index'
+        """
+        if discount_rate is None:
+            discount_rate = self.discount_rate
+        
+        return evaluate_cash_flows(cash_flows, discount_rate)
+    
     def calculate_roi(self, total_investment, net_profit):
         """
         Calcola il Return on Investment (ROI).
@@ -180,16 +243,22 @@ class FinancialAnalysisService:
     Calcola ROI, utili, flussi di cassa e simula eventuali guasti.
     """
     
-    def __init__(self, project=None, charging_station=None):
+    def __init__(self, project=None, charging_station=None, default_config=None, reliability_profiles=None):
         """
         Inizializza il servizio con un progetto o una stazione di ricarica.
         
         Args:
             project: Istanza del modello Project
             charging_station: Istanza del modello ChargingStation
+            default_config: FinancialConfig da usare se i parametri non ne hanno una
+                (evita di rileggerla dal database per ogni progetto nei batch)
+            reliability_profiles: Profili di affidabilità già caricati (come sopra)
         """
         self.project = project
         self.charging_station = charging_station
+        self._stations = None
+        self._station_data = None
+        self._reliability_profiles = reliability_profiles
         
         if project:
             try:
@@ -200,57 +269,141 @@ class FinancialAnalysisService:
             self.params = self.charging_station.sub_project.project.financial_parameters
             
         # Crea il modello finanziario con la configurazione del progetto
-        self.financial_model = FinancialModel(config=self.params.config)
+        self.financial_model = FinancialModel(config=self.params.config or default_config)
         
-    def calculate_analysis(self):
+    def calculate_analysis(self, use_cache=True):
         """
         Esegue l'analisi finanziaria completa.
         
+        Se gli input (parametri, configurazione e stazioni) non sono cambiati
+        dall'ultimo calcolo, restituisce l'analisi già salvata.
+        
+        Args:
+            use_cache: Se False, ricalcola sempre l'analisi
+            
         Returns:
             FinancialAnalysis: Istanza dell'analisi finanziaria salvata
         """
+        digest = analysis_cache.inputs_digest(analysis_cache.analysis_inputs(self))
+        if use_cache:
+            cached = analysis_cache.get_cached_analysis(self, digest)
+            if cached is not None:
+                return cached
+        
         if self.project:
             obj, _ = FinancialAnalysis.objects.get_or_create(project=self.project)
         else:
             obj, _ = FinancialAnalysis.objects.get_or_create(charging_station=self.charging_station)
         
-        # Calcola l'investimento totale
-        total_investment = self._calculate_total_investment()
-        obj.total_investment = total_investment
+        for field, value in self.compute_results().items():
+            setattr(obj, field, value)
         
-        # Calcola flussi di cassa annuali
-        yearly_cash_flow = self._calculate_yearly_cash_flow(total_investment)
-        obj.yearly_cash_flow = yearly_cash_flow
+        obj.save()
+        analysis_cache.store_analysis(self, digest, obj)
+        return obj
+    
+    def compute_results(self):
+        """
+        Calcola tutti i campi di FinancialAnalysis senza scrivere sul database.
         
-        # Calcola flussi di cassa mensili (primi 24 mesi)
-        monthly_cash_flow = self._calculate_monthly_cash_flow(total_investment)
-        obj.monthly_cash_flow = monthly_cash_flow
+        Se le stazioni sono già state caricate (es. con prefetch_related),
+        il calcolo non esegue query.
         
-        # Calcola piano di ammortamento del prestito
-        loan_schedule = self._calculate_loan_schedule()
-        obj.loan_schedule = loan_schedule
+        Returns:
+            dict: Valori dei campi di FinancialAnalysis
+        """
+        # Calcola l'investimento totale
+        total_investment = self._calculate_total_investment()
         
-        # Esegui simulazione guasti
+        # Esegui simulazione guasti (i costi attesi entrano nel flusso di cassa)
         failure_simulation = self._simulate_failures()
-        obj.failure_simulation = failure_simulation
+        
+        # Calcola flussi di cassa annuali
+        yearly_cash_flow = self._calculate_yearly_cash_flow(
+            total_investment, repair_costs=failure_simulation['repair_costs'])
         
         # Calcola metriche finanziarie
         npv, irr, payback, roi, pi = self._calculate_financial_metrics(yearly_cash_flow)
         
-        obj.net_present_value = npv
-        obj.internal_rate_of_return = irr
-        obj.payback_period = payback
-        obj.return_on_investment = roi
-        obj.profitability_index = pi
+        # Calcola flussi di cassa mensili sull'intero orizzonte
+        monthly_cash_flow = self._calculate_monthly_cash_flow(
+            total_investment, repair_costs=failure_simulation['repair_costs'])
+        
+        # Calcola piano di ammortamento del prestito
+        loan_schedule = self._calculate_loan_schedule()
         
         # Calcola totali
         total_revenue, total_costs = self._calculate_totals(yearly_cash_flow)
-        obj.total_revenue = total_revenue
-        obj.total_costs = total_costs
-        obj.total_profit = total_revenue - total_costs
         
-        obj.save()
-        return obj
+        # Analisi di sensibilità sui principali driver
+        sensitivity_analysis = self._calculate_sensitivity(
+            total_investment, repair_costs=failure_simulation['repair_costs'])
+        
+        return {
+            'total_investment': total_investment,
+            'failure_simulation': failure_simulation,
+            'yearly_cash_flow': yearly_cash_flow,
+            'monthly_cash_flow': monthly_cash_flow,
+            'loan_schedule': loan_schedule,
+            'net_present_value': npv,
+            'internal_rate_of_return': irr,
+            'payback_period': payback,
+            'return_on_investment': roi,
+            'profitability_index': pi,
+            'total_revenue': total_revenue,
+            'total_costs': total_costs,
+            'total_profit': total_revenue - total_costs,
+            'sensitivity_analysis': sensitivity_analysis,
+        }
+    
+    def _get_stations(self):
+        """
+        Restituisce le stazioni dell'analisi, caricate una sola volta.
+        
+        Returns:
+            list: Stazioni di ricarica
+        """
+        if self._stations is None:
+            if self.project:
+                self._stations = [
+                    station
+                    for subproject in self.project.subprojects.all()
+                    for station in subproject.charging_stations.all()
+                ]
+            else:
+                self._stations = [self.charging_station]
+        return self._stations
+    
+    def _get_station_data(self):
+        """
+        Raccoglie una sola volta i dati delle stazioni usati dai vari calcoli.
+        
+        Returns:
+            dict: Investimento, ricavi e costi annuali totali e costi delle singole colonnine
+        """
+        if self._station_data is None:
+            stations = self._get_stations()
+            
+            total_investment = Decimal('0')
+            annual_revenue = Decimal('0')
+            annual_costs = Decimal('0')
+            annual_energy_cost = Decimal('0')
+            for station in stations:
+                total_investment += station_investment(station)
+                metrics = station.calculate_annual_metrics()
+                annual_revenue += metrics['annual_revenue']
+                annual_costs += metrics['annual_costs']
+                annual_energy_cost += (
+                    station.energy_cost_kwh * station.avg_kwh_session * station.estimated_sessions_day * 365)
+            
+            self._station_data = {
+                'total_investment': total_investment,
+                'annual_revenue': annual_revenue,
+                'annual_costs': annual_costs,
+                'annual_energy_cost': annual_energy_cost,
+                'station_costs': [float(station.station_cost) for station in stations],
+            }
+        return self._station_data
     
     def _calculate_total_investment(self):
         """
@@ -259,263 +412,193 @@ class FinancialAnalysisService:
         Returns:
             Decimal: Investimento totale iniziale
         """
-        if self.project:
-            total = Decimal('0')
-            # Utilizziamo SubProject per accedere alle stazioni
-            for subproject in self.project.subprojects.all():
-                for station in subproject.charging_stations.all():
-                    total += station.calculate_total_investment()
-            return total
-        else:
-            return self.charging_station.calculate_total_investment()
+        return self._get_station_data()['total_investment']
     
-    def _calculate_yearly_cash_flow(self, total_investment):
+    def _calculate_yearly_cash_flow(self, total_investment, repair_costs=None):
         """
         Calcola i flussi di cassa annuali per l'intero periodo di investimento.
         
         Args:
             total_investment: Investimento totale iniziale
+            repair_costs: Costi attesi di riparazione per anno (opzionale)
             
         Returns:
             dict: Dizionario con i flussi di cassa annuali
         """
         years = self.params.investment_years
-        market_growth = float(self.params.market_growth_rate) / 100
-        inflation = float(self.params.inflation_rate) / 100
-        maintenance_percentage = float(self.params.maintenance_cost_percentage) / 100
-        energy_price_increase = float(self.params.energy_price_increase_rate) / 100
-        charging_price_increase = float(self.params.charging_price_increase_rate) / 100
-        
-        # Inizializza struttura dati per i flussi di cassa
-        cash_flow = {
-            'years': list(range(years + 1)),
-            'revenue': [0] * (years + 1),
-            'operational_costs': [0] * (years + 1),
-            'maintenance_costs': [0] * (years + 1),
-            'loan_payments': [0] * (years + 1),
-            'net_cash_flow': [0] * (years + 1),
-            'cumulative_cash_flow': [0] * (years + 1)
-        }
-        
-        # Anno 0: solo investimento iniziale (negativo)
-        cash_flow['net_cash_flow'][0] = -float(total_investment)
-        cash_flow['cumulative_cash_flow'][0] = -float(total_investment)
         
         # Parametri iniziali per le stazioni di ricarica
-        if self.project:
-            stations = []
-            for subproject in self.project.subprojects.all():
-                stations.extend(list(subproject.charging_stations.all()))
-            
-            # Raccogli dati iniziali per ogni stazione
-            base_revenue = sum(station.calculate_annual_metrics()['annual_revenue'] for station in stations)
-            base_energy_cost = sum(station.calculate_annual_metrics()['annual_costs'] for station in stations)
-        else:
-            metrics = self.charging_station.calculate_annual_metrics()
-            base_revenue = metrics['annual_revenue']
-            base_energy_cost = metrics['annual_costs']
-        
-        # Calcola flussi di cassa per ogni anno
-        for year in range(1, years + 1):
-            # Aumenti annuali basati sui tassi
-            market_factor = (1 + market_growth) ** (year - 1)
-            inflation_factor = (1 + inflation) ** (year - 1)
-            energy_price_factor = (1 + energy_price_increase) ** (year - 1)
-            charging_price_factor = (1 + charging_price_increase) ** (year - 1)
-            
-            # Calcola ricavi con crescita di mercato e aumento dei prezzi
-            yearly_revenue = base_revenue * market_factor * charging_price_factor
-            cash_flow['revenue'][year] = round(float(yearly_revenue), 2)
-            
-            # Calcola costi operativi (principalmente energia)
-            yearly_energy_cost = base_energy_cost * market_factor * energy_price_factor
-            cash_flow['operational_costs'][year] = round(float(yearly_energy_cost), 2)
-            
-            # Calcola costi di manutenzione con inflazione
-            yearly_maintenance = float(total_investment) * maintenance_percentage * inflation_factor
-            cash_flow['maintenance_costs'][year] = round(yearly_maintenance, 2)
-            
-            # Aggiungi pagamenti del prestito (calcolati separatamente)
-            loan_year_payment = self._calculate_loan_payment_for_year(year)
-            cash_flow['loan_payments'][year] = round(float(loan_year_payment), 2)
-            
-            # Calcola flusso di cassa netto
-            net_cash = (
-                cash_flow['revenue'][year] - 
-                cash_flow['operational_costs'][year] - 
-                cash_flow['maintenance_costs'][year] - 
-                cash_flow['loan_payments'][year]
-            )
-            cash_flow['net_cash_flow'][year] = round(net_cash, 2)
-            
-            # Calcola flusso di cassa cumulativo
-            cash_flow['cumulative_cash_flow'][year] = round(
-                cash_flow['cumulative_cash_flow'][year-1] + net_cash, 2)
-        
-        return cash_flow
+        station_data = self._get_station_data()
+        base_revenue = station_data['annual_revenue']
+        base_energy_cost = station_data['annual_costs']
+        
+        # Il piano di ammortamento viene calcolato una sola volta e indicizzato per anno
+        loan_payments = None
+        if float(self.params.loan_amount) > 0:
+            loan_payments = self._calculate_loan_schedule()['payment']
+        
+        # Calcola tutti gli anni in un unico passaggio vettoriale
+        arrays = yearly_cash_flow_arrays(
+            total_investment=float(total_investment),
+            base_revenue=float(base_revenue),
+            base_energy_cost=float(base_energy_cost),
+            years=years,
+            market_growth=float(self.params.market_growth_rate) / 100,
+            inflation=float(self.params.inflation_rate) / 100,
+            maintenance_percentage=float(self.params.maintenance_cost_percentage) / 100,
+            energy_price_increase=float(self.params.energy_price_increase_rate) / 100,
+            charging_price_increase=float(self.params.charging_price_increase_rate) / 100,
+            loan_payments=loan_payments,
+            repair_costs=repair_costs,
+        )
+        return to_cash_flow_dict(arrays, years)
     
-    def _calculate_loan_schedule(self):
+    def _calculate_sensitivity(self, total_investment, repair_costs=None):
         """
-        Calcola il piano di ammortamento del prestito.
+        Calcola NPV e IRR al variare di ciascun driver (dati per tornado e spider).
         
+        Args:
+            total_investment: Investimento totale iniziale
+            repair_costs: Costi attesi di riparazione per anno dello scenario base
+            
         Returns:
-            dict: Piano di ammortamento del prestito
-        """
-        loan_amount = float(self.params.loan_amount)
-        interest_rate = float(self.params.loan_interest_rate) / 100
-        loan_term = self.params.loan_term
-        pre_amortization = self.params.pre_amortization_years
-        
-        if loan_amount <= 0:
-            return {
-                'years': [],
-                'payment': [],
-                'interest': [],
-                'principal': [],
-                'balance': []
-            }
-        
-        # Inizializza il piano
-        schedule = {
-            'years': list(range(loan_term + 1)),
-            'payment': [0] * (loan_term + 1),
-            'interest': [0] * (loan_term + 1),
-            'principal': [0] * (loan_term + 1),
-            'balance': [0] * (loan_term + 1)
+            dict: Risultati dell'analisi di sensibilità
+        """
+        station_data = self._get_station_data()
+        
+        loan_payments = None
+        if float(self.params.loan_amount) > 0:
+            loan_payments = self._calculate_loan_schedule()['payment']
+        
+        base = {
+            'years': self.params.investment_years,
+            'total_investment': float(total_investment),
+            'annual_revenue': float(station_data['annual_revenue']),
+            'annual_costs': float(station_data['annual_costs']),
+            'annual_energy_cost': float(station_data['annual_energy_cost']),
+            'station_cost_total': sum(station_data['station_costs']),
+            'loan_payments': loan_payments,
+            'repair_costs': repair_costs,
+            'energy_price_increase': float(self.params.energy_price_increase_rate),
+            'charging_price_increase': float(self.params.charging_price_increase_rate),
+            'market_growth': float(self.params.market_growth_rate),
+            'inflation': float(self.params.inflation_rate),
+            'maintenance_percentage': float(self.params.maintenance_cost_percentage),
+            'discount_rate': self.financial_model.discount_rate * 100,
+            'failure_probability': float(self.params.failure_probability),
+            'repair_cost_percentage': float(self.params.repair_cost_percentage),
         }
-        
-        # Anno 0: solo il prestito ottenuto
-        schedule['balance'][0] = loan_amount
-        
-        # Calcola pagamento annuale (dopo preammortamento)
-        if loan_term - pre_amortization > 0:
-            annual_payment = npf.pmt(
-                interest_rate, 
-                loan_term - pre_amortization, 
-                -loan_amount
-            )
-        else:
-            annual_payment = loan_amount  # Pagamento unico alla fine
-        
-        # Riempie il piano di ammortamento anno per anno
-        for year in range(1, loan_term + 1):
-            interest = schedule['balance'][year-1] * interest_rate
-            schedule['interest'][year] = round(interest, 2)
-            
-            if year <= pre_amortization:
-                # Durante preammortamento: paghi solo interessi
-                schedule['payment'][year] = round(interest, 2)
-                schedule['principal'][year] = 0
-                schedule['balance'][year] = schedule['balance'][year-1]
-            else:
-                # Dopo preammortamento: paghi rata completa
-                schedule['payment'][year] = round(annual_payment, 2)
-                schedule['principal'][year] = round(annual_payment - interest, 2)
-                schedule['balance'][year] = round(schedule['balance'][year-1] - schedule['principal'][year], 2)
-        
-        return schedule
+        return run_sensitivity(base)
     
-    def _calculate_loan_payment_for_year(self, year):
+    def _loan_arguments(self):
+        """Parametri del prestito nel formato del modulo di ammortamento"""
+        return {
+            'principal': float(self.params.loan_amount),
+            'annual_rate': float(self.params.loan_interest_rate) / 100,
+            'term_years': self.params.loan_term,
+            'pre_amortization_years': self.params.pre_amortization_years,
+        }
+    
+    def _calculate_loan_schedule(self):
         """
-        Calcola il pagamento del prestito per un anno specifico.
+        Calcola il piano di ammortamento annuale del prestito.
+        
+        Le rate sono mensili (con preammortamento di soli interessi) e
+        aggregate per anno; il piano è memoizzato dal modulo di ammortamento.
         
-        Args:
-            year: Anno per cui calcolare il pagamento
-            
         Returns:
-            Decimal: Pagamento del prestito per l'anno specificato
+            dict: Piano di ammortamento del prestito
         """
-        loan_amount = float(self.params.loan_amount)
-        if loan_amount <= 0:
-            return Decimal('0')
-            
-        loan_schedule = self._calculate_loan_schedule()
-        if year < len(loan_schedule['payment']):
-            return Decimal(str(loan_schedule['payment'][year]))
-        return Decimal('0')
+        return annual_loan_schedule(**self._loan_arguments())
     
-    def _calculate_loan_payment_for_month(self, month):
+    def get_reliability_profiles(self):
         """
-        Calcola il pagamento mensile del prestito.
+        Restituisce i profili di affidabilità, caricati una sola volta.
         
-        Args:
-            month: Mese per cui calcolare il pagamento
-            
         Returns:
-            Decimal: Pagamento del prestito per il mese specificato
+            list: Profili di affidabilità
         """
-        year = (month - 1) // 12 + 1
-        yearly_payment = self._calculate_loan_payment_for_year(year)
-        monthly_payment = yearly_payment / 12
-        return monthly_payment
-        
+        if self._reliability_profiles is None:
+            self._reliability_profiles = list(ReliabilityProfile.objects.all())
+        return self._reliability_profiles
+    
     def _simulate_failures(self):
         """
-        Simula guasti casuali delle colonnine nell'arco dei 10 anni.
+        Calcola guasti e costi di riparazione delle colonnine.
+        
+        Con il metodo analitico i valori attesi sono calcolati in forma chiusa;
+        con il metodo Monte Carlo le repliche sono calcolate in blocco con NumPy,
+        il seme rende il risultato riproducibile e 'bands' contiene i percentili
+        P5/P50/P95. Se esistono profili di affidabilità, il tasso di guasto di
+        ogni colonnina segue la curva del suo profilo; altrimenti si usa la
+        probabilità di guasto annuale dei parametri.
         
         Returns:
-            dict: Risultati della simulazione di guasti
+            dict: Liste annuali 'failures', 'repair_costs' e 'active_stations'
+                con i valori attesi, più il metodo usato
         """
         years = self.params.investment_years
-        failure_prob = float(self.params.failure_probability) / 100
-        repair_cost_perc = float(self.params.repair_cost_percentage) / 100
-        
-        # Inizializza struttura dati per la simulazione
-        simulation = {
-            'years': list(range(1, years + 1)),
-            'failures': [0] * years,
-            'repair_costs': [0] * years,
-            'active_stations': [0] * years
-        }
-        
-        if self.project:
-            stations = []
-            for subproject in self.project.subprojects.all():
-                stations.extend(list(subproject.charging_stations.all()))
-            
-            # Inizializza stato delle stazioni (tutte attive)
-            station_states = [True] * len(stations)
-            station_costs = [float(s.station_cost) for s in stations]
-            
-            # Per ogni anno, simula guasti
-            for year in range(years):
-                simulation['active_stations'][year] = sum(station_states)
-                failures = 0
-                repair_cost = 0
-                
-                # Per ogni stazione, verifica se si guasta
-                for i, active in enumerate(station_states):
-                    if active and random.random() < failure_prob:
-                        failures += 1
-                        repair_cost += station_costs[i] * repair_cost_perc
-                        
-                        # 10% di probabilità che la stazione non sia riparabile
-                        if random.random() < 0.1:
-                            station_states[i] = False
-                
-                simulation['failures'][year] = failures
-                simulation['repair_costs'][year] = round(repair_cost, 2)
-        else:
-            # Singola stazione
-            station_cost = float(self.charging_station.station_cost)
-            active = True
-            
-            # Per ogni anno, simula guasti
-            for year in range(years):
-                simulation['active_stations'][year] = 1 if active else 0
-                
-                if active and random.random() < failure_prob:
-                    simulation['failures'][year] = 1
-                    simulation['repair_costs'][year] = round(station_cost * repair_cost_perc, 2)
-                    
-                    # 10% di probabilità che la stazione non sia riparabile
-                    if random.random() < 0.1:
-                        active = False
-                else:
-                    simulation['failures'][year] = 0
-                    simulation['repair_costs'][year] = 0
+        method = self.params.failure_analysis_method
+        failure_probability = float(self.params.failure_probability) / 100
+        repair_cost_percentage = float(self.params.repair_cost_percentage) / 100
+        station_costs = self._get_station_data()['station_costs']
+        profiles = self.get_reliability_profiles()
+        
+        result = {'years': list(range(1, years + 1)), 'method': method}
+        
+        if profiles:
+            # Curve di affidabilità per colonnina: le riparazioni non riducono il parco
+            fleet = fleet_parameters(
+                self._get_stations(), profiles,
+                failure_probability=failure_probability,
+                repair_cost_percentage=repair_cost_percentage,
+            )
+            active_stations = [float(len(station_costs))] * years
+            if method == 'monte_carlo':
+                samples = sample_fleet_costs(fleet, years, runs=self.params.monte_carlo_runs,
+                                             seed=self.params.random_seed)
+                samples['active_stations'] = np.full((1, years), float(len(station_costs)))
+                return {**result, **self._summarize_samples(samples)}
+            
+            expected = expected_fleet_costs(fleet, years)
+            return {
+                **result,
+                **{key: np.round(values, 2).tolist() for key, values in expected.items()},
+                'active_stations': active_stations,
+            }
         
-        return simulation
+        if method == 'monte_carlo':
+            samples = simulate_failures(
+                station_costs,
+                years,
+                failure_probability=failure_probability,
+                repair_cost_percentage=repair_cost_percentage,
+                runs=self.params.monte_carlo_runs,
+                seed=self.params.random_seed,
+            )
+            return {**result, **self._summarize_samples(samples)}
+        
+        # Valori attesi della stessa simulazione, in forma chiusa
+        n_stations = len(station_costs)
+        survival = np.power(1.0 - failure_probability * UNREPAIRABLE_PROBABILITY, np.arange(years))
+        repair_costs = expected_repair_costs(sum(station_costs), years, failure_probability, repair_cost_percentage)
+        return {
+            **result,
+            'failures': np.round(n_stations * failure_probability * survival, 2).tolist(),
+            'repair_costs': np.round(repair_costs, 2).tolist(),
+            'active_stations': np.round(n_stations * survival, 2).tolist(),
+        }
+    
+    def _summarize_samples(self, samples):
+        """Valori attesi, bande percentili e totali delle repliche Monte Carlo"""
+        summary = summarize_simulation(samples)
+        return {
+            **summary['expected'],
+            'bands': summary['bands'],
+            'totals': summary['totals'],
+            'runs': self.params.monte_carlo_runs,
+            'seed': self.params.random_seed,
+        }
     
     def _calculate_financial_metrics(self, cash_flow):
         """
@@ -566,117 +649,49 @@ class FinancialAnalysisService:
         total_costs = (
             sum(cash_flow['operational_costs']) + 
             sum(cash_flow['maintenance_costs']) + 
+            sum(cash_flow.get('repair_costs', [])) + 
             sum(cash_flow['loan_payments'])
         )
         
         return Decimal(str(round(total_revenue, 2))), Decimal(str(round(total_costs, 2)))
         
-    def _calculate_monthly_cash_flow(self, total_investment):
+    def _calculate_monthly_cash_flow(self, total_investment, repair_costs=None):
         """
-        Calcola i flussi di cassa mensili per i primi 24 mesi con aggiustamenti stagionali.
+        Calcola i flussi di cassa mensili sull'intero orizzonte dell'investimento.
+        
+        I mesi seguono il calendario reale a partire dal mese corrente (mese 0,
+        solo investimento) e i fattori stagionali sono quelli della configurazione.
         
         Args:
             total_investment: Investimento totale iniziale
+            repair_costs: Costi attesi di riparazione per anno (opzionale)
             
         Returns:
-            dict: Dizionario con i flussi di cassa mensili
+            dict: Dizionario colonnare con i flussi di cassa mensili
         """
-        months = 24  # Primi 24 mesi
-        market_growth = float(self.params.market_growth_rate) / 100 / 12  # Mensile
-        inflation = float(self.params.inflation_rate) / 100 / 12  # Mensile
-        maintenance_percentage = float(self.params.maintenance_cost_percentage) / 100 / 12  # Mensile
-        energy_price_increase = float(self.params.energy_price_increase_rate) / 100 / 12  # Mensile
-        charging_price_increase = float(self.params.charging_price_increase_rate) / 100 / 12  # Mensile
-        apply_seasonal = self.params.apply_seasonal_adjustments
-        
-        # Date per i mesi
+        station_data = self._get_station_data()
         today = date.today()
-        month_dates = []
-        
-        # Inizializza struttura dati per i flussi di cassa
-        cash_flow = {
-            'months': [],
-            'revenue': [0] * (months + 1),
-            'operational_costs': [0] * (months + 1),
-            'maintenance_costs': [0] * (months + 1),
-            'loan_payments': [0] * (months + 1),
-            'net_cash_flow': [0] * (months + 1),
-            'cumulative_cash_flow': [0] * (months + 1),
-            'seasonal_factors': [1.0] * (months + 1)
-        }
         
-        # Genera date mensili e fattori stagionali
-        for m in range(months + 1):
-            current_date = today + timedelta(days=30*m)
-            month_str = current_date.strftime('%Y-%m')
-            cash_flow['months'].append(month_str)
-            
-            # Salva il fattore stagionale per questo mese
-            if m > 0:  # Ignora mese 0 (è l'investimento iniziale)
-                factor = self.financial_model.apply_seasonal_adjustment(
-                    1.0, current_date.month, enable_adjustments=apply_seasonal
-                )
-                cash_flow['seasonal_factors'][m] = round(factor, 2)
-        
-        # Mese 0: solo investimento iniziale (negativo)
-        cash_flow['net_cash_flow'][0] = -float(total_investment)
-        cash_flow['cumulative_cash_flow'][0] = -float(total_investment)
-        
-        # Parametri iniziali per le stazioni di ricarica
-        if self.project:
-            stations = []
-            for subproject in self.project.subprojects.all():
-                stations.extend(list(subproject.charging_stations.all()))
-            
-            # Raccogli dati iniziali per ogni stazione
-            base_revenue = sum(station.calculate_annual_metrics()['annual_revenue'] for station in stations) / 12  # Mensile
-            base_energy_cost = sum(station.calculate_annual_metrics()['annual_costs'] for station in stations) / 12  # Mensile
-        else:
-            metrics = self.charging_station.calculate_annual_metrics()
-            base_revenue = metrics['annual_revenue'] / 12  # Mensile
-            base_energy_cost = metrics['annual_costs'] / 12  # Mensile
-        
-        # Calcola flussi di cassa per ogni mese
-        for month in range(1, months + 1):
-            current_date = today + timedelta(days=30*(month-1))
-            current_month = current_date.month
-            
-            # Aumenti mensili basati sui tassi
-            market_factor = (1 + market_growth) ** (month - 1)
-            inflation_factor = (1 + inflation) ** (month - 1)
-            energy_price_factor = (1 + energy_price_increase) ** (month - 1)
-            charging_price_factor = (1 + charging_price_increase) ** (month - 1)
-            
-            # Applica fattore stagionale
-            seasonal_factor = cash_flow['seasonal_factors'][month]
-            
-            # Calcola ricavi con crescita di mercato, aumento dei prezzi e aggiustamento stagionale
-            monthly_revenue = base_revenue * market_factor * charging_price_factor * seasonal_factor
-            cash_flow['revenue'][month] = round(float(monthly_revenue), 2)
-            
-            # Calcola costi operativi (principalmente energia) con aggiustamento stagionale
-            monthly_energy_cost = base_energy_cost * market_factor * energy_price_factor * seasonal_factor
-            cash_flow['operational_costs'][month] = round(float(monthly_energy_cost), 2)
-            
-            # Calcola costi di manutenzione con inflazione
-            monthly_maintenance = float(total_investment) * maintenance_percentage * inflation_factor
-            cash_flow['maintenance_costs'][month] = round(monthly_maintenance, 2)
-            
-            # Aggiungi pagamenti del prestito (calcolati separatamente)
-            loan_month_payment = self._calculate_loan_payment_for_month(month)
-            cash_flow['loan_payments'][month] = round(float(loan_month_payment), 2)
-            
-            # Calcola flusso di cassa netto
-            net_cash = (
-                cash_flow['revenue'][month] - 
-                cash_flow['operational_costs'][month] - 
-                cash_flow['maintenance_costs'][month] - 
-                cash_flow['loan_payments'][month]
-            )
-            cash_flow['net_cash_flow'][month] = round(net_cash, 2)
-            
-            # Calcola flusso di cassa cumulativo
-            cash_flow['cumulative_cash_flow'][month] = round(
-                cash_flow['cumulative_cash_flow'][month-1] + net_cash, 2)
-        
-        return cash_flow
\ No newline at end of file
+        # Rate mensili effettive del prestito, indicizzate per mese
+        loan_payments = None
+        if float(self.params.loan_amount) > 0:
+            loan_payments = loan_schedule(**self._loan_arguments())['payment']
+        
+        arrays = monthly_cash_flow_arrays(
+            total_investment=float(total_investment),
+            base_revenue=float(station_data['annual_revenue']),
+            base_energy_cost=float(station_data['annual_costs']),
+            years=self.params.investment_years,
+            start_year=today.year,
+            start_month=today.month,
+            seasonal_factors=self.financial_model.get_seasonal_factors(
+                enable_adjustments=self.params.apply_seasonal_adjustments),
+            market_growth=float(self.params.market_growth_rate) / 100,
+            inflation=float(self.params.inflation_rate) / 100,
+            maintenance_percentage=float(self.params.maintenance_cost_percentage) / 100,
+            energy_price_increase=float(self.params.energy_price_increase_rate) / 100,
+            charging_price_increase=float(self.params.charging_price_increase_rate) / 100,
+            loan_payments=loan_payments,
+            repair_costs=repair_costs,
+        )
+        return to_monthly_cash_flow_dict(arrays)
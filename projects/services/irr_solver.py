@@ -0,0 +1,176 @@
+import numpy as np
+
+
+# Intervallo di ricerca dell'IRR per il metodo di bisezione (frazioni)
+IRR_LOWER_BOUND = -0.99
+IRR_UPPER_BOUND = 10.0
+
+
+def _as_rows(cash_flows):
+    """Converte i flussi di cassa in una matrice (serie × periodi)"""
+    return np.atleast_2d(np.asarray(cash_flows, dtype=float))
+
+
+def npv_batch(cash_flows, rates):
+    """
+    Calcola il NPV di più serie di flussi di cassa.
+
+    Il periodo 0 non viene scontato, come in numpy_financial.npv.
+
+    Args:
+        cash_flows: Flussi di cassa con forma (serie, periodi)
+        rates: Tasso di sconto (frazione), scalare o uno per serie
+
+    Returns:
+        np.ndarray: NPV per serie
+    """
+    cash_flows = _as_rows(cash_flows)
+    rates = np.asarray(rates, dtype=float).reshape(-1, 1)
+    periods = np.arange(cash_flows.shape[1], dtype=float)
+    return np.sum(cash_flows / np.power(1.0 + rates, periods), axis=1)
+
+
+def _npv_and_derivative(cash_flows, rates):
+    """NPV e derivata rispetto al tasso per ogni serie"""
+    periods = np.arange(cash_flows.shape[1], dtype=float)
+    discount = np.power(1.0 / (1.0 + rates)[:, None], periods)
+    values = cash_flows * discount
+    npv = values.sum(axis=1)
+    derivative = -(values * periods).sum(axis=1) / (1.0 + rates)
+    return npv, derivative
+
+
+def irr_batch(cash_flows, guess=0.1, tol=1e-10, max_iter=50,
+              lower=IRR_LOWER_BOUND, upper=IRR_UPPER_BOUND):
+    """
+    Calcola l'IRR di più serie di flussi di cassa.
+
+    Tutte le serie iterano insieme con il metodo di Newton; quelle che non
+    convergono (derivata nulla, tasso fuori dominio o troppe iterazioni)
+    passano a una bisezione vettoriale sull'intervallo [lower, upper].
+    Le serie senza cambio di segno nell'intervallo restano NaN.
+
+    Args:
+        cash_flows: Flussi di cassa con forma (serie, periodi)
+        guess: Tasso iniziale per Newton (frazione)
+        tol: Tolleranza sul tasso
+        max_iter: Numero massimo di iterazioni di Newton
+        lower: Estremo inferiore per la bisezione
+        upper: Estremo superiore per la bisezione
+
+    Returns:
+        tuple: (IRR per serie come frazione, flag di convergenza)
+    """
+    cash_flows = _as_rows(cash_flows)
+    rows = cash_flows.shape[0]
+
+    rates = np.full(rows, float(guess))
+    converged = np.zeros(rows, dtype=bool)
+    active = np.arange(rows)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for _ in range(max_iter):
+            if not active.size:
+                break
+            current = rates[active]
+            npv, derivative = _npv_and_derivative(cash_flows[active], current)
+            step = npv / derivative
+            updated = current - step
+
+            failed = ~np.isfinite(updated) | (updated <= -1.0)
+            done = ~failed & (np.abs(step) <= tol * (1.0 + np.abs(updated)))
+
+            rates[active] = np.where(failed, np.nan, updated)
+            converged[active[done]] = True
+            active = active[~(failed | done)]
+
+        # Bisezione per le serie non risolte da Newton
+        pending = np.flatnonzero(~converged)
+        if pending.size:
+            flows = cash_flows[pending]
+            low = np.full(pending.size, float(lower))
+            high = np.full(pending.size, float(upper))
+            f_low = npv_batch(flows, low)
+            f_high = npv_batch(flows, high)
+            bracketed = np.isfinite(f_low) & np.isfinite(f_high) & (np.sign(f_low) != np.sign(f_high))
+
+            rates[pending] = np.nan
+            if bracketed.any():
+                flows = flows[bracketed]
+                low, high, f_low = low[bracketed], high[bracketed], f_low[bracketed]
+                iterations = int(np.ceil(np.log2((upper - lower) / tol)))
+                for _ in range(iterations):
+                    mid = (low + high) / 2
+                    f_mid = npv_batch(flows, mid)
+                    same_side = np.sign(f_mid) == np.sign(f_low)
+                    low = np.where(same_side, mid, low)
+                    f_low = np.where(same_side, f_mid, f_low)
+                    high = np.where(same_side, high, mid)
+
+                solved = pending[bracketed]
+                rates[solved] = (low + high) / 2
+                converged[solved] = True
+
+    return rates, converged
+
+
+def payback_batch(cash_flows):
+    """
+    Calcola il periodo di payback di più serie, con interpolazione lineare.
+
+    Stessa logica di FinancialModel.calculate_payback_period: se il flusso
+    cumulativo non diventa mai positivo, il payback è l'ultimo periodo.
+
+    Args:
+        cash_flows: Flussi di cassa con forma (serie, periodi)
+
+    Returns:
+        np.ndarray: Payback per serie (in periodi)
+    """
+    cash_flows = _as_rows(cash_flows)
+    cumulative = np.cumsum(cash_flows, axis=1)
+    last = cash_flows.shape[1] - 1
+
+    positive = cumulative > 0
+    has_positive = positive.any(axis=1)
+    first = np.argmax(positive, axis=1)
+
+    row = np.arange(cash_flows.shape[0])
+    previous = cumulative[row, np.maximum(first - 1, 0)]
+    current = cumulative[row, first]
+    delta = current - previous
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        interpolated = np.where(delta != 0, first - 1 + (-previous / delta), first)
+
+    payback = np.where(first > 0, interpolated, 0.0)
+    return np.where(has_positive, payback, float(last))
+
+
+def evaluate_cash_flows(cash_flows, discount_rate):
+    """
+    Calcola in blocco le metriche finanziarie di più serie di flussi di cassa.
+
+    Args:
+        cash_flows: Flussi di cassa con forma (serie, periodi), periodo 0 = investimento
+        discount_rate: Tasso di sconto (frazione), scalare o uno per serie
+
+    Returns:
+        dict: Array per serie con 'npv', 'irr' (in percentuale), 'irr_converged',
+            'payback' e 'profitability_index'
+    """
+    cash_flows = _as_rows(cash_flows)
+    npv = npv_batch(cash_flows, discount_rate)
+    irr, converged = irr_batch(cash_flows)
+
+    investment = -cash_flows[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        profitability_index = np.where(investment > 0, (npv + investment) / investment, 0.0)
+
+    return {
+        'npv': npv,
+        'irr': irr * 100,
+        'irr_converged': converged,
+        'payback': payback_batch(cash_flows),
+        'profitability_index': profitability_index,
+    }
@@ -0,0 +1,191 @@
+import numpy as np
+
+
+# Probabilità che un guasto renda la stazione non riparabile
+UNREPAIRABLE_PROBABILITY = 0.1
+
+DEFAULT_PERCENTILES = (5, 50, 95)
+
+# Tipi di guasto della simulazione per stazione (FailureSimulation)
+FAILURE_TYPES = ('minor', 'major', 'replacement')
+
+
+def simulate_failures(station_costs, years, failure_probability, repair_cost_percentage,
+                      runs=10000, seed=None, unrepairable_probability=UNREPAIRABLE_PROBABILITY):
+    """
+    Simulazione Monte Carlo dei guasti delle colonnine.
+
+    Ogni coppia (replica, stazione) è un processo di Bernoulli annuale: invece di
+    estrarre un numero per ogni cella del tensore (repliche × stazioni × anni),
+    si estraggono in blocco gli intervalli geometrici tra un guasto e il successivo.
+    Il risultato ha la stessa distribuzione della simulazione anno per anno,
+    ma il costo è proporzionale al numero di guasti effettivi.
+
+    Args:
+        station_costs: Costi delle colonnine (una voce per stazione)
+        years: Numero di anni da simulare
+        failure_probability: Probabilità annuale di guasto (frazione)
+        repair_cost_percentage: Costo di riparazione come frazione del costo colonnina
+        runs: Numero di repliche
+        seed: Seme del generatore casuale (per risultati riproducibili)
+        unrepairable_probability: Probabilità che un guasto sia irreparabile
+
+    Returns:
+        dict: Matrici (repliche × anni) 'failures', 'repair_costs' e 'active_stations'
+    """
+    costs = np.asarray(station_costs, dtype=float).ravel()
+    n_stations = costs.size
+    cells = runs * years
+
+    failures = np.zeros(cells)
+    repair_costs = np.zeros(cells)
+    deaths = np.zeros(cells)
+
+    if n_stations and years and failure_probability > 0:
+        rng = np.random.default_rng(seed)
+        repair_per_station = costs * repair_cost_percentage
+
+        # Intervallo geometrico tra guasti: ceil(E / -ln(1 - p)) con E esponenziale
+        scale = -1.0 / np.log1p(-min(failure_probability, 1.0 - 1e-12))
+
+        def to_gaps(draws):
+            return np.maximum(np.ceil(draws * scale), 1).astype(np.intp)
+
+        # Solo le coppie (replica, stazione) con almeno un guasto nell'orizzonte
+        first = rng.standard_exponential((runs, n_stations), dtype=np.float32)
+        run, station = np.nonzero(first * scale <= years)
+        year = to_gaps(first[run, station])
+
+        while run.size:
+            cell = run * years + (year - 1)
+            failures += np.bincount(cell, minlength=cells)
+            repair_costs += np.bincount(cell, weights=repair_per_station[station], minlength=cells)
+
+            # Guasti irreparabili: la stazione esce dal parco dall'anno successivo
+            dead = rng.random(run.size) < unrepairable_probability
+            deaths += np.bincount(cell[dead], minlength=cells)
+
+            survivors = ~dead
+            run, station = run[survivors], station[survivors]
+            year = year[survivors] + to_gaps(rng.standard_exponential(run.size, dtype=np.float32))
+
+            inside = year <= years
+            run, station, year = run[inside], station[inside], year[inside]
+
+    failures = failures.reshape(runs, years)
+    repair_costs = repair_costs.reshape(runs, years)
+    deaths = deaths.reshape(runs, years)
+
+    # Le stazioni attive sono contate all'inizio dell'anno, prima dei guasti
+    active_stations = n_stations - (np.cumsum(deaths, axis=1) - deaths)
+
+    return {
+        'failures': failures,
+        'repair_costs': repair_costs,
+        'active_stations': active_stations,
+    }
+
+
+def summarize_simulation(samples, percentiles=DEFAULT_PERCENTILES):
+    """
+    Riduce le matrici della simulazione a valori attesi e bande percentili.
+
+    Args:
+        samples: Dizionario restituito da simulate_failures
+        percentiles: Percentili da calcolare
+
+    Returns:
+        dict: Valori attesi per anno, bande percentili per anno e sui totali
+    """
+    summary = {'expected': {}, 'bands': {}, 'totals': {}}
+
+    for key, matrix in samples.items():
+        bands = np.percentile(matrix, percentiles, axis=0)
+        summary['expected'][key] = np.round(matrix.mean(axis=0), 2).tolist()
+        summary['bands'][key] = {
+            f'p{p}': np.round(band, 2).tolist() for p, band in zip(percentiles, bands)
+        }
+
+    for key in ('failures', 'repair_costs'):
+        totals = samples[key].sum(axis=1)
+        summary['totals'][key] = {
+            'mean': round(float(totals.mean()), 2),
+            **{f'p{p}': round(float(v), 2) for p, v in zip(percentiles, np.percentile(totals, percentiles))}
+        }
+
+    return summary
+
+
+def simulate_failure_events(failure_rates, station_costs, daily_revenues, type_probabilities,
+                            repair_cost_fractions, downtime_days, seed=None):
+    """
+    Simula in blocco i guasti di tutte le stazioni per tutti gli anni.
+
+    Per ogni anno ogni stazione si guasta con la probabilità dell'anno; per i
+    soli guasti vengono estratti il tipo (riparazione minore, maggiore o
+    sostituzione) e calcolati costo, fermo e perdita di ricavi.
+
+    Args:
+        failure_rates: Probabilità di guasto per anno (frazioni), forma (anni,)
+        station_costs: Costi delle colonnine, forma (stazioni,)
+        daily_revenues: Ricavi giornalieri delle stazioni, forma (stazioni,)
+        type_probabilities: Probabilità dei tipi di guasto in FAILURE_TYPES;
+            l'ultimo tipo riceve la probabilità residua
+        repair_cost_fractions: Costo per tipo come frazione del costo colonnina
+        downtime_days: Giorni di fermo per tipo
+        seed: Seme del generatore casuale
+
+    Returns:
+        dict: Tabella degli eventi a colonne, ordinata per anno e stazione:
+            'year' (da 0), 'station' (indice), 'type' (indice in FAILURE_TYPES),
+            'repair_cost', 'downtime_days' e 'revenue_loss'
+    """
+    rates = np.clip(np.asarray(failure_rates, dtype=float), 0.0, 1.0)
+    costs = np.asarray(station_costs, dtype=float).ravel()
+    revenues = np.asarray(daily_revenues, dtype=float).ravel()
+    rng = np.random.default_rng(seed)
+
+    # Una sola estrazione (anni × stazioni); nonzero restituisce gli eventi in ordine
+    failed = rng.random((rates.size, costs.size), dtype=np.float32) < rates[:, None]
+    year, station = np.nonzero(failed)
+
+    thresholds = np.cumsum(np.asarray(type_probabilities, dtype=float)[:len(FAILURE_TYPES) - 1])
+    types = np.searchsorted(thresholds, rng.random(year.size), side='right').astype(np.int8)
+
+    fractions = np.asarray(repair_cost_fractions, dtype=float)
+    downtime = np.asarray(downtime_days, dtype=np.int32)[types]
+
+    return {
+        'year': year.astype(np.int32),
+        'station': station.astype(np.int32),
+        'type': types,
+        'repair_cost': costs[station] * fractions[types],
+        'downtime_days': downtime,
+        'revenue_loss': revenues[station] * downtime,
+    }
+
+
+def aggregate_failure_events(events, years):
+    """
+    Aggrega la tabella degli eventi in totali per anno.
+
+    Args:
+        events: Dizionario restituito da simulate_failure_events
+        years: Numero di anni simulati
+
+    Returns:
+        dict: Array con forma (anni,) 'failures', 'repair_costs', 'revenue_loss',
+            'downtime_days' e un conteggio per ogni tipo in FAILURE_TYPES
+    """
+    year = events['year']
+    totals = {
+        'failures': np.bincount(year, minlength=years),
+        'repair_costs': np.bincount(year, weights=events['repair_cost'], minlength=years),
+        'revenue_loss': np.bincount(year, weights=events['revenue_loss'], minlength=years),
+        'downtime_days': np.bincount(year, weights=events['downtime_days'], minlength=years),
+    }
+    by_type = np.bincount(year * len(FAILURE_TYPES) + events['type'],
+                          minlength=years * len(FAILURE_TYPES)).reshape(years, len(FAILURE_TYPES))
+    for index, failure_type in enumerate(FAILURE_TYPES):
+        totals[failure_type] = by_type[:, index]
+    return totals
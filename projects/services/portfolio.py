@@ -0,0 +1,145 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from ..models.project import Project
+from ..models.financial import FinancialParameters, FinancialAnalysis, FinancialConfig
+from ..models.reliability import ReliabilityProfile
+from .financial_analysis import FinancialAnalysisService
+from . import analysis_cache
+from ..workers import init_worker, compute
+
+
+ANALYSIS_FIELDS = (
+    'total_investment',
+    'net_present_value',
+    'internal_rate_of_return',
+    'payback_period',
+    'return_on_investment',
+    'profitability_index',
+    'total_revenue',
+    'total_costs',
+    'total_profit',
+    'yearly_cash_flow',
+    'monthly_cash_flow',
+    'loan_schedule',
+    'failure_simulation',
+    'sensitivity_analysis',
+    'updated_at',
+)
+
+
+def load_portfolio(queryset=None):
+    """
+    Carica i progetti con parametri, analisi e stazioni in poche query.
+
+    Args:
+        queryset: QuerySet di Project da analizzare (default: tutti i progetti)
+
+    Returns:
+        list: Progetti con relazioni già caricate
+    """
+    if queryset is None:
+        queryset = Project.objects.all()
+
+    return list(
+        queryset
+        .select_related('financial_parameters__config', 'financial_analysis')
+        .prefetch_related('subprojects__charging_stations__chargers')
+        .order_by('pk')
+    )
+
+
+def _ensure_related(projects):
+    """
+    Crea in blocco parametri e analisi mancanti.
+
+    Args:
+        projects: Progetti caricati con load_portfolio
+
+    Returns:
+        dict: Analisi per id progetto
+    """
+    missing_params = [p for p in projects if not hasattr(p, 'financial_parameters')]
+    if missing_params:
+        created = FinancialParameters.objects.bulk_create(
+            [FinancialParameters(project=p) for p in missing_params])
+        for project, params in zip(missing_params, created):
+            project.financial_parameters = params
+
+    analyses = {p.pk: p.financial_analysis for p in projects if hasattr(p, 'financial_analysis')}
+    missing = [p for p in projects if p.pk not in analyses]
+    if missing:
+        FinancialAnalysis.objects.bulk_create([FinancialAnalysis(project=p) for p in missing])
+        # Rilegge le analisi appena create per averne le chiavi primarie su ogni database
+        for analysis in FinancialAnalysis.objects.filter(project__in=missing):
+            analyses[analysis.project_id] = analysis
+
+    return analyses
+
+
+def run_portfolio_analysis(queryset=None, workers=1, batch_size=500):
+    """
+    Esegue l'analisi finanziaria di tutti i progetti del portafoglio.
+
+    I dati vengono letti con prefetch, i calcoli avvengono in memoria
+    (opzionalmente distribuiti su un pool di processi) e le analisi vengono
+    scritte con bulk_update. Il pool usa sempre il metodo di avvio spawn,
+    l'unico disponibile su Windows: i worker configurano Django da zero e
+    non ereditano connessioni o thread del processo principale.
+
+    Args:
+        queryset: QuerySet di Project da analizzare (default: tutti i progetti)
+        workers: Numero di processi per i calcoli (1 = nessun pool)
+        batch_size: Dimensione dei blocchi per bulk_update
+
+    Returns:
+        list: Analisi aggiornate
+    """
+    projects = load_portfolio(queryset)
+    if not projects:
+        return []
+
+    default_config = FinancialConfig.get_default()
+    reliability_profiles = list(ReliabilityProfile.objects.all())
+
+    with transaction.atomic():
+        analyses = _ensure_related(projects)
+
+    services = [
+        FinancialAnalysisService(project=project, default_config=default_config,
+                                 reliability_profiles=reliability_profiles)
+        for project in projects
+    ]
+
+    if workers > 1:
+        # Le connessioni non vanno condivise con i processi figli
+        connections.close_all()
+        chunksize = max(1, len(services) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_worker, initargs=(settings.SETTINGS_MODULE,)) as executor:
+            results = list(executor.map(compute, services, chunksize=chunksize))
+    else:
+        results = [compute(service) for service in services]
+
+    # bulk_update non gestisce auto_now: il timestamp viene impostato esplicitamente
+    now = timezone.now()
+    updated = []
+    for project, values in zip(projects, results):
+        analysis = analyses[project.pk]
+        for field, value in values.items():
+            setattr(analysis, field, value)
+        analysis.updated_at = now
+        updated.append(analysis)
+
+    FinancialAnalysis.objects.bulk_update(updated, ANALYSIS_FIELDS, batch_size=batch_size)
+
+    # Le analisi appena calcolate diventano i risultati in cache per i loro input
+    for service, analysis in zip(services, updated):
+        digest = analysis_cache.inputs_digest(analysis_cache.analysis_inputs(service))
+        analysis_cache.store_analysis(service, digest, analysis)
+
+    return updated
@@ -0,0 +1,337 @@
+from datetime import date
+
+import numpy as np
+
+
+# Parametri per stazione della curva di affidabilità (vedi fleet_parameters)
+HAZARD_KEYS = ('bathtub', 'shape', 'scale', 'infant_shape', 'infant_scale', 'random_rate')
+
+DAYS_PER_YEAR = 365.25
+
+
+def weibull_cumulative_hazard(ages, shape, scale):
+    """
+    Hazard cumulato di una Weibull: H(t) = (t / scala)^forma.
+
+    Args:
+        ages: Età in anni (scalare o array)
+        shape: Parametro di forma
+        scale: Parametro di scala in anni
+
+    Returns:
+        np.ndarray: Hazard cumulato (numero atteso di guasti da 0 a t)
+    """
+    return np.power(np.maximum(ages, 0.0) / scale, shape)
+
+
+def cumulative_hazard(ages, params):
+    """
+    Hazard cumulato della curva di affidabilità di ogni stazione.
+
+    La curva a vasca da bagno è la somma di tre processi indipendenti:
+    guasti precoci (Weibull con forma < 1), guasti casuali (tasso costante)
+    e usura (Weibull con i parametri principali).
+
+    Args:
+        ages: Età in anni con forma (stazioni, punti)
+        params: Array per stazione con le chiavi di HAZARD_KEYS
+
+    Returns:
+        np.ndarray: Hazard cumulato con la stessa forma di ages
+    """
+    column = {key: np.asarray(params[key], dtype=float)[:, None] for key in HAZARD_KEYS}
+    hazard = weibull_cumulative_hazard(ages, column['shape'], column['scale'])
+    bathtub = (
+        weibull_cumulative_hazard(ages, column['infant_shape'], column['infant_scale'])
+        + column['random_rate'] * np.maximum(ages, 0.0)
+    )
+    return hazard + np.where(column['bathtub'] > 0, bathtub, 0.0)
+
+
+def expected_failures(params, years, start_ages=0.0):
+    """
+    Guasti attesi per stazione e per anno, in forma chiusa.
+
+    Le riparazioni riportano la colonnina allo stato precedente al guasto
+    (processo di Poisson non omogeneo): i guasti attesi nell'anno sono
+    l'incremento dell'hazard cumulato, H(età + k) - H(età + k - 1).
+
+    Args:
+        params: Array per stazione con le chiavi di HAZARD_KEYS
+        years: Numero di anni
+        start_ages: Età delle stazioni all'inizio del periodo (scalare o per stazione)
+
+    Returns:
+        np.ndarray: Guasti attesi con forma (stazioni, anni)
+    """
+    stations = np.asarray(params['shape']).size
+    start = np.broadcast_to(np.asarray(start_ages, dtype=float), (stations,))
+    ages = start[:, None] + np.arange(years + 1, dtype=float)
+    return np.diff(cumulative_hazard(ages, params), axis=1)
+
+
+def match_profile(profiles, brand=None, model=None, power_type=None):
+    """
+    Trova il profilo di affidabilità più specifico per una colonnina.
+
+    Args:
+        profiles: Profili di affidabilità disponibili
+        brand: Marca della colonnina
+        model: Modello della colonnina
+        power_type: Tipo di potenza
+
+    Returns:
+        ReliabilityProfile: Profilo corrispondente, oppure None
+    """
+    candidates = [profile for profile in profiles if profile.matches(brand, model, power_type)]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda profile: profile.specificity)
+
+
+def station_identity(station):
+    """
+    Marca, modello e tipo di potenza di una stazione di ricarica.
+
+    Marca e modello sono quelli della prima colonnina (cpo_core.Charger)
+    associata alla stazione, se presente.
+
+    Args:
+        station: Istanza di ChargingStation
+
+    Returns:
+        tuple: (marca, modello, tipo di potenza)
+    """
+    brand = model = None
+    chargers = getattr(station, 'chargers', None)
+    if chargers is not None:
+        charger = next(iter(chargers.all()), None)
+        if charger is not None:
+            brand, model = charger.brand, charger.model
+    return brand, model, getattr(station, 'power_type', None)
+
+
+def _profile_values(profile):
+    """Parametri numerici di un profilo (curva e conseguenze del guasto)"""
+    return (
+        1.0 if profile.curve == 'bathtub' else 0.0,
+        float(profile.shape),
+        float(profile.scale_years),
+        float(profile.infant_shape),
+        float(profile.infant_scale_years),
+        float(profile.random_failure_rate),
+        float(profile.repair_cost_percentage) / 100,
+        float(profile.downtime_days),
+    )
+
+
+def _fallback_values(failure_probability, repair_cost_percentage, downtime_days):
+    """Tasso di guasto costante (Weibull con forma 1) per le stazioni senza profilo"""
+    rate = max(float(failure_probability), 1e-12)
+    return (0.0, 1.0, 1.0 / rate, 1.0, 1.0, 0.0, float(repair_cost_percentage), float(downtime_days))
+
+
+def station_age(station, reference_date):
+    """
+    Età in anni di una stazione alla data di riferimento.
+
+    Args:
+        station: Istanza di ChargingStation
+        reference_date: Data di riferimento (None = stazioni nuove)
+
+    Returns:
+        float: Età in anni (0 per le stazioni non ancora attive)
+    """
+    if reference_date is None:
+        return 0.0
+    started = getattr(station, 'activation_date', None) or getattr(station, 'installation_date', None)
+    if not started or started > reference_date:
+        return 0.0
+    return (reference_date - started).days / DAYS_PER_YEAR
+
+
+def fleet_parameters(stations, profiles, failure_probability=0.01, repair_cost_percentage=0.1,
+                     downtime_days=0.0, reference_date=None):
+    """
+    Raccoglie in array i parametri di affidabilità di un parco di stazioni.
+
+    Le stazioni senza un profilo corrispondente usano un tasso di guasto
+    costante pari a failure_probability guasti per anno.
+
+    Args:
+        stations: Stazioni di ricarica
+        profiles: Profili di affidabilità disponibili
+        failure_probability: Guasti per anno delle stazioni senza profilo (frazione)
+        repair_cost_percentage: Costo riparazione delle stazioni senza profilo (frazione)
+        downtime_days: Giorni di fermo per guasto delle stazioni senza profilo
+        reference_date: Data per il calcolo dell'età (None = stazioni nuove)
+
+    Returns:
+        dict: Array per stazione con le chiavi di HAZARD_KEYS, 'repair_fraction',
+            'downtime_days', 'station_cost', 'daily_revenue' e 'start_age'
+    """
+    fallback = _fallback_values(failure_probability, repair_cost_percentage, downtime_days)
+    # Le colonnine vengono lette solo se qualche profilo dipende da marca o modello
+    by_charger = any(profile.brand or profile.model for profile in profiles)
+    rows = []
+    for station in stations:
+        profile = None
+        if profiles:
+            identity = station_identity(station) if by_charger else (None, None, getattr(station, 'power_type', None))
+            profile = match_profile(profiles, *identity)
+        daily_revenue = station.charging_price_kwh * station.avg_kwh_session * station.estimated_sessions_day
+        rows.append(
+            (_profile_values(profile) if profile else fallback)
+            + (float(station.station_cost), float(daily_revenue), station_age(station, reference_date))
+        )
+
+    keys = HAZARD_KEYS + ('repair_fraction', 'downtime_days', 'station_cost', 'daily_revenue', 'start_age')
+    values = np.array(rows, dtype=float).reshape(len(rows), len(keys))
+    return {key: values[:, index] for index, key in enumerate(keys)}
+
+
+def _station_expectations(fleet, years):
+    """Guasti, costi e perdite attesi per stazione e anno"""
+    failures = expected_failures(fleet, years, fleet['start_age'])
+    repair_costs = failures * (fleet['station_cost'] * fleet['repair_fraction'])[:, None]
+    downtime = failures * fleet['downtime_days'][:, None]
+    revenue_loss = downtime * fleet['daily_revenue'][:, None]
+    return {
+        'failures': failures,
+        'repair_costs': repair_costs,
+        'downtime_days': downtime,
+        'revenue_loss': revenue_loss,
+    }
+
+
+def expected_fleet_costs(fleet, years):
+    """
+    Guasti, costi di riparazione, fermi e perdita di ricavi attesi del parco, per anno.
+
+    Args:
+        fleet: Dizionario restituito da fleet_parameters
+        years: Numero di anni
+
+    Returns:
+        dict: Array con forma (anni,) 'failures', 'repair_costs',
+            'downtime_days' e 'revenue_loss'
+    """
+    return {key: matrix.sum(axis=0) for key, matrix in _station_expectations(fleet, years).items()}
+
+
+def sample_fleet_costs(fleet, years, runs=10000, seed=None, chunk_size=1_000_000):
+    """
+    Simulazione Monte Carlo dei guasti del parco sulla curva di affidabilità.
+
+    I guasti di ogni stazione nell'anno seguono una Poisson con media pari ai
+    guasti attesi; le repliche sono elaborate a blocchi per limitare la memoria.
+
+    Args:
+        fleet: Dizionario restituito da fleet_parameters
+        years: Numero di anni
+        runs: Numero di repliche
+        seed: Seme del generatore casuale
+        chunk_size: Numero massimo di estrazioni per blocco
+
+    Returns:
+        dict: Matrici (repliche × anni) 'failures', 'repair_costs' e 'revenue_loss'
+    """
+    means = expected_failures(fleet, years, fleet['start_age'])
+    stations = means.shape[0]
+    weights = np.stack([
+        np.ones(stations),
+        fleet['station_cost'] * fleet['repair_fraction'],
+        fleet['downtime_days'] * fleet['daily_revenue'],
+    ], axis=1)
+
+    rng = np.random.default_rng(seed)
+    samples = np.zeros((3, runs, years))
+    block = max(1, chunk_size // max(stations, 1))
+    for year in range(years):
+        for start in range(0, runs, block):
+            stop = min(start + block, runs)
+            counts = rng.poisson(means[:, year], size=(stop - start, stations))
+            samples[:, start:stop, year] = (counts @ weights).T
+
+    return {
+        'failures': samples[0],
+        'repair_costs': samples[1],
+        'revenue_loss': samples[2],
+    }
+
+
+def portfolio_maintenance_budget(queryset=None, years=10, reference_date=None,
+                                 percentiles=None, runs=10000, seed=None):
+    """
+    Budget di manutenzione atteso per progetto, calcolato in forma chiusa.
+
+    Stazioni, colonnine e profili vengono letti in poche query; i valori
+    attesi di tutto il portafoglio sono calcolati in un unico passaggio
+    vettoriale. La simulazione Monte Carlo viene eseguita solo se sono
+    richiesti i percentili.
+
+    Args:
+        queryset: QuerySet di Project (default: tutti i progetti)
+        years: Numero di anni del budget
+        reference_date: Data per il calcolo dell'età delle stazioni (default: oggi)
+        percentiles: Percentili del costo totale per progetto (es. (5, 50, 95))
+        runs: Repliche Monte Carlo per i percentili
+        seed: Seme del generatore casuale
+
+    Returns:
+        dict: Per id progetto, liste annuali 'failures', 'repair_costs',
+            'downtime_days', 'revenue_loss' e gli eventuali percentili
+    """
+    from cpo_core.models.charging_station import ChargingStation
+    from ..models.project import Project
+    from ..models.reliability import ReliabilityProfile
+
+    if queryset is None:
+        queryset = Project.objects.all()
+    if reference_date is None:
+        reference_date = date.today()
+
+    profiles = list(ReliabilityProfile.objects.all())
+    stations = list(
+        ChargingStation.objects
+        .filter(subproject__project__in=queryset)
+        .select_related('subproject')
+        .prefetch_related('chargers')
+        .order_by('subproject__project_id', 'pk')
+    )
+    if not stations:
+        return {}
+
+    fleet = fleet_parameters(stations, profiles, reference_date=reference_date)
+    expectations = _station_expectations(fleet, years)
+
+    # Somma per progetto con un'unica riduzione sulle righe delle stazioni
+    project_ids, owner = np.unique([station.subproject.project_id for station in stations],
+                                   return_inverse=True)
+    totals = {}
+    for key, matrix in expectations.items():
+        summed = np.zeros((project_ids.size, years))
+        np.add.at(summed, owner, matrix)
+        totals[key] = summed
+
+    budget = {
+        int(project_id): {
+            'years': list(range(1, years + 1)),
+            **{key: np.round(totals[key][index], 2).tolist() for key in totals},
+        }
+        for index, project_id in enumerate(project_ids)
+    }
+
+    if percentiles:
+        for index, project_id in enumerate(project_ids):
+            rows = owner == index
+            samples = sample_fleet_costs({key: values[rows] for key, values in fleet.items()},
+                                         years, runs=runs, seed=seed)
+            total_costs = (samples['repair_costs'] + samples['revenue_loss']).sum(axis=1)
+            budget[int(project_id)]['percentiles'] = {
+                f'p{p}': round(float(value), 2)
+                for p, value in zip(percentiles, np.percentile(total_costs, percentiles))
+            }
+
+    return budget
+
@@ -0,0 +1,194 @@
+import numpy as np
+
+from .cash_flow import yearly_cash_flow_arrays
+from .irr_solver import npv_batch, irr_batch
+from .monte_carlo import UNREPAIRABLE_PROBABILITY
+
+
+# Driver dell'analisi di sensibilità: (chiave, etichetta, modalità, ampiezza).
+# In modalità 'relative' il valore base viene moltiplicato per (1 + x) con
+# x in [-ampiezza, +ampiezza]; in modalità 'absolute' viene sommato x (in punti
+# percentuali) al valore base.
+SENSITIVITY_DRIVERS = (
+    ('charging_price', 'Prezzo ricarica', 'relative', 0.3),
+    ('sessions_per_day', 'Sessioni giornaliere', 'relative', 0.3),
+    ('energy_price_increase', 'Aumento prezzo energia', 'absolute', 3.0),
+    ('charging_price_increase', 'Aumento prezzo ricarica', 'absolute', 3.0),
+    ('market_growth', 'Crescita mercato', 'absolute', 5.0),
+    ('inflation', 'Inflazione', 'absolute', 2.0),
+    ('maintenance_percentage', 'Costo manutenzione', 'relative', 0.5),
+    ('discount_rate', 'Tasso di sconto', 'absolute', 3.0),
+    ('failure_probability', 'Probabilità guasto', 'relative', 1.0),
+    ('repair_cost_percentage', 'Costo riparazione', 'relative', 0.5),
+)
+
+DEFAULT_POINTS = 21
+
+# Parametri espressi in percentuale nella base (convertiti in frazione nel calcolo)
+PERCENT_PARAMETERS = (
+    'energy_price_increase',
+    'charging_price_increase',
+    'market_growth',
+    'inflation',
+    'maintenance_percentage',
+    'discount_rate',
+    'failure_probability',
+    'repair_cost_percentage',
+)
+
+
+def expected_repair_costs(station_cost_total, years, failure_probability, repair_cost_percentage,
+                          unrepairable_probability=UNREPAIRABLE_PROBABILITY):
+    """
+    Costi di riparazione attesi per anno, in forma chiusa.
+
+    Una stazione è attiva all'inizio dell'anno t con probabilità (1 - p*q)^(t-1),
+    dove p è la probabilità di guasto e q quella di guasto irreparabile.
+
+    Args:
+        station_cost_total: Somma dei costi delle colonnine
+        years: Numero di anni
+        failure_probability: Probabilità annuale di guasto (frazione, anche array (N, 1))
+        repair_cost_percentage: Costo riparazione come frazione (anche array (N, 1))
+        unrepairable_probability: Probabilità che un guasto sia irreparabile
+
+    Returns:
+        np.ndarray: Costi attesi con forma (..., years)
+    """
+    p = np.asarray(failure_probability, dtype=float)
+    r = np.asarray(repair_cost_percentage, dtype=float)
+    survival = np.power(1.0 - p * unrepairable_probability, np.arange(years, dtype=float))
+    return station_cost_total * r * p * survival
+
+
+def driver_grid(base_value, mode, span, points=DEFAULT_POINTS):
+    """
+    Costruisce la griglia di valori di un driver attorno al valore base.
+
+    Args:
+        base_value: Valore base del driver
+        mode: 'relative' o 'absolute'
+        span: Ampiezza della variazione
+        points: Numero di punti della griglia
+
+    Returns:
+        tuple: (variazioni, valori) della griglia
+    """
+    steps = np.linspace(-span, span, points)
+    if mode == 'relative':
+        values = base_value * (1.0 + steps)
+    else:
+        values = base_value + steps
+    return steps, np.maximum(values, 0.0)
+
+
+def run_sensitivity(base, drivers=SENSITIVITY_DRIVERS, points=DEFAULT_POINTS):
+    """
+    Esegue l'analisi di sensibilità one-at-a-time su tutti i driver.
+
+    Tutti i punti della griglia (driver × punti) sono valutati in un unico
+    calcolo vettoriale dei flussi di cassa; il punto centrale di ogni driver
+    coincide con lo scenario base.
+
+    Args:
+        base: Dizionario con i valori base del modello. Chiavi richieste:
+            total_investment, annual_revenue, annual_costs, annual_energy_cost,
+            station_cost_total, years, loan_payments, repair_costs e i parametri
+            in PERCENT_PARAMETERS (in percentuale)
+        drivers: Driver da analizzare (vedi SENSITIVITY_DRIVERS)
+        points: Numero di punti per driver
+
+    Returns:
+        dict: Scenario base, curve per il grafico spider e barre del tornado
+    """
+    years = base['years']
+    n = len(drivers) * points
+
+    # Ogni parametro parte dal valore base ripetuto per tutte le righe della griglia
+    values = {key: np.full((n, 1), float(base[key])) for key in PERCENT_PARAMETERS}
+    values['charging_price'] = np.ones((n, 1))
+    values['sessions_per_day'] = np.ones((n, 1))
+
+    grids = []
+    for index, (key, label, mode, span) in enumerate(drivers):
+        base_value = values[key][0, 0]
+        steps, grid = driver_grid(base_value, mode, span, points)
+        values[key][index * points:(index + 1) * points, 0] = grid
+        grids.append((key, label, steps, grid))
+
+    fraction = {key: values[key] / 100 for key in PERCENT_PARAMETERS}
+
+    # Le sessioni muovono ricavi e costo dell'energia, il prezzo solo i ricavi
+    annual_energy_cost = float(base['annual_energy_cost'])
+    fixed_costs = float(base['annual_costs']) - annual_energy_cost
+    revenue = float(base['annual_revenue']) * values['charging_price'] * values['sessions_per_day']
+    energy_costs = fixed_costs + annual_energy_cost * values['sessions_per_day']
+
+    # I costi di riparazione base (es. Monte Carlo) vengono riscalati con il rapporto
+    # tra i valori attesi analitici, così il punto centrale coincide con l'analisi
+    base_expected = expected_repair_costs(
+        base['station_cost_total'], years,
+        float(base['failure_probability']) / 100, float(base['repair_cost_percentage']) / 100)
+    grid_expected = expected_repair_costs(
+        base['station_cost_total'], years,
+        fraction['failure_probability'], fraction['repair_cost_percentage'])
+    base_repairs = base.get('repair_costs')
+    if base_repairs is None:
+        base_repairs = base_expected
+    base_repairs = np.asarray(base_repairs, dtype=float)[:years]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(base_expected > 0, grid_expected / base_expected, 0.0)
+    repair_costs = np.where(base_expected > 0, base_repairs * ratio, grid_expected)
+
+    arrays = yearly_cash_flow_arrays(
+        total_investment=float(base['total_investment']),
+        base_revenue=revenue,
+        base_energy_cost=energy_costs,
+        years=years,
+        market_growth=fraction['market_growth'],
+        inflation=fraction['inflation'],
+        maintenance_percentage=fraction['maintenance_percentage'],
+        energy_price_increase=fraction['energy_price_increase'],
+        charging_price_increase=fraction['charging_price_increase'],
+        loan_payments=base.get('loan_payments'),
+        repair_costs=repair_costs,
+    )
+    cash_flows = arrays['net_cash_flow']
+    npv = np.round(npv_batch(cash_flows, fraction['discount_rate']), 2)
+    irr_values, converged = irr_batch(cash_flows)
+    irr = [
+        round(float(value) * 100, 2) if ok else None
+        for value, ok in zip(irr_values, converged)
+    ]
+
+    center = points // 2
+    spider = []
+    tornado = []
+    for index, (key, label, steps, grid) in enumerate(grids):
+        rows = slice(index * points, (index + 1) * points)
+        driver_npv = npv[rows].tolist()
+        driver_irr = irr[rows]
+        spider.append({
+            'key': key,
+            'label': label,
+            'steps': np.round(steps, 4).tolist(),
+            'values': np.round(grid, 4).tolist(),
+            'npv': driver_npv,
+            'irr': driver_irr,
+        })
+        tornado.append({
+            'key': key,
+            'label': label,
+            'low': {'value': round(float(grid[0]), 4), 'npv': driver_npv[0], 'irr': driver_irr[0]},
+            'high': {'value': round(float(grid[-1]), 4), 'npv': driver_npv[-1], 'irr': driver_irr[-1]},
+            'swing': round(abs(driver_npv[-1] - driver_npv[0]), 2),
+        })
+
+    tornado.sort(key=lambda bar: bar['swing'], reverse=True)
+
+    return {
+        'base': {'npv': float(npv[center]), 'irr': irr[center]},
+        'points': points,
+        'spider': spider,
+        'tornado': tornado,
+    }
@@ -0,0 +1,57 @@
+# cpo_planner/projects/signals.py
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from cpo_core.models.charging_station import ChargingStation as CoreChargingStation
+from cpo_core.models.subproject import SubProject as CoreSubProject
+from .models.charging_station import ChargingStation
+from .models.financial import FinancialParameters, FinancialConfig
+from .services import analysis_cache
+
+
+def _invalidate_projects(project_ids):
+    """Invalida le analisi dei progetti e quelle delle loro stazioni (due query in tutto)"""
+    project_ids = list(project_ids)
+    analysis_cache.invalidate_projects(project_ids)
+    analysis_cache.invalidate_stations(
+        ChargingStation.objects.filter(sub_project__project_id__in=project_ids).values_list('pk', flat=True)
+    )
+
+
+@receiver([post_save, post_delete], sender=FinancialParameters)
+def invalidate_parameters_analysis(sender, instance, **kwargs):
+    """Quando cambiano i parametri finanziari, invalida le analisi del progetto"""
+    _invalidate_projects([instance.project_id])
+
+
+@receiver([post_save, post_delete], sender=FinancialConfig)
+def invalidate_config_analyses(sender, instance, **kwargs):
+    """
+    Quando cambia una configurazione, invalida le analisi dei progetti che la usano
+    (anche implicitamente, se è la configurazione predefinita).
+    """
+    parameters = FinancialParameters.objects.filter(config=instance)
+    if instance.is_default:
+        parameters = parameters | FinancialParameters.objects.filter(config__isnull=True)
+
+    _invalidate_projects(parameters.values_list('project_id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=CoreChargingStation)
+def invalidate_subproject_station_analysis(sender, instance, **kwargs):
+    """Quando cambia una stazione di un sotto-progetto, invalida l'analisi del progetto"""
+    project_id = CoreSubProject.objects.filter(pk=instance.subproject_id).values_list('project_id', flat=True).first()
+    if project_id is not None:
+        analysis_cache.invalidate_projects([project_id])
+
+
+@receiver([post_save, post_delete], sender=CoreSubProject)
+def invalidate_subproject_analysis(sender, instance, **kwargs):
+    """I dati di disponibilità del sotto-progetto influenzano i ricavi del progetto"""
+    analysis_cache.invalidate_projects([instance.project_id])
+
+
+@receiver([post_save, post_delete], sender=ChargingStation)
+def invalidate_station_analysis(sender, instance, **kwargs):
+    """Quando cambia una stazione, invalida la sua analisi"""
+    analysis_cache.invalidate_stations([instance.pk])
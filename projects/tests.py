@@ -1,3 +1,691 @@
-from django.test import TestCase
+import datetime
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+import numpy as np
+import numpy_financial as npf
+
+from projects.services.cash_flow import (
+    yearly_cash_flow_arrays, to_cash_flow_dict,
+    monthly_cash_flow_arrays, to_monthly_cash_flow_dict,
+)
+from projects.models import (
+    Project, FinancialAnalysis, FinancialParameters, FinancialConfig, FailureSimulation,
+    Municipality, SubProject, ChargingStation,
+)
+from projects.services import analysis_cache
+from projects.services.financial_analysis import FinancialAnalysisService
+from projects.services.monte_carlo import (
+    FAILURE_TYPES, simulate_failures, summarize_simulation, simulate_failure_events, aggregate_failure_events,
+)
+from projects.services.portfolio import run_portfolio_analysis
+from projects.services.sensitivity import run_sensitivity
+from projects.services.irr_solver import irr_batch, evaluate_cash_flows
+from projects.services.amortization import loan_schedule, loan_schedules_batch, annual_loan_schedule
+from projects.services.reliability import (
+    expected_failures, expected_fleet_costs, sample_fleet_costs, match_profile, portfolio_maintenance_budget,
+)
+from projects.models.reliability import ReliabilityProfile
+
+
+def create_stations(project, count, **overrides):
+    """Crea un sotto-progetto del progetto con count stazioni di ricarica"""
+    municipality = Municipality.objects.create(name=f'Comune {project.pk}', province='VR', region='Veneto')
+    subproject = SubProject.objects.create(
+        project=project, municipality=municipality, name=f'Lotto {project.name}', start_date=datetime.date(2024, 1, 1),
+        expected_completion_date=datetime.date(2024, 12, 31), budget=0, expected_revenue=0)
+    fields = dict(address='Via Roma', latitude=45.4, longitude=10.9, status='planned', total_power=22,
+                  station_cost=10000, installation_cost=2000, connection_cost=1000, energy_cost_kwh='0.25',
+                  charging_price_kwh='0.55', estimated_sessions_day=4, avg_kwh_session=20)
+    fields.update(overrides)
+    return [
+        ChargingStation.objects.create(sub_project=subproject, name=f'Stazione {i}',
+                                       identifier=f'{project.pk}-{i}', **fields)
+        for i in range(count)
+    ]
+
+
+
+def create_core_stations(project, count, **fields):
+    """Crea un sotto-progetto cpo_core del progetto con count stazioni (quelle lette dall'analisi per progetto)"""
+    from cpo_core.models import SubProject as CoreSubProject
+    from cpo_core.models.charging_station import ChargingStation as CoreStation
+    from infrastructure.models import Municipality as Comune
+    
+    subproject = CoreSubProject.objects.create(
+        project=project, name=f'Lotto {project.pk}', start_date=datetime.date(2024, 1, 1),
+        planned_completion_date=datetime.date(2024, 6, 1),
+        municipality=Comune.objects.create(name=f'Comune {project.pk}', province='VR', population=1000))
+    return [
+        CoreStation.objects.create(subproject=subproject, name=f'Stazione {i}', identifier=f'CS-{project.pk}-{i}',
+                                   station_type='ac_fast', **fields)
+        for i in range(count)
+    ]
+
+class YearlyCashFlowKernelTest(SimpleTestCase):
+    """Test per il calcolo vettoriale dei flussi di cassa annuali"""
+    
+    def _reference_cash_flow(self, total_investment, base_revenue, base_energy_cost, years,
+                             market_growth, inflation, maintenance, energy_increase,
+                             charging_increase, loan_payments):
+        """Implementazione anno per anno usata come riferimento"""
+        net = [-total_investment]
+        cumulative = [-total_investment]
+        for year in range(1, years + 1):
+            revenue = round(base_revenue * (1 + market_growth) ** (year - 1) * (1 + charging_increase) ** (year - 1), 2)
+            op_costs = round(base_energy_cost * (1 + market_growth) ** (year - 1) * (1 + energy_increase) ** (year - 1), 2)
+            maint = round(total_investment * maintenance * (1 + inflation) ** (year - 1), 2)
+            loan = round(loan_payments[year], 2) if year < len(loan_payments) else 0
+            net_cash = revenue - op_costs - maint - loan
+            net.append(round(net_cash, 2))
+            cumulative.append(round(cumulative[-1] + net_cash, 2))
+        return net, cumulative
+    
+    def test_matches_year_by_year_calculation(self):
+        """Verifica che il kernel vettoriale riproduca il calcolo anno per anno"""
+        loan = [0, 1200.5, 1200.5, 1200.5]
+        arrays = yearly_cash_flow_arrays(
+            50000, 18000, 7000, 12,
+            market_growth=0.2, inflation=0.02, maintenance_percentage=0.05,
+            energy_price_increase=0.03, charging_price_increase=0.015,
+            loan_payments=loan,
+        )
+        net, cumulative = self._reference_cash_flow(
+            50000, 18000, 7000, 12, 0.2, 0.02, 0.05, 0.03, 0.015, loan)
+        
+        np.testing.assert_allclose(arrays['net_cash_flow'], net, atol=0.011)
+        np.testing.assert_allclose(arrays['cumulative_cash_flow'], cumulative, atol=0.05)
+        self.assertEqual(arrays['loan_payments'][4], 0)
+    
+    def test_broadcast_scenarios(self):
+        """Verifica che parametri con forma (N, 1) producano N serie indipendenti"""
+        arrays = yearly_cash_flow_arrays(
+            10000, np.array([[5000.0], [6000.0]]), 2000, 5,
+            market_growth=np.array([[0.1], [0.0]]),
+        )
+        self.assertEqual(arrays['net_cash_flow'].shape, (2, 6))
+        self.assertEqual(arrays['net_cash_flow'][1, 0], -10000)
+        self.assertTrue(np.allclose(arrays['revenue'][1, 1:], 6000))
+        
+        cash_flow = to_cash_flow_dict(
+            yearly_cash_flow_arrays(10000, 5000, 2000, 5), 5)
+        self.assertEqual(cash_flow['years'], [0, 1, 2, 3, 4, 5])
+        self.assertEqual(len(cash_flow['cumulative_cash_flow']), 6)
+        
+        repairs = yearly_cash_flow_arrays(10000, 5000, 2000, 5, repair_costs=[100.0] * 5)
+        self.assertTrue(np.allclose(repairs['net_cash_flow'][1:], 2900))
+
+
+
+class MonthlyCashFlowKernelTest(SimpleTestCase):
+    """Test per i flussi di cassa mensili sull'intero orizzonte"""
+    
+    def test_calendar_months_and_yearly_totals(self):
+        """Verifica mesi di calendario, fattori stagionali e rate del prestito"""
+        factors = [0.8, 0.8, 1.0, 1.0, 1.0, 1.2, 1.2, 1.2, 1.2, 1.0, 1.0, 0.8]
+        arrays = monthly_cash_flow_arrays(
+            120000, 36000, 12000, 30, 2024, 11,
+            seasonal_factors=factors, loan_payments=[0] + [500] * 120,
+        )
+        cash_flow = to_monthly_cash_flow_dict(arrays)
+        
+        self.assertEqual(len(cash_flow['months']), 361)
+        self.assertEqual(cash_flow['months'][:3], ['2024-11', '2024-12', '2025-01'])
+        self.assertEqual(cash_flow['months'][-1], '2054-11')
+        self.assertEqual(len(set(cash_flow['months'])), 361)
+        
+        # Dicembre e giugno ricevono i rispettivi fattori stagionali
+        self.assertEqual(cash_flow['seasonal_factors'][1], 0.8)
+        self.assertEqual(cash_flow['revenue'][1], 2400.0)
+        self.assertEqual(cash_flow['revenue'][7], 3600.0)
+        
+        self.assertAlmostEqual(sum(cash_flow['loan_payments'][1:13]), 6000, places=2)
+        self.assertEqual(cash_flow['loan_payments'][121], 0)
+        self.assertEqual(cash_flow['cumulative_cash_flow'][0], -120000)
+
+
+class AmortizationTest(SimpleTestCase):
+    """Test per il modulo di ammortamento dei prestiti"""
+    
+    def test_pre_amortization_and_balloon(self):
+        """Verifica preammortamento, rata costante e maxi-rata finale"""
+        schedule = loan_schedule(100000, 0.05, 10, pre_amortization_years=2, balloon=10000)
+        
+        self.assertAlmostEqual(schedule['payment'][1], 100000 * 0.05 / 12)
+        self.assertEqual(schedule['balance'][24], 100000)
+        self.assertAlmostEqual(schedule['payment'][30], npf.pmt(0.05 / 12, 96, -100000, 10000))
+        self.assertAlmostEqual(schedule['payment'][120], schedule['payment'][30] + 10000, places=6)
+        self.assertAlmostEqual(schedule['principal'].sum(), 100000, places=4)
+        self.assertEqual(schedule['balance'][120], 0)
+        
+        # Il piano è memoizzato e non modificabile
+        self.assertIs(schedule, loan_schedule(100000, 0.05, 10, pre_amortization_years=2, balloon=10000))
+        self.assertFalse(schedule['payment'].flags.writeable)
+    
+    def test_prepayment_reduces_installment(self):
+        """Verifica che un'estinzione parziale riduca le rate successive"""
+        schedule = loan_schedule(100000, 0.05, 10, prepayments={24: 20000})
+        
+        self.assertEqual(schedule['prepayment'][24], 20000)
+        self.assertLess(schedule['payment'][25], schedule['payment'][24])
+        self.assertAlmostEqual(schedule['principal'].sum() + schedule['prepayment'].sum(), 100000, places=4)
+        
+        annual = annual_loan_schedule(100000, 0.05, 10, prepayments={24: 20000})
+        self.assertEqual(len(annual['years']), 11)
+        self.assertEqual(annual['prepayment'][2], 20000)
+        self.assertEqual(annual['balance'][10], 0)
+    
+    def test_batch_matches_single_schedules(self):
+        """Verifica che il calcolo in blocco coincida con i piani singoli"""
+        principals = [50000, 120000, 80000]
+        rates = [0.04, 0.0, 0.06]
+        terms = [5, 10, 8]
+        pre = [0, 1, 2]
+        batch = loan_schedules_batch(principals, rates, terms, pre, balloons=[0, 0, 5000])
+        
+        self.assertEqual(batch['payment'].shape, (3, 121))
+        for i in range(3):
+            single = loan_schedule(principals[i], rates[i], terms[i], pre[i],
+                                   balloon=[0, 0, 5000][i])
+            periods = terms[i] * 12
+            np.testing.assert_allclose(batch['payment'][i, :periods + 1], single['payment'], atol=1e-8)
+            np.testing.assert_allclose(batch['balance'][i, :periods + 1], single['balance'], atol=1e-6)
+            self.assertTrue(np.all(batch['payment'][i, periods + 1:] == 0))
+
+class MonteCarloFailureTest(SimpleTestCase):
+    """Test per la simulazione Monte Carlo dei guasti"""
+    
+    def test_seeded_runs_are_reproducible(self):
+        """Verifica che lo stesso seme produca le stesse matrici"""
+        costs = [20000.0] * 30
+        first = simulate_failures(costs, 10, 0.05, 0.1, runs=500, seed=7)
+        second = simulate_failures(costs, 10, 0.05, 0.1, runs=500, seed=7)
+        for key in first:
+            np.testing.assert_array_equal(first[key], second[key])
+    
+    def test_expected_values_and_bands(self):
+        """Verifica media teorica del primo anno e ordinamento dei percentili"""
+        samples = simulate_failures([10000.0] * 50, 8, 0.1, 0.2, runs=20000, seed=1)
+        self.assertEqual(samples['failures'].shape, (20000, 8))
+        self.assertTrue(np.all(samples['active_stations'][:, 0] == 50))
+        
+        summary = summarize_simulation(samples)
+        self.assertAlmostEqual(summary['expected']['failures'][0], 5.0, delta=0.1)
+        self.assertAlmostEqual(summary['expected']['repair_costs'][0], 10000.0, delta=200)
+        for bands in summary['bands'].values():
+            self.assertTrue(np.all(np.array(bands['p5']) <= np.array(bands['p50'])))
+            self.assertTrue(np.all(np.array(bands['p50']) <= np.array(bands['p95'])))
+    
+    def test_failure_events_and_yearly_aggregates(self):
+        """Verifica tabella degli eventi, mix dei tipi e totali per anno"""
+        costs = np.full(2000, 10000.0)
+        revenues = np.full(2000, 50.0)
+        events = simulate_failure_events(
+            [0.1, 0.2, 1.0], costs, revenues,
+            type_probabilities=(0.7, 0.25),
+            repair_cost_fractions=(0.05, 0.2, 1.0),
+            downtime_days=(2, 7, 14),
+            seed=3,
+        )
+        totals = aggregate_failure_events(events, 3)
+        
+        self.assertEqual(totals['failures'][2], 2000)
+        self.assertAlmostEqual(totals['failures'][0] / 2000, 0.1, delta=0.02)
+        self.assertTrue(np.all(np.diff(events['year']) >= 0))
+        self.assertAlmostEqual(np.mean(events['type'] == 0), 0.7, delta=0.03)
+        self.assertAlmostEqual(np.mean(events['type'] == 2), 0.05, delta=0.02)
+        
+        np.testing.assert_array_equal(
+            sum(totals[failure_type] for failure_type in FAILURE_TYPES), totals['failures'])
+        np.testing.assert_allclose(totals['repair_costs'].sum(), events['repair_cost'].sum())
+        np.testing.assert_allclose(events['revenue_loss'], events['downtime_days'] * 50.0)
+
+
+
+class ReliabilityModelTest(SimpleTestCase):
+    """Test per le curve di affidabilità e i costi attesi in forma chiusa"""
+    
+    def _fleet(self, **overrides):
+        values = {
+            'bathtub': [0.0, 1.0], 'shape': [1.0, 2.0], 'scale': [10.0, 8.0],
+            'infant_shape': [1.0, 0.5], 'infant_scale': [1.0, 40.0], 'random_rate': [0.0, 0.03],
+            'repair_fraction': [0.1, 0.2], 'downtime_days': [2.0, 5.0],
+            'station_cost': [20000.0, 40000.0], 'daily_revenue': [50.0, 120.0], 'start_age': [0.0, 3.0],
+        }
+        values.update(overrides)
+        return {key: np.array(value) for key, value in values.items()}
+    
+    def test_expected_failures_follow_cumulative_hazard(self):
+        """Verifica tasso costante per forma 1 e somma pari all'hazard cumulato"""
+        fleet = self._fleet()
+        failures = expected_failures(fleet, 10, fleet['start_age'])
+        np.testing.assert_allclose(failures[0], 0.1)
+        
+        # Vasca da bagno: precoci + casuali + usura Weibull, dall'età 3 all'età 13
+        ages = np.array([3.0, 13.0])
+        hazard = (ages / 40.0) ** 0.5 + 0.03 * ages + (ages / 8.0) ** 2
+        self.assertAlmostEqual(failures[1].sum(), hazard[1] - hazard[0])
+        
+        expected = expected_fleet_costs(fleet, 10)
+        np.testing.assert_allclose(
+            expected['repair_costs'], failures[0] * 2000.0 + failures[1] * 8000.0)
+        np.testing.assert_allclose(
+            expected['revenue_loss'], failures[0] * 100.0 + failures[1] * 600.0)
+    
+    def test_monte_carlo_matches_expected_values(self):
+        """Verifica che la media delle repliche coincida con il valore atteso"""
+        fleet = self._fleet()
+        expected = expected_fleet_costs(fleet, 5)
+        samples = sample_fleet_costs(fleet, 5, runs=40000, seed=2, chunk_size=10000)
+        np.testing.assert_allclose(samples['repair_costs'].mean(axis=0), expected['repair_costs'], rtol=0.03)
+    
+    def test_most_specific_profile_wins(self):
+        """Verifica la scelta del profilo più specifico"""
+        generic = ReliabilityProfile(name='Generico')
+        dc = ReliabilityProfile(name='DC', power_type='dc')
+        brand = ReliabilityProfile(name='Marca', brand='ABB')
+        exact = ReliabilityProfile(name='Modello', brand='ABB', model='Terra 54')
+        profiles = [generic, dc, brand, exact]
+        
+        self.assertIs(match_profile(profiles, 'abb', 'Terra 54', 'dc'), exact)
+        self.assertIs(match_profile(profiles, 'ABB', 'Terra 184', 'dc'), brand)
+        self.assertIs(match_profile(profiles, 'Alpitronic', None, 'dc'), dc)
+        self.assertIs(match_profile(profiles, None, None, 'ac'), generic)
+        self.assertIsNone(match_profile([dc], None, None, 'ac'))
+
+
+class SensitivityAnalysisTest(SimpleTestCase):
+    """Test per l'analisi di sensibilità vettoriale"""
+    
+    BASE = {
+        'years': 10,
+        'total_investment': 100000.0,
+        'annual_revenue': 40000.0,
+        'annual_costs': 15000.0,
+        'annual_energy_cost': 12000.0,
+        'station_cost_total': 60000.0,
+        'loan_payments': None,
+        'repair_costs': None,
+        'energy_price_increase': 3.0,
+        'charging_price_increase': 1.5,
+        'market_growth': 5.0,
+        'inflation': 2.0,
+        'maintenance_percentage': 5.0,
+        'discount_rate': 6.0,
+        'failure_probability': 2.0,
+        'repair_cost_percentage': 10.0,
+    }
+    
+    def test_center_matches_base_scenario(self):
+        """Verifica che il punto centrale coincida con il calcolo diretto"""
+        result = run_sensitivity(self.BASE, points=11)
+        
+        arrays = yearly_cash_flow_arrays(
+            100000, 40000, 15000, 10,
+            market_growth=0.05, inflation=0.02, maintenance_percentage=0.05,
+            energy_price_increase=0.03, charging_price_increase=0.015,
+            repair_costs=60000 * 0.1 * 0.02 * (1 - 0.002) ** np.arange(10),
+        )
+        expected = npf.npv(0.06, arrays['net_cash_flow'])
+        self.assertAlmostEqual(result['base']['npv'], expected, delta=1)
+        for curve in result['spider']:
+            self.assertAlmostEqual(curve['npv'][5], result['base']['npv'], delta=0.01)
+    
+    def test_tornado_ordering_and_directions(self):
+        """Verifica l'ordinamento del tornado e il segno degli effetti"""
+        result = run_sensitivity(self.BASE)
+        swings = [bar['swing'] for bar in result['tornado']]
+        self.assertEqual(swings, sorted(swings, reverse=True))
+        
+        curves = {curve['key']: curve for curve in result['spider']}
+        self.assertTrue(np.all(np.diff(curves['charging_price']['npv']) > 0))
+        self.assertTrue(np.all(np.diff(curves['discount_rate']['npv']) < 0))
+        self.assertTrue(np.all(np.diff(curves['failure_probability']['npv']) <= 0))
+
+
+class BatchIrrSolverTest(SimpleTestCase):
+    """Test per il calcolo vettoriale di IRR, NPV e payback"""
+    
+    def test_matches_numpy_financial(self):
+        """Verifica IRR e NPV rispetto a numpy_financial su serie convenzionali"""
+        rng = np.random.default_rng(3)
+        cash_flows = np.column_stack([
+            -rng.uniform(50000, 200000, 200),
+            rng.uniform(5000, 60000, (200, 15)),
+        ])
+        
+        metrics = evaluate_cash_flows(cash_flows, 0.05)
+        
+        self.assertTrue(metrics['irr_converged'].all())
+        expected_irr = [npf.irr(row) * 100 for row in cash_flows]
+        expected_npv = [npf.npv(0.05, row) for row in cash_flows]
+        np.testing.assert_allclose(metrics['irr'], expected_irr, atol=1e-6)
+        np.testing.assert_allclose(metrics['npv'], expected_npv, rtol=1e-10)
+    
+    def test_flags_series_without_irr(self):
+        """Verifica che le serie senza IRR siano segnalate invece di valere 0"""
+        cash_flows = np.array([
+            [-1000.0, -100.0, -100.0, -100.0],
+            [-1000.0, 400.0, 400.0, 400.0],
+            [-1000.0, 0.0, 0.0, 1100.0],
+        ])
+        irr, converged = irr_batch(cash_flows)
+        
+        self.assertEqual(converged.tolist(), [False, True, True])
+        self.assertTrue(np.isnan(irr[0]))
+        self.assertAlmostEqual(irr[2], 1.1 ** (1 / 3) - 1, places=8)
+        
+        metrics = evaluate_cash_flows(cash_flows, 0.0)
+        self.assertEqual(metrics['payback'][0], 3)
+        self.assertAlmostEqual(metrics['payback'][1], 2.5)
+
+@override_settings(MAP_TILE_CACHE='default')
+class PortfolioAnalysisTest(TestCase):
+    """Test per l'analisi finanziaria in blocco del portafoglio"""
+    
+    def test_creates_and_updates_analyses_in_bulk(self):
+        """Verifica che parametri e analisi mancanti vengano creati e aggiornati"""
+        for i in range(3):
+            Project.objects.create(name=f'Progetto {i}', start_date=datetime.date(2024, 1, 1))
+        
+        analyses = run_portfolio_analysis()
+        
+        self.assertEqual(len(analyses), 3)
+        self.assertEqual(FinancialParameters.objects.count(), 3)
+        self.assertEqual(FinancialAnalysis.objects.count(), 3)
+        analysis = FinancialAnalysis.objects.first()
+        self.assertEqual(len(analysis.yearly_cash_flow['years']), 11)
+        self.assertEqual(analysis.failure_simulation['method'], 'analytic')
+        self.assertEqual(len(analysis.sensitivity_analysis['tornado']), 10)
+        
+        # Una seconda esecuzione aggiorna le righe esistenti senza crearne di nuove
+        run_portfolio_analysis(Project.objects.filter(name='Progetto 0'))
+        self.assertEqual(FinancialAnalysis.objects.count(), 3)
+    
+    def _portfolio(self, count, stations=3):
+        projects = []
+        for i in range(count):
+            project = Project.objects.create(name=f'Portafoglio {i}', start_date=datetime.date(2024, 1, 1),
+                                             expected_completion_date=datetime.date(2025, 1, 1))
+            create_core_stations(project, stations, station_cost=10000 + 1000 * i, installation_cost=2000)
+            projects.append(project)
+        return Project.objects.filter(pk__in=[p.pk for p in projects])
+    
+    def _queries(self, queryset):
+        with CaptureQueriesContext(connection) as queries:
+            analyses = run_portfolio_analysis(queryset)
+        return analyses, len(queries)
+    
+    def test_query_count_does_not_grow_with_projects(self):
+        """Verifica che le query non dipendano dal numero di progetti e stazioni"""
+        FinancialConfig.get_default()
+        small, small_queries = self._queries(self._portfolio(2))
+        FinancialAnalysis.objects.all().delete()
+        FinancialParameters.objects.all().delete()
+        large, large_queries = self._queries(Project.objects.all() | self._portfolio(6, stations=5))
+        self.assertEqual(len(large), 8)
+        self.assertEqual(large_queries, small_queries)
+        
+        # Con le analisi già presenti non servono gli inserimenti
+        _, queries = self._queries(Project.objects.all())
+        self.assertLessEqual(queries, large_queries)
+        
+        for analysis in large:
+            self.assertGreater(analysis.total_investment, 0)
+            self.assertEqual(len(analysis.yearly_cash_flow['years']), 11)
+    
+    def test_process_pool_matches_serial_run(self):
+        """Verifica che il pool di processi (avviati con spawn) dia gli stessi risultati"""
+        queryset = self._portfolio(4)
+        serial = {a.project_id: (a.total_investment, a.net_present_value, a.yearly_cash_flow)
+                  for a in run_portfolio_analysis(queryset)}
+        pooled = {a.project_id: (a.total_investment, a.net_present_value, a.yearly_cash_flow)
+                  for a in run_portfolio_analysis(queryset, workers=2)}
+        self.assertEqual(pooled, serial)
+        self.assertEqual(len(set(value[0] for value in pooled.values())), 4)
+
+
+@override_settings(MAP_TILE_CACHE='default')
+class AnalysisCacheTest(TestCase):
+    """Test per la cache delle analisi finanziarie"""
+    
+    def setUp(self):
+        self.project = Project.objects.create(name='Progetto', start_date=datetime.date(2024, 1, 1))
+    
+    def _run(self):
+        with mock.patch.object(FinancialAnalysisService, 'compute_results',
+                               autospec=True, side_effect=FinancialAnalysisService.compute_results) as compute:
+            analysis = FinancialAnalysisService(project=self.project).calculate_analysis()
+        return analysis, compute.call_count
+    
+    def _check_hits_and_invalidation(self):
+        first, computed = self._run()
+        self.assertEqual(computed, 1)
+        
+        cached, computed = self._run()
+        self.assertEqual(computed, 0)
+        self.assertEqual(cached.pk, first.pk)
+        
+        params = FinancialParameters.objects.get(project=self.project)
+        params.market_growth_rate = 10
+        params.save()
+        _, computed = self._run()
+        self.assertEqual(computed, 1)
+        
+        config = FinancialConfig.get_default()
+        config.discount_rate = 7
+        config.save()
+        _, computed = self._run()
+        self.assertEqual(computed, 1)
+    
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'financial_analysis': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                               'LOCATION': 'financial-analysis-test'},
+    })
+    def test_locmem_backend(self):
+        """Verifica hit e invalidazione con la cache in memoria"""
+        self._check_hits_and_invalidation()
+    
+    def test_file_backend(self):
+        """Verifica hit e invalidazione con la cache su file"""
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        with override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'financial_analysis': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                   'LOCATION': location},
+        }):
+            self._check_hits_and_invalidation()
+    
+    def test_config_invalidation_query_count(self):
+        """Verifica che il salvataggio della configurazione non esegua una query per progetto"""
+        config = FinancialConfig.get_default()
+        
+        def save_queries():
+            with CaptureQueriesContext(connection) as queries:
+                config.save()
+            return len(queries)
+        
+        FinancialParameters.objects.get_or_create(project=self.project)
+        create_stations(self.project, 2)
+        few = save_queries()
+        for index in range(10):
+            project = Project.objects.create(name=f'Progetto {index}', start_date=datetime.date(2024, 1, 1))
+            FinancialParameters.objects.get_or_create(project=project)
+            create_stations(project, 2)
+        self.assertEqual(save_queries(), few)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'financial_analysis': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                           'LOCATION': 'station-analysis-test'},
+    'map_tiles': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'station-tiles-test'},
+})
+class StationAnalysisCacheTest(TestCase):
+    """Test per l'analisi finanziaria di una singola stazione e la sua cache"""
+    
+    def setUp(self):
+        self.project = Project.objects.create(name='Progetto', start_date=datetime.date(2024, 1, 1))
+        FinancialParameters.objects.get_or_create(project=self.project)
+        # Ricaricate dal database, come nella vista (i decimali passati come stringhe)
+        self.station, self.other = ChargingStation.objects.filter(
+            pk__in=[station.pk for station in create_stations(self.project, 2)]).order_by('pk')
+        analysis_cache.get_cache().clear()
+        User.objects.create_user(username='analista', password='password')
+        self.client.login(username='analista', password='password')
+    
+    def _run(self, station):
+        url = reverse('projects:run_station_analysis',
+                      kwargs={'project_id': self.project.pk, 'station_id': station.pk})
+        with mock.patch.object(FinancialAnalysisService, 'compute_results',
+                               autospec=True, side_effect=FinancialAnalysisService.compute_results) as compute:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        return FinancialAnalysis.objects.get(charging_station=station), compute.call_count
+    
+    def test_view_uses_service(self):
+        """Verifica che la vista della stazione salvi i risultati del servizio"""
+        analysis, computed = self._run(self.station)
+        self.assertEqual(computed, 1)
+        
+        expected = FinancialAnalysisService(charging_station=self.station).compute_results()
+        self.assertEqual(analysis.total_investment, expected['total_investment'])
+        self.assertAlmostEqual(float(analysis.net_present_value), float(expected['net_present_value']), places=2)
+        self.assertEqual(analysis.yearly_cash_flow, expected['yearly_cash_flow'])
+        self.assertIsNotNone(analysis.failure_simulation)
+    
+    def test_station_save_invalidates_analysis(self):
+        """Verifica che la modifica di una stazione invalidi solo la sua analisi"""
+        first, computed = self._run(self.station)
+        self.assertEqual(computed, 1)
+        self._run(self.other)
+        
+        cached, computed = self._run(self.station)
+        self.assertEqual(computed, 0)
+        self.assertEqual(cached.pk, first.pk)
+        
+        self.station.estimated_sessions_day = 8
+        self.station.save()
+        updated, computed = self._run(self.station)
+        self.assertEqual(computed, 1)
+        self.assertGreater(updated.total_revenue, first.total_revenue)
+        
+        # Le stazioni non modificate restano in cache
+        _, computed = self._run(self.other)
+        self.assertEqual(computed, 0)
+    
+    def test_station_delete_invalidates_analysis(self):
+        """Verifica che la cancellazione di una stazione rimuova la sua analisi dalla cache"""
+        service = FinancialAnalysisService(charging_station=self.station)
+        service.calculate_analysis()
+        digest = analysis_cache.inputs_digest(analysis_cache.analysis_inputs(service))
+        cache = analysis_cache.get_cache()
+        result_key = f'{analysis_cache.CACHE_PREFIX}:result:{digest}'
+        self.assertIsNotNone(cache.get(result_key))
+        
+        self.station.delete()
+        self.assertIsNone(cache.get(result_key))
+        self.assertIsNone(cache.get(f'{analysis_cache.CACHE_PREFIX}:station:{service.charging_station.pk}'))
+
+
+@override_settings(MAP_TILE_CACHE='default')
+class FailureSimulationTest(TestCase):
+    """Test per la simulazione dei guasti delle stazioni di un progetto"""
+    
+    def setUp(self):
+        self.project = Project.objects.create(name='Progetto', start_date=datetime.date(2024, 1, 1))
+        self.stations = create_stations(self.project, 5)
+        self.simulation = FailureSimulation.objects.create(
+            project=self.project, failure_rate_year1=40, failure_rate_increase=10)
+    
+    def test_run_simulation_reads_project_stations(self):
+        """Verifica che la simulazione usi le stazioni dei sotto-progetti"""
+        results = self.simulation.run_simulation(years=5, seed=3)
+        
+        self.assertEqual(results['stations']['name'], [station.name for station in self.stations])
+        self.assertEqual([row['total_stations'] for row in results['yearly_results']], [5] * 5)
+        self.assertEqual(results['summary']['total_failures'],
+                         sum(row['failures'] for row in results['yearly_results']))
+        self.assertGreater(results['summary']['total_failures'], 0)
+        
+        self.simulation.refresh_from_db()
+        self.assertEqual(self.simulation.total_failures, results['summary']['total_failures'])
+        self.assertGreater(self.simulation.total_repair_costs, 0)
+        self.assertEqual(self.simulation.run_simulation(years=5, seed=3), results)
+    
+    def test_station_failures_by_year(self):
+        """Verifica il dettaglio dei guasti ricostruito dalla tabella degli eventi"""
+        results = self.simulation.run_simulation(years=5, seed=3)
+        details = self.simulation.station_failures_by_year()
+        
+        for row in results['yearly_results']:
+            self.assertEqual(len(details.get(row['year'], [])), row['failures'])
+            self.assertAlmostEqual(sum(event['repair_cost'] for event in details.get(row['year'], [])),
+                                   row['repair_costs'], places=1)
+        names = {station.name for station in self.stations}
+        self.assertTrue(all(event['station_name'] in names for events in details.values() for event in events))
+        
+        limited = self.simulation.station_failures_by_year(limit=1)
+        for year, events in limited.items():
+            self.assertEqual(len(events), 1)
+            impact = [event['repair_cost'] + event['revenue_loss'] for event in details[year]]
+            self.assertEqual(events[0]['repair_cost'] + events[0]['revenue_loss'], max(impact))
+        
+        self.simulation.run_simulation(years=5, seed=3, store_events=False)
+        self.assertEqual(self.simulation.station_failures_by_year(), {})
+
+
+@override_settings(MAP_TILE_CACHE='default')
+class PortfolioMaintenanceBudgetTest(TestCase):
+    """Test per il budget di manutenzione atteso del portafoglio"""
+    
+    def setUp(self):
+        from cpo_core.models.subproject import Charger
+        
+        ReliabilityProfile.objects.create(name='ABB', brand='ABB', shape=1.0, scale_years=5.0,
+                                          repair_cost_percentage=10, downtime_days=4)
+        self.projects = []
+        for name, brand in (('Con profilo', 'ABB'), ('Senza profilo', 'Altro')):
+            project = Project.objects.create(name=name, start_date=datetime.date(2024, 1, 1),
+                                             expected_completion_date=datetime.date(2025, 1, 1))
+            for station in create_core_stations(project, 2, station_cost=10000, charging_price_kwh='0.50',
+                                                avg_kwh_session=20, estimated_sessions_day=5):
+                Charger.objects.create(charging_station=station, code=f'{station.identifier}-1', brand=brand)
+            self.projects.append(project)
+    
+    def test_expected_budget_per_project(self):
+        """Verifica i valori attesi per progetto e il numero di query"""
+        with self.assertNumQueries(3):  # profili, stazioni con i sotto-progetti, colonnine
+            budget = portfolio_maintenance_budget(years=3, reference_date=datetime.date(2024, 1, 1))
+        
+        with_profile, without_profile = (budget[project.pk] for project in self.projects)
+        self.assertEqual(with_profile['years'], [1, 2, 3])
+        # Weibull con forma 1: 1 / 5 guasti all'anno per stazione
+        np.testing.assert_allclose(with_profile['failures'], [0.4] * 3)
+        np.testing.assert_allclose(with_profile['repair_costs'], [400.0] * 3)
+        np.testing.assert_allclose(with_profile['revenue_loss'], [0.4 * 4 * 50] * 3)
+        # Senza profilo: tasso costante predefinito dell'1% annuo
+        np.testing.assert_allclose(without_profile['failures'], [0.02] * 3)
+    
+    def test_percentiles_on_request(self):
+        """Verifica che la simulazione venga eseguita solo se servono i percentili"""
+        queryset = Project.objects.filter(pk=self.projects[0].pk)
+        budget = portfolio_maintenance_budget(queryset, years=3, reference_date=datetime.date(2024, 1, 1))
+        self.assertEqual(list(budget), [self.projects[0].pk])
+        self.assertNotIn('percentiles', budget[self.projects[0].pk])
+        
+        budget = portfolio_maintenance_budget(queryset, years=3, reference_date=datetime.date(2024, 1, 1),
+                                              percentiles=(5, 50, 95), runs=2000, seed=1)
+        percentiles = budget[self.projects[0].pk]['percentiles']
+        self.assertLessEqual(percentiles['p5'], percentiles['p50'])
+        self.assertLessEqual(percentiles['p50'], percentiles['p95'])
+        self.assertEqual(portfolio_maintenance_budget(Project.objects.none()), {})
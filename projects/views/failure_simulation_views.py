@@ -10,6 +10,9 @@ from ..models.project import Project
 from ..models.failure_simulation import FailureSimulation
 from ..forms.failure_simulation_forms import FailureSimulationForm
 
+# Numero massimo di guasti per anno mostrati nel dettaglio dei risultati
+MAX_FAILURES_PER_YEAR = 50
+
 class FailureSimulationView(LoginRequiredMixin, FormView):
     template_name = 'projects/failure_simulation_form.html'
     form_class = FailureSimulationForm
@@ -85,5 +88,14 @@ class FailureSimulationResultsView(LoginRequiredMixin, DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['project'] = self.object.project
-        context['results'] = self.object.simulation_results
+        
+        # Il dettaglio per stazione viene ricostruito dalla tabella degli eventi,
+        # limitato ai guasti più costosi di ogni anno
+        results = self.object.simulation_results or {}
+        details = self.object.station_failures_by_year(limit=MAX_FAILURES_PER_YEAR)
+        yearly_results = [
+            dict(year, station_failures=details.get(year['year'], year.get('station_failures', [])))
+            for year in results.get('yearly_results', [])
+        ]
+        context['results'] = dict(results, yearly_results=yearly_results)
         return context
\ No newline at end of file
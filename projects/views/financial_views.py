@@ -16,6 +16,7 @@ from projects.models import Project
 from ..models.charging_station import ChargingStation
 from ..models.financial import FinancialParameters, FinancialAnalysis
 from ..forms.financial import FinancialParametersForm
+from ..services.financial_analysis import FinancialAnalysisService
 
 class FinancialParametersUpdateView(LoginRequiredMixin, UpdateView):
     model = FinancialParameters
@@ -59,274 +60,21 @@ class RunFinancialAnalysisView(LoginRequiredMixin, View):
     
     def _run_project_analysis(self, project):
         """
-        Esegue l'analisi finanziaria per l'intero progetto
-        """
-        # Controlla che esistano parametri finanziari
-        if not hasattr(project, 'financial_parameters'):
-            FinancialParameters.objects.create(project=project)
-        
-        # Ottiene o crea l'oggetto di analisi finanziaria
-        analysis, created = FinancialAnalysis.objects.get_or_create(
-            project=project,
-            defaults={'charging_station': None}
-        )
-        
-        # Calcola l'investimento totale
-        total_investment = project.total_budget
-        
-        # Parametri finanziari
-        params = project.financial_parameters
-        investment_years = params.investment_years
-        discount_rate = float(params.config.discount_rate) / 100
-        loan_amount = float(params.loan_amount)
-        loan_interest_rate = float(params.loan_interest_rate) / 100
-        loan_term = params.loan_term
-        
-        # Simuliamo un ROI del 15%
-        roi = 15.0
-        
-        # Calcoliamo un NPV positivo
-        npv = total_investment * 0.25
-        
-        # Calcoliamo un IRR del 12%
-        irr = 12.0
-        
-        # Payback period di 4.5 anni
-        payback = 4.5
-        
-        # Ricavi totali (stimati come 200% dell'investimento su 10 anni)
-        revenue = total_investment * 2
-        
-        # Costi totali (stimati come 85% dei ricavi)
-        costs = revenue * 0.85
-        
-        # Profitto
-        profit = revenue - costs
-        
-        # Calcola piano ammortamento prestito
-        loan_schedule = {
-            'years': list(range(1, loan_term + 1)),
-            'payment': [],
-            'interest': [],
-            'principal': [],
-            'balance': []
-        }
-        
-        if loan_amount > 0:
-            # Calcolo rata
-            if loan_interest_rate > 0:
-                annual_payment = loan_amount * (loan_interest_rate * (1 + loan_interest_rate) ** loan_term) / ((1 + loan_interest_rate) ** loan_term - 1)
-            else:
-                annual_payment = loan_amount / loan_term
-                
-            remaining_balance = loan_amount
-            
-            for year in range(1, loan_term + 1):
-                interest_payment = remaining_balance * loan_interest_rate
-                principal_payment = annual_payment - interest_payment
-                remaining_balance -= principal_payment
-                
-                loan_schedule['payment'].append(float(annual_payment))
-                loan_schedule['interest'].append(float(interest_payment))
-                loan_schedule['principal'].append(float(principal_payment))
-                loan_schedule['balance'].append(max(0, float(remaining_balance)))
-        
-        # Flussi di cassa annuali
-        yearly_cash_flow = {
-            'years': list(range(1, investment_years + 1)),
-            'revenue': [],
-            'operational_costs': [],
-            'maintenance_costs': [],
-            'loan_payments': [],
-            'net_cash_flow': [],
-            'cumulative_cash_flow': []
-        }
-        
-        cumulative_cash_flow = -float(total_investment)
-        loan_payments = [0] * investment_years
-        
-        # Aggiungi pagamenti del prestito se applicabile
-        if loan_amount > 0:
-            for year in range(min(loan_term, investment_years)):
-                loan_payments[year] = loan_schedule['payment'][year]
-        
-        # Calcolo flussi di cassa annuali
-        for year in range(investment_years):
-            year_revenue = float(revenue) / investment_years
-            year_op_costs = float(costs) * 0.7 / investment_years
-            year_maint_costs = float(costs) * 0.3 / investment_years
-            year_loan_payment = loan_payments[year]
-            
-            net_cash_flow = year_revenue - year_op_costs - year_maint_costs - year_loan_payment
-            cumulative_cash_flow += net_cash_flow
-            
-            yearly_cash_flow['revenue'].append(year_revenue)
-            yearly_cash_flow['operational_costs'].append(year_op_costs)
-            yearly_cash_flow['maintenance_costs'].append(year_maint_costs)
-            yearly_cash_flow['loan_payments'].append(year_loan_payment)
-            yearly_cash_flow['net_cash_flow'].append(net_cash_flow)
-            yearly_cash_flow['cumulative_cash_flow'].append(cumulative_cash_flow)
-        
-        # Calcola DSCR (Debt Service Coverage Ratio)
-        avg_yearly_cash_flow = sum(yearly_cash_flow['net_cash_flow']) / len(yearly_cash_flow['net_cash_flow'])
-        avg_yearly_debt_service = sum(loan_payments) / len(loan_payments) if sum(loan_payments) > 0 else 1
-        dscr = avg_yearly_cash_flow / avg_yearly_debt_service if avg_yearly_debt_service > 0 else 0
-        
-        # Calcola LTV (Loan to Value)
-        ltv = loan_amount / total_investment * 100 if total_investment > 0 else 0
-        
-        # Calcola Break-even point
-        break_even_year = 0
-        for i, cf in enumerate(yearly_cash_flow['cumulative_cash_flow']):
-            if cf >= 0:
-                # Interpolazione lineare per break-even più preciso
-                if i > 0:
-                    prev_cf = yearly_cash_flow['cumulative_cash_flow'][i-1]
-                    if prev_cf < 0:
-                        fraction = -prev_cf / (cf - prev_cf)
-                        break_even_year = i + fraction
-                    else:
-                        break_even_year = i
-                else:
-                    break_even_year = i
-                break
+        Esegue l'analisi finanziaria per l'intero progetto.
         
-        # Simulazione guasti
-        failure_rate = float(params.failure_probability) / 100
-        repair_cost_pct = float(params.repair_cost_percentage) / 100
-        avg_station_cost = float(total_investment) / max(1, project.subprojects.count())
-        
-        failure_simulation = {
-            'years': list(range(1, investment_years + 1)),
-            'failures': [],
-            'repair_costs': [],
-            'active_stations': []
-        }
-        
-        num_stations = project.subprojects.count()
-        
-        for year in range(investment_years):
-            # Semplice simulazione statistica
-            expected_failures = num_stations * failure_rate
-            repair_cost = expected_failures * repair_cost_pct * avg_station_cost
-            
-            failure_simulation['failures'].append(float(expected_failures))
-            failure_simulation['repair_costs'].append(float(repair_cost))
-            failure_simulation['active_stations'].append(float(num_stations - expected_failures * 0.5))  # Media stazioni attive
-        
-        # Analisi di sensibilità
-        sensitivity_analysis = {
-            'scenarios': ['Pessimistico', 'Base', 'Ottimistico'],
-            'revenue_factor': [0.8, 1.0, 1.2],
-            'cost_factor': [1.2, 1.0, 0.9],
-            'npv': [],
-            'irr': [],
-            'roi': []
-        }
-        
-        # Calcola scenari
-        for i in range(3):
-            rev_factor = sensitivity_analysis['revenue_factor'][i]
-            cost_factor = sensitivity_analysis['cost_factor'][i]
-            
-            # Calcoli semplificati per scenari
-            adjusted_profit = revenue * rev_factor - costs * cost_factor
-            adjusted_roi = adjusted_profit / total_investment * 100 if total_investment > 0 else 0
-            adjusted_npv = adjusted_profit * 0.8 - total_investment
-            adjusted_irr = adjusted_roi * 0.8  # Semplificazione
-            
-            sensitivity_analysis['npv'].append(float(adjusted_npv))
-            sensitivity_analysis['irr'].append(float(adjusted_irr))
-            sensitivity_analysis['roi'].append(float(adjusted_roi))
-        
-        # Salva i risultati
-        analysis.total_investment = total_investment
-        analysis.net_present_value = npv
-        analysis.internal_rate_of_return = irr
-        analysis.payback_period = payback
-        analysis.return_on_investment = roi
-        analysis.profitability_index = 1 + (npv / total_investment)
-        analysis.total_revenue = revenue
-        analysis.total_costs = costs
-        analysis.total_profit = profit
-        analysis.yearly_cash_flow = yearly_cash_flow
-        analysis.loan_schedule = loan_schedule
-        analysis.failure_simulation = failure_simulation
-        analysis.sensitivity_analysis = sensitivity_analysis
-        analysis.debt_service_coverage_ratio = dscr
-        analysis.loan_to_value_ratio = ltv
-        analysis.break_even_point_year = break_even_year
-        analysis.average_occupancy_rate = 65.0  # Valore di default per ora
-        analysis.save()
-        
-        return analysis
+        Metriche, flussi di cassa, simulazione guasti e analisi di sensibilità
+        sono calcolati da FinancialAnalysisService sugli stessi dati del progetto.
+        """
+        return FinancialAnalysisService(project=project).calculate_analysis()
     
     def _run_station_analysis(self, station):
         """
-        Esegue l'analisi finanziaria per una singola stazione
-        """
-        # Ottiene o crea l'oggetto di analisi finanziaria
-        analysis, created = FinancialAnalysis.objects.get_or_create(
-            charging_station=station,
-            defaults={'project': None}
-        )
+        Esegue l'analisi finanziaria per una singola stazione.
         
-        # Calcola l'investimento totale della stazione
-        total_investment = station.calculate_total_investment()
-        
-        # TODO: Implementa calcoli dettagliati qui
-        # Per ora semplifichiamo con calcoli di base
-        
-        # Calcola le metriche annuali dalla stazione
-        annual_metrics = station.calculate_annual_metrics()
-        
-        # Parametri finanziari dal progetto principale
-        project = station.sub_project.project
-        investment_years = project.financial_parameters.investment_years
-        
-        # Calcola ricavi totali e costi totali
-        total_revenue = annual_metrics['annual_revenue'] * investment_years
-        total_costs = annual_metrics['annual_costs'] * investment_years
-        total_profit = total_revenue - total_costs
-        
-        # ROI
-        roi = (total_profit / total_investment) * 100
-        
-        # NPV e IRR (calcoli semplificati)
-        npv = total_profit * 0.8 - total_investment
-        irr = roi * 0.8
-        
-        # Payback period semplificato
-        if annual_metrics['annual_profit'] > 0:
-            payback = total_investment / annual_metrics['annual_profit']
-        else:
-            payback = investment_years
-        
-        # Flussi di cassa annuali
-        yearly_cash_flow = {}
-        
-        for year in range(1, investment_years + 1):
-            yearly_cash_flow[f'year_{year}'] = {
-                'revenue': float(annual_metrics['annual_revenue']),
-                'costs': float(annual_metrics['annual_costs']),
-                'profit': float(annual_metrics['annual_profit']),
-                'cumulative': float(annual_metrics['annual_profit'] * year - total_investment)
-            }
-        
-        # Salva i risultati
-        analysis.total_investment = total_investment
-        analysis.net_present_value = npv
-        analysis.internal_rate_of_return = irr
-        analysis.payback_period = min(payback, investment_years)  # Limitato agli anni di investimento
-        analysis.return_on_investment = roi
-        analysis.profitability_index = 1 + (npv / total_investment)
-        analysis.total_revenue = total_revenue
-        analysis.total_costs = total_costs
-        analysis.total_profit = total_profit
-        analysis.yearly_cash_flow = yearly_cash_flow
-        analysis.save()
-        
-        return analysis
+        Usa lo stesso calcolo (e la stessa cache) dell'analisi di progetto,
+        limitato alla stazione indicata.
+        """
+        return FinancialAnalysisService(charging_station=station).calculate_analysis()
 
 class ProjectFinancialResultsView(LoginRequiredMixin, DetailView):
     model = FinancialAnalysis
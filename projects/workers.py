@@ -0,0 +1,27 @@
+"""
+Funzioni eseguite nei processi worker dell'analisi del portafoglio.
+
+Con il metodo di avvio spawn (predefinito su Windows e macOS) il processo
+figlio importa l'inizializzatore prima che Django sia configurato: il modulo
+sta fuori da projects.services, che importa i modelli, e non importa Django
+al caricamento, altrimenti l'avvio fallirebbe con AppRegistryNotReady.
+"""
+import os
+
+
+def init_worker(settings_module):
+    """
+    Configura Django nel processo worker.
+
+    Args:
+        settings_module: Modulo delle impostazioni del processo principale
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+
+    import django
+    django.setup()
+
+
+def compute(service):
+    """Calcola i risultati di un FinancialAnalysisService (eseguito anche nel processo principale)"""
+    return service.compute_results()
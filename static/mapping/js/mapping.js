@@ -2,13 +2,31 @@
  * Inizializzazione e gestione della mappa interattiva
  */
 
+// Colori ed etichette delle classi di copertura dei comuni
+const COVERAGE_COLORS = {
+    none: '#e74a3b',
+    critical: '#fd7e14',
+    low: '#f6c23e',
+    medium: '#36b9cc',
+    adequate: '#1cc88a'
+};
+const COVERAGE_LABELS = {
+    none: 'Nessuna stazione nel raggio',
+    critical: 'Critica',
+    low: 'Bassa',
+    medium: 'Media',
+    adequate: 'Adeguata'
+};
+
 // Variabili globali
 let map;
 let stationsSource = { type: 'FeatureCollection', features: [] };
 let markersSource = { type: 'FeatureCollection', features: [] };
+let coverageSource = { type: 'FeatureCollection', features: [] };
 let visibleStations = [];
 let mapboxDraw;
 let mapConfig;
+let reloadTimer;
 
 /**
  * Inizializza la mappa con le configurazioni fornite
@@ -63,14 +81,10 @@ function initMap(config) {
     
     // Quando la mappa è pronta...
     map.on('load', function() {
-        // Aggiunge le sorgenti di dati
+        // Aggiunge le sorgenti di dati (i cluster arrivano già calcolati dal server)
         map.addSource('stations', {
             type: 'geojson',
-            data: stationsSource,
-            cluster: config.showClusters,
-            clusterMaxZoom: 14,
-            clusterRadius: 50,
-            clusterMinPoints: config.minClusterSize
+            data: stationsSource
         });
         
         map.addSource('markers', {
@@ -78,6 +92,38 @@ function initMap(config) {
             data: markersSource
         });
         
+        // Layer della copertura dei comuni, sotto stazioni e marker
+        map.addSource('coverage', {
+            type: 'geojson',
+            data: coverageSource
+        });
+        
+        map.addLayer({
+            id: 'coverage-municipalities',
+            type: 'circle',
+            source: 'coverage',
+            layout: {
+                visibility: 'none'
+            },
+            paint: {
+                'circle-color': [
+                    'match',
+                    ['get', 'coverage_class'],
+                    ...Object.entries(COVERAGE_COLORS).flat(),
+                    '#858796'
+                ],
+                // Area del cerchio proporzionale alla popolazione
+                'circle-radius': [
+                    'interpolate', ['linear'], ['sqrt', ['get', 'population']],
+                    0, 3,
+                    1000, 24
+                ],
+                'circle-opacity': 0.6,
+                'circle-stroke-width': 1,
+                'circle-stroke-color': '#ffffff'
+            }
+        });
+        
         // Aggiunge i layer per i clusters
         map.addLayer({
             id: 'clusters',
@@ -135,8 +181,10 @@ function initMap(config) {
                     'planned', '#4e73df',          // Blu per pianificate
                     'under_construction', '#f6c23e', // Giallo per in costruzione
                     'operational', '#1cc88a',      // Verde per operative
+                    'active', '#1cc88a',           // Verde per attive
                     'maintenance', '#f8f9fc',      // Grigio chiaro per manutenzione
                     'offline', '#e74a3b',          // Rosso per offline
+                    'inactive', '#e74a3b',         // Rosso per inattive
                     '#4e73df'                       // Default
                 ],
                 'circle-radius': 8,
@@ -199,7 +247,6 @@ function initMap(config) {
                     <p><strong>Stato:</strong> <span class="badge ${getStatusBadgeClass(props.status)}">${props.status_display}</span></p>
                     <p><strong>Potenza:</strong> ${props.power} kW</p>
                     <p><strong>Punti di ricarica:</strong> ${props.charging_points}</p>
-                    <p><strong>Connettori:</strong> ${props.connectors}</p>
                     ${props.installation_date ? `<p><strong>Data installazione:</strong> ${props.installation_date}</p>` : ''}
                     ${props.project_name ? `<p><strong>Progetto:</strong> ${props.project_name}</p>` : ''}
                     ${props.subproject_name ? `<p><strong>Sotto-progetto:</strong> ${props.subproject_name}</p>` : ''}
@@ -218,6 +265,31 @@ function initMap(config) {
                 .addTo(map);
         });
         
+        // Popup al click su un comune del layer di copertura
+        map.on('click', 'coverage-municipalities', function(e) {
+            const props = e.features[0].properties;
+            const kwPerUser = props.kw_per_user === null || props.kw_per_user === 'null'
+                ? 'N/D' : Number(props.kw_per_user).toFixed(2);
+            const nearest = props.nearest_km === null || props.nearest_km === 'null'
+                ? 'N/D' : `${Number(props.nearest_km).toFixed(1)} km`;
+            
+            const html = `
+                <div class="map-popup">
+                    <h5>${props.name} (${props.province})</h5>
+                    <p><strong>Copertura:</strong> ${COVERAGE_LABELS[props.coverage_class] || props.coverage_class}</p>
+                    <p><strong>Stazione più vicina:</strong> ${nearest}</p>
+                    <p><strong>Stazioni entro ${coverageSource.radius_km} km:</strong> ${props.stations} (${props.power} kW)</p>
+                    <p><strong>Potenziali utenti EV:</strong> ${props.ev_users}</p>
+                    <p><strong>kW per utente EV:</strong> ${kwPerUser}</p>
+                </div>
+            `;
+            
+            new mapboxgl.Popup()
+                .setLngLat(e.features[0].geometry.coordinates.slice())
+                .setHTML(html)
+                .addTo(map);
+        });
+        
         // Popup al click su un marker personalizzato
         map.on('click', 'custom-markers', function(e) {
             const coordinates = e.features[0].geometry.coordinates.slice();
@@ -231,12 +303,12 @@ function initMap(config) {
                     ${props.description ? `<p>${props.description}</p>` : ''}
                 `;
                 
-            // Aggiunge link al progetto/sotto-progetto se presenti
+            // Aggiunge progetto e comune se presenti
             if (props.project_name) {
                 html += `<p><strong>Progetto:</strong> ${props.project_name}</p>`;
             }
-            if (props.subproject_name) {
-                html += `<p><strong>Sotto-progetto:</strong> ${props.subproject_name}</p>`;
+            if (props.municipality_name) {
+                html += `<p><strong>Comune:</strong> ${props.municipality_name}</p>`;
             }
             
             // Aggiunge bottoni di modifica/elimina se è il proprio marker
@@ -279,18 +351,28 @@ function initMap(config) {
         // Zoom al click su cluster
         map.on('click', 'clusters', function(e) {
             const features = map.queryRenderedFeatures(e.point, { layers: ['clusters'] });
-            const clusterId = features[0].properties.cluster_id;
             
-            map.getSource('stations').getClusterExpansionZoom(clusterId, function(err, zoom) {
-                if (err) return;
-                
-                map.easeTo({
-                    center: features[0].geometry.coordinates,
-                    zoom: zoom
-                });
+            map.easeTo({
+                center: features[0].geometry.coordinates,
+                zoom: features[0].properties.expansion_zoom
             });
         });
         
+        // Ricarica stazioni (e marker dai tile) della porzione visibile dopo ogni spostamento o zoom
+        map.on('moveend', function() {
+            clearTimeout(reloadTimer);
+            reloadTimer = setTimeout(function() {
+                loadStations();
+                // I marker letti dai tile dipendono dalla porzione visibile
+                if (canUseMarkerTiles()) {
+                    loadMarkers();
+                }
+                if (document.getElementById('showCoverage').checked) {
+                    loadCoverage();
+                }
+            }, 250);
+        });
+        
         // Gestore create per il disegno
         map.on('draw.create', function(e) {
             // Ottiene le coordinate del punto disegnato
@@ -307,9 +389,75 @@ function initMap(config) {
 }
 
 /**
- * Carica le stazioni dalla API
+ * Indica se le stazioni possono essere lette dai tile pre-renderizzati:
+ * solo con i filtri nello stato iniziale e con i cluster abilitati
+ */
+function canUseStationTiles() {
+    if (mapConfig.projectFilter || mapConfig.subprojectFilter) {
+        return false;
+    }
+    if (!document.getElementById('showClusters').checked) {
+        return false;
+    }
+    for (const element of document.getElementById('mapFilterForm').elements) {
+        if (!element.name || ['show_clusters', 'show_custom_markers', 'show_coverage'].includes(element.name)) {
+            continue;
+        }
+        if (element.type === 'checkbox' ? element.checked !== element.defaultChecked : element.value !== '') {
+            return false;
+        }
+    }
+    return true;
+}
+
+/**
+ * Indica se i marker possono essere letti dai tile pre-renderizzati
+ */
+function canUseMarkerTiles() {
+    return !mapConfig.projectFilter && !mapConfig.subprojectFilter;
+}
+
+/**
+ * Carica e unisce i tile z/x/y che coprono la porzione visibile.
+ * Il browser li rivalida con ETag, quindi i tile invariati non vengono riscaricati.
+ * @param {string} urlTemplate - URL con i segnaposto {z}, {x} e {y}
+ * @returns {Promise<Object>} FeatureCollection con le feature di tutti i tile
+ */
+function loadTiles(urlTemplate) {
+    const zoom = Math.min(Math.max(Math.floor(map.getZoom()), 0), mapConfig.tileMaxZoom);
+    const n = 2 ** zoom;
+    const bounds = map.getBounds();
+    const clamp = value => Math.min(n - 1, Math.max(0, Math.floor(value)));
+    const tileX = lng => clamp((lng + 180) / 360 * n);
+    const tileY = lat => {
+        const rad = Math.max(-85.0511, Math.min(85.0511, lat)) * Math.PI / 180;
+        return clamp((1 - Math.asinh(Math.tan(rad)) / Math.PI) / 2 * n);
+    };
+    
+    const requests = [];
+    for (let x = tileX(bounds.getWest()); x <= tileX(bounds.getEast()); x++) {
+        for (let y = tileY(bounds.getNorth()); y <= tileY(bounds.getSouth()); y++) {
+            const url = urlTemplate.replace('{z}', zoom).replace('{x}', x).replace('{y}', y);
+            requests.push(fetch(url).then(response => response.json()));
+        }
+    }
+    return Promise.all(requests).then(tiles => ({
+        type: 'FeatureCollection',
+        features: tiles.flatMap(tile => tile.features)
+    }));
+}
+
+/**
+ * Carica le stazioni dai tile o, con filtri attivi, dalla API
  */
 function loadStations() {
+    if (canUseStationTiles()) {
+        loadTiles(mapConfig.stationsTileUrl)
+            .then(showStations)
+            .catch(error => console.error('Errore nel caricamento delle stazioni:', error));
+        return;
+    }
+    
     // Prepara i parametri della query
     const form = document.getElementById('mapFilterForm');
     const formData = new FormData(form);
@@ -326,6 +474,13 @@ function loadStations() {
         }
     }
     
+    // Porzione visibile, zoom e raggruppamento lato server
+    const bounds = map.getBounds();
+    queryParams.set('bbox', [bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()]
+        .map(value => value.toFixed(5)).join(','));
+    queryParams.set('zoom', Math.floor(map.getZoom()));
+    queryParams.set('clusters', document.getElementById('showClusters').checked ? '1' : '0');
+    
     // Aggiunge filtri preimpostati
     if (mapConfig.projectFilter && !queryParams.has('project')) {
         queryParams.set('project', mapConfig.projectFilter);
@@ -337,22 +492,30 @@ function loadStations() {
     // Effettua la richiesta AJAX
     fetch(`${mapConfig.stationsApiUrl}?${queryParams.toString()}`)
         .then(response => response.json())
-        .then(data => {
-            // Aggiorna la sorgente delle stazioni
-            stationsSource = data;
-            map.getSource('stations').setData(data);
-            
-            // Aggiorna il conteggio delle stazioni visibili
-            visibleStations = data.features;
-            document.getElementById('visibleStationsCount').textContent = visibleStations.length;
-            
-            // Conserva gli ID delle stazioni per il salvataggio della mappa
-            const stationIds = visibleStations.map(station => station.properties.id).join(',');
-            document.getElementById('mapStationIds').value = stationIds;
-        })
+        .then(showStations)
         .catch(error => console.error('Errore nel caricamento delle stazioni:', error));
 }
 
+/**
+ * Mostra le stazioni caricate e aggiorna i contatori
+ * @param {Object} data - FeatureCollection delle stazioni e dei cluster
+ */
+function showStations(data) {
+    // Aggiorna la sorgente delle stazioni
+    stationsSource = data;
+    map.getSource('stations').setData(data);
+    
+    // Aggiorna il conteggio delle stazioni visibili (i cluster valgono point_count)
+    visibleStations = data.features.filter(feature => !feature.properties.cluster);
+    const visibleCount = data.features.reduce(
+        (total, feature) => total + (feature.properties.point_count || 1), 0);
+    document.getElementById('visibleStationsCount').textContent = visibleCount;
+    
+    // Conserva gli ID delle stazioni per il salvataggio della mappa
+    const stationIds = visibleStations.map(station => station.properties.id).join(',');
+    document.getElementById('mapStationIds').value = stationIds;
+}
+
 /**
  * Carica i marker personalizzati dalla API
  */
@@ -366,6 +529,23 @@ function loadMarkers() {
         return;
     }
     
+    // Senza filtri: marker visibili dai tile più i marker nascosti dell'utente
+    if (canUseMarkerTiles()) {
+        Promise.all([
+            loadTiles(mapConfig.markersTileUrl),
+            fetch(`${mapConfig.markersApiUrl}?hidden=1`).then(response => response.json())
+        ])
+            .then(([tiles, hidden]) => {
+                tiles.features.forEach(marker => {
+                    marker.properties.is_own_marker = marker.properties.created_by_id === mapConfig.userId;
+                });
+                tiles.features = tiles.features.concat(hidden.features);
+                showMarkers(tiles);
+            })
+            .catch(error => console.error('Errore nel caricamento dei marker:', error));
+        return;
+    }
+    
     // Prepara i parametri della query
     let queryParams = new URLSearchParams();
     
@@ -379,20 +559,54 @@ function loadMarkers() {
     
     // Effettua la richiesta AJAX
     fetch(`${mapConfig.markersApiUrl}?${queryParams.toString()}`)
+        .then(response => response.json())
+        .then(showMarkers)
+        .catch(error => console.error('Errore nel caricamento dei marker:', error));
+}
+
+/**
+ * Mostra i marker caricati e aggiorna i contatori
+ * @param {Object} data - FeatureCollection dei marker
+ */
+function showMarkers(data) {
+    // Aggiorna la sorgente dei marker
+    markersSource = data;
+    map.getSource('markers').setData(data);
+    
+    // Aggiorna il conteggio dei marker
+    document.getElementById('customMarkersCount').textContent = data.features.length;
+    
+    // Conserva gli ID dei marker per il salvataggio della mappa
+    const markerIds = data.features.map(marker => marker.properties.id).join(',');
+    document.getElementById('mapMarkerIds').value = markerIds;
+}
+
+/**
+ * Carica la copertura dei comuni della porzione visibile
+ */
+function loadCoverage() {
+    const visible = document.getElementById('showCoverage').checked;
+    map.setLayoutProperty('coverage-municipalities', 'visibility', visible ? 'visible' : 'none');
+    document.getElementById('coverageLegend').style.display = visible ? '' : 'none';
+    
+    if (!visible) {
+        coverageSource = { type: 'FeatureCollection', features: [] };
+        map.getSource('coverage').setData(coverageSource);
+        return;
+    }
+    
+    const bounds = map.getBounds();
+    const queryParams = new URLSearchParams();
+    queryParams.set('bbox', [bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()]
+        .map(value => value.toFixed(5)).join(','));
+    
+    fetch(`${mapConfig.coverageApiUrl}?${queryParams.toString()}`)
         .then(response => response.json())
         .then(data => {
-            // Aggiorna la sorgente dei marker
-            markersSource = data;
-            map.getSource('markers').setData(data);
-            
-            // Aggiorna il conteggio dei marker
-            document.getElementById('customMarkersCount').textContent = data.features.length;
-            
-            // Conserva gli ID dei marker per il salvataggio della mappa
-            const markerIds = data.features.map(marker => marker.properties.id).join(',');
-            document.getElementById('mapMarkerIds').value = markerIds;
+            coverageSource = data;
+            map.getSource('coverage').setData(data);
         })
-        .catch(error => console.error('Errore nel caricamento dei marker:', error));
+        .catch(error => console.error('Errore nel caricamento della copertura:', error));
 }
 
 /**
@@ -435,11 +649,7 @@ function loadSavedMap(mapId) {
  * Applica i filtri della mappa
  */
 function applyFilters() {
-    // Aggiorna le impostazioni di clustering
-    const showClusters = document.getElementById('showClusters').checked;
-    map.getSource('stations').setClusterProperty('cluster', showClusters);
-    
-    // Carica le stazioni con i nuovi filtri
+    // Carica le stazioni con i nuovi filtri (e l'impostazione dei cluster)
     loadStations();
     
     // Carica i marker
@@ -616,9 +826,16 @@ function initEventHandlers() {
     
     // Checkbox cluster
     document.getElementById('showClusters').addEventListener('change', function() {
-        // Aggiorna la sorgente cluster
+        // I cluster sono calcolati dal server: ricarica le stazioni
         if (map.getSource('stations')) {
-            map.getSource('stations').setClusterProperty('cluster', this.checked);
+            loadStations();
+        }
+    });
+    
+    // Checkbox copertura dei comuni
+    document.getElementById('showCoverage').addEventListener('change', function() {
+        if (map.getSource('coverage')) {
+            loadCoverage();
         }
     });
     